@@ -13,6 +13,7 @@
 # limitations under the License.
 #
 # Requires Python 2.7+
+import json
 import os
 
 from core.src.bootstrap.Bootstrapper import Bootstrapper
@@ -78,7 +79,8 @@ class CoreMain(object):
             # Assessment happens for all operations. If the goal seeking tracked operation is CP, then its final status can only be written after assessment reaches a terminal state
             assessment_exception_error = None
             try:
-                patch_assessment_successful = patch_assessor.start_assessment()
+                with patch_assessor:
+                    patch_assessment_successful = patch_assessor.start_assessment()
             except Exception as error:
                 assessment_exception_error = error  # hold this until configure patching is closed out
 
@@ -93,9 +95,11 @@ class CoreMain(object):
                 # setting current operation here, to include patch_installer init within installation actions, ensuring any exceptions during patch_installer init are added in installation summary errors object
                 status_handler.set_current_operation(Constants.INSTALLATION)
                 patch_installer = container.get('patch_installer')
-                patch_installation_successful = patch_installer.start_installation()
+                with patch_installer:
+                    patch_installation_successful = patch_installer.start_installation()
                 patch_assessment_successful = False
-                patch_assessment_successful = patch_assessor.start_assessment()
+                with patch_assessor:
+                    patch_assessment_successful = patch_assessor.start_assessment()
 
                 # PatchInstallationSummary to be marked as completed successfully only after the implicit (i.e. 2nd) assessment is completed, as per CRP's restrictions
                 if patch_assessment_successful and patch_installation_successful:
@@ -132,24 +136,45 @@ class CoreMain(object):
 
         finally:
             if status_handler is not None:
+                try:
+                    status_handler.flush()     # nothing coalesced in memory should be left behind
+                except Exception as error:
+                    composite_logger.log_error("Unable to persist pending status updates. [Error={0}]".format(repr(error)))
                 status_handler.log_truncated_patches()
 
-            if package_manager is not None:
-                package_manager.refresh_repo_safely()
+            try:
+                if package_manager is not None:
+                    package_manager.refresh_repo_safely()
 
-            # clean up temp folder of files created by Core after execution completes
-            if self.is_temp_folder_available(bootstrapper.env_layer, execution_config):
-                composite_logger.log_debug("Deleting format-matching items from temp folder [FormatList={0}][TempFolderLocation={1}]"
-                                           .format(Constants.TEMP_FOLDER_CLEANUP_ARTIFACT_LIST, str(execution_config.temp_folder)))
-                bootstrapper.env_layer.file_system.delete_from_dir(execution_config.temp_folder, Constants.TEMP_FOLDER_CLEANUP_ARTIFACT_LIST)
+                # clean up temp folder of files created by Core after execution completes
+                if self.is_temp_folder_available(bootstrapper.env_layer, execution_config):
+                    composite_logger.log_debug("Deleting format-matching items from temp folder [FormatList={0}][TempFolderLocation={1}]"
+                                               .format(Constants.TEMP_FOLDER_CLEANUP_ARTIFACT_LIST, str(execution_config.temp_folder)))
+                    bootstrapper.env_layer.file_system.delete_from_dir(execution_config.temp_folder, Constants.TEMP_FOLDER_CLEANUP_ARTIFACT_LIST)
+
+                if lifecycle_manager is not None:
+                    lifecycle_manager.update_core_sequence(completed=True)
 
-            if lifecycle_manager is not None:
-                lifecycle_manager.update_core_sequence(completed=True)
+                self.write_command_perf_report(bootstrapper, telemetry_writer, composite_logger)
+                telemetry_writer.write_event("Completed Linux Patch core operation.", Constants.TelemetryEventLevel.Informational)
+            finally:
+                telemetry_writer.drain()       # everything queued for the background writer must be on disk before exit, even if the clean up above failed
+                bootstrapper.env_layer.close_coprocess_shells()
 
-            telemetry_writer.write_event("Completed Linux Patch core operation.", Constants.TelemetryEventLevel.Informational)
+                stdout_file_mirror.stop()
+                file_logger.close(message_at_close="\n<End of output>")
 
-            stdout_file_mirror.stop()
-            file_logger.close(message_at_close="\n<End of output>")
+    @staticmethod
+    def write_command_perf_report(bootstrapper, telemetry_writer, composite_logger):
+        """ Emits the aggregated command perf ledger as a telemetry event, and in full to a local report ranked by cumulative time """
+        try:
+            report = bootstrapper.env_layer.command_perf_ledger.get_report()
+            if report['commandCount'] == 0:
+                return
+            telemetry_writer.write_event(bootstrapper.env_layer.command_perf_ledger.get_summary(report), Constants.TelemetryEventLevel.Informational)
+            bootstrapper.env_layer.file_system.write_with_retry_using_temp_file(bootstrapper.command_perf_report_file_path, json.dumps(report, indent=2))
+        except Exception as error:
+            composite_logger.log_debug("Unable to write command perf report. [Path={0}][Error={1}]".format(bootstrapper.command_perf_report_file_path, repr(error)))
 
     @staticmethod
     def update_patch_substatus_if_pending(patch_operation_requested, overall_patch_installation_operation_successful, patch_assessment_successful, configure_patching_successful, status_handler, composite_logger):
@@ -33,6 +33,7 @@ class Bootstrapper(object):
         self.argv = argv
         self.auto_assessment_only = bool(self.get_value_from_argv(self.argv, Constants.ARG_AUTO_ASSESS_ONLY, "False") == "True")
         self.log_file_path, self.events_folder, self.telemetry_supported = self.get_path_to_log_files_and_telemetry_dir(argv, self.auto_assessment_only)
+        self.command_perf_report_file_path = self.log_file_path[:-len(".core.log")] + Constants.CommandPerfLedgerConfig.REPORT_FILE_SUFFIX
 
         # Container initialization
         print("Building bootstrap container configuration...")
@@ -0,0 +1,175 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""In-memory ledger of command executions, for finding the hot paths of a run"""
+import shlex
+import sys
+import threading
+
+from core.src.bootstrap.Constants import Constants
+
+
+class CommandPerfLedger(object):
+    """ Aggregates the commands run, by command template (the command with its arguments masked, e.g. 'dpkg -s <ARG>'), so the cost of each kind of command can be ranked """
+
+    ARG_PLACEHOLDER = "<ARG>"
+    ARGS_PLACEHOLDER = "<ARG>..."
+    OTHER_TEMPLATE = "<OTHER>"
+    UNKNOWN_CALLER = "<UNKNOWN>"
+
+    # Tokens that select what a command does, and are kept in the template. Anything else that is not an option is masked.
+    __VERBS = frozenset([
+        "install", "reinstall", "remove", "erase", "upgrade", "dist-upgrade", "update", "updates", "update-minimal", "check-update", "upgrade-minimal", "refresh", "clean", "makecache",
+        "list", "installed", "available", "obsoletes", "info", "show", "search", "se", "madison", "policy", "depends", "rdepends", "download", "repolist", "updateinfo", "security",
+        "list-updates", "lu", "list-patches", "lp", "patches", "patch", "patch-check", "pchk", "ps", "package", "packages", "repos", "locks", "needs-restarting", "all",
+        "is-enabled", "is-active", "status", "start", "stop", "restart", "enable", "disable", "daemon-reload", "security-status", "api", "attach", "detach", "config"])
+
+    __SHELL_OPERATORS = frozenset(["|", "||", "&&", ";", "&"])
+    __REDIRECT_OPERATORS = frozenset([">", ">>", "<", "2>", "2>>", "&>"])
+    __STREAM_DUPLICATIONS = frozenset(["2>&1", "1>&2", ">&2"])
+    __ENVIRONMENT_PREFIXES = frozenset(["sudo", "env", "nohup", "nice"])
+
+    # Generic command runners - the caller recorded is the first function up the stack that is none of these (see also add_pass_through_functions)
+    __PASS_THROUGH_FUNCTIONS = frozenset([
+        "record", "__get_caller", "run_command_output", "__run_command_output", "run_command_output_streaming", "run_command_output_spilled", "__run_command_output_with_time_limit",
+        "run_command_output_cancellable", "run_package_manager_command", "__run_package_manager_command", "invoke_package_manager", "invoke_package_manager_advanced", "invoke_package_manager_and_parse_output", "invoke_apt_cache",
+        "invoke_package_manager_transaction"])
+
+    def __init__(self):
+        self.__entries = {}
+        self.__lock = threading.Lock()
+        self.__pass_through_functions = self.__PASS_THROUGH_FUNCTIONS
+
+    def record(self, cmd, duration_in_secs, output_size_in_bytes, code):
+        # type: (str, float, int, int) -> None
+        """ Adds one execution of cmd to the ledger """
+        template = self.get_command_template(cmd)
+        caller = self.__get_caller()
+        with self.__lock:
+            if template not in self.__entries and len(self.__entries) >= Constants.CommandPerfLedgerConfig.MAX_TEMPLATES:
+                template = self.OTHER_TEMPLATE
+            entry = self.__entries.get(template)
+            if entry is None:
+                entry = self.__entries[template] = {'template': template, 'count': 0, 'totalTimeInSecs': 0.0, 'maxTimeInSecs': 0.0, 'totalOutputSizeInBytes': 0, 'maxOutputSizeInBytes': 0,
+                                                    'failureCount': 0, 'exitCodes': {}, 'callers': {}, 'slowestCommand': cmd}
+
+            entry['count'] += 1
+            entry['totalTimeInSecs'] += duration_in_secs
+            if duration_in_secs >= entry['maxTimeInSecs']:
+                entry['maxTimeInSecs'] = duration_in_secs
+                entry['slowestCommand'] = cmd
+            entry['totalOutputSizeInBytes'] += output_size_in_bytes
+            entry['maxOutputSizeInBytes'] = max(entry['maxOutputSizeInBytes'], output_size_in_bytes)
+            if code != 0:
+                entry['failureCount'] += 1
+            entry['exitCodes'][str(code)] = entry['exitCodes'].get(str(code), 0) + 1
+            if caller in entry['callers'] or len(entry['callers']) < Constants.CommandPerfLedgerConfig.MAX_CALLERS_PER_TEMPLATE:
+                entry['callers'][caller] = entry['callers'].get(caller, 0) + 1
+
+    def add_pass_through_functions(self, function_names):
+        # type: (list) -> None
+        """ Adds functions that run commands on behalf of their callers (e.g. stand-ins for the env layer's command runners), so the callers are recorded instead """
+        self.__pass_through_functions = self.__pass_through_functions.union(function_names)
+
+    def get_report(self):
+        # type: () -> dict
+        """ Returns the aggregates per command template, ranked by cumulative time """
+        with self.__lock:
+            entries = [dict(entry, exitCodes=dict(entry['exitCodes']), callers=dict(entry['callers'])) for entry in self.__entries.values()]
+
+        for entry in entries:
+            entry['avgTimeInSecs'] = round(entry['totalTimeInSecs'] / entry['count'], 3)
+            entry['totalTimeInSecs'] = round(entry['totalTimeInSecs'], 3)
+            entry['maxTimeInSecs'] = round(entry['maxTimeInSecs'], 3)
+        entries.sort(key=lambda entry: entry['totalTimeInSecs'], reverse=True)
+
+        return {'commandCount': sum(entry['count'] for entry in entries),
+                'totalTimeInSecs': round(sum(entry['totalTimeInSecs'] for entry in entries), 3),
+                'commands': entries}
+
+    @staticmethod
+    def get_summary(report):
+        # type: (dict) -> str
+        """ One line summary of a report, with the top command templates by cumulative time, sized for a telemetry event """
+        summary = "Command perf summary: [Commands={0}][TotalTimeInSecs={1}][Templates={2}]".format(str(report['commandCount']), str(report['totalTimeInSecs']), str(len(report['commands'])))
+        for entry in report['commands'][:Constants.CommandPerfLedgerConfig.TELEMETRY_SUMMARY_TOP_COUNT]:
+            entry_summary = " [{0}|Count={1}|TotalSecs={2}|MaxSecs={3}|Bytes={4}|Failures={5}]".format(entry['template'], str(entry['count']), str(entry['totalTimeInSecs']),
+                                                                                                    str(entry['maxTimeInSecs']), str(entry['totalOutputSizeInBytes']), str(entry['failureCount']))
+            if len(summary) + len(entry_summary) > Constants.CommandPerfLedgerConfig.TELEMETRY_SUMMARY_SIZE_LIMIT_IN_CHARS:
+                break
+            summary += entry_summary
+        return summary
+
+    @staticmethod
+    def get_command_template(cmd):
+        # type: (str) -> str
+        """ Masks the arguments of cmd (package names, versions, paths, values of options), keeping the programs, options and verbs. E.g. 'sudo dpkg -s git' -> 'dpkg -s <ARG>' """
+        try:
+            tokens = shlex.split(cmd)
+        except ValueError:
+            tokens = cmd.split()    # e.g. unbalanced quotes
+
+        template_tokens = []
+        is_program_expected = True
+        is_redirect_target = False
+        for token in tokens:
+            if token in CommandPerfLedger.__SHELL_OPERATORS:
+                template_tokens.append(token)
+                is_program_expected = True
+            elif is_program_expected:
+                if token in CommandPerfLedger.__ENVIRONMENT_PREFIXES:
+                    continue
+                if "=" in token and not token.startswith("-"):     # environment variable assignment, e.g. LANG=en_US.UTF8
+                    template_tokens.append(token.split("=", 1)[0] + "=" + CommandPerfLedger.ARG_PLACEHOLDER)
+                    continue
+                template_tokens.append(token)
+                is_program_expected = False
+            elif token in CommandPerfLedger.__REDIRECT_OPERATORS:
+                template_tokens.append(token)
+                is_redirect_target = True
+                continue
+            elif token in CommandPerfLedger.__STREAM_DUPLICATIONS:
+                template_tokens.append(token)
+            elif is_redirect_target or not (token.startswith("-") or token in CommandPerfLedger.__VERBS):
+                CommandPerfLedger.__append_arg_placeholder(template_tokens)
+            elif token.startswith("-") and "=" in token:
+                template_tokens.append(token.split("=", 1)[0] + "=" + CommandPerfLedger.ARG_PLACEHOLDER)
+            else:
+                template_tokens.append(token)
+            is_redirect_target = False
+
+        return " ".join(template_tokens)
+
+    @staticmethod
+    def __append_arg_placeholder(template_tokens):
+        """ Consecutive arguments, e.g. a package list, are masked together so the template does not depend on their count """
+        if len(template_tokens) > 0 and template_tokens[-1] in (CommandPerfLedger.ARG_PLACEHOLDER, CommandPerfLedger.ARGS_PLACEHOLDER):
+            template_tokens[-1] = CommandPerfLedger.ARGS_PLACEHOLDER
+        else:
+            template_tokens.append(CommandPerfLedger.ARG_PLACEHOLDER)
+
+    def __get_caller(self):
+        """ Returns 'Class.function' for the first function up the stack that is not a generic command runner """
+        try:
+            frame = sys._getframe(1)
+            while frame is not None and frame.f_code.co_name in self.__pass_through_functions:
+                frame = frame.f_back
+            if frame is None:
+                return CommandPerfLedger.UNKNOWN_CALLER
+            instance = frame.f_locals.get('self')
+            return frame.f_code.co_name if instance is None else instance.__class__.__name__ + "." + frame.f_code.co_name
+        except Exception:
+            return CommandPerfLedger.UNKNOWN_CALLER
@@ -55,6 +55,16 @@ class Constants(object):
 
     class SystemPaths(EnumBackport):
         SYSTEMD_ROOT = "/etc/systemd/system/"
+        DPKG_STATUS = "/var/lib/dpkg/status"
+        DPKG_UPDATES = "/var/lib/dpkg/updates"
+        APT_LISTS = "/var/lib/apt/lists"
+        APT_SOURCES_LIST = "/etc/apt/sources.list"
+        APT_SOURCES_LIST_DIR = "/etc/apt/sources.list.d"
+        APT_ESM_HOOK_CONF = "/etc/apt/apt.conf.d/20apt-esm-hook.conf"
+        RPM_DB = "/var/lib/rpm"
+        RPM_DB_SYSIMAGE = "/usr/lib/sysimage/rpm"
+        YUM_REPOS_DIR = "/etc/yum.repos.d"
+        ZYPP_REPOS_DIR = "/etc/zypp/repos.d"
 
     class AzGPSPaths(EnumBackport):
         EULA_SETTINGS = "/var/lib/azure/linuxpatchextension/patch.eula.settings"
@@ -187,6 +197,9 @@ class Constants(object):
     # wait time after status updates
     WAIT_TIME_AFTER_HEALTHSTORE_STATUS_UPDATE_IN_SECS = 20
 
+    # minimum interval between non-terminal status file writes (in-memory updates in between are coalesced into the next write)
+    MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS = 5
+
     # Status file states
     STATUS_TRANSITIONING = "Transitioning"
     STATUS_ERROR = "Error"
@@ -242,6 +255,44 @@ class Constants(object):
     SET_CHECK_SUDO_STATUS_TRUE = True
     MAX_CHECK_SUDO_ATTEMPTS = 6
     MAX_CHECK_SUDO_INTERVAL_IN_SEC = 300
+    MAX_STREAMED_COMMAND_OUTPUT_TAIL_IN_CHARS = 64 * 1024     # only the tail of streamed command output is kept, for error handling and diagnostics
+
+    class CommandOutputSpillConfig(EnumBackport):
+        SPILL_THRESHOLD_IN_BYTES = 1024 * 1024     # larger outputs of spilled commands stay on disk, see EnvLayer.run_command_output_spilled
+        FILE_NAME_TEMPLATE = "azgps-cmd-output-{0}.tmp"     # in the temp folder, and covered by its cleanup
+        EXCERPT_HEAD_IN_CHARS = 4096
+        EXCERPT_TAIL_IN_CHARS = 4096
+
+    class CommandPerfLedgerConfig(EnumBackport):
+        MAX_TEMPLATES = 256     # commands of any further template are aggregated together
+        MAX_CALLERS_PER_TEMPLATE = 16
+        TELEMETRY_SUMMARY_TOP_COUNT = 10
+        TELEMETRY_SUMMARY_SIZE_LIMIT_IN_CHARS = 2048
+        REPORT_FILE_SUFFIX = ".commandperf.json"    # in place of .core.log, next to the core log
+
+    class CommandDeadlineConfig(EnumBackport):
+        MIN_TIME_LIMIT_IN_SECS = 60     # commands started past the deadline still get this long, e.g. the periodic status reconciliation between installs
+        TERMINATION_GRACE_PERIOD_IN_SECS = 10     # between SIGTERM and SIGKILL to the process group of a command past its time limit
+        TIMED_OUT_EXIT_CODE = 124       # as for coreutils timeout
+        CANCELLED_EXIT_CODE = 125       # see EnvLayer.run_command_output_cancellable
+
+    class CoprocessShellConfig(EnumBackport):
+        ENABLED = True
+        POOL_SIZE = 4       # one per concurrent query, see ParallelQueryConfig
+        COMMAND_TIMEOUT_IN_SECS = 600
+        CLOSE_TIMEOUT_IN_SECS = 5       # for the shell to exit once ended - it's left behind after that, rather than holding up teardown
+        MAX_CONSECUTIVE_FAILURES = 3     # the regular one-off process per command is used for the rest of the run after that
+        QUERY_COMMAND_PATTERN = r'^(sudo )?(LANG=\S+ )?(dpkg -s |dpkg-query |apt-cache madison |rpm -q|(yum|dnf|tdnf) list (installed|available) |zypper search |systemctl is-(enabled|active) |mokutil |command -v )'
+
+    class ParallelQueryConfig(EnumBackport):
+        ENABLED = True
+        MAX_PARALLELISM = 4
+
+    class CommandResultCacheConfig(EnumBackport):
+        ENABLED = True
+        MAX_ENTRIES = 256
+        MAX_SIZE_IN_CHARS = 32 * 1024 * 1024
+        MAX_ENTRY_SIZE_IN_CHARS = 8 * 1024 * 1024
 
     class PackageBatchConfig(EnumBackport):
         # Batch Patching Parameters
@@ -267,6 +318,7 @@ class Constants(object):
     PKG_MGR_SETTING_FILTER_CRITSEC_ONLY = 'FilterCritSecOnly'
     PKG_MGR_SETTING_IDENTITY = 'PackageManagerIdentity'
     PKG_MGR_SETTING_IGNORE_PKG_FILTER = 'IgnorePackageFilter'
+    PKG_MGR_SETTING_SINGLE_PASS_ASSESSMENT = 'SinglePassAssessment'
 
     # Reboot Manager
     REBOOT_NEVER = 'Never reboot'
@@ -308,6 +360,44 @@ class Constants(object):
     # Maintenance Window
     PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES = 5
 
+    # Install durations learned on the machine - used over the defaults above, once there is enough history
+    INSTALL_DURATION_HISTORY_FILE = "InstallDurationHistory.json"
+
+    class InstallDurationHistoryConfig(EnumBackport):
+        EWMA_SMOOTHING_FACTOR = 0.3
+        PERCENTILE = 95
+        MIN_SAMPLES_FOR_ESTIMATE = 10
+        MAX_SAMPLES_PER_PACKAGE_MANAGER = 200
+        MAX_SAMPLES_PER_PACKAGE = 10
+        MAX_PACKAGES = 2000
+        MIN_AVG_TIME_IN_SECS = 1
+        MIN_MAX_TIME_IN_SECS = 60
+
+    # Packages planned for installation, downloaded ahead of the maintenance window (during auto-assessment) - see PackagePrefetcher
+    PACKAGE_PREFETCH_STATE_FILE = "PackagePrefetchState.json"
+
+    class PackagePrefetchConfig(EnumBackport):
+        ENABLED = True
+        MAX_BANDWIDTH_IN_KBPS = 2048        # where the package manager supports a download rate limit
+        MAX_PACKAGES_PER_COMMAND = 300
+
+    BATCH_DOWNLOAD_FOLDER_NAME = "azgps-batch-downloads"     # in the temp folder, cleaned up with it
+
+    class BatchDownloadPipelineConfig(EnumBackport):
+        ENABLED = True
+        MIN_FREE_DISK_SPACE_IN_MB = 2048     # left for the installation in progress - the download is not started, or is cancelled, below this
+        DISK_SPACE_CHECK_INTERVAL_IN_SECS = 5
+
+    class InstallPlanConfig(EnumBackport):
+        REBOOT_LIKELY_PACKAGE_PATTERN = r'^(linux-(image|modules|firmware)|kernel|grub|shim|systemd|glibc|libc6|dbus|microcode|intel-microcode|amd64-microcode)'
+
+    # Progress of the installation run in progress, for it to resume from after a crash or unexpected reboot - see InstallationJournal
+    INSTALLATION_JOURNAL_FILE = "InstallationJournal.jsonl"
+
+    class InstallationJournalConfig(EnumBackport):
+        ENABLED = True
+        MAX_RESUME_AGE_IN_HOURS = 24
+
     # Package Manager Setting
     PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION = "RepeatUpdateRun"
 
@@ -346,6 +436,15 @@ class Constants(object):
     TELEMETRY_EVENT_COUNTER_MSG_SIZE_LIMIT_IN_CHARS = 15  # buffer for telemetry event counter text added at the end of every message sent to telemetry
     TELEMETRY_MAX_EVENT_COUNT_THROTTLE = 360
     TELEMETRY_MAX_TIME_IN_SECONDS_FOR_EVENT_COUNT_THROTTLE = 300
+    TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS = 5     # spooled events are written out at least this often, besides when an event file fills up or a flush is requested
+    TELEMETRY_BACKGROUND_WRITER_ENABLED = True      # events are handed off to a queue drained by a background writer, so throttling never blocks the operation
+    TELEMETRY_EVENT_QUEUE_MAX_SIZE = 1000           # bound only applies to verbose events - others are never dropped
+    TELEMETRY_EVENT_QUEUE_OVERFLOW_POLICY = "CoalesceVerbose"
+    TELEMETRY_DRAIN_TIMEOUT_IN_SECS = 60
+
+    class TelemetryEventQueueOverflowPolicy(EnumBackport):
+        COALESCE_VERBOSE = "CoalesceVerbose"        # newest verbose event is merged into the last queued verbose event, if size permits; else as below
+        DROP_OLDEST_VERBOSE = "DropOldestVerbose"   # oldest queued verbose event makes room for the new event
 
     # Telemetry Event Level
     class TelemetryEventLevel(EnumBackport):
@@ -404,6 +503,15 @@ class Constants(object):
         MAX_OS_MAJOR_VERSION_SUPPORTED = 24
         MINIMUM_CLIENT_VERSION = "27.14.4"
 
+    class InProcessQuerySettings(EnumBackport):
+        VERIFY_AGAINST_COMMAND_LINE = False     # runs the command line queries too, logging any differences, and uses their results
+
+    class AptPkgSettings(EnumBackport):
+        FEATURE_ENABLED = True
+
+    class RpmBindingsSettings(EnumBackport):
+        FEATURE_ENABLED = True
+
     class BufferMessage(EnumBackport):
         TRUE = 0
         FALSE = 1
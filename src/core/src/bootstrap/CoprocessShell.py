@@ -0,0 +1,122 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Long-lived shell for running quick commands without a process launch per command"""
+from __future__ import print_function
+import os
+import select
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+from core.src.bootstrap.Constants import Constants
+
+
+class CoprocessShell(object):
+    """ A long-lived privileged shell that runs the commands written to its stdin, one at a time. Each command runs in a subshell (so it cannot change
+        the shell's own state) and is followed by a sentinel line carrying its exit code, which marks the end of its output. """
+
+    class CommandTimeoutError(Exception):
+        pass
+
+    def __init__(self):
+        shell_cmd = ["/bin/sh"]     # same shell as for subprocess.Popen(shell=True)
+        if os.geteuid() != 0:
+            shell_cmd = ["sudo", "-n"] + shell_cmd
+        self.__process = subprocess.Popen(shell_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, close_fds=True, preexec_fn=os.setsid)
+
+    def is_alive(self):
+        return self.__process.poll() is None
+
+    def run_command_output(self, cmd, timeout_in_secs):
+        # type: (str, int) -> (int, bytes)
+        """ Returns return code and raw output of 'cmd'. Raises if the shell exited or did not complete the command in time - the shell is closed then. """
+        sentinel = "__COPROCESS_SHELL_{0}__".format(uuid.uuid4().hex)     # unique per command, so no output of an earlier command can end this one
+        marker = ("\n" + sentinel + " ").encode('ascii')
+        script = "( {0}\n) </dev/null 2>&1; printf '\\n{1} %d\\n' $?\n".format(self.__strip_sudo(cmd), sentinel)
+
+        try:
+            self.__process.stdin.write(script.encode('utf-8'))
+            self.__process.stdin.flush()
+
+            output = bytearray()
+            file_descriptor = self.__process.stdout.fileno()
+            deadline = time.time() + timeout_in_secs
+            while True:
+                marker_index = output.find(marker, max(0, len(output) - 65536 - len(marker)))
+                code_end_index = output.find(b'\n', marker_index + len(marker)) if marker_index >= 0 else -1
+                if code_end_index >= 0:
+                    return int(output[marker_index + len(marker):code_end_index].decode('ascii')), bytes(output[:marker_index])
+
+                remaining_time_in_secs = deadline - time.time()
+                if remaining_time_in_secs <= 0:
+                    raise CoprocessShell.CommandTimeoutError("Timed out waiting for command on coprocess shell. [Timeout={0}s]".format(str(timeout_in_secs)))
+
+                readable, _, _ = select.select([file_descriptor], [], [], remaining_time_in_secs)
+                if readable:
+                    chunk = os.read(file_descriptor, 65536)
+                    if not chunk:
+                        raise Exception("Coprocess shell exited. [Code={0}]".format(str(self.__process.poll())))
+                    output.extend(chunk)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """ Ends the shell, along with anything it may still be running """
+        try:
+            self.__process.stdin.close()
+        except Exception:
+            pass
+        if self.__process.poll() is None:
+            try:
+                os.killpg(self.__process.pid, signal.SIGKILL)
+            except OSError as error:
+                # e.g. EPERM, for a shell started with sudo by an unprivileged user
+                print("Unable to end coprocess shell process group. Ending the shell instead. [Pid={0}][Error={1}]".format(str(self.__process.pid), repr(error)), file=sys.stdout)
+                self.__kill_shell()
+            if not self.__wait(Constants.CoprocessShellConfig.CLOSE_TIMEOUT_IN_SECS):
+                print("Coprocess shell did not exit after being ended. Leaving it behind. [Pid={0}]".format(str(self.__process.pid)), file=sys.stdout)
+        self.__process.stdout.close()
+
+    def __kill_shell(self):
+        try:
+            self.__process.kill()
+            return
+        except OSError as error:
+            print("Unable to end coprocess shell. Retrying with sudo. [Pid={0}][Error={1}]".format(str(self.__process.pid), repr(error)), file=sys.stdout)
+        try:
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call(["sudo", "-n", "kill", "-KILL", "--", "-" + str(self.__process.pid)], stdout=devnull, stderr=devnull)
+        except Exception as error:
+            print("Unable to end coprocess shell with sudo. [Pid={0}][Error={1}]".format(str(self.__process.pid), repr(error)), file=sys.stdout)
+
+    def __wait(self, timeout_in_secs):
+        # type: (float) -> bool
+        """ Waits for the shell to exit, for up to timeout_in_secs. Returns whether it did. """
+        deadline = time.time() + timeout_in_secs
+        while self.__process.poll() is None:
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    @staticmethod
+    def __strip_sudo(cmd):
+        """ The shell is already privileged """
+        return cmd[len("sudo "):] if cmd.startswith("sudo ") else cmd
@@ -16,18 +16,26 @@
 
 from __future__ import print_function
 
+import collections
+import contextlib
 import datetime
 import glob
+import mmap
 import os
 import re
 import platform
 import shutil
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import time
+import uuid
 
+from core.src.bootstrap.CommandPerfLedger import CommandPerfLedger
 from core.src.bootstrap.Constants import Constants
+from core.src.bootstrap.CoprocessShell import CoprocessShell
 from core.src.external_dependencies import distro
 
 
@@ -43,6 +51,21 @@ class EnvLayer(object):
         # Constant paths
         self.etc_environment_file_path = "/etc/environment"
 
+        # Time, output size and exit code of every command run, by command template
+        self.command_perf_ledger = CommandPerfLedger()
+
+        # Time limit for commands (None for no limit), and the commands that ran past it - see set_command_time_limit_provider
+        self.__command_time_limit_provider = None
+        self.__command_time_limit_suspension = threading.local()    # see command_time_limit_suspended
+        self.timed_out_commands = []
+
+        # Long-lived shells for quick read-only queries, see CoprocessShellConfig
+        self.__idle_coprocess_shells = []
+        self.__coprocess_shell_count = 0
+        self.__coprocess_shell_consecutive_failures = 0
+        self.__coprocess_shell_lock = threading.Lock()
+        self.__coprocess_shell_query_pattern = re.compile(Constants.CoprocessShellConfig.QUERY_COMMAND_PATTERN)
+
     @staticmethod
     def is_distro_azure_linux(distro_name):
         return any(x in distro_name for x in Constants.AZURE_LINUX)
@@ -265,6 +288,34 @@ class EnvLayer(object):
     def run_command_output(self, cmd, no_output=False, chk_err=True):
         # type: (str, bool, bool) -> (int, any)
         """ Wrapper for subprocess.check_output. Execute 'cmd'. Returns return code and STDOUT, trapping expected exceptions. Reports exceptions to Error if chk_err parameter is True """
+        start_time = time.time()
+        code, output = self.__run_command_output(cmd, no_output, chk_err)
+        self.command_perf_ledger.record(cmd, time.time() - start_time, len(output) if output is not None else 0, code)
+        return code, output
+
+    def run_command_output_cancellable(self, cmd, cancellation_event, chk_err=True):
+        # type: (str, threading.Event, bool) -> (int, str)
+        """ Same contract as run_command_output, but the command's process group is also ended once cancellation_event is set (e.g. from another thread) - the
+            return code is CANCELLED_EXIT_CODE then. For background work that must not outlive what it runs alongside. """
+        start_time = time.time()
+        code, output = self.__run_command_output_with_time_limit(cmd, False, chk_err, self.__get_command_time_limit_in_secs(), cancellation_event)
+        self.command_perf_ledger.record(cmd, time.time() - start_time, len(output) if output is not None else 0, code)
+        return code, output
+
+    def __run_command_output(self, cmd, no_output, chk_err):
+        # type: (str, bool, bool) -> (int, any)
+        time_limit_in_secs = self.__get_command_time_limit_in_secs()
+
+        if not no_output and self.__coprocess_shell_query_pattern.match(cmd) is not None:
+            result = self.__try_run_command_output_on_coprocess_shell(cmd, time_limit_in_secs)
+            if result is not None:
+                code, output = result
+                if code != 0 and chk_err:
+                    print("Error: CalledProcessError. [Code={0}][Command={1}][Result={2}]".format(str(code), cmd, self.__convert_process_output_to_ascii(output[:-1])), file=sys.stdout)
+                return code, self.__convert_process_output_to_ascii(output)
+
+        if time_limit_in_secs is not None:
+            return self.__run_command_output_with_time_limit(cmd, no_output, chk_err, time_limit_in_secs)
 
         def check_output(*popenargs, **kwargs):
             """ Backport from subprocess module from python 2.7 """
@@ -324,6 +375,240 @@ class EnvLayer(object):
         else:
             return 0, self.__convert_process_output_to_ascii(output)
 
+    def run_command_output_streaming(self, cmd, line_consumer, chk_err=True):
+        # type: (str, callable, bool) -> (int, str)
+        """ Execute 'cmd', passing each line of its combined STDOUT and STDERR to line_consumer as soon as it's produced, instead of buffering all of it.
+            Returns return code and only the tail of the output (see MAX_STREAMED_COMMAND_OUTPUT_TAIL_IN_CHARS), for error handling and diagnostics.
+            The command is ended past its time limit, as for run_command_output. """
+        output_tail = collections.deque()
+        output_tail_size = 0
+        output_size = 0
+        start_time = time.time()
+
+        time_limit_in_secs = self.__get_command_time_limit_in_secs()
+        is_time_limited = time_limit_in_secs is not None
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True, preexec_fn=os.setsid if is_time_limited else None)
+        timed_out, unused_cancelled, stop_watching = self.__watch_process_group(process, time_limit_in_secs)
+        try:
+            for raw_line in iter(process.stdout.readline, b''):
+                line = self.__convert_process_output_to_ascii(raw_line)
+                line = line[:-1] if line.endswith('\n') else line
+                line_consumer(line)
+                output_size += len(line) + 1
+
+                output_tail.append(line)
+                output_tail_size += len(line) + 1
+                while output_tail_size > Constants.MAX_STREAMED_COMMAND_OUTPUT_TAIL_IN_CHARS and len(output_tail) > 1:
+                    output_tail_size -= len(output_tail.popleft()) + 1
+            code = process.wait()
+        finally:
+            stop_watching()
+            if process.poll() is None:      # line_consumer raised - the command is not left running
+                self.__kill_process_or_group(process, is_time_limited)
+                process.wait()
+            process.stdout.close()
+
+        if timed_out.is_set():
+            code = Constants.CommandDeadlineConfig.TIMED_OUT_EXIT_CODE
+            self.__record_command_timeout(cmd, time_limit_in_secs)
+            output_tail.append("[Command timed out][TimeLimit={0}s]".format(str(int(time_limit_in_secs))))
+
+        self.command_perf_ledger.record(cmd, time.time() - start_time, output_size, code)
+        output = "\n".join(output_tail)
+        if code != 0 and chk_err:
+            print("Error: CalledProcessError. [Code={0}][Command={1}][Result={2}]".format(str(code), cmd, output), file=sys.stdout)
+        return code, output
+
+    def run_command_output_spilled(self, cmd, spill_folder, chk_err=True):
+        # type: (str, str, bool) -> (int, EnvLayer.CommandOutput)
+        """ Execute 'cmd' with its combined STDOUT and STDERR written straight to a file in spill_folder, instead of being buffered in memory. The output is read back
+            into memory only up to SPILL_THRESHOLD_IN_BYTES - larger outputs stay on disk and are read via mmap. The caller closes the returned output (removing the file).
+            The command is ended past its time limit, as for run_command_output. """
+        if spill_folder is None or not os.path.isdir(spill_folder):
+            code, output = self.run_command_output(cmd, False, chk_err)
+            return code, self.CommandOutput(text=output)
+
+        spill_file_path = os.path.join(spill_folder, Constants.CommandOutputSpillConfig.FILE_NAME_TEMPLATE.format(uuid.uuid4().hex))
+        start_time = time.time()
+        time_limit_in_secs = self.__get_command_time_limit_in_secs()
+        with open(spill_file_path, 'wb') as spill_file:
+            process = subprocess.Popen(cmd, stdout=spill_file, stderr=subprocess.STDOUT, shell=True, preexec_fn=os.setsid if time_limit_in_secs is not None else None)
+            timed_out, unused_cancelled, stop_watching = self.__watch_process_group(process, time_limit_in_secs)
+            try:
+                code = process.wait()
+            finally:
+                stop_watching()
+            if timed_out.is_set():
+                code = Constants.CommandDeadlineConfig.TIMED_OUT_EXIT_CODE
+                self.__record_command_timeout(cmd, time_limit_in_secs)
+                spill_file.write("\n[Command timed out][TimeLimit={0}s]\n".format(str(int(time_limit_in_secs))).encode('utf-8'))
+        output = self.CommandOutput(spill_file_path=spill_file_path, converter=self.__convert_process_output_to_ascii)
+        self.command_perf_ledger.record(cmd, time.time() - start_time, output.size, code)
+
+        if code != 0 and chk_err:
+            print("Error: CalledProcessError. [Code={0}][Command={1}][Result={2}]".format(str(code), cmd, output.get_excerpt()), file=sys.stdout)
+        return code, output
+
+    def set_command_time_limit_provider(self, command_time_limit_provider):
+        # type: (callable) -> None
+        """ command_time_limit_provider() returns how long a command started now may take, in seconds. Commands past it are ended (see run_command_output),
+            and recorded in timed_out_commands. None removes the time limit. """
+        self.__command_time_limit_provider = command_time_limit_provider
+
+    @contextlib.contextmanager
+    def command_time_limit_suspended(self):
+        """ Commands run on this thread within the block have no time limit - for package installs and removals, which leave the package database
+            broken if they are ended midway. Commands on other threads (e.g. downloads alongside an installation) keep theirs. """
+        self.__command_time_limit_suspension.is_suspended = True
+        try:
+            yield
+        finally:
+            self.__command_time_limit_suspension.is_suspended = False
+
+    def __get_command_time_limit_in_secs(self):
+        if self.__command_time_limit_provider is None or getattr(self.__command_time_limit_suspension, 'is_suspended', False):
+            return None
+        try:
+            return self.__command_time_limit_provider()
+        except Exception:
+            return None     # not the place to surface problems with the provider
+
+    def __run_command_output_with_time_limit(self, cmd, no_output, chk_err, time_limit_in_secs, cancellation_event=None):
+        # type: (str, bool, bool, float, threading.Event) -> (int, any)
+        """ Same contract as run_command_output, but the command's process group is sent SIGTERM once the time limit passes (or cancellation_event is set),
+            and SIGKILL after a grace period. The return code is TIMED_OUT_EXIT_CODE (or CANCELLED_EXIT_CODE) then. """
+        process = subprocess.Popen(cmd, stdout=None if no_output else subprocess.PIPE, stderr=subprocess.STDOUT, shell=True, preexec_fn=os.setsid)
+        timed_out, cancelled, stop_watching = self.__watch_process_group(process, time_limit_in_secs, cancellation_event)
+        try:
+            output, unused_err = process.communicate()
+        finally:
+            stop_watching()
+
+        code = process.returncode
+        output = None if no_output else self.__convert_process_output_to_ascii(output)
+        if cancelled.is_set() and not timed_out.is_set():
+            code = Constants.CommandDeadlineConfig.CANCELLED_EXIT_CODE
+            output = None if no_output else output + "\n[Command cancelled]"
+        elif timed_out.is_set():
+            code = Constants.CommandDeadlineConfig.TIMED_OUT_EXIT_CODE
+            self.__record_command_timeout(cmd, time_limit_in_secs)
+            output = None if no_output else output + "\n[Command timed out][TimeLimit={0}s]".format(str(int(time_limit_in_secs)))
+
+        if code != 0 and chk_err:
+            print("Error: CalledProcessError. [Code={0}][Command={1}][Result={2}]".format(str(code), cmd, (output or str())[:-1]), file=sys.stdout)
+        return code, output
+
+    @staticmethod
+    def __kill_process_or_group(process, is_process_group):
+        try:
+            if is_process_group:
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except OSError:
+            pass    # already ended
+
+    @staticmethod
+    def __watch_process_group(process, time_limit_in_secs, cancellation_event=None):
+        # type: (subprocess.Popen, float, threading.Event) -> (threading.Event, threading.Event, callable)
+        """ Sends the process group of process (started with os.setsid) SIGTERM once the time limit passes (or cancellation_event is set), and SIGKILL after a grace
+            period. Returns the timed out and cancelled events, and the function to call once the process has ended, to stop watching it. """
+        timed_out = threading.Event()
+        cancelled = threading.Event()
+        ended = threading.Event()
+
+        def signal_process_group(signal_number, reason=timed_out):
+            reason.set()
+            try:
+                os.killpg(process.pid, signal_number)
+            except OSError:
+                pass    # already ended
+
+        def cancel_on_request():
+            while not ended.is_set():
+                if cancellation_event.wait(1):
+                    signal_process_group(signal.SIGTERM, cancelled)
+                    if not ended.wait(Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS):
+                        signal_process_group(signal.SIGKILL, cancelled)
+                    return
+
+        timers = []
+        if time_limit_in_secs is not None:
+            timers += [threading.Timer(time_limit_in_secs, signal_process_group, [signal.SIGTERM]),
+                       threading.Timer(time_limit_in_secs + Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS, signal_process_group, [signal.SIGKILL])]
+        watchers = timers + ([threading.Thread(target=cancel_on_request)] if cancellation_event is not None else [])
+        for watcher in watchers:
+            watcher.daemon = True
+            watcher.start()
+
+        def stop_watching():
+            ended.set()
+            for timer in timers:
+                timer.cancel()
+
+        return timed_out, cancelled, stop_watching
+
+    def __record_command_timeout(self, cmd, time_limit_in_secs):
+        self.timed_out_commands.append({'command': cmd, 'timeLimitInSecs': int(time_limit_in_secs), 'timestamp': time.time()})
+
+    def close_coprocess_shells(self):
+        """ Ends the idle long-lived shells. More are started if needed. """
+        with self.__coprocess_shell_lock:
+            shells = self.__idle_coprocess_shells
+            self.__idle_coprocess_shells = []
+            self.__coprocess_shell_count -= len(shells)
+
+        for shell in shells:
+            shell.close()
+
+    def __try_run_command_output_on_coprocess_shell(self, cmd, time_limit_in_secs=None):
+        # type: (str, float) -> (int, bytes) or None
+        """ Runs a query on a long-lived shell, saving a process launch. Returns None if no shell was available, or it failed - the caller runs the command as usual then. """
+        shell = self.__acquire_coprocess_shell()
+        if shell is None:
+            return None
+
+        is_time_limited = time_limit_in_secs is not None and time_limit_in_secs < Constants.CoprocessShellConfig.COMMAND_TIMEOUT_IN_SECS
+        try:
+            result = shell.run_command_output(cmd, time_limit_in_secs if is_time_limited else Constants.CoprocessShellConfig.COMMAND_TIMEOUT_IN_SECS)
+        except CoprocessShell.CommandTimeoutError:
+            with self.__coprocess_shell_lock:     # the shell is closed already, a fresh one is started for the next query
+                self.__coprocess_shell_count -= 1
+                if not is_time_limited:
+                    self.__coprocess_shell_consecutive_failures += 1
+            if is_time_limited:
+                self.__record_command_timeout(cmd, time_limit_in_secs)
+                return Constants.CommandDeadlineConfig.TIMED_OUT_EXIT_CODE, b''
+            return None
+        except Exception:
+            with self.__coprocess_shell_lock:
+                self.__coprocess_shell_count -= 1
+                self.__coprocess_shell_consecutive_failures += 1
+            return None
+
+        with self.__coprocess_shell_lock:
+            self.__idle_coprocess_shells.append(shell)
+            self.__coprocess_shell_consecutive_failures = 0
+        return result
+
+    def __acquire_coprocess_shell(self):
+        with self.__coprocess_shell_lock:
+            if not Constants.CoprocessShellConfig.ENABLED or self.__coprocess_shell_consecutive_failures >= Constants.CoprocessShellConfig.MAX_CONSECUTIVE_FAILURES:
+                return None
+            if len(self.__idle_coprocess_shells) > 0:
+                return self.__idle_coprocess_shells.pop()
+            if self.__coprocess_shell_count >= Constants.CoprocessShellConfig.POOL_SIZE:
+                return None
+            self.__coprocess_shell_count += 1
+
+        try:
+            return CoprocessShell()
+        except Exception:
+            with self.__coprocess_shell_lock:
+                self.__coprocess_shell_count -= 1
+                self.__coprocess_shell_consecutive_failures += 1
+            return None
+
     @staticmethod
     def __convert_process_output_to_ascii(output):
         major_version = EnvLayer.get_python_major_version()
@@ -334,6 +619,15 @@ class EnvLayer(object):
         else:
             raise Exception("Unknown version of python encountered.")
 
+    @staticmethod
+    def get_output_excerpt(output):
+        # type: (str) -> str
+        """ Bounded head and tail of command output, for logs and telemetry """
+        head_size, tail_size = Constants.CommandOutputSpillConfig.EXCERPT_HEAD_IN_CHARS, Constants.CommandOutputSpillConfig.EXCERPT_TAIL_IN_CHARS
+        if output is None or len(output) <= head_size + tail_size:
+            return output
+        return "{0}\n...[{1} chars omitted]...\n{2}".format(output[:head_size], str(len(output) - head_size - tail_size), output[-tail_size:])
+
     @staticmethod
     def reboot_machine(reboot_cmd):
         subprocess.Popen(reboot_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -350,6 +644,89 @@ class EnvLayer(object):
         else:
             return sys.version_info[0]  # python 2.6 doesn't have attributes like 'major' within sys.version_info
 
+# region - Command output
+    class CommandOutput(object):
+        """ Output of a command, held in memory - or above SPILL_THRESHOLD_IN_BYTES, in a spill file that is read via mmap, so it's never held in memory as a whole """
+
+        def __init__(self, text=None, spill_file_path=None, converter=None):
+            self.__text = text
+            self.__spill_file_path = spill_file_path
+            self.__converter = converter
+            self.size = len(text) if text is not None else os.path.getsize(spill_file_path)
+            if spill_file_path is not None and self.size <= Constants.CommandOutputSpillConfig.SPILL_THRESHOLD_IN_BYTES:
+                with open(spill_file_path, 'rb') as spill_file:
+                    self.__text = converter(spill_file.read())
+                self.close()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self.close()
+
+        def is_spilled(self):
+            return self.__spill_file_path is not None
+
+        def iterate_lines(self):
+            """ Yields the lines of the output, without their line breaks """
+            if not self.is_spilled():
+                for line in str(self.__text).split('\n'):
+                    yield line
+                return
+
+            with open(self.__spill_file_path, 'rb') as spill_file:
+                mapped_output = mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for raw_line in iter(mapped_output.readline, b''):
+                        line = self.__converter(raw_line)
+                        yield line[:-1] if line.endswith('\n') else line
+                finally:
+                    mapped_output.close()
+
+        def read(self):
+            """ The whole output - defeats the purpose of spilling, so only for outputs known to be small """
+            if not self.is_spilled():
+                return self.__text
+            with open(self.__spill_file_path, 'rb') as spill_file:
+                return self.__converter(spill_file.read())
+
+        def read_from_last_occurrence(self, marker):
+            # type: (str) -> str or None
+            """ The output from the last occurrence of marker to its end, or None if marker does not occur """
+            if not self.is_spilled():
+                index = str(self.__text).rfind(marker)
+                return None if index < 0 else self.__text[index:]
+
+            with open(self.__spill_file_path, 'rb') as spill_file:
+                mapped_output = mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    index = mapped_output.rfind(marker.encode('utf-8'))
+                    return None if index < 0 else self.__converter(mapped_output[index:])
+                finally:
+                    mapped_output.close()
+
+        def get_excerpt(self):
+            """ Bounded head and tail of the output, for logs and telemetry """
+            if not self.is_spilled():
+                return EnvLayer.get_output_excerpt(self.__text)
+
+            head_size, tail_size = Constants.CommandOutputSpillConfig.EXCERPT_HEAD_IN_CHARS, Constants.CommandOutputSpillConfig.EXCERPT_TAIL_IN_CHARS
+            with open(self.__spill_file_path, 'rb') as spill_file:
+                head = spill_file.read(head_size)
+                spill_file.seek(-tail_size, os.SEEK_END)
+                tail = spill_file.read(tail_size)
+            return "{0}\n...[{1} bytes omitted]...\n{2}".format(self.__converter(head), str(self.size - head_size - tail_size), self.__converter(tail))
+
+        def close(self):
+            """ Removes the spill file, if any """
+            if self.__spill_file_path is not None:
+                try:
+                    os.remove(self.__spill_file_path)
+                except OSError:
+                    pass    # the temp folder is cleaned up at the end of the run anyway
+                self.__spill_file_path = None
+# endregion - Command output
+
 # region - Platform extensions
     class Platform(object):
         @staticmethod
@@ -0,0 +1,152 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Download of the next batch of packages while the current batch installs"""
+import os
+import shutil
+import threading
+import time
+
+from core.src.bootstrap.Constants import Constants
+
+
+class BatchDownloadPipeline(object):
+    """ Downloads the package set of the next batch in the background (download-only), while the current batch installs, so network and disk work overlap instead
+        of alternating. Only one download runs at a time, and only while the free disk space is above MIN_FREE_DISK_SPACE_IN_MB. The download is moved into the
+        package manager's cache once the current batch has installed (see finish), or discarded if the next batch is not going to be installed (see cancel). """
+
+    def __init__(self, composite_logger, package_manager, download_dir):
+        self.composite_logger = composite_logger
+        self.package_manager = package_manager
+        self.download_dir = download_dir
+        self.__worker = None
+        self.__cancellation_event = None
+        self.__packages = []
+        self.__download_start_time = None
+        self.__download_end_time = None
+        self.__is_download_successful = False
+
+    def is_supported(self):
+        # type: () -> bool
+        return Constants.BatchDownloadPipelineConfig.ENABLED and self.package_manager.concurrent_download_only_cmd is not None and self.package_manager.package_cache_path is not None
+
+    def start(self, packages, package_versions):
+        # type: (list, list) -> bool
+        """ Starts downloading the packages (with their dependencies) in the background. Returns whether the download was started. """
+        if self.__worker is not None or len(packages) == 0 or not self.is_supported() or not os.path.isdir(self.package_manager.package_cache_path):
+            return False
+
+        try:
+            self.__reset_download_dir()
+            free_disk_space_in_mb = self.__get_free_disk_space_in_mb()
+            if free_disk_space_in_mb < Constants.BatchDownloadPipelineConfig.MIN_FREE_DISK_SPACE_IN_MB:
+                self.composite_logger.log_debug("[BDP] Not enough free disk space to download the next batch alongside installation. [FreeDiskSpaceInMB={0}][MinFreeDiskSpaceInMB={1}]"
+                                                .format(str(free_disk_space_in_mb), str(Constants.BatchDownloadPipelineConfig.MIN_FREE_DISK_SPACE_IN_MB)))
+                self.__remove_download_dir()
+                return False
+        except Exception as error:
+            self.composite_logger.log_debug("[BDP] Unable to set up download of the next batch. [DownloadDir={0}][Error={1}]".format(self.download_dir, repr(error)))
+            self.__remove_download_dir()
+            return False
+
+        self.__packages = list(packages)
+        self.__download_start_time, self.__download_end_time = time.time(), None
+        self.__is_download_successful = False
+        self.__cancellation_event = threading.Event()
+        self.__worker = threading.Thread(target=self.__download, args=(list(packages), list(package_versions), self.__cancellation_event, threading.Event()))
+        self.__worker.daemon = True
+        self.__worker.start()
+        self.composite_logger.log_debug("[BDP] Downloading the next batch alongside installation. [Packages={0}]".format(str(len(packages))))
+        return True
+
+    def get_overlap_in_secs(self, start_time, end_time):
+        # type: (float, float) -> float
+        """ How long the download ran between start_time and end_time (e.g. of an install) - the time saved over downloading afterwards """
+        if self.__download_start_time is None:
+            return 0
+        download_end_time = self.__download_end_time if self.__download_end_time is not None else time.time()
+        return max(0, min(end_time, download_end_time) - max(start_time, self.__download_start_time))
+
+    def finish(self):
+        # type: () -> list
+        """ Waits for the download to complete, and moves it into the package manager's cache. Returns the packages downloaded (none, if the download failed). """
+        if self.__worker is None:
+            return []
+
+        wait_start_time = time.time()
+        self.__worker.join()
+        self.__worker = None
+        staged_count = 0
+        try:
+            if self.__is_download_successful:
+                staged_count = self.package_manager.stage_downloaded_packages(self.download_dir)
+        except Exception as error:
+            self.__is_download_successful = False
+            self.composite_logger.log_debug("[BDP] Unable to move downloaded packages into the package manager's cache. [Error={0}]".format(repr(error)))
+        self.__remove_download_dir()
+
+        self.composite_logger.log_debug("[BDP] Download of the next batch completed. [Successful={0}][Packages={1}][Files={2}][DownloadTimeInSecs={3}][WaitTimeInSecs={4}]".format(
+            str(self.__is_download_successful), str(len(self.__packages)), str(staged_count), str(round(self.__download_end_time - self.__download_start_time, 2)),
+            str(round(time.time() - wait_start_time, 2))))
+        return self.__packages if self.__is_download_successful else []
+
+    def cancel(self):
+        """ Ends the download in progress, if any, and discards it - e.g. on the maintenance window cutoff """
+        if self.__worker is None:
+            return
+
+        self.__cancellation_event.set()
+        self.__worker.join()
+        self.__worker = None
+        self.__remove_download_dir()
+        self.composite_logger.log_debug("[BDP] Download of the next batch cancelled. [Packages={0}]".format(str(len(self.__packages))))
+
+    def __download(self, packages, package_versions, cancellation_event, download_ended_event):
+        disk_space_monitor = threading.Thread(target=self.__monitor_disk_space, args=(cancellation_event, download_ended_event))
+        disk_space_monitor.daemon = True
+        disk_space_monitor.start()
+        try:
+            code, out = self.package_manager.download_updates_concurrently(packages, package_versions, self.download_dir, cancellation_event)
+            self.__is_download_successful = self.package_manager.is_download_successful(code, out) and not cancellation_event.is_set()
+        except Exception as error:
+            self.composite_logger.log_debug("[BDP] Download of the next batch failed. [Error={0}]".format(repr(error)))
+        finally:
+            self.__download_end_time = time.time()
+            download_ended_event.set()
+
+    def __monitor_disk_space(self, cancellation_event, download_ended_event):
+        """ Cancels the download if the free disk space drops below the minimum, so the installation in progress is not starved of it """
+        while not download_ended_event.wait(Constants.BatchDownloadPipelineConfig.DISK_SPACE_CHECK_INTERVAL_IN_SECS):
+            try:
+                free_disk_space_in_mb = self.__get_free_disk_space_in_mb()
+            except Exception:
+                continue    # download dir not set up yet, or already removed
+            if free_disk_space_in_mb < Constants.BatchDownloadPipelineConfig.MIN_FREE_DISK_SPACE_IN_MB:
+                self.composite_logger.log_debug("[BDP] Free disk space is running low. Cancelling download of the next batch. [FreeDiskSpaceInMB={0}]".format(str(free_disk_space_in_mb)))
+                cancellation_event.set()
+                return
+
+    def __get_free_disk_space_in_mb(self):
+        stats = os.statvfs(self.download_dir)
+        return int(stats.f_bavail * stats.f_frsize / (1024 * 1024))
+
+    def __reset_download_dir(self):
+        self.__remove_download_dir()
+        os.makedirs(os.path.join(self.download_dir, "partial"))     # for in-progress downloads, where the package manager expects it
+
+    def __remove_download_dir(self):
+        if os.path.exists(self.download_dir):
+            shutil.rmtree(self.download_dir, ignore_errors=True)
@@ -0,0 +1,121 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Per-machine package install duration history"""
+import json
+import math
+import os
+import time
+
+from core.src.bootstrap.Constants import Constants
+
+
+class InstallDurationHistory(object):
+    """ Persisted history of package install durations on this machine, with robust estimates (EWMA and a high percentile) per package manager and per package """
+
+    def __init__(self, env_layer, composite_logger, history_file_path):
+        self.env_layer = env_layer
+        self.composite_logger = composite_logger
+        self.history_file_path = history_file_path
+        self.__history = None   # loaded on first use
+        self.__is_dirty = False
+
+    def record(self, package_manager_name, package_count, duration_in_secs, package_name=None):
+        # type: (str, int, float, str) -> None
+        """ Records an install of package_count packages (parents and dependencies) that took duration_in_secs.
+            package_name is only expected when the whole duration can be attributed to that (parent) package, i.e. it was installed on its own. """
+        if package_count <= 0 or duration_in_secs < 0:
+            return
+
+        history = self.__get_history()
+        self.__add_sample(history['packageManagers'].setdefault(package_manager_name, {}), duration_in_secs / float(package_count), Constants.InstallDurationHistoryConfig.MAX_SAMPLES_PER_PACKAGE_MANAGER)
+        if package_name is not None:
+            self.__add_sample(history['packages'].setdefault(package_name, {}), duration_in_secs, Constants.InstallDurationHistoryConfig.MAX_SAMPLES_PER_PACKAGE)
+            self.__evict_least_recently_installed_packages(history['packages'])
+        self.__is_dirty = True
+
+    def get_estimates_in_seconds(self, package_manager_name, default_avg_time_in_secs, default_max_time_in_secs, packages=None):
+        # type: (str, float, float, list) -> tuple
+        """ Returns the expected (average, max) time to install a package. The defaults are used until the package manager has enough history on this machine.
+            The max is raised for any of the given packages that is known to take longer to install on its own. """
+        history = self.__get_history()
+        avg_time_in_secs, max_time_in_secs = default_avg_time_in_secs, default_max_time_in_secs
+
+        entry = history['packageManagers'].get(package_manager_name)
+        if entry is not None and len(entry['samples']) >= Constants.InstallDurationHistoryConfig.MIN_SAMPLES_FOR_ESTIMATE:
+            avg_time_in_secs = max(entry['ewma'], Constants.InstallDurationHistoryConfig.MIN_AVG_TIME_IN_SECS)
+            max_time_in_secs = max(self.__get_percentile(entry['samples']), Constants.InstallDurationHistoryConfig.MIN_MAX_TIME_IN_SECS)
+
+        for package in (packages if packages is not None else []):
+            entry = history['packages'].get(package)
+            if entry is not None:
+                max_time_in_secs = max(max_time_in_secs, self.__get_percentile(entry['samples']))
+
+        return avg_time_in_secs, max_time_in_secs
+
+    def get_package_estimate_in_seconds(self, package_name, default_time_in_secs):
+        # type: (str, float) -> float
+        """ Returns the expected time to install the (parent) package on its own, or the default if it was not installed on its own before """
+        entry = self.__get_history()['packages'].get(package_name)
+        return entry['ewma'] if entry is not None and 'ewma' in entry else default_time_in_secs
+
+    def save(self):
+        """ Persists the history, if anything was recorded since the last save. Failures are not fatal - the history is only an optimization. """
+        if not self.__is_dirty:
+            return
+
+        try:
+            self.env_layer.file_system.write_with_retry_using_temp_file(self.history_file_path, json.dumps(self.__history))
+            self.__is_dirty = False
+        except Exception as error:
+            self.composite_logger.log_debug("[IDH] Unable to save install duration history. [Path={0}][Error={1}]".format(self.history_file_path, repr(error)))
+
+    def __get_history(self):
+        if self.__history is not None:
+            return self.__history
+
+        self.__history = {'version': 1, 'packageManagers': {}, 'packages': {}}
+        if os.path.isfile(self.history_file_path):
+            try:
+                history = json.loads(self.env_layer.file_system.read_with_retry(self.history_file_path))
+                if history.get('version') == 1 and isinstance(history.get('packageManagers'), dict) and isinstance(history.get('packages'), dict):
+                    self.__history = history
+            except Exception as error:
+                self.composite_logger.log_debug("[IDH] Discarding unreadable install duration history. [Path={0}][Error={1}]".format(self.history_file_path, repr(error)))
+        return self.__history
+
+    def __add_sample(self, entry, duration_in_secs, max_samples):
+        """ Updates the EWMA, and keeps a window of the most recent samples for the percentile. Outliers are clipped to the percentile before they go into the EWMA. """
+        samples = entry.get('samples', [])
+        smoothed_duration_in_secs = duration_in_secs if len(samples) < Constants.InstallDurationHistoryConfig.MIN_SAMPLES_FOR_ESTIMATE else min(duration_in_secs, self.__get_percentile(samples))
+        smoothing_factor = Constants.InstallDurationHistoryConfig.EWMA_SMOOTHING_FACTOR
+        entry['ewma'] = smoothed_duration_in_secs if 'ewma' not in entry else (smoothing_factor * smoothed_duration_in_secs + (1 - smoothing_factor) * entry['ewma'])
+        entry['samples'] = (samples + [round(duration_in_secs, 2)])[-max_samples:]
+        entry['lastInstalled'] = int(time.time())
+
+    @staticmethod
+    def __evict_least_recently_installed_packages(packages):
+        excess_count = len(packages) - Constants.InstallDurationHistoryConfig.MAX_PACKAGES
+        if excess_count > 0:
+            for package in sorted(packages, key=lambda name: packages[name].get('lastInstalled', 0))[:excess_count]:
+                del packages[package]
+
+    @staticmethod
+    def __get_percentile(samples):
+        """ Nearest-rank percentile """
+        ordered_samples = sorted(samples)
+        rank = int(math.ceil(Constants.InstallDurationHistoryConfig.PERCENTILE / 100.0 * len(ordered_samples)))
+        return ordered_samples[max(rank, 1) - 1]
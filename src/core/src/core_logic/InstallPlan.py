@@ -0,0 +1,100 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""This is the expected course of an installation run"""
+import datetime
+
+
+class InstallPlan(object):
+    """ The expected course of an installation run, worked out before anything is installed (see PatchInstaller.get_install_plan): the installs the packages are
+        expected to go in, how long each is expected to take, the packages expected to be left for a later run by the maintenance window cutoff, and whether
+        a reboot is likely to be needed after. """
+
+    REBOOT_PENDING = "Pending"      # already, before anything is installed
+    REBOOT_LIKELY = "Likely"        # packages that usually need a reboot to take effect are installed
+    REBOOT_UNLIKELY = "Unlikely"
+
+    def __init__(self, start_time, batch_size):
+        # type: (datetime.datetime, int) -> None
+        self.start_time = start_time
+        self.batch_size = batch_size
+        self.installs = []      # dicts of packages, packageVersions (parents), transactionSize (parents and dependencies), expectedDurationInSecs, isSequential
+        self.cut_off_packages = []
+        self.cut_off_package_versions = []
+        self.excluded_packages = []
+        self.skipped_esm_packages = []
+        self.reboot_likelihood = self.REBOOT_UNLIKELY
+
+    def add_install(self, packages, package_versions, transaction_size, expected_duration_in_secs, is_sequential=False):
+        # type: (list, list, int, float, bool) -> None
+        self.installs.append({'packages': list(packages), 'packageVersions': list(package_versions), 'transactionSize': transaction_size,
+                              'expectedDurationInSecs': round(expected_duration_in_secs, 2), 'isSequential': is_sequential})
+
+    def get_planned_packages(self):
+        # type: () -> list
+        return [package for install in self.installs for package in install['packages']]
+
+    def get_expected_duration_in_secs(self):
+        # type: () -> float
+        return sum(install['expectedDurationInSecs'] for install in self.installs)
+
+    def get_predicted_completion_time(self):
+        # type: () -> datetime.datetime
+        return self.start_time + datetime.timedelta(seconds=self.get_expected_duration_in_secs())
+
+    def get_expected_remaining_duration_in_secs(self, still_needed_packages):
+        # type: (list) -> float
+        """ Expected time to install the planned packages that are still needed, with each install's duration shared equally among its packages """
+        still_needed_packages = set(still_needed_packages)
+        return sum(install['expectedDurationInSecs'] * len([package for package in install['packages'] if package in still_needed_packages]) / float(len(install['packages']))
+                   for install in self.installs if len(install['packages']) > 0)
+
+    def get_summary(self):
+        # type: () -> dict
+        return {'plannedPackageCount': len(self.get_planned_packages()),
+                'batchSize': self.batch_size,
+                'batchCount': len([install for install in self.installs if not install['isSequential']]),
+                'sequentialInstallCount': len([install for install in self.installs if install['isSequential']]),
+                'expectedDurationInSecs': round(self.get_expected_duration_in_secs(), 2),
+                'predictedCompletionTime': self.get_predicted_completion_time().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                'cutOffPackageCount': len(self.cut_off_packages),
+                'excludedPackageCount': len(self.excluded_packages),
+                'skippedEsmPackageCount': len(self.skipped_esm_packages),
+                'rebootLikelihood': self.reboot_likelihood}
+
+    def to_dict(self):
+        # type: () -> dict
+        plan = self.get_summary()
+        plan.update({'startTime': self.start_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                     'installs': self.installs,
+                     'cutOffPackages': list(self.cut_off_packages),
+                     'cutOffPackageVersions': list(self.cut_off_package_versions),
+                     'excludedPackages': list(self.excluded_packages),
+                     'skippedEsmPackages': list(self.skipped_esm_packages)})
+        return plan
+
+    @staticmethod
+    def from_dict(plan):
+        # type: (dict) -> InstallPlan
+        """ The plan as saved with to_dict - e.g. in the installation journal """
+        install_plan = InstallPlan(datetime.datetime.strptime(plan['startTime'], "%Y-%m-%dT%H:%M:%SZ"), plan['batchSize'])
+        install_plan.installs = plan['installs']
+        install_plan.cut_off_packages = plan['cutOffPackages']
+        install_plan.cut_off_package_versions = plan['cutOffPackageVersions']
+        install_plan.excluded_packages = plan['excludedPackages']
+        install_plan.skipped_esm_packages = plan['skippedEsmPackages']
+        install_plan.reboot_likelihood = plan['rebootLikelihood']
+        return install_plan
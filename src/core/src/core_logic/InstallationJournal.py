@@ -0,0 +1,156 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""This is the record of the installation run in progress, for it to be resumed from"""
+import json
+import os
+import time
+
+from core.src.bootstrap.Constants import Constants
+
+
+class InstallationJournal(object):
+    """ Append-only record of an installation run: the run as planned (the install queue, with the package statuses it was set up with), then a checkpoint after
+        each batch and sequential install with the packages installed and failed since the previous one, and the package database fingerprint at that point.
+        If the run is ended by a crash or an unexpected reboot, the next run of the same operation resumes from the last checkpoint instead of starting over -
+        as long as the package database is exactly as it was then. A run that ended mid-install is not resumed, as its fingerprint doesn't match any more. """
+
+    VERSION = 1
+
+    def __init__(self, env_layer, execution_config, composite_logger, journal_file_path):
+        self.env_layer = env_layer
+        self.execution_config = execution_config
+        self.composite_logger = composite_logger
+        self.journal_file_path = journal_file_path
+        self.__is_started = False
+        self.__journaled_still_needed_packages = []     # (package, version), as of the last checkpoint
+        self.__journaled_failed_package_count = 0
+
+    def start(self, package_manager_name, run, fingerprint):
+        # type: (str, dict, str) -> None
+        """ Starts a new journal with the run as planned. run holds the install queue (packages, packageVersions) and all the packages it started with as still
+            needed (allPackages, allPackageVersions), along with whatever else is needed to set up the run again on resume. """
+        if not Constants.InstallationJournalConfig.ENABLED or fingerprint is None:
+            return
+
+        record = {'type': 'plan', 'version': self.VERSION, 'timestamp': int(time.time()), 'activityId': self.execution_config.activity_id,
+                  'installationFilter': self.__get_installation_filter(), 'packageManager': package_manager_name, 'run': run, 'fingerprint': fingerprint}
+        try:
+            self.env_layer.file_system.write_with_retry_using_temp_file(self.journal_file_path, json.dumps(record) + "\n")
+        except Exception as error:
+            self.composite_logger.log_debug("[IJ] Unable to start installation journal. Installation will not be resumable. [Path={0}][Error={1}]".format(self.journal_file_path, repr(error)))
+            return
+
+        self.__is_started = True
+        self.__journaled_still_needed_packages = list(zip(run['allPackages'], run['allPackageVersions']))
+        self.__journaled_failed_package_count = 0
+
+    def commit(self, still_needed_packages, failed_packages, failed_package_versions, fingerprint):
+        # type: (list, list, list, str) -> None
+        """ Records a checkpoint: the packages no longer needed and the packages failed since the last one (failed_packages is the full list of the run) """
+        if not self.__is_started:
+            return
+
+        still_needed_packages = set(still_needed_packages)
+        installed = [(package, version) for package, version in self.__journaled_still_needed_packages if package not in still_needed_packages]
+        record = {'type': 'checkpoint', 'timestamp': int(time.time()),
+                  'installedPackages': [package for package, version in installed], 'installedPackageVersions': [version for package, version in installed],
+                  'failedPackages': failed_packages[self.__journaled_failed_package_count:], 'failedPackageVersions': failed_package_versions[self.__journaled_failed_package_count:],
+                  'fingerprint': fingerprint}
+        if self.__append(record):
+            self.__journaled_still_needed_packages = [(package, version) for package, version in self.__journaled_still_needed_packages if package in still_needed_packages]
+            self.__journaled_failed_package_count = len(failed_packages)
+
+    def complete(self):
+        """ Records that the run came to an end, so it's not resumed """
+        if not self.__is_started:
+            return
+
+        self.__append({'type': 'completed', 'timestamp': int(time.time())})
+        self.__is_started = False
+
+    def get_resumable_run(self, package_manager_name, fingerprint):
+        # type: (str, str) -> dict
+        """ Returns the run to resume, with the packages installed (installedPackages, installedPackageVersions) and failed (failedPackages, failedPackageVersions)
+            as of its last checkpoint - or None if there is no run to resume, or if it's not safe to: the run completed, is of another operation or installation
+            filter, is too old, or the package database changed since its last checkpoint. Further checkpoints are recorded on the resumed run. """
+        if not Constants.InstallationJournalConfig.ENABLED or fingerprint is None or not os.path.isfile(self.journal_file_path):
+            return None
+
+        records = self.__read_records()
+        if len(records) == 0 or records[0].get('type') != 'plan' or records[0].get('version') != self.VERSION:
+            return None
+
+        plan_record = records[0]
+        reason = None
+        if records[-1].get('type') == 'completed':
+            return None
+        elif plan_record.get('activityId') != self.execution_config.activity_id or plan_record.get('installationFilter') != self.__get_installation_filter():
+            reason = "Operation changed"
+        elif plan_record.get('packageManager') != package_manager_name:
+            reason = "Package manager changed"
+        elif time.time() - plan_record.get('timestamp', 0) > Constants.InstallationJournalConfig.MAX_RESUME_AGE_IN_HOURS * 60 * 60:
+            reason = "Journal too old"
+        elif records[-1].get('fingerprint') != fingerprint:
+            reason = "Package database changed since the last checkpoint"
+
+        if reason is not None:
+            self.composite_logger.log_debug("[IJ] Not resuming the installation run in the journal. [Reason={0}][Checkpoints={1}]".format(reason, str(len(records) - 1)))
+            return None
+
+        run = dict(plan_record['run'])
+        run.update({'installedPackages': [], 'installedPackageVersions': [], 'failedPackages': [], 'failedPackageVersions': []})
+        for record in records[1:]:
+            for key in ['installedPackages', 'installedPackageVersions', 'failedPackages', 'failedPackageVersions']:
+                run[key] += record.get(key, [])
+
+        self.__is_started = True
+        installed_packages = set(run['installedPackages'])
+        self.__journaled_still_needed_packages = [(package, version) for package, version in zip(run['allPackages'], run['allPackageVersions']) if package not in installed_packages]
+        self.__journaled_failed_package_count = len(run['failedPackages'])
+
+        self.composite_logger.log_debug("[IJ] Resuming the installation run in the journal. [Checkpoints={0}][Installed={1}][Failed={2}]".format(
+            str(len(records) - 1), str(len(run['installedPackages'])), str(len(run['failedPackages']))))
+        return run
+
+    def __get_installation_filter(self):
+        return {'classifications': list(self.execution_config.included_classifications_list or []),
+                'includedPackageMasks': list(self.execution_config.included_package_name_mask_list or []),
+                'excludedPackageMasks': list(self.execution_config.excluded_package_name_mask_list or []),
+                'maxPatchPublishDate': self.execution_config.max_patch_publish_date}
+
+    def __read_records(self):
+        """ Records up to the first one that can't be read - e.g. a checkpoint the crash cut short """
+        records = []
+        try:
+            for line in self.env_layer.file_system.read_with_retry(self.journal_file_path).splitlines():
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        except Exception as error:
+            self.composite_logger.log_debug("[IJ] Unable to read installation journal. [Path={0}][Error={1}]".format(self.journal_file_path, repr(error)))
+            return []
+        return records
+
+    def __append(self, record):
+        """ Failures are not fatal - the run is then resumed from an earlier checkpoint, or not at all """
+        try:
+            self.env_layer.file_system.write_with_retry(self.journal_file_path, json.dumps(record) + "\n", mode='a+')
+            return True
+        except Exception as error:
+            self.composite_logger.log_debug("[IJ] Unable to write to installation journal. [Path={0}][Error={1}]".format(self.journal_file_path, repr(error)))
+            return False
@@ -31,7 +31,7 @@ class MaintenanceWindow(object):
         self.env_layer = env_layer
         self.status_handler = status_handler
 
-    def get_remaining_time_in_minutes(self, current_time=None, log_to_stdout=False):
+    def get_remaining_time_in_minutes(self, current_time=None, log_to_stdout=False, log_utilization=True):
         """Calculate time remaining base on the given job start time"""
         try:
             if current_time is None:
@@ -47,7 +47,7 @@ class MaintenanceWindow(object):
                         [Job start: " + str(start_time) + ", Current time: " + str(current_time.strftime("%Y-%m-%d %H:%M:%S")) + "]"
             if log_to_stdout:
                 self.composite_logger.log(log_line)
-            else:
+            elif log_utilization:
                 self.composite_logger.log_debug(log_line)
         except ValueError as error:
             error_msg = "Error calculating time remaining. Check patch operation input parameters."
@@ -59,19 +59,9 @@ class MaintenanceWindow(object):
 
         return remaining_time_in_minutes
 
-    def is_package_install_time_available(self, package_manager, remaining_time_in_minutes=None, number_of_packages_in_batch=1):
-        """Check if time still available for package installation"""
-        # In the extreme case, all the package installations in the batch might take the maximum time. 
-        # But calculating cutoff time based on max time to install packages for all the packages will make cutoff time very huge 
-        # as it is very unlikely that all the package installations take maximum time.
-        # Assuming that one of the packages in the batch could take maximum time to install and rest of the packages take average time.
-        cutoff_time_in_minutes = Constants.PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES
-        if number_of_packages_in_batch > 1:
-            package_install_expected_avg_time_in_minutes = package_manager.get_package_install_expected_avg_time_in_seconds() / 60
-            cutoff_time_in_minutes += package_install_expected_avg_time_in_minutes * (number_of_packages_in_batch - 1)
-
-        if Constants.REBOOT_SETTINGS[self.execution_config.reboot_setting] != Constants.REBOOT_NEVER:
-            cutoff_time_in_minutes = cutoff_time_in_minutes + Constants.REBOOT_BUFFER_IN_MINUTES
+    def is_package_install_time_available(self, package_manager, remaining_time_in_minutes=None, number_of_packages_in_batch=1, packages=None):
+        """Check if time still available for package installation. Expected install times are learned on the machine (see InstallDurationHistory), packages being the ones about to be installed, if known."""
+        cutoff_time_in_minutes = self.get_package_install_cutoff_time_in_minutes(package_manager, number_of_packages_in_batch, packages)
 
         if remaining_time_in_minutes is None:
             remaining_time_in_minutes = self.get_remaining_time_in_minutes()
@@ -83,6 +73,29 @@ class MaintenanceWindow(object):
             self.composite_logger.log_warning("Time Remaining: " + str(timedelta(seconds=int(remaining_time_in_minutes * 60))) + ", Cutoff time: " + str(timedelta(minutes=cutoff_time_in_minutes)) + " [Out of time!]")
             return False
 
+    def get_package_install_cutoff_time_in_minutes(self, package_manager, number_of_packages_in_batch=1, packages=None):
+        """Remaining time below which a package install (of number_of_packages_in_batch packages) is not started, as it might not complete in time"""
+        # In the extreme case, all the package installations in the batch might take the maximum time. 
+        # But calculating cutoff time based on max time to install packages for all the packages will make cutoff time very huge 
+        # as it is very unlikely that all the package installations take maximum time.
+        # Assuming that one of the packages in the batch could take maximum time to install and rest of the packages take average time.
+        package_install_expected_avg_time_in_seconds, package_install_expected_max_time_in_seconds = package_manager.get_package_install_time_estimates_in_seconds(packages)
+        cutoff_time_in_minutes = package_install_expected_max_time_in_seconds / 60.0
+        if number_of_packages_in_batch > 1:
+            package_install_expected_avg_time_in_minutes = package_install_expected_avg_time_in_seconds / 60.0
+            cutoff_time_in_minutes += package_install_expected_avg_time_in_minutes * (number_of_packages_in_batch - 1)
+
+        if Constants.REBOOT_SETTINGS[self.execution_config.reboot_setting] != Constants.REBOOT_NEVER:
+            cutoff_time_in_minutes = cutoff_time_in_minutes + Constants.REBOOT_BUFFER_IN_MINUTES
+        return cutoff_time_in_minutes
+
+    def get_command_time_limit_in_secs(self):
+        """Time that a command started now may take to complete before the maintenance window cutoff, which leaves time for a reboot unless reboots are disabled"""
+        remaining_time_in_minutes = self.get_remaining_time_in_minutes(log_utilization=False)
+        if Constants.REBOOT_SETTINGS[self.execution_config.reboot_setting] != Constants.REBOOT_NEVER:
+            remaining_time_in_minutes = remaining_time_in_minutes - Constants.REBOOT_BUFFER_IN_MINUTES
+        return max(remaining_time_in_minutes * 60, Constants.CommandDeadlineConfig.MIN_TIME_LIMIT_IN_SECS)
+
     def get_percentage_maintenance_window_used(self):
         """Calculate percentage of maintenance window used"""
         try:
@@ -0,0 +1,127 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""Download of the packages planned for installation, ahead of the maintenance window"""
+import copy
+import json
+import os
+import time
+
+from core.src.bootstrap.Constants import Constants
+from core.src.core_logic.PackageFilter import PackageFilter
+
+
+class PackagePrefetcher(object):
+    """ Stages the packages planned for installation in the package manager's cache (download-only), so installation within the maintenance window is mostly
+        local unpack and configure work. Auto-assessment runs without the installation configuration, so the plan is the installation filter (classifications,
+        inclusions and exclusions) of the last installation operation, which is saved with the packages staged in the prefetch state file. """
+
+    def __init__(self, env_layer, execution_config, composite_logger, package_manager, state_file_path):
+        self.env_layer = env_layer
+        self.execution_config = execution_config
+        self.composite_logger = composite_logger
+        self.package_manager = package_manager
+        self.state_file_path = state_file_path
+        self.__state = None     # loaded on first use
+
+    def save_installation_filter(self):
+        """ Saves the installation filter of this installation operation, as the plan for the next prefetch """
+        state = self.__get_state()
+        state['installationFilter'] = {'classifications': list(self.execution_config.included_classifications_list or []),
+                                       'includedPackageMasks': list(self.execution_config.included_package_name_mask_list or []),
+                                       'excludedPackageMasks': list(self.execution_config.excluded_package_name_mask_list or [])}
+        self.__save_state()
+
+    def prefetch(self):
+        # type: () -> int
+        """ Downloads the packages the last installation filter selects, with the bandwidth cap where supported. Returns the number of packages staged.
+            Failures are not fatal - the packages are then downloaded during installation, as they would have been without this. """
+        if not Constants.PackagePrefetchConfig.ENABLED or self.package_manager.download_only_cmd is None:
+            return 0
+
+        installation_filter = self.__get_state().get('installationFilter')
+        if installation_filter is None:
+            self.composite_logger.log_debug("[PP] No installation filter saved yet. Skipping package prefetch.")
+            return 0
+
+        try:
+            packages, package_versions = self.__get_planned_packages(installation_filter)
+            self.composite_logger.log("[PP] Prefetching packages planned for installation... [Planned={0}][MaxBandwidthInKBps={1}]"
+                                      .format(str(len(packages)), str(Constants.PackagePrefetchConfig.MAX_BANDWIDTH_IN_KBPS)))
+
+            # packages already in the package manager's cache are not downloaded again, so all planned packages are requested
+            staged_packages = {}
+            max_packages_per_command = Constants.PackagePrefetchConfig.MAX_PACKAGES_PER_COMMAND
+            for start in range(0, len(packages), max_packages_per_command):
+                chunk_packages, chunk_package_versions = packages[start:start + max_packages_per_command], package_versions[start:start + max_packages_per_command]
+                code, out = self.package_manager.download_updates(chunk_packages, chunk_package_versions)
+                if self.package_manager.is_download_successful(code, out):
+                    staged_packages.update(zip(chunk_packages, chunk_package_versions))
+                else:
+                    self.composite_logger.log_debug("[PP] Package download failed. These packages will be downloaded during installation. [Code={0}][Packages={1}]"
+                                                    .format(str(code), str(chunk_packages)))
+
+            state = self.__get_state()
+            state['stagedPackages'] = staged_packages
+            state['packageManager'] = self.package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_IDENTITY)
+            state['lastPrefetchTime'] = int(time.time())
+            self.__save_state()
+            self.composite_logger.log("[PP] Package prefetch completed. [Staged={0}][Planned={1}]".format(str(len(staged_packages)), str(len(packages))))
+            return len(staged_packages)
+        except Exception as error:
+            self.composite_logger.log_warning("[PP] Package prefetch failed. Packages will be downloaded during installation. [Error={0}]".format(repr(error)))
+            return 0
+
+    def get_staged_packages(self, packages, package_versions):
+        # type: (list, list) -> list
+        """ Returns those of the packages that were staged ahead of the maintenance window, at the given version """
+        staged_packages = self.__get_state().get('stagedPackages', {})
+        return [package for package, version in zip(packages, package_versions) if staged_packages.get(package) == version]
+
+    def __get_planned_packages(self, installation_filter):
+        """ Packages the installation filter selects, less those excluded and those that can't be installed (e.g. ESM packages without an attached subscription) """
+        filter_config = copy.copy(self.execution_config)
+        filter_config.included_classifications_list = installation_filter['classifications']
+        filter_config.included_package_name_mask_list = installation_filter['includedPackageMasks']
+        filter_config.excluded_package_name_mask_list = installation_filter['excludedPackageMasks']
+        package_filter = PackageFilter(filter_config, self.composite_logger)
+
+        packages, package_versions = self.package_manager.get_available_updates(package_filter)
+        included = [(package, version) for package, version in zip(packages, package_versions) if not package_filter.check_for_exclusion(package)]
+        packages, package_versions = [package for package, version in included], [version for package, version in included]
+        packages, package_versions = self.package_manager.separate_out_esm_packages(packages, package_versions)[:2]
+        return packages, package_versions
+
+    def __get_state(self):
+        if self.__state is not None:
+            return self.__state
+
+        self.__state = {'version': 1}
+        if os.path.isfile(self.state_file_path):
+            try:
+                state = json.loads(self.env_layer.file_system.read_with_retry(self.state_file_path))
+                if state.get('version') == 1 and isinstance(state.get('stagedPackages', {}), dict):
+                    self.__state = state
+            except Exception as error:
+                self.composite_logger.log_debug("[PP] Discarding unreadable package prefetch state. [Path={0}][Error={1}]".format(self.state_file_path, repr(error)))
+        return self.__state
+
+    def __save_state(self):
+        """ Failures are not fatal - the state is only an optimization """
+        try:
+            self.env_layer.file_system.write_with_retry_using_temp_file(self.state_file_path, json.dumps(self.__state))
+        except Exception as error:
+            self.composite_logger.log_debug("[PP] Unable to save package prefetch state. [Path={0}][Error={1}]".format(self.state_file_path, repr(error)))
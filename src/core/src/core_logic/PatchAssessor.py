@@ -22,6 +22,7 @@ import shutil
 import sys
 import time
 from core.src.bootstrap.Constants import Constants
+from core.src.core_logic.PackagePrefetcher import PackagePrefetcher
 from core.src.core_logic.Stopwatch import Stopwatch
 
 
@@ -39,6 +40,20 @@ class PatchAssessor(object):
         self.package_manager_name = self.package_manager.get_package_manager_setting(Constants.PKG_MGR_SETTING_IDENTITY)
         self.assessment_state_file_path = os.path.join(self.execution_config.config_folder, Constants.ASSESSMENT_STATE_FILE)
         self.stopwatch = Stopwatch(self.env_layer, self.telemetry_writer, self.composite_logger)
+        self.package_prefetcher = PackagePrefetcher(self.env_layer, self.execution_config, self.composite_logger, self.package_manager,
+                                                    os.path.join(self.execution_config.config_folder, Constants.PACKAGE_PREFETCH_STATE_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
+
+    def flush(self):
+        """ Persists any assessment status updates and telemetry events still being held in memory """
+        self.status_handler.flush()
+        self.telemetry_writer.flush()
 
     def start_assessment(self):
         """ Start a patch assessment """
@@ -61,6 +76,7 @@ class PatchAssessor(object):
         for i in range(0, Constants.MAX_ASSESSMENT_RETRY_COUNT):
             try:
                 self.composite_logger.log("\n\nGetting available patches...")
+                self.package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_SINGLE_PASS_ASSESSMENT, True)     # one sources refresh and simulation, where supported
                 self.package_manager.refresh_repo()
                 self.status_handler.reset_assessment_data()
 
@@ -70,13 +86,12 @@ class PatchAssessor(object):
                 # All updates
                 retry_count = retry_count + 1
                 
-                # All updates
-                packages, package_versions = self.package_manager.get_all_updates()
+                # All updates and security updates (concurrently, where supported)
+                (packages, package_versions), (sec_packages, sec_package_versions) = self.package_manager.get_all_and_security_updates()
                 self.telemetry_writer.write_event("Full assessment: " + str(packages), Constants.TelemetryEventLevel.Verbose)
                 self.status_handler.set_package_assessment_status(packages, package_versions)
                 if self.lifecycle_manager is not None:
                     self.lifecycle_manager.lifecycle_status_check()     # may terminate the code abruptly, as designed
-                sec_packages, sec_package_versions = self.package_manager.get_security_updates()
 
                 # Tag security updates
                 self.telemetry_writer.write_event("Security assessment: " + str(sec_packages), Constants.TelemetryEventLevel.Verbose)
@@ -89,14 +104,17 @@ class PatchAssessor(object):
                 reboot_pending = self.package_manager.is_reboot_pending()
                 self.status_handler.set_reboot_pending(reboot_pending)
 
+                self.package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_SINGLE_PASS_ASSESSMENT, False)
                 self.status_handler.set_assessment_substatus_json(status=Constants.STATUS_SUCCESS)
                 break   # avoid retries for success
 
             except Exception as error:
+                self.package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_SINGLE_PASS_ASSESSMENT, False)
                 if i < Constants.MAX_ASSESSMENT_RETRY_COUNT - 1:
                     error_msg = 'Retriable error retrieving available patches: ' + repr(error)
                     self.composite_logger.log_warning(error_msg)
                     self.status_handler.add_error_to_status(error_msg, Constants.PatchOperationErrorCodes.DEFAULT_ERROR)
+                    self.flush()    # retry boundary
                     time.sleep(2*(i + 1))
                 else:
                     error_msg = 'Error retrieving available patches: ' + repr(error)
@@ -110,6 +128,11 @@ class PatchAssessor(object):
 
         self.write_assessment_perf_logs(retry_count, Constants.TaskStatus.SUCCEEDED, "")
         self.composite_logger.log("\nPatch assessment completed.\n")
+
+        # auto-assessment runs ahead of maintenance windows, so it stages the packages planned for installation
+        if self.execution_config.exec_auto_assess_only:
+            self.flush()    # assessment results are not held back by the downloads
+            self.package_prefetcher.prefetch()
         return True
 
     def write_assessment_perf_logs(self, retry_count, task_status, error_msg):
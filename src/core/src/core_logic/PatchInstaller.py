@@ -16,10 +16,17 @@
 
 """ The patch install orchestrator """
 import datetime
+import json
 import math
+import os
+import re
 import sys
 import time
 from core.src.bootstrap.Constants import Constants
+from core.src.core_logic.BatchDownloadPipeline import BatchDownloadPipeline
+from core.src.core_logic.InstallationJournal import InstallationJournal
+from core.src.core_logic.InstallPlan import InstallPlan
+from core.src.core_logic.PackagePrefetcher import PackagePrefetcher
 from core.src.core_logic.Stopwatch import Stopwatch
 
 class PatchInstaller(object):
@@ -41,16 +48,41 @@ class PatchInstaller(object):
 
         self.last_still_needed_packages = None  # Used for 'Installed' status records
         self.last_still_needed_package_versions = None
+        self.reconciliation_checkpoint = None   # Installed versions of still needed packages, as of the last full reconciliation
         self.progress_template = "[Time available: {0} | A: {1}, S: {2}, F: {3} | D: {4}]\t {5}"
 
         self.attempted_parent_package_install_count = 0
         self.successful_parent_package_install_count = 0
         self.failed_parent_package_install_count = 0
+        self.failed_packages = []   # parent packages that failed to install, in the order they failed
+        self.failed_package_versions = []
         self.skipped_esm_packages = []
         self.skipped_esm_package_versions = []
         self.esm_packages_found_without_attach = False  # Flag used to record if esm packages excluded as ubuntu vm not attached.
+        self.timed_out_command_count_at_start = 0   # see is_command_deadline_exceeded
+        self.install_plan = None    # see get_install_plan
 
         self.stopwatch = Stopwatch(self.env_layer, self.telemetry_writer, self.composite_logger)
+        self.package_prefetcher = PackagePrefetcher(self.env_layer, self.execution_config, self.composite_logger, self.package_manager,
+                                                    os.path.join(self.execution_config.config_folder, Constants.PACKAGE_PREFETCH_STATE_FILE))
+        self.installation_journal = InstallationJournal(self.env_layer, self.execution_config, self.composite_logger,
+                                                        os.path.join(self.execution_config.config_folder, Constants.INSTALLATION_JOURNAL_FILE))
+        self.batch_download_pipeline = BatchDownloadPipeline(self.composite_logger, self.package_manager, os.path.join(self.execution_config.temp_folder, Constants.BATCH_DOWNLOAD_FOLDER_NAME))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.batch_download_pipeline.cancel()
+        self.env_layer.set_command_time_limit_provider(None)
+        self.flush()
+        return False
+
+    def flush(self):
+        """ Persists any per-package status updates, telemetry events and install durations still being held in memory """
+        self.status_handler.flush()
+        self.telemetry_writer.flush()
+        self.package_manager.install_duration_history.save()
 
     def start_installation(self, simulate=False):
         """ Kick off a patch installation run """
@@ -62,6 +94,11 @@ class PatchInstaller(object):
 
         self.stopwatch.start()
 
+        # Commands have to complete before the maintenance window cutoff, or they are ended - and no further installs are attempted (see is_command_deadline_exceeded).
+        # Installs themselves are not ended, as that would leave the package database broken (see PackageManager.invoke_package_manager_transaction).
+        self.timed_out_command_count_at_start = len(self.env_layer.timed_out_commands)
+        self.env_layer.set_command_time_limit_provider(self.maintenance_window.get_command_time_limit_in_secs)
+
         maintenance_window = self.maintenance_window
         package_manager = self.package_manager
         reboot_manager = self.reboot_manager
@@ -115,12 +152,14 @@ class PatchInstaller(object):
         self.write_installer_perf_logs(update_run_successful, installed_update_count, retry_count, maintenance_window, maintenance_window_exceeded, Constants.TaskStatus.SUCCEEDED, "")
 
         # Reboot as per setting and environment state
+        self.env_layer.set_command_time_limit_provider(None)
         reboot_manager.start_reboot_if_required_and_time_available(maintenance_window.get_remaining_time_in_minutes(None, False))
         maintenance_window_exceeded = maintenance_window_exceeded or reboot_manager.has_maintenance_window_exceeded_at_reboot_manager()
 
         # Combining maintenance
         overall_patch_installation_successful = bool(update_run_successful and not maintenance_window_exceeded)
         # NOTE: Not updating installation substatus at this point because we need to wait for the implicit/second assessment to complete first, as per CRP's instructions
+        self.flush()
 
         return overall_patch_installation_successful
 
@@ -187,6 +226,7 @@ class PatchInstaller(object):
 
             self.status_handler.set_package_install_status_classification(packages, package_versions, classification="Security")
             package_manager.set_security_esm_package_status(Constants.INSTALLATION, packages)
+            self.flush()    # initial statuses are a phase boundary
 
             installed_update_count = 0  # includes dependencies
             patch_installation_successful = True
@@ -195,7 +235,12 @@ class PatchInstaller(object):
             install_result = Constants.FAILED
             for i in range(0, Constants.MAX_INSTALLATION_RETRY_COUNT):
                 code, out = package_manager.install_security_updates_azgps_coordinated()
-                installed_update_count += self.perform_status_reconciliation_conditionally(package_manager)
+                if self.is_command_deadline_exceeded():
+                    patch_installation_successful = False
+                    maintenance_window_exceeded = True
+                    self.status_handler.set_maintenance_window_exceeded(True)
+                    break
+                installed_update_count += self.perform_final_status_reconciliation(package_manager)
 
                 remaining_time = maintenance_window.get_remaining_time_in_minutes()
                 if remaining_time < 120:
@@ -221,6 +266,11 @@ class PatchInstaller(object):
 
     def install_updates(self, maintenance_window, package_manager, simulate=False):
         """wrapper function of installing updates"""
+        # A run ended by a crash or an unexpected reboot is resumed from its last checkpoint, if the package database is unchanged since
+        resumable_run = None if simulate else self.installation_journal.get_resumable_run(self.package_manager_name, package_manager.command_result_cache.get_database_fingerprint())
+        if resumable_run is not None:
+            return self.resume_installation(maintenance_window, package_manager, resumable_run, simulate)
+
         self.composite_logger.log("\n\nGetting available updates...")
         package_manager.refresh_repo()
 
@@ -243,6 +293,11 @@ class PatchInstaller(object):
 
         self.telemetry_writer.write_event("Final package list: " + str(packages), Constants.TelemetryEventLevel.Verbose)
 
+        # packages staged ahead of the maintenance window only need to be unpacked and configured - the filter of this run is the plan for the next prefetch
+        staged_packages = self.package_prefetcher.get_staged_packages(packages, package_versions)
+        self.composite_logger.log_debug("Packages staged ahead of the maintenance window: {0} of {1}".format(str(len(staged_packages)), str(len(packages))))
+        self.package_prefetcher.save_installation_filter()
+
         # Set initial statuses
         if not package_manager.get_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, False):  # 'Not included' list is not accurate when a repeat is required
             self.status_handler.set_package_install_status(not_included_packages, not_included_package_versions, Constants.NOT_SELECTED)
@@ -258,6 +313,68 @@ class PatchInstaller(object):
         # Set the security-esm package status.
         package_manager.set_security_esm_package_status(Constants.INSTALLATION, packages)
 
+        # Batches and sequential installs work through the packages in this order
+        packages, package_versions = self.get_prioritized_install_queue(package_manager, packages, package_versions, sec_packages)
+        self.telemetry_writer.write_event("Prioritized package list: " + str(packages), Constants.TelemetryEventLevel.Verbose)
+        self.flush()    # initial statuses are a phase boundary
+
+        all_packages, all_package_versions = package_manager.get_all_updates(cached=False)
+        self.telemetry_writer.write_event("All available packages list: " + str(all_packages), Constants.TelemetryEventLevel.Verbose)
+        self.last_still_needed_packages = list(all_packages)
+        self.last_still_needed_package_versions = list(all_package_versions)
+        self.reconciliation_checkpoint = self.get_reconciliation_checkpoint(package_manager)
+
+        # Batches are installed as planned - the first one's dependency resolution is reused, the package database is unchanged until it's installed
+        self.install_plan = self.get_install_plan(maintenance_window, package_manager, all_packages, all_package_versions, packages, package_versions, excluded_packages)
+
+        # The run is journaled as set up here, to be resumed from if it's ended by a crash or an unexpected reboot
+        if not simulate:
+            is_not_selected_status_set = not package_manager.get_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, False)
+            self.installation_journal.start(self.package_manager_name, {
+                'packages': packages, 'packageVersions': package_versions, 'allPackages': all_packages, 'allPackageVersions': all_package_versions,
+                'notIncludedPackages': not_included_packages if is_not_selected_status_set else [], 'notIncludedPackageVersions': not_included_package_versions if is_not_selected_status_set else [],
+                'excludedPackages': excluded_packages, 'excludedPackageVersions': excluded_package_versions,
+                'skippedEsmPackages': self.skipped_esm_packages, 'skippedEsmPackageVersions': self.skipped_esm_package_versions, 'esmPackagesFoundWithoutAttach': self.esm_packages_found_without_attach,
+                'securityPackages': sec_packages, 'securityPackageVersions': sec_package_versions, 'plan': self.install_plan.to_dict()}, package_manager.command_result_cache.get_database_fingerprint())
+
+        return self.install_packages(maintenance_window, package_manager, all_packages, all_package_versions, packages, package_versions, self.install_plan.batch_size, simulate)
+
+    def resume_installation(self, maintenance_window, package_manager, run, simulate=False):
+        """ Sets up the run in the installation journal again as it was at its last checkpoint, and installs the packages left - without refreshing the
+            repositories, assessing or planning again, as the package database is unchanged since (see InstallationJournal.get_resumable_run) """
+        self.composite_logger.log("\n\nResuming patch installation from the installation journal... [Installed={0}][Failed={1}]".format(str(len(run['installedPackages'])), str(len(run['failedPackages']))))
+
+        self.status_handler.set_package_install_status(run['notIncludedPackages'], run['notIncludedPackageVersions'], Constants.NOT_SELECTED)
+        self.status_handler.set_package_install_status(run['excludedPackages'], run['excludedPackageVersions'], Constants.EXCLUDED)
+        self.status_handler.set_package_install_status(run['packages'], run['packageVersions'], Constants.PENDING)
+        self.status_handler.set_package_install_status(run['skippedEsmPackages'], run['skippedEsmPackageVersions'], Constants.FAILED)
+        self.status_handler.set_package_install_status_classification(run['securityPackages'], run['securityPackageVersions'], classification="Security")
+        package_manager.set_security_esm_package_status(Constants.INSTALLATION, run['packages'])
+        self.status_handler.set_package_install_status(run['installedPackages'], run['installedPackageVersions'], Constants.INSTALLED)
+        self.status_handler.set_package_install_status(run['failedPackages'], run['failedPackageVersions'], Constants.FAILED)
+        self.skipped_esm_packages, self.skipped_esm_package_versions = list(run['skippedEsmPackages']), list(run['skippedEsmPackageVersions'])
+        self.esm_packages_found_without_attach = run['esmPackagesFoundWithoutAttach']
+        self.failed_packages, self.failed_package_versions = list(run['failedPackages']), list(run['failedPackageVersions'])
+        self.flush()
+
+        installed_packages = set(run['installedPackages'])
+        still_needed = [(package, version) for package, version in zip(run['allPackages'], run['allPackageVersions']) if package not in installed_packages]
+        self.last_still_needed_packages = [package for package, version in still_needed]
+        self.last_still_needed_package_versions = [version for package, version in still_needed]
+        self.reconciliation_checkpoint = self.get_reconciliation_checkpoint(package_manager)
+        self.install_plan = InstallPlan.from_dict(run['plan'])
+
+        # failed packages are not retried, as in the run resumed
+        failed_packages = set(run['failedPackages'])
+        remaining = [(package, version) for package, version in zip(run['packages'], run['packageVersions']) if package not in installed_packages and package not in failed_packages]
+        packages, package_versions = [package for package, version in remaining], [version for package, version in remaining]
+        self.composite_logger.log("\nList of packages left to be updated: \n" + str(packages))
+
+        # the batch size is worked out again, for the time left in the maintenance window
+        return self.install_packages(maintenance_window, package_manager, list(run['allPackages']), list(run['allPackageVersions']), packages, package_versions, None, simulate)
+
+    def install_packages(self, maintenance_window, package_manager, all_packages, all_package_versions, packages, package_versions, max_batch_size_for_packages, simulate=False):
+        """ Installs the packages (in install order) in batches, and then those not attempted in batches sequentially, as time in the maintenance window allows """
         self.composite_logger.log("\nNote: Packages that are neither included nor excluded may still be installed if an included package has a dependency on it.")
         # We will see this as packages going from NotSelected --> Installed. We could remove them preemptively from not_included_packages, but we're explicitly choosing not to.
 
@@ -266,14 +383,9 @@ class PatchInstaller(object):
 
         patch_installation_successful = True
         maintenance_window_exceeded = False
-        all_packages, all_package_versions = package_manager.get_all_updates(cached=False)
-        self.telemetry_writer.write_event("All available packages list: " + str(all_packages), Constants.TelemetryEventLevel.Verbose)
-        self.last_still_needed_packages = list(all_packages)
-        self.last_still_needed_package_versions = list(all_package_versions)
-
         packages, package_versions, install_update_count_in_batch_patching, patch_installation_successful = self.batch_patching(all_packages, all_package_versions,
                                                                                                                 packages, package_versions, maintenance_window,
-                                                                                                                package_manager)
+                                                                                                                package_manager, max_batch_size_for_packages)
 
         installed_update_count = install_update_count_in_batch_patching
         attempted_parent_package_install_count_in_batch_patching = self.attempted_parent_package_install_count
@@ -281,10 +393,11 @@ class PatchInstaller(object):
 
         if len(packages) == 0:
             self.log_final_metrics(maintenance_window, patch_installation_successful, maintenance_window_exceeded, installed_update_count)
+            self.installation_journal.complete()
             return installed_update_count, patch_installation_successful, maintenance_window_exceeded
         else:
             progress_status = self.progress_template.format(str(datetime.timedelta(minutes=maintenance_window.get_remaining_time_in_minutes())), str(self.attempted_parent_package_install_count), str(self.successful_parent_package_install_count), str(self.failed_parent_package_install_count), str(installed_update_count - self.successful_parent_package_install_count),
-                                                        "Following packages are not attempted or failed in batch installation: " + str(packages))
+                                                        "Following packages are not attempted in batch installation: " + str(packages))
             self.composite_logger.log(progress_status)
 
         stopwatch_for_sequential_install_process = Stopwatch(self.env_layer, self.telemetry_writer, self.composite_logger)
@@ -305,7 +418,7 @@ class PatchInstaller(object):
 
             # maintenance window check
             remaining_time = maintenance_window.get_remaining_time_in_minutes()
-            if maintenance_window.is_package_install_time_available(package_manager, remaining_time, number_of_packages_in_batch=1) is False:
+            if self.is_command_deadline_exceeded() or maintenance_window.is_package_install_time_available(package_manager, remaining_time, number_of_packages_in_batch=1, packages=[package]) is False:
                 error_msg = "Stopped patch installation as it is past the maintenance window cutoff time."
                 self.composite_logger.log_error("\n" + error_msg)
                 self.status_handler.add_error_to_status(error_msg, Constants.PatchOperationErrorCodes.DEFAULT_ERROR)
@@ -327,7 +440,10 @@ class PatchInstaller(object):
             self.include_dependencies(package_manager, [package], [version], all_packages, all_package_versions, packages, package_versions, package_and_dependencies, package_and_dependency_versions)
 
             # parent package install (+ dependencies) and parent package result management
+            install_start_time = time.time()
             install_result = package_manager.install_update_and_dependencies_and_get_status(package_and_dependencies, package_and_dependency_versions, simulate)
+            if install_result == Constants.INSTALLED:
+                package_manager.record_package_install_duration(package_and_dependencies, time.time() - install_start_time, package)
 
             # Update reboot pending status in status_handler
             self.status_handler.set_reboot_pending(self.package_manager.is_reboot_pending())
@@ -335,6 +451,8 @@ class PatchInstaller(object):
             if install_result == Constants.FAILED:
                 self.status_handler.set_package_install_status(package_manager.get_product_name(str(package_and_dependencies[0])), str(package_and_dependency_versions[0]), Constants.FAILED)
                 self.failed_parent_package_install_count += 1
+                self.failed_packages.append(package)
+                self.failed_package_versions.append(version)
                 patch_installation_successful = False
             elif install_result == Constants.INSTALLED:
                 self.status_handler.set_package_install_status(package_manager.get_product_name(str(package_and_dependencies[0])), str(package_and_dependency_versions[0]), Constants.INSTALLED)
@@ -353,7 +471,7 @@ class PatchInstaller(object):
                 if dependency not in self.last_still_needed_packages or dependency == package:
                     continue
 
-                if package_manager.is_package_version_installed(dependency, dependency_version):
+                if package_manager.is_package_version_installed_per_snapshot(dependency, dependency_version):
                     self.composite_logger.log_debug(" - Marking dependency as succeeded: " + str(dependency) + "(" + str(dependency_version) + ")")
                     self.status_handler.set_package_install_status(package_manager.get_product_name(str(dependency)), str(dependency_version), Constants.INSTALLED)
                     index = self.last_still_needed_packages.index(dependency)
@@ -375,9 +493,10 @@ class PatchInstaller(object):
                                        "PackageInstallResult", str(install_result), "NumberOfDependenciesInstalled", str(number_of_dependencies_installed), "NumberOfDependenciesFailed", str(number_of_dependencies_failed))
 
             single_package_install_stopwatch.stop_and_write_telemetry(str(package_install_perf_log))
+            self.commit_installation_progress(package_manager)
 
         self.composite_logger.log_debug("\nPerforming final system state reconciliation...")
-        installed_update_count += self.perform_status_reconciliation_conditionally(package_manager, True)
+        installed_update_count += self.perform_final_status_reconciliation(package_manager)
         self.log_final_metrics(maintenance_window, patch_installation_successful, maintenance_window_exceeded, installed_update_count)
 
         install_update_count_in_sequential_patching = installed_update_count - install_update_count_in_batch_patching
@@ -391,9 +510,23 @@ class PatchInstaller(object):
                                          failed_parent_package_install_count_after_sequential_patching)
 
         stopwatch_for_sequential_install_process.stop_and_write_telemetry(sequential_processing_perf_log)
+        self.installation_journal.complete()
 
         return installed_update_count, patch_installation_successful, maintenance_window_exceeded
 
+    def commit_installation_progress(self, package_manager):
+        """ Records a checkpoint in the installation journal - a resumed run sets the package statuses up to it again from there """
+        self.installation_journal.commit(self.last_still_needed_packages, self.failed_packages, self.failed_package_versions, package_manager.command_result_cache.get_database_fingerprint())
+
+    def is_command_deadline_exceeded(self):
+        """ Whether a command was ended since the installation started, as it ran past the maintenance window cutoff. Installation stops then, to leave the rest of the window for a reboot. """
+        if len(self.env_layer.timed_out_commands) <= self.timed_out_command_count_at_start:
+            return False
+
+        timed_out_command = self.env_layer.timed_out_commands[-1]
+        self.composite_logger.log_warning("[PI] A command was ended as it ran past the maintenance window cutoff. [Command={0}][TimeLimitInSecs={1}]".format(timed_out_command['command'], str(timed_out_command['timeLimitInSecs'])))
+        return True
+
     def log_final_metrics(self, maintenance_window, patch_installation_successful, maintenance_window_exceeded, installed_update_count):
         """
         logs the final metrics.
@@ -408,6 +541,11 @@ class PatchInstaller(object):
                                                         "Completed processing packages!")
         self.composite_logger.log(progress_status)
 
+        if self.install_plan is not None:
+            not_installed_packages = [package for package in self.install_plan.get_planned_packages() + self.install_plan.cut_off_packages if package in self.last_still_needed_packages]
+            self.composite_logger.log_debug("[PI] Installation compared to its plan. [PredictedCompletionTime={0}][CompletionTime={1}][ExpectedCutOffPackages={2}][NotInstalledPackages={3}]".format(
+                self.install_plan.get_predicted_completion_time().strftime("%Y-%m-%dT%H:%M:%SZ"), self.env_layer.datetime.timestamp(), str(len(self.install_plan.cut_off_packages)), str(len(not_installed_packages))))
+
         if not patch_installation_successful or maintenance_window_exceeded:
             message = "\n\nOperation status was marked as failed because: "
             message += "[X] a failure occurred during the operation  " if not patch_installation_successful else ""
@@ -431,7 +569,7 @@ class PatchInstaller(object):
         package_and_dependency_versions (List of strings): Versions of packages in package_and_dependencies. Input list does not contain versions of the dependent packages.
                                                            The version of dependent packages are added in the list in this function.
         """
-        dependencies = package_manager.get_dependent_list(package_and_dependencies)
+        dependencies = package_manager.dependency_graph.get_dependent_list(package_and_dependencies)
 
         for dependency in dependencies:
             if dependency not in all_packages:
@@ -447,13 +585,14 @@ class PatchInstaller(object):
 
         self.composite_logger.log("Packages including dependencies are: " + str(package_and_dependencies))
 
-    def batch_patching(self, all_packages, all_package_versions, packages, package_versions, maintenance_window, package_manager):
+    def batch_patching(self, all_packages, all_package_versions, packages, package_versions, maintenance_window, package_manager, max_batch_size_for_packages=None):
         stopwatch_for_batch_install_process = Stopwatch(self.env_layer, self.telemetry_writer, self.composite_logger)
         stopwatch_for_batch_install_process.start()
 
         total_packages_to_install_count = len(packages)
         maintenance_window_batch_cutoff_reached = False
-        max_batch_size_for_packages = self.get_max_batch_size(maintenance_window, package_manager)
+        if max_batch_size_for_packages is None:
+            max_batch_size_for_packages = self.get_max_batch_size(maintenance_window, package_manager)
         installed_update_count_in_batch_patching = 0
         patch_installation_successful_in_batch_patching = True
 
@@ -525,9 +664,9 @@ class PatchInstaller(object):
         patch_installation_successful (bool): Whether package installation succeeded for all attempted packages.
         maintenance_window_batch_cutoff_reached (bool): Whether process of installing packages in batches stopped due to not enough time in maintenance window
                                                         to install packages in batch.
-        not_attempted_and_failed_packages (List of strings): List of packages which are (a) Not attempted due to not enough time in maintenance window to install in batch. 
-                                                             (b) Failed to install in batch patching.
-        not_attempted_and_failed_package_versions (List of strings): Versions of packages in the list not_attempted_and_failed_packages.
+        not_attempted_packages (List of strings): List of packages which are not attempted due to not enough time in maintenance window to install in batch.
+                                                  Failed packages are not included, as failures in a batch are isolated by bisection (see install_batch_and_bisect_failures).
+        not_attempted_package_versions (List of strings): Versions of packages in the list not_attempted_packages.
         
         """
         number_of_batches = int(math.ceil(len(packages) / float(max_batch_size_for_packages)))
@@ -540,16 +679,8 @@ class PatchInstaller(object):
         # These packages will be attempted in sequential installation if there is enough time in maintenance window to install package sequentially.
         remaining_packages = []
         remaining_package_versions = []
-        
-        # failed_packages are the packages which are failed to install in batch patching. These packages will be attempted again in sequential patching if there is 
-        # enough time remaining in maintenance window.
-        failed_packages = []
-        failed_package_versions = []
 
         for batch_index in range(0, number_of_batches):
-            per_batch_installation_stopwatch = Stopwatch(self.env_layer, self.telemetry_writer, self.composite_logger)
-            per_batch_installation_stopwatch.start()
-
             # Extension state check
             if self.lifecycle_manager is not None:
                 self.lifecycle_manager.lifecycle_status_check()
@@ -580,7 +711,7 @@ class PatchInstaller(object):
 
             remaining_time = maintenance_window.get_remaining_time_in_minutes()
 
-            if maintenance_window.is_package_install_time_available(package_manager, remaining_time, len(packages_in_batch)) is False:
+            if self.is_command_deadline_exceeded() or maintenance_window.is_package_install_time_available(package_manager, remaining_time, len(packages_in_batch), packages_in_batch) is False:
                 self.composite_logger.log("Stopped installing packages in batches as it is past the maintenance window cutoff time for installing in batches." +
                                            " Batch Index: {0}, remaining time: {1}, number of packages in batch: {2}".format(batch_index, remaining_time, str(len(packages_in_batch))))
                 maintenance_window_batch_cutoff_reached = True
@@ -593,37 +724,138 @@ class PatchInstaller(object):
                                                             "Processing batch index: " + str(batch_index) + ", Number of packages: " + str(len(packages_in_batch)) + "\nProcessing packages: " + str(packages_in_batch))
             self.composite_logger.log(progress_status)
 
+            # The next batch is downloaded while this one installs
+            next_batch = [(package, version) for package, version in zip(packages[end_index + 1:end_index + 1 + max_batch_size_for_packages], package_versions[end_index + 1:end_index + 1 + max_batch_size_for_packages])
+                          if package in self.last_still_needed_packages]
+            next_batch_packages, next_batch_package_versions = [package for package, version in next_batch], [version for package, version in next_batch]
+            is_next_batch_downloading = not simulate and self.batch_download_pipeline.start(next_batch_packages, next_batch_package_versions)
+
+            batch_installed_update_count, batch_failed_packages, batch_failed_package_versions, not_attempted_packages, not_attempted_package_versions = self.install_batch_and_bisect_failures(
+                all_packages, all_package_versions, packages, package_versions, packages_in_batch, package_versions_in_batch, maintenance_window, package_manager, simulate)
+
+            # The next batch's download is only waited for if there's time to install it, and is moved into the package manager's cache then
+            if is_next_batch_downloading:
+                if len(not_attempted_packages) > 0 or maintenance_window.is_package_install_time_available(package_manager, maintenance_window.get_remaining_time_in_minutes(), len(next_batch_packages), next_batch_packages) is False:
+                    self.batch_download_pipeline.cancel()
+                else:
+                    self.batch_download_pipeline.finish()
+
+            installed_update_count += batch_installed_update_count
+            if len(batch_failed_packages) > 0:
+                patch_installation_successful = False
+
+            self.attempted_parent_package_install_count += len(packages_in_batch) - len(not_attempted_packages)
+
+            # dependency package result management fallback (not reliable enough to be used as primary, and will be removed; remember to retain last_still_needed refresh when you do that)
+            installed_update_count += self.perform_status_reconciliation_conditionally(package_manager, condition=(self.attempted_parent_package_install_count % Constants.PACKAGE_STATUS_REFRESH_RATE_IN_SECONDS == 0))  # reconcile status after every 10 attempted installs
+
+            if len(not_attempted_packages) > 0:
+                # Bisection of a failed batch ran into the maintenance window cutoff
+                maintenance_window_batch_cutoff_reached = True
+                remaining_packages = not_attempted_packages + packages[end_index + 1:]
+                remaining_package_versions = not_attempted_package_versions + package_versions[end_index + 1:]
+                self.flush()
+                self.commit_installation_progress(package_manager)
+                break
+
+            self.flush()    # batch boundary
+            self.commit_installation_progress(package_manager)
+            if self.install_plan is not None:
+                self.composite_logger.log_debug("[PI] Installation is expected to complete at {0}.".format(self.get_completion_estimate().strftime("%Y-%m-%dT%H:%M:%SZ")))
+
+        # Performing reconciliation at the end to get accurate number of installed packages through this function.
+        installed_update_count += self.perform_final_status_reconciliation(package_manager)
+
+        # Packages not attempted due to not enough time in maintenance window are attempted in the sequential patching if there is enough time remaining in maintenance window.
+        # Failed packages are not retried there, as each failure has already been isolated to an install of its own.
+        return installed_update_count, patch_installation_successful, maintenance_window_batch_cutoff_reached, remaining_packages, remaining_package_versions
+
+    def install_batch_and_bisect_failures(self, all_packages, all_package_versions, packages, package_versions, packages_in_batch, package_versions_in_batch, maintenance_window, package_manager, simulate=False):
+        """
+        Installs a batch of packages. Parent packages that fail in an install with other parent packages are split into two halves (along the connected components
+        of their dependency graph, where possible) and retried, recursively, until each failure is isolated to an install of its own.
+        This takes O(k log n) installs for k failures in a batch of n, instead of falling back to n sequential installs.
+
+        Parameters:
+        all_packages (List of strings): List of all available packages to install.
+        all_package_versions (List of strings): Versions of the packages in the list all_packages.
+        packages (List of strings): List of all packages selected by user to install.
+        package_versions (List of strings): Versions of packages in the list packages.
+        packages_in_batch (List of strings): Packages in the batch. The maintenance window is expected to have been checked for this batch already.
+        package_versions_in_batch (List of strings): Versions of packages in the list packages_in_batch.
+        maintenance_window (MaintenanceWindow): Maintenance window for the job.
+        package_manager (PackageManager): Package manager used.
+        simulate (bool): Whether this function is called from a test run.
+
+        Returns:
+        installed_update_count (int): Number of packages installed, including dependencies.
+        failed_packages (List of strings): Parent packages that failed to install on their own, i.e. isolated failures. These are marked as failed already.
+        failed_package_versions (List of strings): Versions of packages in the list failed_packages.
+        not_attempted_packages (List of strings): Parent packages not attempted (again), due to not enough time in maintenance window to install the next part of the batch.
+        not_attempted_package_versions (List of strings): Versions of packages in the list not_attempted_packages.
+        """
+        installed_update_count = 0
+        failed_packages, failed_package_versions = [], []
+        not_attempted_packages, not_attempted_package_versions = [], []
+        pending_parts = [(list(packages_in_batch), list(package_versions_in_batch), 0)]    # (packages, versions, bisection depth) - worked on as a stack, first half first
+
+        while len(pending_parts) > 0:
+            part_packages, part_package_versions, bisection_depth = pending_parts.pop()
+            if bisection_depth > 0:
+                # Could have got installed as dependent package of some other part of the batch
+                part_package_versions = [version for package, version in zip(part_packages, part_package_versions) if package in self.last_still_needed_packages]
+                installed_parts_packages = [package for package in part_packages if package not in self.last_still_needed_packages]
+                part_packages = [package for package in part_packages if package in self.last_still_needed_packages]
+                self.successful_parent_package_install_count += len(installed_parts_packages)
+                if len(part_packages) == 0:
+                    continue
+
+                if self.lifecycle_manager is not None:
+                    self.lifecycle_manager.lifecycle_status_check()
+
+                remaining_time = maintenance_window.get_remaining_time_in_minutes()
+                if self.is_command_deadline_exceeded() or maintenance_window.is_package_install_time_available(package_manager, remaining_time, len(part_packages), part_packages) is False:
+                    self.composite_logger.log("Stopped bisecting failed batch as it is past the maintenance window cutoff time for installing in batches. [RemainingTime={0}][PackagesInPart={1}]".format(str(remaining_time), str(len(part_packages))))
+                    for pending_packages, pending_package_versions, pending_depth in [(part_packages, part_package_versions, bisection_depth)] + list(reversed(pending_parts)):
+                        not_attempted_packages += pending_packages
+                        not_attempted_package_versions += pending_package_versions
+                    break
+
+                self.composite_logger.log("Retrying part of failed batch. [BisectionDepth={0}][Packages={1}]".format(str(bisection_depth), str(part_packages)))
+
+            part_installation_stopwatch = Stopwatch(self.env_layer, self.telemetry_writer, self.composite_logger)
+            part_installation_stopwatch.start()
+
             # package_and_dependencies initially conains only packages in batch. The dependencies are added in the list by method include_dependencies
-            package_and_dependencies = list(packages_in_batch)
-            package_and_dependency_versions = list(package_versions_in_batch)
+            package_and_dependencies = list(part_packages)
+            package_and_dependency_versions = list(part_package_versions)
 
-            self.include_dependencies(package_manager, packages_in_batch, package_versions_in_batch, all_packages, all_package_versions, packages, package_versions, package_and_dependencies, package_and_dependency_versions)
+            self.include_dependencies(package_manager, part_packages, part_package_versions, all_packages, all_package_versions, packages, package_versions, package_and_dependencies, package_and_dependency_versions)
 
+            part_failed_packages, part_failed_package_versions = [], []
             parent_packages_installed_in_batch_count = 0
-            parent_packages_failed_in_batch_count = 0
             number_of_dependencies_installed = 0
             number_of_dependencies_failed = 0
 
+            install_start_time = time.time()
             code, out, exec_cmd = package_manager.install_update_and_dependencies(package_and_dependencies, package_and_dependency_versions, simulate)
+            install_duration_in_secs = time.time() - install_start_time
+            next_batch_download_overlap_in_secs = self.batch_download_pipeline.get_overlap_in_secs(install_start_time, install_start_time + install_duration_in_secs)
 
-            for package,version in zip(package_and_dependencies, package_and_dependency_versions):
+            for package, version in zip(package_and_dependencies, package_and_dependency_versions):
                 install_result = package_manager.get_installation_status(code, out, exec_cmd, package, version, simulate)
 
                 if install_result == Constants.FAILED:
-                    if package in packages_in_batch:
+                    if package in part_packages:
                         # parent package
-                        self.status_handler.set_package_install_status(package_manager.get_product_name(str(package)), str(version), Constants.FAILED)
-                        self.failed_parent_package_install_count += 1
-                        patch_installation_successful = False
-                        parent_packages_failed_in_batch_count += 1
-                        failed_packages.append(package)
-                        failed_package_versions.append(version)
+                        part_failed_packages.append(package)
+                        part_failed_package_versions.append(version)
                     else:
                         # dependent package
-                        number_of_dependencies_failed +=1
+                        number_of_dependencies_failed += 1
                 elif install_result == Constants.INSTALLED:
                     self.status_handler.set_package_install_status(package_manager.get_product_name(str(package)), str(version), Constants.INSTALLED)
-                    if package in packages_in_batch:
+                    if package in part_packages:
                         # parent package
                         self.successful_parent_package_install_count += 1
                         parent_packages_installed_in_batch_count += 1
@@ -637,32 +869,87 @@ class PatchInstaller(object):
                         self.last_still_needed_package_versions.pop(index)
                         installed_update_count += 1
 
-            self.attempted_parent_package_install_count += len(packages_in_batch)
-
             # Update reboot pending status in status_handler
             self.status_handler.set_reboot_pending(self.package_manager.is_reboot_pending())
 
-            # dependency package result management fallback (not reliable enough to be used as primary, and will be removed; remember to retain last_still_needed refresh when you do that)
-            installed_update_count += self.perform_status_reconciliation_conditionally(package_manager, condition=(self.attempted_parent_package_install_count % Constants.PACKAGE_STATUS_REFRESH_RATE_IN_SECONDS == 0))  # reconcile status after every 10 attempted installs
-
-            per_batch_install_perf_log = "[{0}={1}][{2}={3}][{4}={5}][{6}={7}][{8}={9}][{10}={11}][{12}={13}][{14}={15}]".format(Constants.PerfLogTrackerParams.TASK, "InstallBatchOfPackages",
-                                         "PackagesInBatch", str(packages_in_batch), "PackageAndDependencies", str(package_and_dependencies), "PackageAndDependencyVersions", str(package_and_dependency_versions),
-                                         "NumberOfParentPackagesInstalled", str(parent_packages_installed_in_batch_count), "NumberOfParentPackagesFailed", str(parent_packages_failed_in_batch_count),
-                                         "NumberOfDependenciesInstalled", str(number_of_dependencies_installed), "NumberOfDependenciesFailed", str(number_of_dependencies_failed))
+            if len(part_failed_packages) == 0:
+                package_manager.record_package_install_duration(package_and_dependencies, install_duration_in_secs, part_packages[0] if len(part_packages) == 1 else None)
 
-            per_batch_installation_stopwatch.stop_and_write_telemetry(str(per_batch_install_perf_log))
-
-        # Performing reconciliation at the end to get accurate number of installed packages through this function.
-        installed_update_count += self.perform_status_reconciliation_conditionally(package_manager, True)
-
-        # not_attempted_and_failed_packages is the list of packages including two kind of packages:
-        # (a) Not attempted due to not enough time in maintenance window to install packages in batches.
-        # (b) Failed to install in batch patching.
-        # These packages are attempted in the sequential patching if there is enough time remaining in maintenance window. The non attempted packages are in
-        # the front of the list than failed packages and hence non attempated packages are attempted first in sequential patching than the failed packages.
-        not_attempted_and_failed_packages = remaining_packages + failed_packages
-        not_attempted_and_failed_package_versions = remaining_package_versions + failed_package_versions
-        return installed_update_count, patch_installation_successful, maintenance_window_batch_cutoff_reached, not_attempted_and_failed_packages, not_attempted_and_failed_package_versions
+            if len(part_failed_packages) > 0 and len(part_packages) > 1:
+                # The failure is not isolated yet - bisect
+                first_half, second_half = self.bisect_failed_packages(package_manager, part_failed_packages, part_failed_package_versions)
+                pending_parts.append((second_half[0], second_half[1], bisection_depth + 1))
+                if len(first_half[0]) > 0:
+                    pending_parts.append((first_half[0], first_half[1], bisection_depth + 1))
+            else:
+                for package, version in zip(part_failed_packages, part_failed_package_versions):
+                    self.status_handler.set_package_install_status(package_manager.get_product_name(str(package)), str(version), Constants.FAILED)
+                    self.failed_parent_package_install_count += 1
+                    self.failed_packages.append(package)
+                    self.failed_package_versions.append(version)
+                    failed_packages.append(package)
+                    failed_package_versions.append(version)
+
+            per_batch_install_perf_log = "[{0}={1}][{2}={3}][{4}={5}][{6}={7}][{8}={9}][{10}={11}][{12}={13}][{14}={15}][{16}={17}][{18}={19}]".format(Constants.PerfLogTrackerParams.TASK, "InstallBatchOfPackages",
+                                         "PackagesInBatch", str(part_packages), "PackageAndDependencies", str(package_and_dependencies), "PackageAndDependencyVersions", str(package_and_dependency_versions),
+                                         "NumberOfParentPackagesInstalled", str(parent_packages_installed_in_batch_count), "NumberOfParentPackagesFailed", str(len(part_failed_packages)),
+                                         "NumberOfDependenciesInstalled", str(number_of_dependencies_installed), "NumberOfDependenciesFailed", str(number_of_dependencies_failed), "BisectionDepth", str(bisection_depth),
+                                         "NextBatchDownloadOverlapInSecs", str(round(next_batch_download_overlap_in_secs, 2)))
+
+            part_installation_stopwatch.stop_and_write_telemetry(str(per_batch_install_perf_log))
+
+        return installed_update_count, failed_packages, failed_package_versions, not_attempted_packages, not_attempted_package_versions
+
+    def bisect_failed_packages(self, package_manager, failed_packages, failed_package_versions):
+        """ Splits failed packages into two halves for a retry. Packages are kept with the others in their connected component of the dependency graph, wherever a
+            component boundary is reasonably close to the middle, so that one bad package (or dependency) does not fail both halves again. """
+        if len(failed_packages) == 1:
+            return ([], []), (list(failed_packages), list(failed_package_versions))
+
+        components = self.get_dependency_components(package_manager, failed_packages) if len(failed_packages) > 2 else [[package] for package in failed_packages]
+        ordered_indexes = [failed_packages.index(package) for component in components for package in component]
+
+        # cut at the component boundary closest to the middle, unless that is too lopsided (e.g. one large component)
+        cut = len(failed_packages) // 2
+        boundaries, boundary = [], 0
+        for component in components[:-1]:
+            boundary += len(component)
+            boundaries.append(boundary)
+        if len(boundaries) > 0:
+            closest_boundary = min(boundaries, key=lambda candidate: abs(candidate - cut))
+            if abs(closest_boundary - cut) <= len(failed_packages) // 4:
+                cut = closest_boundary
+
+        first_half = ([failed_packages[index] for index in ordered_indexes[:cut]], [failed_package_versions[index] for index in ordered_indexes[:cut]])
+        second_half = ([failed_packages[index] for index in ordered_indexes[cut:]], [failed_package_versions[index] for index in ordered_indexes[cut:]])
+        return first_half, second_half
+
+    def get_dependency_components(self, package_manager, packages):
+        """ Returns packages grouped by connected components of their dependency graph (packages sharing a dependency, or depending on each other, are connected), in input order """
+        component_of = dict((package, package) for package in packages)   # union-find, over packages and their dependencies
+
+        def find(node):
+            while component_of[node] != node:
+                component_of[node] = component_of[component_of[node]]
+                node = component_of[node]
+            return node
+
+        for package in packages:
+            for dependency in package_manager.dependency_graph.get_dependent_list([package]):
+                component_of.setdefault(dependency, dependency)
+                root_of_package, root_of_dependency = find(package), find(dependency)
+                if root_of_package != root_of_dependency:
+                    component_of[root_of_dependency] = root_of_package
+
+        components = []
+        component_index_of_root = {}
+        for package in packages:
+            root = find(package)
+            if root not in component_index_of_root:
+                component_index_of_root[root] = len(components)
+                components.append([])
+            components[component_index_of_root[root]].append(package)
+        return components
 
     def mark_installation_completed(self):
         """ Marks Installation operation as completed by updating the status of PatchInstallationSummary as success and patch metadata to be sent to healthstore.
@@ -693,6 +980,8 @@ class PatchInstaller(object):
     def perform_status_reconciliation_conditionally(self, package_manager, condition=True):
         """Periodically based on the condition check, writes out success records as required; returns count of detected installs.
            This is mostly to capture the dependencies that get silently installed recorded.
+           Changes are first worked out from the installed package database against the last checkpoint. A full available-updates
+           evaluation is only done when that delta is unavailable or ambiguous (e.g. a still needed package changed to an unexpected version).
            VERY IMPORTANT NOTE: THIS ONLY WORKS IF EACH DEPENDENCY INSTALLED WAS THE VERY LATEST VERSION AVAILABLE.
            So it's only here as a fallback method and shouldn't normally be required with newer code - it will be removed in the future."""
         if not condition:
@@ -700,19 +989,70 @@ class PatchInstaller(object):
 
         self.composite_logger.log_verbose("\nStarting status reconciliation...")
         start_time = time.time()
-        still_needed_packages, still_needed_package_versions = package_manager.get_all_updates(cached=False)  # do not use cache
-        successful_packages = []
-        successful_package_versions = []
-        for i in range(0, len(self.last_still_needed_packages)):
-            if self.last_still_needed_packages[i] not in still_needed_packages:
-                successful_packages.append(self.last_still_needed_packages[i])
-                successful_package_versions.append(self.last_still_needed_package_versions[i])
+        successful_packages, successful_package_versions = self.get_reconciled_packages_from_checkpoint(package_manager)
+        if successful_packages is not None:
+            for package in successful_packages:
+                index = self.last_still_needed_packages.index(package)
+                self.last_still_needed_packages.pop(index)
+                self.last_still_needed_package_versions.pop(index)
+            reconciliation_mode = "Incremental"
+        else:
+            still_needed_packages, still_needed_package_versions = package_manager.get_all_updates(cached=False)  # do not use cache
+            successful_packages = []
+            successful_package_versions = []
+            for i in range(0, len(self.last_still_needed_packages)):
+                if self.last_still_needed_packages[i] not in still_needed_packages:
+                    successful_packages.append(self.last_still_needed_packages[i])
+                    successful_package_versions.append(self.last_still_needed_package_versions[i])
+
+            self.last_still_needed_packages = still_needed_packages
+            self.last_still_needed_package_versions = still_needed_package_versions
+            self.reconciliation_checkpoint = self.get_reconciliation_checkpoint(package_manager)
+            reconciliation_mode = "Full"
 
         self.status_handler.set_package_install_status(successful_packages, successful_package_versions, Constants.INSTALLED)
-        self.last_still_needed_packages = still_needed_packages
-        self.last_still_needed_package_versions = still_needed_package_versions
-        self.composite_logger.log_verbose("Completed status reconciliation. Time taken: " + str(time.time() - start_time) + " seconds.")
+        self.composite_logger.log_verbose("Completed status reconciliation. [Mode={0}][DetectedInstalls={1}] Time taken: {2} seconds.".format(reconciliation_mode, str(len(successful_packages)), str(time.time() - start_time)))
         return len(successful_packages)
+
+    def perform_final_status_reconciliation(self, package_manager):
+        """ Status reconciliation once installs have stopped. Its queries are not ended at the command time limit - past the maintenance window cutoff, that would
+            be reported instead of the package statuses, and installation is over anyway. """
+        with self.env_layer.command_time_limit_suspended():
+            return self.perform_status_reconciliation_conditionally(package_manager, True)
+
+    def get_reconciliation_checkpoint(self, package_manager):
+        """Returns the installed versions of every still needed package, or None if the installed package database isn't available"""
+        installed_packages = package_manager.get_installed_packages_snapshot()
+        if len(installed_packages) == 0:
+            return None
+
+        checkpoint = {}
+        for package in self.last_still_needed_packages:
+            checkpoint[package] = sorted(installed_packages.get(package, []))
+        return checkpoint
+
+    def get_reconciled_packages_from_checkpoint(self, package_manager):
+        """Returns still needed packages whose required version is now installed, as per the installed package database.
+           Returns None, None if the delta from the checkpoint can't be trusted and a full evaluation is required."""
+        if self.reconciliation_checkpoint is None:
+            return None, None
+
+        installed_packages = package_manager.get_installed_packages_snapshot()
+        if len(installed_packages) == 0:
+            return None, None
+
+        successful_packages = []
+        successful_package_versions = []
+        for package, version in zip(self.last_still_needed_packages, self.last_still_needed_package_versions):
+            installed_versions = installed_packages.get(package, [])
+            if version in installed_versions:
+                successful_packages.append(package)
+                successful_package_versions.append(version)
+            elif package not in self.reconciliation_checkpoint or sorted(installed_versions) != self.reconciliation_checkpoint[package]:
+                self.composite_logger.log_verbose("[PI] Installed state delta is ambiguous. [Package={0}][Version={1}][InstalledVersions={2}]".format(str(package), str(version), str(installed_versions)))
+                return None, None
+
+        return successful_packages, successful_package_versions
     # endregion
 
     # region Package List Manipulation @ Update Run level
@@ -739,15 +1079,18 @@ class PatchInstaller(object):
         if not self.package_filter.is_exclusion_list_present():
             return excluded_packages, excluded_package_versions
 
+        # packages that are not excluded themselves are resolved together, and only narrowed down to those with excluded dependencies
+        candidate_packages = [package for package in packages if not self.package_filter.check_for_exclusion(package)]
+        packages_with_excluded_dependencies = package_manager.dependency_graph.find_packages_with_matching_dependencies(candidate_packages, self.package_filter.check_for_exclusion)
+
         for package, package_version in zip(packages, package_versions):
-            if self.package_filter.check_for_exclusion(package):
+            if package not in candidate_packages:
                 excluded_packages.append(package)  # package is excluded, no need to check for dependency exclusion
                 excluded_package_versions.append(package_version)
                 continue
 
-            dependency_list = package_manager.get_dependent_list([package])
-            if dependency_list and self.package_filter.check_for_exclusion(dependency_list):
-                self.composite_logger.log_debug(" - Exclusion list match on dependency list for package '{0}': {1}".format(str(package), str(dependency_list)))
+            if package in packages_with_excluded_dependencies:
+                self.composite_logger.log_debug(" - Exclusion list match on dependency list for package '{0}': {1}".format(str(package), str(packages_with_excluded_dependencies[package])))
                 excluded_packages.append(package)  # one of the package's dependencies are excluded, so exclude the package
                 excluded_package_versions.append(package_version)
 
@@ -771,6 +1114,77 @@ class PatchInstaller(object):
         return new_included_packages, new_included_package_versions
     # endregion
 
+    def get_prioritized_install_queue(self, package_manager, packages, package_versions, security_packages):
+        """ Returns the packages in the order they are to be installed in, so that the maintenance window cutoff drops the least valuable ones first:
+            explicitly included packages first, then security packages, then the rest - and within each of these, those expected to install fastest first.
+            Packages that are equal on all of these keep their order. """
+        security_packages = set(security_packages)
+        is_explicitly_included = [self.package_filter.check_for_explicit_inclusion(package, version) for package, version in zip(packages, package_versions)]
+        is_security = [package in security_packages for package in packages]
+        install_cost_estimates = package_manager.get_package_install_cost_estimates_in_seconds(packages)
+        queue = sorted(range(0, len(packages)), key=lambda index: (not is_explicitly_included[index], not is_security[index], install_cost_estimates[index], index))
+
+        self.composite_logger.log_debug("[PI] Install queue prioritized. [Packages={0}][ExplicitlyIncluded={1}][Security={2}]".format(
+            str(len(packages)), str(is_explicitly_included.count(True)), str(is_security.count(True))))
+        return [packages[index] for index in queue], [package_versions[index] for index in queue]
+
+    def get_install_plan(self, maintenance_window, package_manager, all_packages, all_package_versions, packages, package_versions, excluded_packages=None):
+        """ Works out how the installation of the packages (in install order) is expected to go, before anything is installed - the batches they are installed in,
+            with their dependencies and arch siblings, how long each is expected to take as learned on this machine, and what the maintenance window cutoff is
+            expected to leave out. Batches follow the same cutoff rules as the installation, and packages that don't fit in a batch fall back to installs of
+            their own, until one doesn't fit. The plan is logged, and the installation is batched as planned. """
+        batch_size = self.get_max_batch_size(maintenance_window, package_manager)
+        plan = InstallPlan(self.env_layer.datetime.datetime_utcnow(), batch_size)
+        plan.excluded_packages = list(excluded_packages if excluded_packages is not None else [])
+        plan.skipped_esm_packages = list(self.skipped_esm_packages)
+
+        avg_time_in_secs = package_manager.get_package_install_time_estimates_in_seconds()[0]
+        remaining_time_in_minutes = maintenance_window.get_remaining_time_in_minutes(log_utilization=False)
+        transaction_packages = []
+        begin_index = 0
+
+        # batches, until one doesn't fit
+        while batch_size > 0 and begin_index < len(packages):
+            batch_packages, batch_package_versions = packages[begin_index:begin_index + batch_size], package_versions[begin_index:begin_index + batch_size]
+            if remaining_time_in_minutes <= maintenance_window.get_package_install_cutoff_time_in_minutes(package_manager, len(batch_packages), batch_packages):
+                break
+            package_and_dependencies, package_and_dependency_versions = list(batch_packages), list(batch_package_versions)
+            self.include_dependencies(package_manager, batch_packages, batch_package_versions, all_packages, all_package_versions, packages, package_versions, package_and_dependencies, package_and_dependency_versions)
+            expected_duration_in_secs = avg_time_in_secs * len(package_and_dependencies)
+            plan.add_install(batch_packages, batch_package_versions, len(package_and_dependencies), expected_duration_in_secs)
+            transaction_packages += package_and_dependencies
+            remaining_time_in_minutes -= expected_duration_in_secs / 60.0
+            begin_index += batch_size
+
+        # installs of their own, until one doesn't fit
+        install_cost_estimates = package_manager.get_package_install_cost_estimates_in_seconds(packages[begin_index:])
+        for package, version, expected_duration_in_secs in zip(packages[begin_index:], package_versions[begin_index:], install_cost_estimates):
+            if len(plan.cut_off_packages) == 0 and remaining_time_in_minutes > maintenance_window.get_package_install_cutoff_time_in_minutes(package_manager, 1, [package]):
+                plan.add_install([package], [version], 1, expected_duration_in_secs, is_sequential=True)
+                transaction_packages.append(package)
+                remaining_time_in_minutes -= expected_duration_in_secs / 60.0
+            else:
+                plan.cut_off_packages.append(package)
+                plan.cut_off_package_versions.append(version)
+
+        if package_manager.is_reboot_pending():
+            plan.reboot_likelihood = InstallPlan.REBOOT_PENDING
+        elif any(re.match(Constants.InstallPlanConfig.REBOOT_LIKELY_PACKAGE_PATTERN, package) is not None for package in transaction_packages):
+            plan.reboot_likelihood = InstallPlan.REBOOT_LIKELY
+
+        self.composite_logger.log("\nInstall plan: " + json.dumps(plan.get_summary(), sort_keys=True))
+        self.composite_logger.log_debug("[PI] Install plan details: " + json.dumps(plan.to_dict(), sort_keys=True))
+        self.telemetry_writer.write_event("Install plan: " + json.dumps(plan.get_summary(), sort_keys=True), Constants.TelemetryEventLevel.Informational)
+        if len(plan.cut_off_packages) > 0:
+            self.composite_logger.log_warning("The maintenance window is expected to be too short to install all packages. [ExpectedCutOffPackages={0}]".format(str(plan.cut_off_packages)))
+        return plan
+
+    def get_completion_estimate(self):
+        """ Returns when the installation is now expected to complete, going by the install plan and the packages still needed - None if there is no plan yet """
+        if self.install_plan is None:
+            return None
+        return self.env_layer.datetime.datetime_utcnow() + datetime.timedelta(seconds=self.install_plan.get_expected_remaining_duration_in_secs(self.last_still_needed_packages))
+
     def get_max_batch_size(self, maintenance_window, package_manager):
         """Returns maximum batch size for batch patching as per the time remaining in the maintenance window and time taken to install package by package manager"""
         available_time_to_install_packages = maintenance_window.get_remaining_time_in_minutes()
@@ -785,12 +1199,15 @@ class PatchInstaller(object):
         max_batch_size_for_packages = 0
 
         # Taking assumption that 1 of the packages in the batch takes maximum expected time to install and remaining packages take average time to install.
-        if available_time_to_install_packages > Constants.PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES:
-            available_time_to_install_packages = available_time_to_install_packages - Constants.PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES
+        # Expected times are learned from installs on this machine, once there is enough history (see InstallDurationHistory).
+        package_install_expected_avg_time_in_seconds, package_install_expected_max_time_in_seconds = package_manager.get_package_install_time_estimates_in_seconds()
+        package_install_expected_max_time_in_minutes = package_install_expected_max_time_in_seconds / 60.0
+        if available_time_to_install_packages > package_install_expected_max_time_in_minutes:
+            available_time_to_install_packages = available_time_to_install_packages - package_install_expected_max_time_in_minutes
             max_batch_size_for_packages += 1
 
             # Remaining packages take average expected time to install.
-            package_install_expected_avg_time_in_minutes = package_manager.get_package_install_expected_avg_time_in_seconds() / 60.0
+            package_install_expected_avg_time_in_minutes = package_install_expected_avg_time_in_seconds / 60.0
             max_batch_size_for_packages += int(math.floor(available_time_to_install_packages / package_install_expected_avg_time_in_minutes))
 
         if max_batch_size_for_packages > Constants.PackageBatchConfig.MAX_BATCH_SIZE_FOR_PACKAGES:
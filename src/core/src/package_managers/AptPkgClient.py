@@ -0,0 +1,123 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""This is an in-process client for the apt package cache (python-apt)"""
+import threading
+
+from core.src.bootstrap.Constants import Constants
+
+
+class AptPkgClient(object):
+    """ Answers read-only apt queries in-process with python-apt, instead of spawning apt-get/apt-cache. Queries raise if python-apt is not available
+        to this interpreter or the cache can't be opened - the caller falls back to the command line then. """
+
+    SECURITY_ORIGIN_CRITERIA = ["security", "fips-updates"]     # same criteria as used for security-only sources
+
+    def __init__(self, composite_logger, fingerprint_provider):
+        # type: (object, callable) -> None
+        self.composite_logger = composite_logger
+        self.fingerprint_provider = fingerprint_provider      # identity of the package database and repository metadata state - the cache is reopened when it changes
+        self.__apt = None
+        self.__apt_pkg = None
+        self.__is_available = None
+        self.__default_sources = None
+        self.__cache = None
+        self.__cache_identity = None
+        self.__lock = threading.Lock()      # the apt cache and its marks are not thread-safe
+
+    def is_available(self):
+        # type: () -> bool
+        """ Returns whether python-apt can be used. The import is attempted only once. """
+        if not Constants.AptPkgSettings.FEATURE_ENABLED:
+            return False
+
+        with self.__lock:
+            if self.__is_available is None:
+                try:
+                    import apt
+                    import apt_pkg
+                    self.__apt, self.__apt_pkg = apt, apt_pkg
+                    self.__is_available = True
+                except Exception as error:
+                    self.__is_available = False
+                    self.composite_logger.log_debug("[APM][AptPkg] python-apt is not available. Using the apt command line. [Error={0}]".format(repr(error)))
+            return self.__is_available
+
+    def simulate_dist_upgrade(self, source_parts_dir=str(), source_list=str()):
+        # type: (str, str) -> (list, list, list, list)
+        """ Equivalent of 'apt-get -s dist-upgrade' on the given sources. Returns the packages and versions that would be installed, and those of them offered by a security origin. """
+        with self.__lock:
+            cache = self.__get_cache(source_parts_dir, source_list)
+            try:
+                cache.upgrade(dist_upgrade=True)
+                return self.__get_marked_packages_and_versions(cache)
+            finally:
+                cache.clear()
+
+    def get_dependent_packages(self, package_names):
+        # type: (list) -> list
+        """ Equivalent of 'apt-get --only-upgrade true -s install <packages>'. Returns the other packages that would be installed along with the given ones. """
+        with self.__lock:
+            cache = self.__get_cache()
+            try:
+                for package_name in package_names:
+                    if package_name in cache and cache[package_name].is_installed:     # only upgrades
+                        cache[package_name].mark_install()
+                packages = self.__get_marked_packages_and_versions(cache)[0]
+                return [package for package in packages if package not in package_names]
+            finally:
+                cache.clear()
+
+    def get_available_versions(self, package_name):
+        # type: (str) -> list
+        """ Equivalent of 'apt-cache madison <package>'. Returns the versions offered by the configured sources, latest first. """
+        with self.__lock:
+            cache = self.__get_cache()
+            if package_name not in cache:
+                return []
+            return [version.version for version in cache[package_name].versions if version.downloadable]
+
+    def __get_cache(self, source_parts_dir=str(), source_list=str()):
+        """ Opens the cache on the given sources (see __generate_command_with_custom_sources), or reuses the one already open if nothing changed since """
+        if source_parts_dir != str() or source_list != str():
+            source_parts_dir, source_list = source_parts_dir if source_parts_dir != str() else "/dev/null", source_list if source_list != str() else "/dev/null"
+        cache_identity = (self.fingerprint_provider(), source_parts_dir, source_list)
+        if self.__cache is not None and self.__cache_identity == cache_identity:
+            return self.__cache
+
+        if self.__default_sources is None:
+            self.__default_sources = (self.__apt_pkg.config.find_dir("Dir::Etc::SourceParts"), self.__apt_pkg.config.find_file("Dir::Etc::SourceList"))
+        self.__apt_pkg.config.set("Dir::Etc::SourceParts", source_parts_dir if source_parts_dir != str() else self.__default_sources[0])
+        self.__apt_pkg.config.set("Dir::Etc::SourceList", source_list if source_list != str() else self.__default_sources[1])
+
+        self.__cache = self.__cache_identity = None
+        self.__cache = self.__apt.Cache()
+        self.__cache_identity = cache_identity
+        self.composite_logger.log_verbose("[APM][AptPkg] Opened apt cache. [SourcePartsDir={0}][SourceList={1}]".format(source_parts_dir, source_list))
+        return self.__cache
+
+    def __get_marked_packages_and_versions(self, cache):
+        packages, versions, security_packages, security_versions = [], [], [], []
+        for package in cache.get_changes():
+            if not (package.marked_install or package.marked_upgrade):
+                continue
+            packages.append(package.name)
+            versions.append(package.candidate.version)
+            origins = " ".join("{0}:{1}".format(origin.label, origin.archive) for origin in package.candidate.origins)
+            if any(criteria in origins for criteria in self.SECURITY_ORIGIN_CRITERIA):
+                security_packages.append(package.name)
+                security_versions.append(package.candidate.version)
+        return packages, versions, security_packages, security_versions
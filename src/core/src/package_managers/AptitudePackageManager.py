@@ -15,6 +15,7 @@
 # Requires Python 2.7+
 
 """The is Aptitude package manager implementation"""
+import functools
 import json
 import os
 import re
@@ -25,6 +26,8 @@ from core.src.package_managers.PackageManager import PackageManager
 from core.src.bootstrap.Constants import Constants
 from core.src.core_logic.VersionComparator import VersionComparator
 from core.src.package_managers.UbuntuProClient import UbuntuProClient
+from core.src.package_managers.DpkgStatusReader import DpkgStatusReader
+from core.src.package_managers.AptPkgClient import AptPkgClient
 
 
 class AptitudePackageManager(PackageManager):
@@ -58,12 +61,21 @@ class AptitudePackageManager(PackageManager):
         self.cmd_single_package_check_versions_template = 'apt-cache madison <PACKAGE-NAME>'
         self.cmd_single_package_find_install_dpkg_template = 'sudo dpkg -s <PACKAGE-NAME>'
         self.cmd_single_package_find_install_apt_template = 'sudo apt list --installed <PACKAGE-NAME>'
+        self.cmd_get_installed_packages_snapshot = "dpkg-query -W -f='${Package} ${Version} ${db:Status-Abbrev}\\n'"
+        self.lock_free_command_pattern = r'\bapt-get (\S+ )*-s |\bapt-cache |\bdpkg -s |\bdpkg-query |\bapt list '     # simulations and queries do not take the dpkg lock
+        self.cacheable_command_pattern = r'\bapt-get (\S+ )*-s |\bapt-cache madison '
+        self.dpkg_status_reader = DpkgStatusReader(composite_logger)
+        self.apt_pkg_client = AptPkgClient(composite_logger, self.command_result_cache.get_fingerprint)     # in-process alternative to read-only apt-get/apt-cache queries
         self.single_package_upgrade_simulation_cmd = '''DEBIAN_FRONTEND=noninteractive ''' + optional_accept_eula_in_cmd + ''' LANG=en_US.UTF8 apt-get -y --only-upgrade true -s install '''
         self.single_package_dependency_resolution_template = 'DEBIAN_FRONTEND=noninteractive ' + optional_accept_eula_in_cmd + ' LANG=en_US.UTF8 apt-get -y --only-upgrade true -s install <PACKAGE-NAME> '
 
         # Package installation
         # --only-upgrade: upgrade only single package (only if it is installed)
         self.single_package_upgrade_cmd = '''sudo DEBIAN_FRONTEND=noninteractive LANG=en_US.UTF8 ''' + optional_accept_eula_in_cmd + ''' apt-get -y --only-upgrade true install '''
+        self.download_only_cmd = '''sudo DEBIAN_FRONTEND=noninteractive LANG=en_US.UTF8 ''' + optional_accept_eula_in_cmd + ''' apt-get -y --only-upgrade true --download-only -o Acquire::http::Dl-Limit=<MAX-KBPS> install '''
+        # the installation in progress holds the dpkg and archives locks - downloads alongside it go to a directory of their own, and are moved into the cache after
+        self.concurrent_download_only_cmd = '''sudo DEBIAN_FRONTEND=noninteractive LANG=en_US.UTF8 ''' + optional_accept_eula_in_cmd + ''' apt-get -y --only-upgrade true --download-only -o Debug::NoLocking=true -o Dir::Cache::archives=<DOWNLOAD-DIR> install '''
+        self.package_cache_path = '/var/cache/apt/archives'
         self.install_security_updates_azgps_coordinated_cmd = '''sudo DEBIAN_FRONTEND=noninteractive LANG=en_US.UTF8 ''' + optional_accept_eula_in_cmd + ''' apt-get -y --only-upgrade true dist-upgrade <SOURCES> '''
 
         # Package manager exit code(s)
@@ -84,11 +96,16 @@ class AptitudePackageManager(PackageManager):
 
         # Ubuntu Pro Client pre-requisite checks.
         self.__pro_client_prereq_met = False  # This flag will be used to determine if Ubuntu Pro Client can be used for querying reboot status or get packages list.
-        self.ubuntu_pro_client = UbuntuProClient(env_layer, composite_logger)
+        self.ubuntu_pro_client = UbuntuProClient(env_layer, composite_logger, execution_config.temp_folder)
         self.check_pro_client_prerequisites()
 
         self.ubuntu_pro_client_all_updates_cached = []
         self.ubuntu_pro_client_all_updates_versions_cached = []
+
+        # Single-pass assessment - security updates classified by origin from the same simulation as all updates
+        self.security_updates_cached = []
+        self.security_update_versions_cached = []
+        self.is_security_updates_cache_current = False
         self.version_comparator = VersionComparator()
 
         self.package_install_expected_avg_time_in_seconds = 90  # As per telemetry data, the average time to install package is around 81 seconds for apt.
@@ -274,10 +291,10 @@ class AptitudePackageManager(PackageManager):
     # endregion Sources Management
 
     # region Get Available Updates
-    def invoke_package_manager_advanced(self, command, raise_on_exception=True):
+    def invoke_package_manager_advanced(self, command, raise_on_exception=True, line_parser=None):
         """Get missing updates using the command input"""
         self.composite_logger.log_verbose('[APM] Invoking package manager. [Command={0}]'.format(command))
-        code, out = self.env_layer.run_command_output(command, False, False)
+        code, out = self.run_package_manager_command(command, line_parser)
 
         if code != self.apt_exitcode_ok and self.STR_DPKG_WAS_INTERRUPTED in out:
             self.composite_logger.log_error('[ERROR] YOU NEED TO TAKE ACTION TO PROCEED. The package manager on this machine is not in a healthy state, and '
@@ -290,20 +307,23 @@ class AptitudePackageManager(PackageManager):
             if raise_on_exception:
                 raise Exception(error_msg, "[{0}]".format(Constants.ERROR_ADDED_TO_STATUS))
         elif code != self.apt_exitcode_ok:
-            self.composite_logger.log_warning('[ERROR] Customer environment error. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), str(out)))
+            self.composite_logger.log_warning('[ERROR] Customer environment error. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), self.env_layer.get_output_excerpt(str(out))))
             error_msg = "Customer environment error: Investigate and resolve unexpected return code ({0}) from package manager on command: {1}".format(str(code), command)
             self.status_handler.add_error_to_status(error_msg, Constants.PatchOperationErrorCodes.PACKAGE_MANAGER_FAILURE)
             if raise_on_exception:
                 raise Exception(error_msg, "[{0}]".format(Constants.ERROR_ADDED_TO_STATUS))
             # more known return codes should be added as appropriate
         else:  # verbose diagnostic log
-            self.composite_logger.log_debug('[APM] Invoked package manager. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), str(out)))
+            self.composite_logger.log_debug('[APM] Invoked package manager. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), self.env_layer.get_output_excerpt(str(out))))
         return out, code
 
+    def get_package_database_fingerprint_paths(self):
+        return [Constants.SystemPaths.DPKG_STATUS, Constants.SystemPaths.DPKG_UPDATES, Constants.SystemPaths.APT_LISTS, Constants.SystemPaths.APT_SOURCES_LIST, Constants.SystemPaths.APT_SOURCES_LIST_DIR]
+
     def invoke_apt_cache(self, command):
         """Invoke apt-cache using the command input"""
         self.composite_logger.log_verbose('[APM] Invoking apt-cache using: ' + command)
-        code, out = self.env_layer.run_command_output(command, False, False)
+        code, out = self.run_package_manager_command(command)
         if code != 0:
             self.composite_logger.log_warning('[ERROR] Customer environment error. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), str(out)))
             error_msg = "Customer environment error: Investigate and resolve unexpected return code (\'{0}\') from package manager on command: {1}".format(str(code), command)
@@ -337,12 +357,18 @@ class AptitudePackageManager(PackageManager):
 
         # when cached is False, query both default way and using Ubuntu Pro Client.
         source_parts, source_list = self.__get_custom_sources_to_spec(self.max_patch_publish_date, base_classification=str())
-        cmd = self.__generate_command_with_custom_sources(command_template=self.cmd_dist_upgrade_simulation_template, source_parts=source_parts, source_list=source_list)
-        out = self.invoke_package_manager(cmd)
-        self.all_updates_cached, self.all_update_versions_cached = self.extract_packages_and_versions(out)
+        queries = [functools.partial(self.__simulate_dist_upgrade, source_parts, source_list)]
+        if self.__pro_client_prereq_met:
+            queries.append(self.ubuntu_pro_client.get_all_updates)     # independent of the simulation, on the same sources
+        query_results = self.query_executor.run(queries)
+        self.all_updates_cached, self.all_update_versions_cached, security_packages, security_package_versions = query_results[0]
+
+        self.is_security_updates_cache_current = self.get_package_manager_setting(Constants.PKG_MGR_SETTING_SINGLE_PASS_ASSESSMENT, False)
+        if self.is_security_updates_cache_current:
+            self.security_updates_cached, self.security_update_versions_cached = security_packages, security_package_versions
 
         if self.__pro_client_prereq_met:
-            ubuntu_pro_client_all_updates_query_success, self.ubuntu_pro_client_all_updates_cached, self.ubuntu_pro_client_all_updates_versions_cached = self.ubuntu_pro_client.get_all_updates()
+            ubuntu_pro_client_all_updates_query_success, self.ubuntu_pro_client_all_updates_cached, self.ubuntu_pro_client_all_updates_versions_cached = query_results[1]
             pro_client_missed_updates = list(set(self.all_updates_cached) - set(self.ubuntu_pro_client_all_updates_cached))
             all_updates_missed_updates = list(set(self.ubuntu_pro_client_all_updates_cached) - set(self.all_updates_cached))
             self.composite_logger.log_debug("[APM-Pro] Get all updates : [DefaultAllPackagesCount={0}][UbuntuProClientQuerySuccess={1}][UbuntuProClientAllPackagesCount={2}]"
@@ -363,17 +389,25 @@ class AptitudePackageManager(PackageManager):
         ubuntu_pro_client_security_packages = []
         ubuntu_pro_client_security_package_versions = []
 
-        # regular security updates check
-        self.composite_logger.log_verbose("[APM] Discovering 'security' packages (default)...")
-        source_parts, source_list = self.__get_custom_sources_to_spec(self.max_patch_publish_date, base_classification=Constants.PackageClassification.SECURITY)
-        cmd = self.__generate_command_with_custom_sources(self.cmd_dist_upgrade_simulation_template, source_parts=source_parts, source_list=source_list)
-        out = self.invoke_package_manager(cmd)
-        security_packages, security_package_versions = self.extract_packages_and_versions(out)
-        self.composite_logger.log_debug("[APM] Discovered 'security' packages (default). [Count={0}]".format(len(security_packages)))
+        single_pass_assessment = self.get_package_manager_setting(Constants.PKG_MGR_SETTING_SINGLE_PASS_ASSESSMENT, False)
+        if single_pass_assessment:
+            # security updates classified by origin from the all updates simulation - no security-only sources refresh or simulation
+            self.composite_logger.log_verbose("[APM] Discovering 'security' packages (single-pass)...")
+            if not self.is_security_updates_cache_current:
+                self.get_all_updates(cached=False)
+            security_packages, security_package_versions = list(self.security_updates_cached), list(self.security_update_versions_cached)
+            self.composite_logger.log_debug("[APM] Discovered 'security' packages (single-pass). [Count={0}]".format(len(security_packages)))
+        else:
+            # regular security updates check
+            self.composite_logger.log_verbose("[APM] Discovering 'security' packages (default)...")
+            source_parts, source_list = self.__get_custom_sources_to_spec(self.max_patch_publish_date, base_classification=Constants.PackageClassification.SECURITY)
+            security_packages, security_package_versions = self.__simulate_dist_upgrade(source_parts, source_list)[:2]
+            self.composite_logger.log_debug("[APM] Discovered 'security' packages (default). [Count={0}]".format(len(security_packages)))
 
         # Query pro client if prerequisites are met
         if self.__pro_client_prereq_met:
-            self.refresh_repo()
+            if not single_pass_assessment:    # repo state is still as refreshed for the all updates simulation in single-pass
+                self.refresh_repo()
             self.composite_logger.log_verbose("[APM-Pro][Sec] Discovering 'security' packages (pro client)...")
             ubuntu_pro_client_security_updates_query_success, ubuntu_pro_client_security_packages, ubuntu_pro_client_security_package_versions = self.ubuntu_pro_client.get_security_updates()
 
@@ -444,50 +478,89 @@ class AptitudePackageManager(PackageManager):
     def set_max_patch_publish_date(self, max_patch_publish_date=str()):
         self.composite_logger.log_debug("[APM] Setting max patch publish date. [Date={0}]".format(max_patch_publish_date))
         self.max_patch_publish_date = max_patch_publish_date
+
+    def __simulate_dist_upgrade(self, source_parts, source_list):
+        # type: (str, str) -> (list, list, list, list)
+        """ Returns the packages and versions a dist-upgrade on the given sources would install, and those of them offered by a security origin """
+        def simulate_dist_upgrade_with_command_line():
+            cmd = self.__generate_command_with_custom_sources(command_template=self.cmd_dist_upgrade_simulation_template, source_parts=source_parts, source_list=source_list)
+            simulation_output_parser = self.SimulationOutputParser(self)
+            packages, versions = self.invoke_package_manager_and_parse_output(cmd, simulation_output_parser)
+            security_packages, security_versions = simulation_output_parser.get_security_packages_and_versions()
+            return packages, versions, security_packages, security_versions
+
+        if os.path.exists(Constants.SystemPaths.APT_ESM_HOOK_CONF):     # ESM packages are only reported by the apt hook, in the command line output
+            return simulate_dist_upgrade_with_command_line()
+        return self.__query_with_apt_pkg("DistUpgrade", functools.partial(self.apt_pkg_client.simulate_dist_upgrade, source_parts, source_list), simulate_dist_upgrade_with_command_line,
+                                         lambda result: (sorted(zip(result[0], result[1])), sorted(zip(result[2], result[3]))))
+
+    def __query_with_apt_pkg(self, query_name, apt_pkg_query, command_line_query, get_comparable=sorted):
+        """ Answers a read-only query in-process with python-apt if it's available, else with the command line (see query_in_process) """
+        return self.query_in_process("AptPkg." + query_name, apt_pkg_query if self.apt_pkg_client.is_available() else None, command_line_query, get_comparable)
     # endregion
 
     # region Output Parser(s)
     def extract_packages_and_versions(self, output):
-        # sample output format
+        """Returns packages and versions from given simulation output"""
+        return self.parse_output(output, self.SimulationOutputParser(self))
+
+    def extract_security_packages_and_versions(self, output):
+        """Returns packages and versions from given simulation output, for the candidate versions offered by a security origin"""
+        simulation_output_parser = self.SimulationOutputParser(self)
+        self.parse_output(output, simulation_output_parser)
+        return simulation_output_parser.get_security_packages_and_versions()
+
+    class SimulationOutputParser(PackageManager.OutputLineParser):
+        """ Incremental parser of apt-get simulation output, for all packages and versions and for those offered by a security origin """
+        # sample output format - the parenthesised release field lists every origin/suite offering the candidate version
         # Inst coreutils [8.25-2ubuntu2] (8.25-2ubuntu3~16.10 Ubuntu:16.10/yakkety-updates [amd64])
         # Inst python3-update-manager [1:16.10.7] (1:16.10.8 Ubuntu:16.10/yakkety-updates [all]) [update-manager-core:amd64 ]
-        # Inst update-manager-core [1:16.10.7] (1:16.10.8 Ubuntu:16.10/yakkety-updates [all])
-
-        self.composite_logger.log_verbose("[APM] Extracting package and version data...")
-        packages = []
-        versions = []
-
-        search_text = r'Inst[ ](.*?)[ ].*?[(](.*?)[ ](.*?)[ ]\[(.*?)\]'
-        search = re.compile(search_text, re.M | re.S)
-        package_list = search.findall(str(output))
-
-        for package in package_list:
-            packages.append(package[0])
-            versions.append(package[1])
-
-        self.composite_logger.log_verbose("[APM] Extracted package and version data for " + str(len(packages)) + " packages [BASIC].")
-
-        # Discovering ESM packages - Distro versions with extended security maintenance
-        lines = output.strip().split('\n')
-        esm_marker_found = False
-        esm_packages = []
-        for line_index in range(0, len(lines)-1):
-            line = lines[line_index].strip()
-
-            if not esm_marker_found:
-                if self.ESM_MARKER in line:
-                   esm_marker_found = True
-                continue
-
-            esm_packages = line.split()
-            break
-
-        for package in esm_packages:
-            packages.append(package)
-            versions.append(Constants.UA_ESM_REQUIRED)
-        self.composite_logger.log_verbose("[APM] Extracted package and version data for " + str(len(packages)) + " packages [TOTAL].")
-
-        return packages, versions
+        # Inst libssl1.0.0 [1.0.2g-1ubuntu4.15] (1.0.2g-1ubuntu4.16 Ubuntu:16.04/xenial-updates, Ubuntu:16.04/xenial-security [amd64])
+        PACKAGE_SEARCH = re.compile(r'Inst[ ](.*?)[ ].*?[(](.*?)[ ](.*?)[ ]\[(.*?)\]')
+
+        def __init__(self, package_manager):
+            self.composite_logger = package_manager.composite_logger
+            self.esm_marker = package_manager.ESM_MARKER
+            PackageManager.OutputLineParser.__init__(self)
+
+        def reset(self):
+            PackageManager.OutputLineParser.reset(self)
+            self.packages, self.versions = [], []
+            self.security_packages, self.security_versions = [], []
+            self.esm_packages = []
+            self.__esm_marker_found = False
+            self.__esm_line = None      # only used if it is not the last line of the output
+            self.__is_esm_line_read = False
+
+        def consume_line(self, line):
+            for package in self.PACKAGE_SEARCH.findall(line):
+                self.packages.append(package[0])
+                self.versions.append(package[1])
+                origins = package[2]
+                if "security" in origins or "fips-updates" in origins:     # same criteria as used for security-only sources
+                    self.security_packages.append(package[0])
+                    self.security_versions.append(package[1])
+
+            # Discovering ESM packages - Distro versions with extended security maintenance - listed on the line after the marker
+            if self.__is_esm_line_read:
+                return
+            elif self.__esm_line is not None:
+                self.esm_packages = self.__esm_line.strip().split()
+                self.__is_esm_line_read = True
+            elif self.__esm_marker_found:
+                self.__esm_line = line
+            elif self.esm_marker in line.strip():
+                self.__esm_marker_found = True
+
+        def complete(self):
+            packages = self.packages + self.esm_packages
+            versions = self.versions + [Constants.UA_ESM_REQUIRED] * len(self.esm_packages)
+            self.composite_logger.log_verbose("[APM] Extracted package and version data. [BasicCount={0}][TotalCount={1}]".format(str(len(self.packages)), str(len(packages))))
+            return packages, versions
+
+        def get_security_packages_and_versions(self):
+            self.composite_logger.log_verbose("[APM] Extracted security package and version data by origin. [Count={0}]".format(str(len(self.security_packages))))
+            return list(self.security_packages), list(self.security_versions)
     # endregion
     # endregion
 
@@ -501,7 +574,7 @@ class AptitudePackageManager(PackageManager):
     def install_security_updates_azgps_coordinated(self):
         source_parts, source_list = self.__get_custom_sources_to_spec(self.max_patch_publish_date, base_classification=Constants.PackageClassification.SECURITY)
         command = self.__generate_command_with_custom_sources(self.install_security_updates_azgps_coordinated_cmd, source_parts=source_parts, source_list=source_list)
-        out, code = self.invoke_package_manager_advanced(command, raise_on_exception=False)
+        out, code = self.invoke_package_manager_transaction(command)
         return code, out
 
     def try_meet_azgps_coordinated_requirements(self):
@@ -517,6 +590,10 @@ class AptitudePackageManager(PackageManager):
         #      bash | 4.3-14ubuntu1.2 | http://security.ubuntu.com/ubuntu xenial-security/main amd64 Packages
         #      bash | 4.3-14ubuntu1 | http://us.archive.ubuntu.com/ubuntu xenial/main amd64 Packages
 
+        return self.__query_with_apt_pkg("AvailableVersions", functools.partial(self.apt_pkg_client.get_available_versions, package_name),
+                                         functools.partial(self.__get_all_available_versions_of_package_with_command_line, package_name), lambda result: sorted(set(result)))
+
+    def __get_all_available_versions_of_package_with_command_line(self, package_name):
         package_versions = []
 
         cmd = self.cmd_single_package_check_versions_template.replace('<PACKAGE-NAME>', package_name)
@@ -538,6 +615,12 @@ class AptitudePackageManager(PackageManager):
 
         self.composite_logger.log_verbose("\nCHECKING PACKAGE INSTALL STATUS FOR: " + str(package_name) + " (" + str(package_version) + ")")
 
+        # IN-PROCESS METHOD - read the dpkg status database directly when it's available
+        is_installed = self.dpkg_status_reader.is_package_version_installed(package_name, package_version)
+        if is_installed is not None:
+            self.composite_logger.log_verbose(" - Verified install status from dpkg status database. [IsInstalled={0}]".format(str(is_installed)))
+            return is_installed
+
         # DEFAULT METHOD
         self.composite_logger.log_verbose(" - [1/2] Verifying install status with Dpkg.")
         cmd = self.cmd_single_package_find_install_dpkg_template.replace('<PACKAGE-NAME>', package_name)
@@ -638,8 +721,34 @@ class AptitudePackageManager(PackageManager):
         self.composite_logger.log_verbose("   - Package version specified was determined to NOT be installed.")
         return False
 
+    def get_installed_packages_snapshot(self):
+        """ Prefers the dpkg status database, which tracks its own freshness, over the dpkg-query snapshot """
+        installed_packages = self.dpkg_status_reader.get_installed_packages()
+        if installed_packages is not None:
+            return installed_packages
+        return super(AptitudePackageManager, self).get_installed_packages_snapshot()
+
+    def extract_installed_packages_snapshot(self, output_lines):
+        """ Parses dpkg-query output lines into a map of installed package name to installed versions """
+        # Sample output format
+        # apt 1.2.29 ii
+        # mysql-client 5.7.25-0ubuntu0.16.04.2 rc
+        snapshot = {}
+        for line in output_lines:
+            package_details = line.split()
+            if len(package_details) != 3:
+                continue
+            if package_details[2][1:2] != 'i':     # second letter of the abbreviated status is the current state, 'i' being installed
+                continue
+            snapshot.setdefault(package_details[0], []).append(package_details[1])
+        return snapshot
+
     def get_dependent_list(self, packages):
         """Returns dependent List for the list of packages"""
+        return self.__query_with_apt_pkg("DependentList", functools.partial(self.apt_pkg_client.get_dependent_packages, packages),
+                                         functools.partial(self.__get_dependent_list_with_command_line, packages))
+
+    def __get_dependent_list_with_command_line(self, packages):
         package_names = ""
         for index, package in enumerate(packages):
             if index != 0:
@@ -1018,7 +1127,7 @@ class AptitudePackageManager(PackageManager):
         """ Attempts to install mokutil """
         cmd = self.install_mokutil_cmd
         self.composite_logger.log_verbose('[APM] Invoking install mokutil command [Command={0}]'.format(cmd))
-        out, code = self.invoke_package_manager_advanced(cmd, raise_on_exception=False)
+        out, code = self.invoke_package_manager_transaction(cmd)
         self.composite_logger.log_debug('[APM] Invoked install mokutil command. [Command={0}][Code={1}][Output={2}]'.format(cmd, str(code), str(out)))
         return code == 0
 
@@ -1068,11 +1177,11 @@ class AptitudePackageManager(PackageManager):
         if installed_version != str():
             self.composite_logger.log("[APM][Certs] Existing fwupd version is below minimum. Reinstalling latest. [InstalledVersion={0}][MinimumVersion={1}]"
                                       .format(installed_version, self.min_fwupd_version))
-            self.__run_cert_apt_command(self.remove_fwupd_cmd, step_name="RemoveOldFwupd", raise_on_error=True)
+            self.__run_cert_apt_command(self.remove_fwupd_cmd, step_name="RemoveOldFwupd", raise_on_error=True, is_transaction=True)
         else:
             self.composite_logger.log_debug("[APM][Certs] fwupd is not installed. Installing latest version.")
 
-        self.__run_cert_apt_command(self.install_fwupd_cmd, step_name="InstallFwupd", raise_on_error=True)
+        self.__run_cert_apt_command(self.install_fwupd_cmd, step_name="InstallFwupd", raise_on_error=True, is_transaction=True)
 
         # Validate that the installed fwupd meets the minimum requirement.
         installed_version = self.__get_installed_fwupd_version()
@@ -1122,9 +1231,12 @@ class AptitudePackageManager(PackageManager):
                                         .format(str(installed_version), str(installed_normalized), str(self.min_fwupd_version), str(minimum_normalized), str(compare_result), str(meets_minimum)))
         return meets_minimum
 
-    def __run_cert_apt_command(self, command, step_name, raise_on_error=False):
+    def __run_cert_apt_command(self, command, step_name, raise_on_error=False, is_transaction=False):
         """Run apt/dpkg commands through package-manager wrapper."""
-        out, code = self.invoke_package_manager_advanced(command, raise_on_exception=False)
+        if is_transaction:
+            out, code = self.invoke_package_manager_transaction(command)
+        else:
+            out, code = self.invoke_package_manager_advanced(command, raise_on_exception=False)
         if code != self.apt_exitcode_ok:
             msg = "[APM][UpdateCerts] Apt step failed. [Step={0}][Command={1}][Code={2}][Output={3}]".format(step_name, str(command), str(code), str(out))
             self.composite_logger.log_error(msg)
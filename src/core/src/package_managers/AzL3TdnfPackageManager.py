@@ -63,7 +63,7 @@ class AzL3TdnfPackageManager(TdnfPackageManager):
     def install_security_updates_azgps_coordinated(self):
         """Install security updates in Azure Linux following strict SDP"""
         command = self.add_additional_parameters_as_required_to_cmd(self.install_security_updates_azgps_coordinated_cmd)
-        out, code = self.invoke_package_manager_advanced(command, raise_on_exception=False)
+        out, code = self.invoke_package_manager_transaction(command)
         return code, out
 
     def try_meet_azgps_coordinated_requirements(self):
@@ -112,7 +112,8 @@ class AzL3TdnfPackageManager(TdnfPackageManager):
         """Attempt to update TDNF to meet the minimum version required for strict SDP"""
         self.composite_logger.log_debug("[AzL3TDNF] Attempting to update TDNF to meet strict safe deployment requirements...")
         cmd = "sudo tdnf -y install tdnf-" + self.TDNF_MINIMUM_VERSION_FOR_STRICT_SDP
-        code, output = self.env_layer.run_command_output(cmd, no_output=True, chk_err=False)
+        with self.env_layer.command_time_limit_suspended():
+            code, output = self.env_layer.run_command_output(cmd, no_output=True, chk_err=False)
         if code == 0:
             self.composite_logger.log_debug("[AzL3TDNF] Successfully updated TDNF for Strict SDP. [Command={0}][Code={1}]".format(cmd, code))
             return True
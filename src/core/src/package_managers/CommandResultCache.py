@@ -0,0 +1,140 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""This is a cache of read-only package manager command results"""
+import collections
+import hashlib
+import os
+import threading
+
+from core.src.bootstrap.Constants import Constants
+
+
+class CommandResultCache(object):
+    """ LRU cache of read-only package manager command results (e.g. simulations, version queries), keyed by command. A result is reused for as long as the
+        fingerprint of the package database and repository metadata it was read from is unchanged, and until a command that may change either runs (invalidate). """
+
+    def __init__(self, fingerprint_paths):
+        # type: (list) -> None
+        self.fingerprint_paths = fingerprint_paths
+        self.hit_count = 0
+        self.miss_count = 0
+        self.__entries = collections.OrderedDict()     # command -> (fingerprint, code, output), least recently used first
+        self.__size_in_chars = 0
+        self.__generation = 0
+        self.__lock = threading.Lock()
+
+    def get(self, command):
+        # type: (str) -> tuple
+        """ Returns the cached (code, output) of command, or None if there is no result for the current fingerprint """
+        if not Constants.CommandResultCacheConfig.ENABLED:
+            return None
+
+        fingerprint = self.get_fingerprint()
+        with self.__lock:
+            entry = self.__entries.pop(command, None)
+            if entry is None or fingerprint is None or entry[0] != fingerprint:
+                if entry is not None:
+                    self.__size_in_chars -= len(entry[2])
+                self.miss_count += 1
+                return None
+            self.__entries[command] = entry     # most recently used
+            self.hit_count += 1
+            return entry[1], entry[2]
+
+    def put(self, command, code, output):
+        # type: (str, int, str) -> None
+        """ Caches the result of command, against the fingerprint at the time it completed """
+        if not Constants.CommandResultCacheConfig.ENABLED or output is None or len(output) > Constants.CommandResultCacheConfig.MAX_ENTRY_SIZE_IN_CHARS:
+            return
+
+        fingerprint = self.get_fingerprint()
+        if fingerprint is None:
+            return
+        with self.__lock:
+            if fingerprint[0] != self.__generation:
+                return      # invalidated while the command ran
+            entry = self.__entries.pop(command, None)
+            if entry is not None:
+                self.__size_in_chars -= len(entry[2])
+            self.__entries[command] = (fingerprint, code, output)
+            self.__size_in_chars += len(output)
+
+            while len(self.__entries) > Constants.CommandResultCacheConfig.MAX_ENTRIES or self.__size_in_chars > Constants.CommandResultCacheConfig.MAX_SIZE_IN_CHARS:
+                evicted_command = next(iter(self.__entries))
+                self.__size_in_chars -= len(self.__entries.pop(evicted_command)[2])
+
+    def invalidate(self):
+        """ Drops all results - for when a command that may change the package database or repository metadata runs """
+        with self.__lock:
+            self.__generation += 1
+            self.__entries.clear()
+            self.__size_in_chars = 0
+
+    def get_fingerprint(self):
+        # type: () -> tuple
+        """ Identity of the current package database and repository metadata state: the invalidation generation and the size and mtime of each fingerprint path
+            (and of the entries of those that are directories). Paths that don't exist are part of the fingerprint as such. Returns None if it can't be determined. """
+        with self.__lock:
+            fingerprint = [self.__generation]
+        try:
+            for path in self.fingerprint_paths:
+                fingerprint.append((path,) + self.__get_path_state(path))
+                if os.path.isdir(path):
+                    for entry in sorted(os.listdir(path)):
+                        fingerprint.append((entry,) + self.__get_path_state(os.path.join(path, entry)))
+            return tuple(fingerprint)
+        except (IOError, OSError):
+            return None
+
+    def get_database_fingerprint(self):
+        # type: () -> str
+        """ Digest of the package database and repository metadata state that is comparable across runs, i.e. get_fingerprint without the invalidation
+            generation of this process. Returns None if it can't be determined, or if there are no fingerprint paths to determine it from. """
+        fingerprint = self.get_fingerprint()
+        if fingerprint is None or len(self.fingerprint_paths) == 0:
+            return None
+        return hashlib.sha256(repr(fingerprint[1:]).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def __get_path_state(path):
+        if not os.path.exists(path):
+            return None, None
+        status = os.stat(path)
+        return status.st_mtime, status.st_size
+
+    class OutputCapture(object):
+        """ Collects streamed output lines for the cache, up to the size of the largest entry that can be cached """
+
+        def __init__(self):
+            self.lines = []
+            self.size_in_chars = 0
+            self.is_complete = True
+
+        def append(self, line):
+            if not self.is_complete:
+                return
+            self.size_in_chars += len(line) + 1
+            if self.size_in_chars > Constants.CommandResultCacheConfig.MAX_ENTRY_SIZE_IN_CHARS:
+                self.lines = []
+                self.is_complete = False
+                return
+            self.lines.append(line)
+
+        def get_output(self):
+            # type: () -> str
+            """ Returns the captured output, or None if it was too large to capture """
+            return "\n".join(self.lines) if self.is_complete else None
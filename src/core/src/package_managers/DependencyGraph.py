@@ -0,0 +1,82 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""This is the per-run graph of package dependency resolutions"""
+import threading
+
+
+class DependencyGraph(object):
+    """ Memoizes dependency resolutions (upgrade simulations, see PackageManager.get_dependent_list) by package set, for as long as the package database and repository
+        metadata are unchanged. Questions about many packages are answered with as few simulations as possible, by resolving the packages together first and only
+        narrowing down to the packages that need a closer look. """
+
+    def __init__(self, composite_logger, resolver, fingerprint_provider):
+        # type: (object, callable, callable) -> None
+        self.composite_logger = composite_logger
+        self.resolver = resolver                            # packages -> other packages that would be installed along with them
+        self.fingerprint_provider = fingerprint_provider    # identity of the package database and repository metadata state - resolutions are dropped when it changes
+        self.resolution_count = 0
+        self.reuse_count = 0
+        self.__resolutions = {}     # frozenset of packages -> dependencies
+        self.__fingerprint = None
+        self.__lock = threading.Lock()
+
+    def get_dependent_list(self, packages):
+        # type: (list) -> list
+        """ Returns the packages that would be installed along with the given packages, resolving them only if this package set was not resolved yet """
+        key = frozenset(packages)
+        fingerprint = self.fingerprint_provider()
+        with self.__lock:
+            if fingerprint is None or fingerprint != self.__fingerprint:
+                self.__resolutions.clear()
+                self.__fingerprint = fingerprint
+            if key in self.__resolutions:
+                self.reuse_count += 1
+                return list(self.__resolutions[key])
+
+        dependencies = self.resolver(list(packages))
+        with self.__lock:
+            self.resolution_count += 1
+            if fingerprint is not None and fingerprint == self.__fingerprint:
+                self.__resolutions[key] = list(dependencies)
+        return list(dependencies)
+
+    def find_packages_with_matching_dependencies(self, packages, is_match):
+        # type: (list, callable) -> dict
+        """ Returns the packages whose own dependency list is matched by is_match (e.g. contains an excluded package), mapped to that dependency list.
+            All packages are resolved together first - if nothing matches, that one simulation answers for all of them. Sets that do match are halved until the
+            matching packages are isolated, so the simulations needed grow with the number of matching packages, not with the number of packages.
+            This relies on the dependencies of a package being among those of any set it is resolved with (or in the set itself). """
+        matches = {}
+        pending_groups = [list(packages)] if len(packages) > 0 else []
+        while len(pending_groups) > 0:
+            group = pending_groups.pop()
+            dependencies = self.get_dependent_list(group)
+            if len(group) == 1:
+                if len(dependencies) > 0 and is_match(dependencies):
+                    matches[group[0]] = dependencies
+                continue
+
+            # members of the group are not listed as dependencies of the group, so a member that matches by itself may be hiding a dependent member
+            if not (len(dependencies) > 0 and is_match(dependencies)) and not any(is_match([package]) for package in group):
+                continue
+            middle = len(group) // 2
+            pending_groups.append(group[middle:])
+            pending_groups.append(group[:middle])
+
+        self.composite_logger.log_debug("[PM] Dependency graph query completed. [Packages={0}][Matches={1}][TotalResolutions={2}][TotalReused={3}]".format(
+            str(len(packages)), str(len(matches)), str(self.resolution_count), str(self.reuse_count)))
+        return matches
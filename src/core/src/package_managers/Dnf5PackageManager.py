@@ -15,12 +15,14 @@
 # Requires Python 2.7+
 
 """Dnf5PackageManager for Azure Linux 4 or above"""
+import functools
 import json
 import re
 
 from core.src.core_logic.VersionComparator import VersionComparator
 from core.src.bootstrap.Constants import Constants
 from core.src.package_managers.PackageManager import PackageManager
+from core.src.package_managers.RpmDbClient import RpmDbClient
 
 
 class Dnf5PackageManager(PackageManager):
@@ -35,19 +37,26 @@ class Dnf5PackageManager(PackageManager):
         #  Get updates and dependencies.
         self.single_package_check_versions = 'sudo dnf5 list --available <PACKAGE-NAME> '
         self.single_package_check_installed = 'sudo dnf5 list --installed <PACKAGE-NAME> '
+        self.cmd_get_installed_packages_snapshot = "rpm -qa --queryformat '%{NAME}.%{ARCH} %|EPOCH?{%{EPOCH}:}:{}|%{VERSION}-%{RELEASE}\\n'"
+        self.rpm_db_client = RpmDbClient(composite_logger, self.command_result_cache.get_fingerprint, RpmDbClient.LIBDNF5)     # in-process alternative to read-only queries
 
         self.single_package_upgrade_simulation_cmd = "sudo dnf5 upgrade --assumeno "
+        self.lock_free_command_pattern = r'^(sudo )?rpm -q'
+        self.cacheable_command_pattern = r'\bdnf5 -q check-update|\bdnf5 list --(available|installed) |\bdnf5 upgrade --assumeno '
 
         # Install update
         self.single_package_upgrade_cmd = 'sudo dnf5 -y upgrade '
+        self.download_only_cmd = 'sudo dnf5 -y upgrade --downloadonly --setopt=throttle=<MAX-KBPS>k '
         # Support to check if reboot is required
         # dnf-utils not required (needs-restarting is built into dnf5)
         self.needs_restarting_with_flag = 'sudo LANG=en_US.UTF8 dnf5 needs-restarting -r'
 
         # DNF5 exit codes
         self.dnf_exitcode_ok = [0, 100]
+        self.cacheable_command_exit_codes = self.dnf_exitcode_ok
         # DNF5 valid exit codes for simulation commands
         self.dnf5_simulation_valid_exit_codes = [0, 1]
+        self.cacheable_command_exit_codes_by_pattern = [(r'\bdnf5 upgrade --assumeno ', self.dnf5_simulation_valid_exit_codes)]
         self.dnf5_dependency_failure_text = ["Skipping packages with broken dependencies", "Nothing to do.", "Failed to resolve the transaction:"]
         self.dnf5_dependency_success_text = ["Installing dependencies:", "Upgrading dependencies:"]
         self.dnf5_dependency_exit_text = "Transaction Summary"
@@ -85,10 +94,13 @@ class Dnf5PackageManager(PackageManager):
         self.invoke_package_manager(self.cmd_clean_cache)
         self.invoke_package_manager(self.cmd_repo_refresh)
 
+    def get_package_database_fingerprint_paths(self):
+        return [Constants.SystemPaths.RPM_DB, Constants.SystemPaths.RPM_DB_SYSIMAGE, Constants.SystemPaths.YUM_REPOS_DIR]
+
     # region Get Available Updates
-    def invoke_package_manager_advanced(self, command, raise_on_exception=True):
+    def invoke_package_manager_advanced(self, command, raise_on_exception=True, line_parser=None):
         self.composite_logger.log_verbose("[DNF5] Invoking package manager. [Command={0}]".format(str(command)))
-        code, out = self.env_layer.run_command_output(command, False, False)
+        code, out = self.run_package_manager_command(command, line_parser)
         is_valid_not_installed = (self.dnf5_list_installed_command_patterns in command and code == self.dnf5_not_installed_exit_code and self.dnf5_not_installed_text in (out or ""))
 
         # DNF5 dependency simulation using `upgrade --assumeno` may return non-standard exit codes. Successful simulations and transaction
@@ -96,9 +108,9 @@ class Dnf5PackageManager(PackageManager):
         is_valid_dependency_simulation = (self.single_package_upgrade_simulation_cmd in command and code in self.dnf5_simulation_valid_exit_codes)
 
         if code in self.dnf_exitcode_ok or is_valid_not_installed or is_valid_dependency_simulation:
-            self.composite_logger.log_debug('[DNF5] Invoked package manager. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), str(out)))
+            self.composite_logger.log_debug('[DNF5] Invoked package manager. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), self.env_layer.get_output_excerpt(str(out))))
         else:
-            self.composite_logger.log_warning('[ERROR] Customer environment error. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), str(out)))
+            self.composite_logger.log_warning('[ERROR] Customer environment error. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), self.env_layer.get_output_excerpt(str(out))))
             error_msg = "Customer environment error: Investigate and resolve unexpected return code ({0}) from package manager on command: {1}".format(str(code), command)
             self.status_handler.add_error_to_status(error_msg, Constants.PatchOperationErrorCodes.PACKAGE_MANAGER_FAILURE)
             if raise_on_exception:
@@ -170,11 +182,15 @@ class Dnf5PackageManager(PackageManager):
             self.composite_logger.log_debug("[DNF5] Get all updates : [Cached={0}][PackagesCount={1}]".format(str(cached), len(self.all_updates_cached)))
             return self.all_updates_cached, self.all_update_versions_cached  # allows for high performance reuse in areas of the code explicitly aware of the cache
 
-        out = self.invoke_package_manager(self.cmd_get_all_updates)
-        self.all_updates_cached, self.all_update_versions_cached = self.extract_packages_and_versions(out)
+        self.all_updates_cached, self.all_update_versions_cached = self.query_in_process("Rpm.AvailableUpdates", self.__get_rpm_metadata_query(self.rpm_db_client.get_available_updates),
+                                                                                         self.__get_all_updates_with_command_line, lambda result: sorted(zip(result[0], result[1])))
         self.composite_logger.log_debug("[DNF5] Get all updates : [Cached={0}][PackagesCount={1}]".format(str(False), len(self.all_updates_cached)))
         return self.all_updates_cached, self.all_update_versions_cached
 
+    def __get_all_updates_with_command_line(self):
+        out = self.invoke_package_manager(self.cmd_get_all_updates)
+        return self.extract_packages_and_versions(out)
+
     def get_security_updates(self):
         """Get missing security updates. NOTE: Classification based categorization of patches is not available in DNF5 as of now"""
         self.composite_logger.log_verbose("[DNF5] Discovering all packages as 'security' packages, since DNF5 does not support package classification...")
@@ -231,11 +247,22 @@ class Dnf5PackageManager(PackageManager):
         # Sample output format
         # rubygem-json.x86_64    2.13.2-2.azl4~20260501      azurelinux-base
         # rubygem-json.x86_64    2.14.0-1.azl4~20260501      azurelinux-base
+        return self.query_in_process("Rpm.AvailableVersions", self.__get_rpm_metadata_query(functools.partial(self.rpm_db_client.get_available_versions, package_name)),
+                                     functools.partial(self.__get_all_available_versions_of_package_with_command_line, package_name))
+
+    def __get_all_available_versions_of_package_with_command_line(self, package_name):
         cmd = self.single_package_check_versions.replace('<PACKAGE-NAME>', package_name)
         output = self.invoke_package_manager(cmd)
         packages, package_versions = self.extract_packages_and_versions_including_duplicates(output)
         return package_versions
 
+    def get_installed_packages_in_process_query(self):
+        return self.rpm_db_client.get_installed_packages if self.rpm_db_client.is_rpm_available() else None
+
+    def __get_rpm_metadata_query(self, query):
+        """ The in-process query, if the libdnf5 bindings are available (see query_in_process) """
+        return query if self.rpm_db_client.is_metadata_available() else None
+
     def is_package_version_installed(self, package_name, package_version):
         """Returns true if the specific package version is installed"""
         # Sample output format
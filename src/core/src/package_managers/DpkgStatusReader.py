@@ -0,0 +1,138 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""This is an in-process reader for the dpkg status database"""
+import os
+
+from core.src.bootstrap.Constants import Constants
+
+
+class DpkgStatusReader(object):
+    """ Reads installed package state straight from the dpkg status database (and its updates journal), without spawning dpkg """
+
+    def __init__(self, composite_logger, status_file_path=None, updates_dir_path=None):
+        self.composite_logger = composite_logger
+        self.status_file_path = status_file_path if status_file_path is not None else Constants.SystemPaths.DPKG_STATUS
+        self.updates_dir_path = updates_dir_path if updates_dir_path is not None else Constants.SystemPaths.DPKG_UPDATES
+
+        # Index is only rebuilt when the database fingerprint (status file + journal entries) changes
+        self.index = None
+        self.installed_packages = None
+        self.index_fingerprint = None
+
+    def get_index(self):
+        # type: () -> dict
+        """ Returns a map of package name (and name:arch) to a list of (version, status, arch) tuples, or None if the database can't be read """
+        fingerprint = self.get_database_fingerprint()
+        if fingerprint is None:
+            self.index = self.installed_packages = self.index_fingerprint = None
+            return None
+
+        if self.index is not None and fingerprint == self.index_fingerprint:
+            return self.index
+
+        try:
+            stanzas = {}
+            self.__read_stanzas(self.status_file_path, stanzas)
+            for journal_entry in self.__get_journal_entries():    # dpkg applies journal entries, in order, on top of the status file
+                self.__read_stanzas(os.path.join(self.updates_dir_path, journal_entry), stanzas)
+        except Exception as error:
+            self.composite_logger.log_debug("[DSR] Unable to read dpkg status database. [Path={0}][Error={1}]".format(self.status_file_path, repr(error)))
+            self.index = self.installed_packages = self.index_fingerprint = None
+            return None
+
+        index = {}
+        installed_packages = {}
+        for (name, arch), (version, status) in stanzas.items():
+            entry = (version, status, arch)
+            index.setdefault(name, []).append(entry)
+            if arch not in ('', 'all'):
+                index.setdefault(name + ':' + arch, []).append(entry)
+            if self.is_installed_status(status):
+                installed_packages.setdefault(name, []).append(version)
+
+        self.index = index
+        self.installed_packages = installed_packages
+        self.index_fingerprint = fingerprint
+        self.composite_logger.log_verbose("[DSR] Indexed dpkg status database. [PackageCount={0}][JournalEntries={1}]".format(str(len(stanzas)), str(len(fingerprint) - 1)))
+        return self.index
+
+    def get_installed_packages(self):
+        # type: () -> dict
+        """ Returns a map of installed package name to installed versions, or None if the database can't be read """
+        if self.get_index() is None:
+            return None
+        return self.installed_packages
+
+    def is_package_version_installed(self, package_name, package_version):
+        # type: (str, str) -> object
+        """ Returns true/false for the specific package version being installed, or None if the database can't be read """
+        index = self.get_index()
+        if index is None:
+            return None
+
+        for version, status, arch in index.get(package_name, []):
+            if version == package_version and self.is_installed_status(status):
+                return True
+        return False
+
+    def get_database_fingerprint(self):
+        # type: () -> tuple
+        """ Identity of the current database state - dpkg replaces the status file (new inode) and adds journal files on every change """
+        try:
+            status = os.stat(self.status_file_path)
+            fingerprint = [(status.st_ino, status.st_mtime, status.st_size)]
+            for journal_entry in self.__get_journal_entries():
+                journal_status = os.stat(os.path.join(self.updates_dir_path, journal_entry))
+                fingerprint.append((journal_entry, journal_status.st_mtime, journal_status.st_size))
+            return tuple(fingerprint)
+        except (IOError, OSError):
+            return None
+
+    @staticmethod
+    def is_installed_status(status):
+        # type: (str) -> bool
+        """ Status field is '<want> <flag> <state>', e.g. 'install ok installed' or 'hold ok installed' """
+        status_parts = status.split()
+        return len(status_parts) == 3 and status_parts[1] == 'ok' and status_parts[2] == 'installed'
+
+    def __get_journal_entries(self):
+        """ Journal entries are files with purely numeric names, applied in numeric order """
+        if not os.path.isdir(self.updates_dir_path):
+            return []
+        return sorted([entry for entry in os.listdir(self.updates_dir_path) if entry.isdigit()], key=int)
+
+    @staticmethod
+    def __read_stanzas(file_path, stanzas):
+        """ Streams stanzas from a status file into stanzas as (name, arch) -> (version, status); only the fields needed are decoded """
+        name = version = status = arch = None
+        with open(file_path, 'rb') as file_handle:
+            for raw_line in file_handle:
+                if raw_line.startswith(b'Package:'):
+                    name = raw_line[8:].decode('utf-8', 'replace').strip()
+                elif raw_line.startswith(b'Status:'):
+                    status = raw_line[7:].decode('utf-8', 'replace').strip()
+                elif raw_line.startswith(b'Version:'):
+                    version = raw_line[8:].decode('utf-8', 'replace').strip()
+                elif raw_line.startswith(b'Architecture:'):
+                    arch = raw_line[13:].decode('utf-8', 'replace').strip()
+                elif raw_line.strip() == b'':
+                    if name is not None:
+                        stanzas[(name, arch or '')] = (version or '', status or '')
+                    name = version = status = arch = None
+
+        if name is not None:    # last stanza need not be followed by a blank line
+            stanzas[(name, arch or '')] = (version or '', status or '')
@@ -15,9 +15,16 @@
 # Requires Python 2.7+
 
 """The is base package manager, which defines the package management relevant operations"""
+import functools
 import os
+import re
+import shutil
+import threading
 from abc import ABCMeta, abstractmethod
 from core.src.bootstrap.Constants import Constants
+from core.src.core_logic.InstallDurationHistory import InstallDurationHistory
+from core.src.package_managers.CommandResultCache import CommandResultCache
+from core.src.package_managers.DependencyGraph import DependencyGraph
 import time
 
 
@@ -39,6 +46,38 @@ class PackageManager(object):
         self.all_updates_cached = []
         self.all_update_versions_cached = []
 
+        # Independent read-only queries can run concurrently (see QueryExecutor). Package manager commands take the package manager lock, so they do not run into each
+        # other's locks (e.g. dpkg's, which fails fast instead of waiting) - except for those matching lock_free_command_pattern, which is set by package managers as applicable.
+        self.query_executor = self.QueryExecutor(Constants.ParallelQueryConfig.MAX_PARALLELISM)
+        self.package_manager_lock = threading.RLock()
+        self.lock_free_command_pattern = None
+
+        # Results of read-only commands matching cacheable_command_pattern (set by package managers as applicable) are reused while the package database and repository
+        # metadata are unchanged. Any other command that takes the package manager lock is presumed to change them, and invalidates the cache.
+        self.cacheable_command_pattern = None
+        self.cacheable_command_exit_codes = [0]
+        self.cacheable_command_exit_codes_by_pattern = []     # (pattern, exit codes) for cacheable commands with exit codes of their own, e.g. simulations that exit 1 if there is anything to do
+        self.command_result_cache = CommandResultCache(self.get_package_database_fingerprint_paths())
+
+        # Dependency resolutions of this run, reused while the package database and repository metadata are unchanged
+        self.dependency_graph = DependencyGraph(composite_logger, lambda packages: self.get_dependent_list(packages), self.command_result_cache.get_fingerprint)
+
+        # Installed state snapshot - one bulk query answers installed checks until the next install command runs
+        self.cmd_get_installed_packages_snapshot = ''
+        self.installed_packages_snapshot = None
+
+        # Download-only install, for staging packages in the package manager's cache ahead of installation (see PackagePrefetcher) - set by package managers as
+        # applicable. <MAX-KBPS> is replaced with the bandwidth cap, where the package manager supports one.
+        self.download_only_cmd = None
+
+        # Download-only install into <DOWNLOAD-DIR>, that can run while an installation is in progress (see BatchDownloadPipeline) - set by package managers as
+        # applicable. The downloaded packages are moved into package_cache_path once the installation has ended.
+        self.concurrent_download_only_cmd = None
+        self.package_cache_path = None
+
+        # Install durations learned on this machine, for batch sizing and maintenance window cutoffs
+        self.install_duration_history = InstallDurationHistory(env_layer, composite_logger, os.path.join(execution_config.config_folder, Constants.INSTALL_DURATION_HISTORY_FILE))
+
         # auto OS updates
         self.image_default_patch_configuration_backup_path = os.path.join(execution_config.config_folder, Constants.IMAGE_DEFAULT_PATCH_CONFIGURATION_BACKUP_PATH)
 
@@ -76,13 +115,188 @@ class PackageManager(object):
 
     # region Get Available Updates
     @abstractmethod
-    def invoke_package_manager_advanced(self, command, raise_on_exception=True):
+    def invoke_package_manager_advanced(self, command, raise_on_exception=True, line_parser=None):
         pass
 
     def invoke_package_manager(self, command):
         out, code = self.invoke_package_manager_advanced(command, raise_on_exception=True)
         return out
 
+    def invoke_package_manager_transaction(self, command, raise_on_exception=False):
+        """ Invokes the package manager for a command that changes the installed packages. It isn't ended at the command time limit (see
+            EnvLayer.set_command_time_limit_provider), as that would leave the package database broken - installation stops before the next one instead. """
+        with self.env_layer.command_time_limit_suspended():
+            return self.invoke_package_manager_advanced(command, raise_on_exception=raise_on_exception)
+
+    def invoke_package_manager_and_parse_output(self, command, line_parser):
+        """ Invokes the package manager, parsing its output as it's produced instead of buffering all of it. Returns the parser's result. """
+        self.invoke_package_manager_advanced(command, raise_on_exception=True, line_parser=line_parser)
+        return line_parser.complete()
+
+    def run_package_manager_command(self, command, line_parser=None):
+        """ Runs a package manager command. If a line parser is given, the output is streamed to it and only the tail of the output is returned. """
+        is_cacheable = self.cacheable_command_pattern is not None and re.search(self.cacheable_command_pattern, command) is not None
+        is_lock_free = self.lock_free_command_pattern is not None and re.search(self.lock_free_command_pattern, command) is not None
+        if is_cacheable:
+            cached_result = self.command_result_cache.get(command)
+            if cached_result is not None:
+                self.composite_logger.log_verbose("[PM] Reusing cached command result. [Command={0}][Code={1}]".format(command, str(cached_result[0])))
+                return self.__replay_command_result(cached_result, line_parser)
+        elif not is_lock_free:
+            self.command_result_cache.invalidate()
+
+        output_capture = CommandResultCache.OutputCapture() if is_cacheable and line_parser is not None else None
+        if is_lock_free:
+            code, out = self.__run_package_manager_command(command, line_parser, output_capture)
+        else:
+            with self.package_manager_lock:
+                code, out = self.__run_package_manager_command(command, line_parser, output_capture)
+
+        if is_cacheable and code in self.__get_cacheable_command_exit_codes(command):
+            self.command_result_cache.put(command, code, out if output_capture is None else output_capture.get_output())
+        return code, out
+
+    def __get_cacheable_command_exit_codes(self, command):
+        """ Exit codes for which the result of a cacheable command is cached """
+        for pattern, exit_codes in self.cacheable_command_exit_codes_by_pattern:
+            if re.search(pattern, command) is not None:
+                return exit_codes
+        return self.cacheable_command_exit_codes
+
+    def __run_package_manager_command(self, command, line_parser, output_capture=None):
+        if line_parser is None:
+            return self.env_layer.run_command_output(command, False, False)
+        if output_capture is None:
+            return self.env_layer.run_command_output_streaming(command, line_parser.feed, False)
+
+        def capture_and_feed(line):
+            output_capture.append(line)
+            line_parser.feed(line)
+        return self.env_layer.run_command_output_streaming(command, capture_and_feed, False)
+
+    @staticmethod
+    def __replay_command_result(cached_result, line_parser):
+        """ Returns a cached result the same way as the command would have - streamed to the line parser, if any """
+        code, out = cached_result
+        if line_parser is None:
+            return code, out
+        for line in out.split('\n'):
+            line_parser.feed(line)
+        return code, out[-Constants.MAX_STREAMED_COMMAND_OUTPUT_TAIL_IN_CHARS:]
+
+    def query_in_process(self, query_name, in_process_query, command_line_query, get_comparable=sorted):
+        """ Answers a read-only query in-process (e.g. with the package manager's python bindings) where in_process_query is given, else - or if that fails - with
+            command_line_query. For A/B verification with InProcessQuerySettings.VERIFY_AGAINST_COMMAND_LINE, both are queried and any differences logged - the
+            command line result is returned then. """
+        in_process_result = None
+        if in_process_query is not None:
+            try:
+                in_process_result = in_process_query()
+            except Exception as error:
+                self.composite_logger.log_debug("[PM] In-process query failed. Falling back to the command line. [Query={0}][Error={1}]".format(query_name, repr(error)))
+
+        if in_process_result is not None and not Constants.InProcessQuerySettings.VERIFY_AGAINST_COMMAND_LINE:
+            return in_process_result
+
+        command_line_result = command_line_query()
+        if in_process_result is not None:
+            if get_comparable(in_process_result) == get_comparable(command_line_result):
+                self.composite_logger.log_debug("[PM] In-process query result matches the command line. [Query={0}]".format(query_name))
+            else:
+                self.composite_logger.log_debug("[PM][!] In-process query result differs from the command line. [Query={0}][InProcess={1}][CommandLine={2}]"
+                                                .format(query_name, str(in_process_result), str(command_line_result)))
+        return command_line_result
+
+    def get_package_database_fingerprint_paths(self):
+        # type: () -> list
+        """ Paths whose state identifies the package database and repository metadata that read-only command results depend on - see CommandResultCache """
+        return []
+
+    class QueryExecutor(object):
+        """ Small thread pool for independent read-only queries. Package manager commands within the queries are still serialized as needed (see run_package_manager_command). """
+
+        def __init__(self, max_parallelism):
+            self.max_parallelism = max_parallelism
+
+        def run(self, queries):
+            # type: (list) -> list
+            """ Runs the queries (callables without arguments) concurrently, up to max_parallelism at a time. Returns their results in the same order.
+                If any query raised, the error of the first of those (in order) is raised once all have completed. """
+            results = [None] * len(queries)
+            errors = [None] * len(queries)
+            if not Constants.ParallelQueryConfig.ENABLED or self.max_parallelism <= 1 or len(queries) <= 1:
+                for index, query in enumerate(queries):
+                    results[index] = query()
+                return results
+
+            next_index = [0]
+            index_lock = threading.Lock()
+
+            def worker():
+                while True:
+                    with index_lock:
+                        index = next_index[0]
+                        next_index[0] += 1
+                    if index >= len(queries):
+                        return
+                    try:
+                        results[index] = queries[index]()
+                    except BaseException as error:  # incl. SystemExit, which would otherwise only end this thread
+                        errors[index] = error
+
+            workers = [threading.Thread(target=worker) for _ in range(0, min(self.max_parallelism, len(queries)))]
+            for thread in workers:
+                thread.daemon = True
+                thread.start()
+            for thread in workers:
+                thread.join()
+
+            for error in errors:
+                if error is not None:
+                    raise error
+            return results
+
+    @staticmethod
+    def parse_output(output, line_parser):
+        """ Runs already buffered output through an incremental line parser """
+        for line in str(output).split('\n'):
+            line_parser.feed(line)
+        return line_parser.complete()
+
+    class OutputLineParser(object):
+        """ Base for incremental parsers of package manager output, which see one line at a time. Lines are passed on with the same boundaries as
+            output.strip().split('\n') would give on the buffered output, i.e. leading and trailing blank lines are dropped. """
+        __metaclass__ = ABCMeta
+
+        def __init__(self):
+            self.reset()
+
+        def feed(self, line):
+            if line.strip() == str():
+                if not self.__is_first_line:
+                    self.__deferred_blank_lines.append(line)    # only passed on if more output follows
+                return
+
+            for blank_line in self.__deferred_blank_lines:
+                self.consume_line(blank_line)
+            self.__deferred_blank_lines = []
+            self.consume_line(line.lstrip() if self.__is_first_line else line)
+            self.__is_first_line = False
+
+        def reset(self):
+            """ Discards all output seen so far, e.g. before the command is retried """
+            self.__is_first_line = True
+            self.__deferred_blank_lines = []
+
+        @abstractmethod
+        def consume_line(self, line):
+            pass
+
+        @abstractmethod
+        def complete(self):
+            """ Returns the result, once all output has been seen """
+            pass
+
     def get_available_updates(self, package_filter):
         """Returns List of all installed packages with available updates."""
         class_packages, class_versions = self.get_updates_for_classification(package_filter)
@@ -111,6 +325,10 @@ class PackageManager(object):
         else:
             return [], []  # happens when nothing was selected, and inclusions are present
 
+    def get_all_and_security_updates(self):
+        """ Returns all missing updates and missing security updates. Package managers where the two queries are independent may run them concurrently. """
+        return self.get_all_updates(), self.get_security_updates()
+
     @abstractmethod
     def get_all_updates(self, cached=False):
         """Same behavior as get_available_updates, but higher performance with no filters"""
@@ -149,6 +367,10 @@ class PackageManager(object):
         included_package_versions = []
         not_included_packages = []
 
+        # Available versions are looked up concurrently for packages included by name only, ahead of checking them below
+        packages_included_by_name = [package for index, package in enumerate(packages) if not package_filter.check_for_inclusion(package, package_versions[index]) and package_filter.check_for_inclusion(package)]
+        available_versions_of_packages = dict(zip(packages_included_by_name, self.query_executor.run([functools.partial(self.get_all_available_versions_of_package, package) for package in packages_included_by_name])))
+
         # Check for inclusions
         for index, package in enumerate(packages):
             if package_filter.check_for_inclusion(package, package_versions[index]):    # check for the latest version
@@ -157,7 +379,7 @@ class PackageManager(object):
                 included_package_versions.append(package_versions[index])
 
             elif package_filter.check_for_inclusion(package):                           # check for all available versions
-                available_versions = self.get_all_available_versions_of_package(package)
+                available_versions = available_versions_of_packages[package]
                 matched = False
                 for available_version in available_versions:
                     if not package_filter.check_for_inclusion(package, available_version):
@@ -241,12 +463,53 @@ class PackageManager(object):
             cmd = self.single_package_upgrade_simulation_cmd
         exec_cmd = str(self.get_install_command(cmd, package_and_dependencies, package_and_dependency_versions))
 
+        if simulate is False:
+            self.invalidate_installed_packages_snapshot()   # installed state is about to change
+
         self.composite_logger.log_debug("UPDATING PACKAGE (WITH DEPENDENCIES) USING COMMAND: " + exec_cmd)
-        out, code = self.invoke_package_manager_advanced(exec_cmd, raise_on_exception=False)
+        if simulate is False:
+            out, code = self.invoke_package_manager_transaction(exec_cmd)
+        else:
+            out, code = self.invoke_package_manager_advanced(exec_cmd, raise_on_exception=False)
         self.composite_logger.log_debug("\n<PackageInstallOutput>\n" + out + "\n</PackageInstallOutput>")  # wrapping multi-line for readability
 
         return code, out, exec_cmd
 
+    def download_updates(self, packages, package_versions):
+        # type: (list, list) -> (int, str)
+        """ Downloads the packages (with their dependencies) into the package manager's cache, without installing them. Returns the exit code and output.
+            Errors are not added to the status - downloads ahead of installation are only an optimization. """
+        cmd = self.get_install_command(self.download_only_cmd.replace('<MAX-KBPS>', str(Constants.PackagePrefetchConfig.MAX_BANDWIDTH_IN_KBPS)), packages, package_versions)
+        self.composite_logger.log_debug("[PM] Downloading packages. [Command={0}]".format(cmd))
+        code, out = self.run_package_manager_command(cmd)
+        self.composite_logger.log_debug("[PM] Downloaded packages. [Code={0}][Output={1}]".format(str(code), self.env_layer.get_output_excerpt(str(out))))
+        return code, out
+
+    def download_updates_concurrently(self, packages, package_versions, download_dir, cancellation_event):
+        # type: (list, list, str, threading.Event) -> (int, str)
+        """ Downloads the packages (with their dependencies) into download_dir, alongside an installation in progress - so this doesn't take the package manager
+            lock, and doesn't invalidate cached results. Ended if cancellation_event is set. Returns the exit code and output. Errors are not added to the status. """
+        cmd = self.get_install_command(self.concurrent_download_only_cmd.replace('<DOWNLOAD-DIR>', download_dir), packages, package_versions)
+        self.composite_logger.log_debug("[PM] Downloading packages alongside installation. [Command={0}]".format(cmd))
+        code, out = self.env_layer.run_command_output_cancellable(cmd, cancellation_event, False)
+        self.composite_logger.log_debug("[PM] Downloaded packages alongside installation. [Code={0}][Output={1}]".format(str(code), self.env_layer.get_output_excerpt(str(out))))
+        return code, out
+
+    def stage_downloaded_packages(self, download_dir):
+        # type: (str) -> int
+        """ Moves packages downloaded into download_dir (see download_updates_concurrently) into the package manager's cache. Returns the number of packages moved. """
+        staged_count = 0
+        for file_name in os.listdir(download_dir):
+            file_path = os.path.join(download_dir, file_name)
+            if os.path.isfile(file_path):
+                shutil.move(file_path, os.path.join(self.package_cache_path, file_name))
+                staged_count += 1
+        return staged_count
+
+    def is_download_successful(self, code, out):
+        # type: (int, str) -> bool
+        return code == 0
+
     def get_installation_status(self, code, out, exec_cmd, package, version, simulate=False):
         """
         Returns result of the package installation
@@ -280,7 +543,7 @@ class PackageManager(object):
                 self.composite_logger.log_debug("[PM]    > Evidence of package no longer required NOT detected.")
 
         if not package_no_longer_required:
-            if not self.is_package_version_installed(package, version):
+            if not self.is_package_version_installed_per_snapshot(package, version):
                 if code == 0 and self.STR_ONLY_UPGRADES.replace('<PACKAGE>', package) in out:
                     # It is premature to fail this package. In the *unlikely* case it never gets picked up, it'll remain NotStarted.
                     # The NotStarted status must not be written again in the calling function (it's not at the time of this writing).
@@ -371,6 +634,58 @@ class PackageManager(object):
         """ Returns true if the specific package version is installed """
         pass
 
+    def get_installed_packages_snapshot(self):
+        # type: () -> dict
+        """ Returns a map of installed package name to installed versions, built from one bulk query and reused until the next install command """
+        if self.installed_packages_snapshot is not None:
+            return self.installed_packages_snapshot
+
+        self.installed_packages_snapshot = {}
+        if self.cmd_get_installed_packages_snapshot == '':
+            return self.installed_packages_snapshot
+
+        self.installed_packages_snapshot = self.query_in_process("InstalledPackages", self.get_installed_packages_in_process_query(), self.__take_installed_packages_snapshot_with_command_line,
+                                                                 lambda snapshot: sorted((name, sorted(versions)) for name, versions in snapshot.items()))
+        self.composite_logger.log_verbose("[PM] Installed packages snapshot taken. [PackageCount={0}]".format(str(len(self.installed_packages_snapshot))))
+        return self.installed_packages_snapshot
+
+    def __take_installed_packages_snapshot_with_command_line(self):
+        code, output = self.env_layer.run_command_output_spilled(self.cmd_get_installed_packages_snapshot, self.execution_config.temp_folder, False)
+        with output:
+            if code != 0:
+                self.composite_logger.log_debug("[PM] Installed packages snapshot unavailable. Falling back to per-package checks. [Command={0}][Code={1}][Output={2}]".format(self.cmd_get_installed_packages_snapshot, str(code), output.get_excerpt()))
+                return {}
+            return self.extract_installed_packages_snapshot(output.iterate_lines())
+
+    def get_installed_packages_in_process_query(self):
+        # type: () -> callable
+        """ Returns an in-process equivalent of the installed packages snapshot query, if one is available (see query_in_process) """
+        return None
+
+    def extract_installed_packages_snapshot(self, output_lines):
+        # type: (iter) -> dict
+        """ Parses '<name> <version>' lines from the snapshot query output. Lines in any other shape are ignored. """
+        snapshot = {}
+        for line in output_lines:
+            package_details = line.split()
+            if len(package_details) != 2:
+                continue
+            snapshot.setdefault(package_details[0], []).append(package_details[1])
+        return snapshot
+
+    def invalidate_installed_packages_snapshot(self):
+        """ Drops the installed packages snapshot so the next installed check re-queries the package database """
+        self.installed_packages_snapshot = None
+
+    def is_package_version_installed_per_snapshot(self, package_name, package_version):
+        """ Returns true if the specific package version is installed, answering from the snapshot where it can.
+            Anything the snapshot cannot confirm is verified with the authoritative per-package check. """
+        if package_version in self.get_installed_packages_snapshot().get(package_name, []):
+            self.composite_logger.log_verbose("[PM] > Installed version match found in snapshot. [PackageName={0}][PackageVersion={1}]".format(str(package_name), str(package_version)))
+            return True
+
+        return self.is_package_version_installed(package_name, package_version)
+
     @abstractmethod
     def get_dependent_list(self, package_name):
         """Retrieve available updates. Expect an array being returned"""
@@ -497,6 +812,23 @@ class PackageManager(object):
         """Retrieves average time to install package in seconds."""
         pass
 
+    def get_package_install_time_estimates_in_seconds(self, packages=None):
+        # type: (list) -> tuple
+        """ Returns the expected (average, max) time to install a package, as learned on this machine. Defaults apply until there is enough install history. """
+        return self.install_duration_history.get_estimates_in_seconds(self.get_package_manager_setting(Constants.PKG_MGR_SETTING_IDENTITY), self.get_package_install_expected_avg_time_in_seconds(),
+                                                                      Constants.PACKAGE_INSTALL_EXPECTED_MAX_TIME_IN_MINUTES * 60, packages)
+
+    def get_package_install_cost_estimates_in_seconds(self, packages):
+        # type: (list) -> list
+        """ Returns the expected time to install each of the packages, as learned on this machine - the average install time for packages without history """
+        avg_time_in_secs = self.get_package_install_time_estimates_in_seconds()[0]
+        return [self.install_duration_history.get_package_estimate_in_seconds(package, avg_time_in_secs) for package in packages]
+
+    def record_package_install_duration(self, package_and_dependencies, duration_in_secs, package=None):
+        # type: (list, float, str) -> None
+        """ Adds a successful install to the install history. package is only expected if it was the only parent package in the install. """
+        self.install_duration_history.record(self.get_package_manager_setting(Constants.PKG_MGR_SETTING_IDENTITY), len(package_and_dependencies), duration_in_secs, package)
+
     # region Update certificates in factory defaults
     def ensure_mokutil_available_for_cert_checks(self):
         # type: () -> bool
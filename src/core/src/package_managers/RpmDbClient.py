@@ -0,0 +1,189 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+"""This is an in-process client for the rpm database and dnf/libdnf5 repository metadata (python bindings)"""
+import functools
+import threading
+
+from core.src.bootstrap.Constants import Constants
+
+
+class RpmDbClient(object):
+    """ Answers read-only rpm-family queries in-process with the rpm python bindings (installed set) and the dnf or libdnf5 python bindings (repository metadata),
+        instead of spawning rpm/yum/dnf5 and parsing their human-formatted output. Queries raise if the bindings are not available to this interpreter or
+        can't be set up - the caller falls back to the command line then. Versions are formatted as by the command line: [epoch:]version-release. """
+
+    DNF = "dnf"
+    LIBDNF5 = "libdnf5"
+
+    def __init__(self, composite_logger, fingerprint_provider, metadata_bindings=None):
+        # type: (object, callable, str) -> None
+        self.composite_logger = composite_logger
+        self.fingerprint_provider = fingerprint_provider      # identity of the package database and repository metadata state - metadata is reloaded when it changes
+        self.metadata_bindings = metadata_bindings            # DNF, LIBDNF5 or None (installed set only)
+        self.__modules = {}
+        self.__metadata_base = None
+        self.__metadata_base_identity = None
+        self.__lock = threading.Lock()      # the bindings' package sacks are not thread-safe
+        self.__import_lock = threading.Lock()
+
+    def is_rpm_available(self):
+        # type: () -> bool
+        return self.__is_module_available("rpm")
+
+    def is_metadata_available(self):
+        # type: () -> bool
+        return self.metadata_bindings is not None and self.__is_module_available(self.metadata_bindings)
+
+    def get_installed_packages(self, include_arch=True):
+        # type: (bool) -> dict
+        """ Equivalent of "rpm -qa --queryformat '%{NAME}.%{ARCH} %|EPOCH?{%{EPOCH}:}:{}|%{VERSION}-%{RELEASE}'". Returns a map of installed package name
+            (with arch, if include_arch) to installed versions, in the shape of the installed packages snapshot. """
+        rpm = self.__get_module("rpm")
+        installed_packages = {}
+        transaction_set = rpm.TransactionSet()
+        try:
+            for header in transaction_set.dbMatch():
+                name = self.__to_str(header[rpm.RPMTAG_NAME])
+                if include_arch:
+                    name += "." + self.__to_str(header[rpm.RPMTAG_ARCH])
+                epoch = header[rpm.RPMTAG_EPOCH]
+                version = ("" if epoch is None else str(epoch) + ":") + self.__to_str(header[rpm.RPMTAG_VERSION]) + "-" + self.__to_str(header[rpm.RPMTAG_RELEASE])
+                installed_packages.setdefault(name, []).append(version)
+        finally:
+            transaction_set.closeDB()
+        return installed_packages
+
+    def get_available_updates(self):
+        # type: () -> (list, list)
+        """ Equivalent of 'yum/dnf5 check-update' with duplicates removed. Returns the latest available upgrade of each installed package (name.arch) and its version. """
+        with self.__lock:
+            base = self.__get_metadata_base()
+            if self.metadata_bindings == self.DNF:
+                upgrades = [(package.name + "." + package.arch, package.evr) for package in base.sack.query().upgrades().latest()]
+            else:
+                query = self.__get_module(self.LIBDNF5).rpm.PackageQuery(base)
+                query.filter_upgrades()
+                query.filter_latest_evr()
+                upgrades = [(package.get_name() + "." + package.get_arch(), package.get_evr()) for package in query]
+
+        upgrades.sort()
+        return [upgrade[0] for upgrade in upgrades], [upgrade[1] for upgrade in upgrades]
+
+    def get_available_versions(self, package_name):
+        # type: (str) -> list
+        """ Equivalent of 'yum list available <package> --showduplicates' and 'dnf5 list --available <package>'. Returns the versions offered by the enabled
+            repositories that are not installed, oldest first. package_name may include the arch (name.arch). """
+        name, arch = package_name, None
+        for supported_arch in Constants.SUPPORTED_PACKAGE_ARCH:
+            if package_name.endswith(supported_arch):
+                name, arch = package_name[:-len(supported_arch)], supported_arch[1:]
+
+        with self.__lock:
+            base = self.__get_metadata_base()
+            if self.metadata_bindings == self.DNF:
+                query = base.sack.query().filter(name=name)
+                if arch is not None:
+                    query = query.filter(arch=arch)
+                installed = set((package.arch, package.evr) for package in query.installed())
+                return [package.evr for package in sorted(query.available()) if (package.arch, package.evr) not in installed]
+
+            libdnf5 = self.__get_module(self.LIBDNF5)
+            query = libdnf5.rpm.PackageQuery(base)
+            query.filter_name([name])
+            if arch is not None:
+                query.filter_arch([arch])
+            installed_query = libdnf5.rpm.PackageQuery(query)
+            installed_query.filter_installed()
+            installed = set((package.get_arch(), package.get_evr()) for package in installed_query)
+            query.filter_available()
+            versions = [(package.get_arch(), package.get_evr()) for package in query if (package.get_arch(), package.get_evr()) not in installed]
+            return sorted([version[1] for version in versions], key=functools.cmp_to_key(self.__compare_evr))
+
+    def __get_metadata_base(self):
+        """ Loads the system and repository metadata, or reuses what is already loaded if nothing changed since. Enabled repositories, excludes and
+            variables come from the system configuration, as for the command line. """
+        base_identity = self.fingerprint_provider()
+        if self.__metadata_base is not None and self.__metadata_base_identity == base_identity:
+            return self.__metadata_base
+
+        if self.__metadata_base is not None and self.metadata_bindings == self.DNF:
+            self.__metadata_base.close()
+        self.__metadata_base = self.__metadata_base_identity = None
+
+        if self.metadata_bindings == self.DNF:
+            dnf = self.__get_module(self.DNF)
+            base = dnf.Base()
+            base.conf.read()
+            base.conf.substitutions.update_from_etc(base.conf.installroot)
+            base.read_all_repos()
+            base.fill_sack(load_system_repo=True, load_available_repos=True)
+        else:
+            libdnf5 = self.__get_module(self.LIBDNF5)
+            base = libdnf5.base.Base()
+            if hasattr(base, "load_config"):
+                base.load_config()
+            else:   # libdnf5 < 5.2
+                base.load_config_from_file()
+            base.setup()
+            repo_sack = base.get_repo_sack()
+            repo_sack.create_repos_from_system_configuration()
+            if hasattr(repo_sack, "load_repos"):
+                repo_sack.load_repos()
+            else:   # libdnf5 < 5.2
+                repo_sack.update_and_load_enabled_repos(True)
+
+        self.__metadata_base, self.__metadata_base_identity = base, base_identity
+        self.composite_logger.log_verbose("[PM][Rpm] Loaded repository metadata in-process. [Bindings={0}]".format(self.metadata_bindings))
+        return base
+
+    def __is_module_available(self, module_name):
+        if not Constants.RpmBindingsSettings.FEATURE_ENABLED:
+            return False
+        try:
+            self.__get_module(module_name)
+            return True
+        except Exception:
+            return False
+
+    def __get_module(self, module_name):
+        """ Imports the bindings on first use. The outcome is remembered, so a missing module is only looked for once. """
+        with self.__import_lock:
+            if module_name not in self.__modules:
+                try:
+                    self.__modules[module_name] = __import__(module_name)
+                except Exception as error:
+                    self.__modules[module_name] = error
+                    self.composite_logger.log_debug("[PM][Rpm] Python bindings are not available. Using the command line. [Module={0}][Error={1}]".format(module_name, repr(error)))
+
+        module = self.__modules[module_name]
+        if isinstance(module, Exception):
+            raise module
+        return module
+
+    def __compare_evr(self, evr_a, evr_b):
+        """ rpm version comparison of two [epoch:]version-release strings """
+        return self.__get_module("rpm").labelCompare(self.__split_evr(evr_a), self.__split_evr(evr_b))
+
+    @staticmethod
+    def __split_evr(evr):
+        epoch, version_release = evr.split(":", 1) if ":" in evr else ("0", evr)
+        version, release = version_release.rsplit("-", 1) if "-" in version_release else (version_release, "")
+        return epoch, version, release
+
+    @staticmethod
+    def __to_str(value):
+        return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
@@ -23,6 +23,7 @@ from abc import ABCMeta, abstractmethod
 from core.src.core_logic.VersionComparator import VersionComparator
 from core.src.bootstrap.Constants import Constants
 from core.src.package_managers.PackageManager import PackageManager
+from core.src.package_managers.RpmDbClient import RpmDbClient
 
 
 class TdnfPackageManager(PackageManager):
@@ -38,15 +39,21 @@ class TdnfPackageManager(PackageManager):
         self.tdnf_check = 'sudo tdnf -q list updates'
         self.single_package_check_versions = 'sudo tdnf list available <PACKAGE-NAME> '
         self.single_package_check_installed = 'sudo tdnf list installed <PACKAGE-NAME> '
+        self.cmd_get_installed_packages_snapshot = "rpm -qa --queryformat '%{NAME}.%{ARCH} %|EPOCH?{%{EPOCH}:}:{}|%{VERSION}-%{RELEASE}\\n'"
+        self.rpm_db_client = RpmDbClient(composite_logger, self.command_result_cache.get_fingerprint)     # in-process alternative to read-only queries - tdnf has no python bindings
         self.single_package_upgrade_simulation_cmd = 'sudo tdnf install --assumeno --skip-broken '
+        self.lock_free_command_pattern = r'^(sudo )?rpm -q'
+        self.cacheable_command_pattern = r'\btdnf (-q )?list (updates|available |installed )|\btdnf install --assumeno '
 
         # Install update
         self.single_package_upgrade_cmd = 'sudo tdnf -y install --skip-broken '
+        self.download_only_cmd = 'sudo tdnf -y install --skip-broken --downloadonly '       # tdnf has no download rate limit
 
         # Package manager exit code(s)
         self.tdnf_exitcode_ok = 0
         self.tdnf_exitcode_on_no_action_for_install_update = 8
         self.commands_expecting_no_action_exitcode = [self.single_package_upgrade_simulation_cmd]
+        self.cacheable_command_exit_codes = [self.tdnf_exitcode_ok, self.tdnf_exitcode_on_no_action_for_install_update]
 
         # Support to check for processes requiring restart
         self.dnf_utils_prerequisite = 'sudo tdnf -y install dnf-utils'
@@ -85,18 +92,21 @@ class TdnfPackageManager(PackageManager):
         self.invoke_package_manager(self.cmd_clean_cache)
         self.invoke_package_manager(self.cmd_repo_refresh)
 
+    def get_package_database_fingerprint_paths(self):
+        return [Constants.SystemPaths.RPM_DB, Constants.SystemPaths.RPM_DB_SYSIMAGE, Constants.SystemPaths.YUM_REPOS_DIR]
+
     # region Get Available Updates
-    def invoke_package_manager_advanced(self, command, raise_on_exception=True):
+    def invoke_package_manager_advanced(self, command, raise_on_exception=True, line_parser=None):
         """Get missing updates using the command input"""
         self.composite_logger.log_verbose("[TDNF] Invoking package manager. [Command={0}]".format(str(command)))
-        code, out = self.env_layer.run_command_output(command, False, False)
+        code, out = self.run_package_manager_command(command, line_parser)
 
         if code is self.tdnf_exitcode_ok or \
                 (any(command_expecting_no_action_exitcode in command for command_expecting_no_action_exitcode in self.commands_expecting_no_action_exitcode) and
                  code is self.tdnf_exitcode_on_no_action_for_install_update):
-            self.composite_logger.log_debug('[TDNF] Invoked package manager. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), str(out)))
+            self.composite_logger.log_debug('[TDNF] Invoked package manager. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), self.env_layer.get_output_excerpt(str(out))))
         else:
-            self.composite_logger.log_warning('[ERROR] Customer environment error. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), str(out)))
+            self.composite_logger.log_warning('[ERROR] Customer environment error. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), self.env_layer.get_output_excerpt(str(out))))
             error_msg = "Customer environment error: Investigate and resolve unexpected return code ({0}) from package manager on command: {1}".format(str(code), command)
             self.status_handler.add_error_to_status(error_msg, Constants.PatchOperationErrorCodes.PACKAGE_MANAGER_FAILURE)
             if raise_on_exception:
@@ -112,8 +122,8 @@ class TdnfPackageManager(PackageManager):
             self.composite_logger.log_debug("[TDNF] Get all updates : [Cached={0}][PackagesCount={1}]]".format(str(cached), len(self.all_updates_cached)))
             return self.all_updates_cached, self.all_update_versions_cached  # allows for high performance reuse in areas of the code explicitly aware of the cache
 
-        out = self.invoke_package_manager(self.add_additional_parameters_as_required_to_cmd(self.tdnf_check))
-        self.all_updates_cached, self.all_update_versions_cached = self.extract_packages_and_versions(out)
+        packages, versions = self.invoke_package_manager_and_parse_output(self.add_additional_parameters_as_required_to_cmd(self.tdnf_check), self.CheckUpdateOutputParser(self))
+        self.all_updates_cached, self.all_update_versions_cached = self.dedupe_update_packages_to_get_latest_versions(packages, versions)
         self.composite_logger.log_debug("[TDNF] Get all updates : [Cached={0}][PackagesCount={1}]]".format(str(False), len(self.all_updates_cached)))
         return self.all_updates_cached, self.all_update_versions_cached
 
@@ -149,26 +159,46 @@ class TdnfPackageManager(PackageManager):
 
     def extract_packages_and_versions_including_duplicates(self, output):
         """Returns packages and versions from given output"""
-        self.composite_logger.log_verbose("[TDNF] Extracting package and version data...")
-        packages, versions = [], []
-
-        lines = output.strip().split('\n')
-
-        for line_index in range(0, len(lines)):
+        return self.parse_output(output, self.CheckUpdateOutputParser(self))
+
+    class CheckUpdateOutputParser(PackageManager.OutputLineParser):
+        """ Incremental parser of tdnf package listings (e.g. check-update) """
+        def __init__(self, package_manager):
+            self.package_manager = package_manager
+            self.composite_logger = package_manager.composite_logger
+            PackageManager.OutputLineParser.__init__(self)
+            self.composite_logger.log_verbose("[TDNF] Extracting package and version data...")
+
+        def reset(self):
+            PackageManager.OutputLineParser.reset(self)
+            self.packages, self.versions = [], []
+            self.__line_index = 0
+            self.__is_obsoleting_packages_reached = False
+
+        def consume_line(self, raw_line):
             # Do not install Obsoleting Packages. The obsoleting packages list comes towards end in the output.
-            if lines[line_index].strip().startswith("Obsoleting"):
-                break
+            if self.__is_obsoleting_packages_reached or raw_line.strip().startswith("Obsoleting"):
+                self.__is_obsoleting_packages_reached = True
+                return
 
-            line = re.split(r'\s+', lines[line_index].strip())
+            line = re.split(r'\s+', raw_line.strip())
 
             # If we run into a length of 3, we'll accept it and continue
             if len(line) == 3 and self.__is_package(line[0]):
-                packages.append(self.get_product_name(line[0]))
-                versions.append(line[1])
+                self.packages.append(self.package_manager.get_product_name(line[0]))
+                self.versions.append(line[1])
             else:
-                self.composite_logger.log_verbose("[TDNF] > Inapplicable line (" + str(line_index) + "): " + lines[line_index])
+                self.composite_logger.log_verbose("[TDNF] > Inapplicable line (" + str(self.__line_index) + "): " + raw_line)
+            self.__line_index += 1
 
-        return packages, versions
+        def complete(self):
+            return self.packages, self.versions
+
+        @staticmethod
+        def __is_package(chunk):
+            # Using a list comprehension to determine if chunk is a package
+            package_extensions = Constants.SUPPORTED_PACKAGE_ARCH
+            return len([p for p in package_extensions if p in chunk]) == 1
 
     def dedupe_update_packages_to_get_latest_versions(self, packages, package_versions):
         """Remove duplicate packages and returns the latest/highest version of each package """
@@ -189,12 +219,6 @@ class TdnfPackageManager(PackageManager):
             deduped_package_versions.append(package_versions[index])
 
         return deduped_packages, deduped_package_versions
-
-    @staticmethod
-    def __is_package(chunk):
-        # Using a list comprehension to determine if chunk is a package
-        package_extensions = Constants.SUPPORTED_PACKAGE_ARCH
-        return len([p for p in package_extensions if p in chunk]) == 1
     # endregion
     # endregion
 
@@ -232,6 +256,9 @@ class TdnfPackageManager(PackageManager):
         packages, package_versions = self.extract_packages_and_versions_including_duplicates(output)
         return package_versions
 
+    def get_installed_packages_in_process_query(self):
+        return self.rpm_db_client.get_installed_packages if self.rpm_db_client.is_rpm_available() else None
+
     def is_package_version_installed(self, package_name, package_version):
         """ Returns true if the specific package version is installed """
         # Sample output format
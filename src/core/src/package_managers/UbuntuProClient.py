@@ -22,9 +22,10 @@ from core.src.bootstrap.Constants import Constants
 
 
 class UbuntuProClient:
-    def __init__(self, env_layer, composite_logger):
+    def __init__(self, env_layer, composite_logger, spill_folder=None):
         self.env_layer = env_layer
         self.composite_logger = composite_logger
+        self.spill_folder = spill_folder    # for the security status, which lists every package with an update
         self.ubuntu_pro_client_install_cmd = 'sudo apt-get install ubuntu-advantage-tools -y'
         self.ubuntu_pro_client_security_status_cmd = 'pro security-status --format=json'
         self.security_esm_criteria_strings = ["esm-infra", "esm-apps"]
@@ -77,14 +78,28 @@ class UbuntuProClient:
         """log the attachment status of the machine."""
         is_ubuntu_pro_client_attached = False
         try:
-            code, output = self.env_layer.run_command_output(self.ubuntu_pro_client_security_status_cmd, False, False)
-            if code == 0:
-                is_ubuntu_pro_client_attached = json.loads(output)['summary']['ua']['attached']
+            code, output = self.env_layer.run_command_output_spilled(self.ubuntu_pro_client_security_status_cmd, self.spill_folder, False)
+            with output:
+                if code == 0:
+                    is_ubuntu_pro_client_attached = self.__get_security_status_summary(output)['ua']['attached']
         except Exception as error:
             ubuntu_pro_client_exception = repr(error)
             self.composite_logger.log_debug("[APM][Pro] Ubuntu Pro Client Attached Exception: [Exception={0}]".format(ubuntu_pro_client_exception))
         return is_ubuntu_pro_client_attached
 
+    @staticmethod
+    def __get_security_status_summary(security_status_output):
+        """ Only the summary is decoded, not the package list ahead of it. The whole security status is decoded if the summary cannot be found on its own. """
+        summary_text = security_status_output.read_from_last_occurrence('"summary"')
+        if summary_text is not None and ':' in summary_text:
+            try:
+                summary, end_index = json.JSONDecoder().raw_decode(summary_text[summary_text.index(':') + 1:].lstrip())
+                if isinstance(summary, dict):
+                    return summary
+            except ValueError:
+                pass
+        return json.loads(security_status_output.read())['summary']
+
     def extract_packages_and_versions(self, updates):
         extracted_updates = []
         extracted_updates_versions = []
@@ -15,11 +15,13 @@
 # Requires Python 2.7+
 
 """YumPackageManager for Redhat and CentOS"""
+import functools
 import json
 import os
 import re
 
 from core.src.package_managers.PackageManager import PackageManager
+from core.src.package_managers.RpmDbClient import RpmDbClient
 from core.src.bootstrap.Constants import Constants
 
 
@@ -34,19 +36,27 @@ class YumPackageManager(PackageManager):
         # Support to get updates and their dependencies
         self.yum_check = 'sudo yum -q check-update'
         self.yum_check_security_prerequisite = 'sudo yum -y install yum-plugin-security'
+        self.is_yum_security_prerequisite_ensured = False
         self.yum_check_security = 'sudo yum -q --security check-update'
         self.single_package_check_versions = 'sudo yum list available <PACKAGE-NAME> --showduplicates'
         self.single_package_check_installed = 'sudo yum list installed <PACKAGE-NAME>'
+        self.cmd_get_installed_packages_snapshot = "rpm -qa --queryformat '%{NAME}.%{ARCH} %|EPOCH?{%{EPOCH}:}:{}|%{VERSION}-%{RELEASE}\\n'"
+        self.rpm_db_client = RpmDbClient(composite_logger, self.command_result_cache.get_fingerprint, RpmDbClient.DNF)     # in-process alternative to read-only queries - yum is dnf from RHEL 8
         self.single_package_upgrade_simulation_cmd = 'LANG=en_US.UTF8 sudo yum install --assumeno --skip-broken '
+        self.lock_free_command_pattern = r'\byum -q (--security )?check-update$|\byum list (available|installed) |^(sudo )?rpm -q'     # yum waits for its own lock, so concurrent queries are safe
+        self.cacheable_command_pattern = r'\byum -q (--security )?check-update$|\byum list (available|installed) |\byum install --assumeno '
+        self.cacheable_command_exit_codes = [0, 100]
 
         # Install update
         self.single_package_upgrade_cmd = 'sudo yum -y install --skip-broken '
+        self.download_only_cmd = 'sudo yum -y install --skip-broken --downloadonly --setopt=throttle=<MAX-KBPS>k '
         self.all_but_excluded_upgrade_cmd = 'sudo yum -y update --exclude='
 
         # Package manager exit code(s)
         self.yum_exitcode_no_applicable_packages = 0
         self.yum_exitcode_ok = 1
         self.yum_exitcode_updates_available = 100
+        self.cacheable_command_exit_codes_by_pattern = [(r'\byum install --assumeno ', [self.yum_exitcode_no_applicable_packages, self.yum_exitcode_ok])]     # simulations exit 1 if there is anything to install
 
         # Support to check for processes requiring restart
         self.yum_utils_prerequisite = 'sudo yum -y install yum-utils'
@@ -104,23 +114,26 @@ class YumPackageManager(PackageManager):
     def refresh_repo(self):
         pass  # Refresh the repo is no ops in YUM
 
+    def get_package_database_fingerprint_paths(self):
+        return [Constants.SystemPaths.RPM_DB, Constants.SystemPaths.YUM_REPOS_DIR]
+
     # region Get Available Updates
-    def invoke_package_manager_advanced(self, command, raise_on_exception=True):
+    def invoke_package_manager_advanced(self, command, raise_on_exception=True, line_parser=None):
         """Get missing updates using the command input"""
         self.composite_logger.log_verbose("[YPM] Invoking package manager. [Command={0}]".format(str(command)))
-        code, out = self.env_layer.run_command_output(command, False, False)
+        code, out = self.run_package_manager_command(command, line_parser)
 
         code, out = self.try_mitigate_issues_if_any(command, code, out, raise_on_exception)
 
         if code not in [self.yum_exitcode_ok, self.yum_exitcode_no_applicable_packages, self.yum_exitcode_updates_available]:
-            self.composite_logger.log_warning('[ERROR] Customer environment error. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), str(out)))
+            self.composite_logger.log_warning('[ERROR] Customer environment error. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), self.env_layer.get_output_excerpt(str(out))))
             error_msg = "Customer environment error: Investigate and resolve unexpected return code ({0}) from package manager on command: {1}".format(str(code), command)
             self.status_handler.add_error_to_status(error_msg, Constants.PatchOperationErrorCodes.PACKAGE_MANAGER_FAILURE)
             if raise_on_exception:
                 raise Exception(error_msg, "[{0}]".format(Constants.ERROR_ADDED_TO_STATUS))
             # more return codes should be added as appropriate
         else:  # verbose diagnostic log
-            self.composite_logger.log_debug('[YPM] Invoked package manager. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), str(out)))
+            self.composite_logger.log_debug('[YPM] Invoked package manager. [Command={0}][Code={1}][Output={2}]'.format(command, str(code), self.env_layer.get_output_excerpt(str(out))))
         return out, code
 
     # region Classification-based (incl. All) update check
@@ -131,12 +144,25 @@ class YumPackageManager(PackageManager):
             self.composite_logger.log_debug("[YPM] Get all updates : [Cached={0}][PackagesCount={1}]]".format(str(cached), len(self.all_updates_cached)))
             return self.all_updates_cached, self.all_update_versions_cached  # allows for high performance reuse in areas of the code explicitly aware of the cache
 
-        out = self.invoke_package_manager(self.yum_check)
-        self.all_updates_cached, self.all_update_versions_cached = self.extract_packages_and_versions(out)
-
+        self.all_updates_cached, self.all_update_versions_cached = self.query_in_process("Rpm.AvailableUpdates", self.__get_rpm_metadata_query(self.rpm_db_client.get_available_updates),
+                                                                                         self.__get_all_updates_with_command_line, lambda result: sorted(zip(result[0], result[1])))
         self.composite_logger.log_debug("[YPM] Get all updates : [Cached={0}][PackagesCount={1}]]".format(str(False), len(self.all_updates_cached)))
         return self.all_updates_cached, self.all_update_versions_cached
 
+    def __get_all_updates_with_command_line(self):
+        packages, versions = self.invoke_package_manager_and_parse_output(self.yum_check, self.CheckUpdateOutputParser(self))
+        return self.dedupe_update_packages(packages, versions)
+
+    def get_all_and_security_updates(self):
+        """ Returns all missing updates and missing security updates. The two check-update queries run concurrently on dnf-based yum (RHEL 8+) only -
+            yum 3 serializes them on its own lock anyway, and needs the security plugin installed first (see install_yum_security_prerequisite). """
+        if not self.__is_image_rhel8_or_higher():
+            self.install_yum_security_prerequisite()
+            return self.get_all_updates(), self.get_security_updates()
+
+        all_updates, security_updates = self.query_executor.run([self.get_all_updates, self.get_security_updates])
+        return all_updates, security_updates
+
     def get_security_updates(self):
         """Get missing security updates"""
         self.composite_logger.log_verbose("[YPM] Discovering 'security' packages...")
@@ -144,8 +170,8 @@ class YumPackageManager(PackageManager):
         if not self.__is_image_rhel8_or_higher():
             self.install_yum_security_prerequisite()
 
-        out = self.invoke_package_manager(self.yum_check_security)
-        security_packages, security_package_versions = self.extract_packages_and_versions(out)
+        packages, versions = self.invoke_package_manager_and_parse_output(self.yum_check_security, self.CheckUpdateOutputParser(self))
+        security_packages, security_package_versions = self.dedupe_update_packages(packages, versions)
 
         if len(security_packages) == 0 and 'CentOS' in str(self.env_layer.platform.linux_distribution()):   # deliberately non-terminal
             self.composite_logger.log_warning("Classification-based patching is only supported on YUM if the machine is independently configured to receive classification information.")
@@ -191,8 +217,13 @@ class YumPackageManager(PackageManager):
         pass
 
     def install_yum_security_prerequisite(self):
-        """Not installed by default in versions prior to RHEL 7. This step is idempotent and fast, so we're not writing more complex code."""
-        code, out = self.env_layer.run_command_output(self.yum_check_security_prerequisite, False, False)
+        """Not installed by default in versions prior to RHEL 7. This step is idempotent and fast, so we're not writing more complex code.
+           It's an install, so it runs under the package manager lock and invalidates cached command results, and only once per run."""
+        if self.is_yum_security_prerequisite_ensured:
+            return
+
+        code, out = self.run_package_manager_command(self.yum_check_security_prerequisite)
+        self.is_yum_security_prerequisite_ensured = True
         self.composite_logger.log_verbose("[YPM] Ensuring RHEL yum-plugin-security is present. [Code={0}][Out={1}]".format(str(code), out))
     # endregion
 
@@ -205,50 +236,71 @@ class YumPackageManager(PackageManager):
 
     def extract_packages_and_versions_including_duplicates(self, output):
         """Returns packages and versions from given output"""
-        self.composite_logger.log_verbose("[YPM] Extracting package and version data...")
-        packages = []
-        versions = []
-        package_extensions = Constants.SUPPORTED_PACKAGE_ARCH
-
-        def is_package(chunk):
-            # Using a list comprehension to determine if chunk is a package
-            return len([p for p in package_extensions if p in chunk]) == 1
-
-        lines = output.strip().split('\n')
-
-        for line_index in range(0, len(lines)):
+        return self.parse_output(output, self.CheckUpdateOutputParser(self))
+
+    class CheckUpdateOutputParser(PackageManager.OutputLineParser):
+        """ Incremental parser of yum package listings (e.g. check-update). Long entries are wrapped over two lines, so each line is parsed once the next one is seen. """
+        def __init__(self, package_manager):
+            self.package_manager = package_manager
+            self.composite_logger = package_manager.composite_logger
+            PackageManager.OutputLineParser.__init__(self)
+            self.composite_logger.log_verbose("[YPM] Extracting package and version data...")
+
+        def reset(self):
+            PackageManager.OutputLineParser.reset(self)
+            self.packages, self.versions = [], []
+            self.__line = None
+            self.__line_index = 0
+            self.__is_obsoleting_packages_reached = False
+
+        def consume_line(self, line):
+            if self.__line is not None:
+                self.__parse_line(self.__line, line)
+            self.__line = line
+
+        def complete(self):
+            if self.__line is not None:
+                self.__parse_line(self.__line, None)
+                self.__line = None
+            return self.packages, self.versions
+
+        def __parse_line(self, raw_line, raw_next_line):
             # Do not install Obsoleting Packages. The obsoleting packages list comes towards end in the output.
-            if lines[line_index].strip().startswith("Obsoleting Packages"):
-                break
-
-            line = re.split(r'\s+', lines[line_index].strip())
-            next_line = []
+            if self.__is_obsoleting_packages_reached or raw_line.strip().startswith("Obsoleting Packages"):
+                self.__is_obsoleting_packages_reached = True
+                return
 
-            if line_index < len(lines) - 1:
-                next_line = re.split(r'\s+', lines[line_index + 1].strip())
+            line = re.split(r'\s+', raw_line.strip())
+            next_line = re.split(r'\s+', raw_next_line.strip()) if raw_next_line is not None else []
 
             # If we run into a length of 3, we'll accept it and continue
-            if len(line) == 3 and is_package(line[0]):
-                packages.append(self.get_product_name(line[0]))
-                versions.append(line[1])
+            if len(line) == 3 and self.__is_package(line[0]):
+                self.packages.append(self.package_manager.get_product_name(line[0]))
+                self.versions.append(line[1])
             # We will handle these two edge cases where the output is on
             # two different lines and treat them as one line
-            elif len(line) == 1 and len(next_line) == 2 and is_package(line[0]):
-                packages.append(self.get_product_name(line[0]))
-                versions.append(next_line[0])
-                line_index += 1
-            elif len(line) == 2 and len(next_line) == 1 and is_package(line[0]):
-                packages.append(self.get_product_name(line[0]))
-                versions.append(line[1])
-                line_index += 1
+            elif len(line) == 1 and len(next_line) == 2 and self.__is_package(line[0]):
+                self.packages.append(self.package_manager.get_product_name(line[0]))
+                self.versions.append(next_line[0])
+            elif len(line) == 2 and len(next_line) == 1 and self.__is_package(line[0]):
+                self.packages.append(self.package_manager.get_product_name(line[0]))
+                self.versions.append(line[1])
             else:
-                self.composite_logger.log_verbose("[YPM] > Inapplicable line (" + str(line_index) + "): " + lines[line_index])
+                self.composite_logger.log_verbose("[YPM] > Inapplicable line (" + str(self.__line_index) + "): " + raw_line)
+            self.__line_index += 1
 
-        return packages, versions
+        @staticmethod
+        def __is_package(chunk):
+            # Using a list comprehension to determine if chunk is a package
+            return len([p for p in Constants.SUPPORTED_PACKAGE_ARCH if p in chunk]) == 1
     # endregion
     # endregion
 
     # region Install Update
+    def is_download_successful(self, code, out):
+        """ Yum 3 exits with 1 after a successful download-only install, i.e. 'exiting because "--downloadonly" specified' """
+        return code == 0 or (code == 1 and 'exiting because "--downloadonly" specified' in str(out))
+
     def get_composite_package_identifier(self, package, package_version):
         package_without_arch, arch = self.get_product_name_and_arch(package)
         package_identifier = package_without_arch + '-' + self.get_package_version_without_epoch(package_version)
@@ -263,7 +315,7 @@ class YumPackageManager(PackageManager):
         cmd = self.all_but_excluded_upgrade_cmd + excluded_string
 
         self.composite_logger.log_debug("[YPM][FAIL SAFE MODE] UPDATING PACKAGES USING COMMAND: " + cmd)
-        self.invoke_package_manager(cmd)
+        self.invoke_package_manager_transaction(cmd, raise_on_exception=True)
 
     def install_security_updates_azgps_coordinated(self):
         pass
@@ -281,11 +333,22 @@ class YumPackageManager(PackageManager):
         # kernel.x86_64                                                                                    3.10.0-862.el7                                                                                         base
         # kernel.x86_64                                                                                    3.10.0-862.2.3.el7                                                                                     updates
         # kernel.x86_64                                                                                    3.10.0-862.3.2.el7                                                                                     updates
+        return self.query_in_process("Rpm.AvailableVersions", self.__get_rpm_metadata_query(functools.partial(self.rpm_db_client.get_available_versions, package_name)),
+                                     functools.partial(self.__get_all_available_versions_of_package_with_command_line, package_name))
+
+    def __get_all_available_versions_of_package_with_command_line(self, package_name):
         cmd = self.single_package_check_versions.replace('<PACKAGE-NAME>', package_name)
         output = self.invoke_package_manager(cmd)
         packages, package_versions = self.extract_packages_and_versions_including_duplicates(output)
         return package_versions
 
+    def get_installed_packages_in_process_query(self):
+        return self.rpm_db_client.get_installed_packages if self.rpm_db_client.is_rpm_available() else None
+
+    def __get_rpm_metadata_query(self, query):
+        """ The in-process query, if the dnf bindings are available (see query_in_process) """
+        return query if self.rpm_db_client.is_metadata_available() else None
+
     def is_package_version_installed(self, package_name, package_version):
         """ Returns true if the specific package version is installed """
         # Loaded plugins: product-id, search-disabled-repos, subscription-manager
@@ -38,6 +38,8 @@ class ZypperPackageManager(PackageManager):
 
     def __init__(self, env_layer, execution_config, composite_logger, telemetry_writer, status_handler):
         super(ZypperPackageManager, self).__init__(env_layer, execution_config, composite_logger, telemetry_writer, status_handler)
+        self.lock_free_command_pattern = r'^(sudo )?rpm -q'     # any zypper command takes the zypp lock, and fails fast if it's held
+        self.cacheable_command_pattern = r'\bzypper (list-updates|list-patches |search )|\bzypper --non-interactive (update|patch) .*--dry-run'
         # Repo refresh
         self.repo_clean = 'sudo zypper clean -a'
         self.repo_refresh = 'sudo zypper refresh'
@@ -47,11 +49,13 @@ class ZypperPackageManager(PackageManager):
         self.zypper_check = 'sudo LANG=en_US.UTF8 zypper list-updates'
         self.zypper_check_security = 'sudo LANG=en_US.UTF8 zypper list-patches --category security'
         self.single_package_check_versions = 'LANG=en_US.UTF8 zypper search -s <PACKAGE-NAME>'
+        self.cmd_get_installed_packages_snapshot = "rpm -qa --queryformat '%{NAME} %|EPOCH?{%{EPOCH}:}:{}|%{VERSION}-%{RELEASE}\\n'"
         self.single_package_upgrade_simulation_cmd = 'sudo LANG=en_US.UTF8 zypper --non-interactive update --dry-run '
         self.zypper_install_security_patches_simulate = 'sudo LANG=en_US.UTF8 zypper --non-interactive patch --category security --dry-run'
 
         # Install update
         self.single_package_upgrade_cmd = 'sudo zypper --non-interactive update '
+        self.download_only_cmd = 'sudo zypper --non-interactive update --download-only '     # zypper has no download rate limit
         self.zypper_install_security_patches = 'sudo zypper --non-interactive patch --category security'
 
         # Package manager exit code(s)
@@ -65,6 +69,7 @@ class ZypperPackageManager(PackageManager):
         self.zypper_exitcode_repos_skipped = 106
         self.zypper_success_exit_codes = [self.zypper_exitcode_ok, self.zypper_exitcode_zypper_updated, self.zypper_exitcode_reboot_required]
         self.zypper_retriable_exit_codes = [self.zypper_exitcode_zypp_locked, self.zypper_exitcode_zypp_lib_exit_err, self.zypper_exitcode_repos_skipped]
+        self.cacheable_command_exit_codes = [self.zypper_exitcode_ok, self.zypper_exitcode_reboot_required]
 
         # Additional output messages that corresponds with exit code 103
         self.zypper_out_zypper_updated_msg = 'Warning: One of the installed patches affects the package manager itself. Run this command once more to install any other needed patches.'
@@ -118,15 +123,20 @@ class ZypperPackageManager(PackageManager):
                 self.composite_logger.log_warning("[ZPM] Setting force_reboot flag to True after refreshing repo services. [Error={0}]".format(str(error)))
                 self.force_reboot = True
 
+    def get_package_database_fingerprint_paths(self):
+        return [Constants.SystemPaths.RPM_DB, Constants.SystemPaths.RPM_DB_SYSIMAGE, Constants.SystemPaths.ZYPP_REPOS_DIR]
+
     # region Get Available Updates
-    def invoke_package_manager_advanced(self, command, raise_on_exception=True):
+    def invoke_package_manager_advanced(self, command, raise_on_exception=True, line_parser=None):
         """Get missing updates using the command input"""
         self.composite_logger.log_verbose("[ZPM] Invoking package manager. [Command={0}]".format(str(command)))
         repo_refresh_services_attempted = False
 
         for i in range(1, self.package_manager_max_retries + 1):
+            if line_parser is not None:
+                line_parser.reset()     # only the output of the last attempt counts
             self.set_lock_timeout_and_backup_original()
-            code, out = self.env_layer.run_command_output(command, False, False)
+            code, out = self.run_package_manager_command(command, line_parser)
             self.restore_original_lock_timeout()
 
             if code not in self.zypper_success_exit_codes:  # more known return codes should be added as appropriate
@@ -202,14 +212,14 @@ class ZypperPackageManager(PackageManager):
 
     def log_errors_on_invoke(self, command, out, code):
         """Logs verbose error messages if there is an error on invoke_package_manager"""
-        self.composite_logger.log_error("[ZPM] Invoked package manager. [Command={0}][Code={1}][Output={2}]".format(command, code, out))
+        self.composite_logger.log_error("[ZPM] Invoked package manager. [Command={0}][Code={1}][Output={2}]".format(command, code, self.env_layer.get_output_excerpt(out)))
         self.log_process_tree_if_exists(out)
         self.telemetry_writer.write_execution_error(command, code, out)
 
     def log_success_on_invoke(self, code, out):
         """Logs verbose success messages on invoke_package_manager"""
         self.composite_logger.log_verbose("\n\n==[SUCCESS]===============================================================")
-        self.composite_logger.log_debug("[ZPM] Invoked package manager. [Code={0}][Output={1}]".format(code, out))
+        self.composite_logger.log_debug("[ZPM] Invoked package manager. [Code={0}][Output={1}]".format(code, self.env_layer.get_output_excerpt(out)))
         self.composite_logger.log_verbose("==========================================================================\n\n")
 
     def log_process_tree_if_exists(self, out):
@@ -289,8 +299,7 @@ class ZypperPackageManager(PackageManager):
             self.composite_logger.log_debug("[ZPM] > Returning cached package data.")
             return self.all_updates_cached, self.all_update_versions_cached  # allows for high performance reuse in areas of the code explicitly aware of the cache
 
-        out = self.invoke_package_manager(self.zypper_check)
-        self.all_updates_cached, self.all_update_versions_cached = self.extract_packages_and_versions(out)
+        self.all_updates_cached, self.all_update_versions_cached = self.invoke_package_manager_and_parse_output(self.zypper_check, self.ListUpdatesOutputParser(self))
         self.composite_logger.log_debug("[ZPM] Discovered " + str(len(self.all_updates_cached)) + " package entries.")
         return self.all_updates_cached, self.all_update_versions_cached
 
@@ -301,8 +310,7 @@ class ZypperPackageManager(PackageManager):
         security_package_versions = []
 
         # Get all security packages
-        out = self.invoke_package_manager(self.zypper_install_security_patches_simulate)
-        packages_from_patch_data = self.extract_packages_from_patch_data(out)
+        packages_from_patch_data = self.invoke_package_manager_and_parse_output(self.zypper_install_security_patches_simulate, self.PatchDataOutputParser(self))
 
         # Correlate and enrich with versions from all package data
         all_packages, all_package_versions = self.get_all_updates(True)
@@ -323,8 +331,7 @@ class ZypperPackageManager(PackageManager):
         other_package_versions = []
 
         # Get all security packages
-        out = self.invoke_package_manager(self.zypper_install_security_patches_simulate)
-        packages_from_patch_data = self.extract_packages_from_patch_data(out)
+        packages_from_patch_data = self.invoke_package_manager_and_parse_output(self.zypper_install_security_patches_simulate, self.PatchDataOutputParser(self))
 
         # SPECIAL CONDITION IF ZYPPER UPDATE IS DETECTED - UNAVOIDABLE SECURITY UPDATE(S) WILL BE INSTALLED AND THE RUN REPEATED FOR 'OTHER".
         if self.get_package_manager_setting(Constants.PACKAGE_MGR_SETTING_REPEAT_PATCH_OPERATION, True):
@@ -352,7 +359,14 @@ class ZypperPackageManager(PackageManager):
     # region Output Parser(s)
     def extract_packages_and_versions(self, output):
         """Returns packages and versions from given output"""
+        return self.parse_output(output, self.ListUpdatesOutputParser(self))
+
+    def extract_packages_from_patch_data(self, output):
+        """Returns packages (sometimes with version information embedded) from patch data"""
+        return self.parse_output(output, self.PatchDataOutputParser(self))
 
+    class ListUpdatesOutputParser(PackageManager.OutputLineParser):
+        """ Incremental parser of 'zypper list-updates' output """
         # Sample output for the cmd 'zypper list-updates' is :
         # Loading repository data...
         # Reading installed packages...
@@ -360,55 +374,65 @@ class ZypperPackageManager(PackageManager):
         # --+--------------------+--------------------+-----------------+-------------------+-------#
         # v | SLES12-SP2-Updates | kernel-default     | 4.4.38-93.1     | 4.4.49-92.11.1    | x86_64
         # v | SLES12-SP2-Updates | libgoa-1_0-0       | 3.20.4-7.2      | 3.20.5-9.6        | x86_64
+        def __init__(self, package_manager):
+            self.composite_logger = package_manager.composite_logger
+            PackageManager.OutputLineParser.__init__(self)
+            self.composite_logger.log_verbose("\nExtracting package and version data...")
 
-        self.composite_logger.log_verbose("\nExtracting package and version data...")
-        packages = []
-        versions = []
+        def reset(self):
+            PackageManager.OutputLineParser.reset(self)
+            self.packages, self.versions = [], []
 
-        lines = output.strip().split('\n')
-        for line in lines:
+        def consume_line(self, line):
             line_split = line.split(' | ')
             if len(line_split) == 6 and line_split[1].strip() != 'Repository':
                 package = line_split[2].strip()
-                packages.append(package)
+                self.packages.append(package)
                 version = line_split[4].strip()
-                versions.append(version)
+                self.versions.append(version)
                 self.composite_logger.log_verbose("[ZPM] > Applicable line: " + line + ". Package: " + package + ". Version: " + version + ".")
             else:
                 self.composite_logger.log_verbose("[ZPM] > Inapplicable line: " + line)
 
-        return packages, versions
+        def complete(self):
+            return self.packages, self.versions
 
-    def extract_packages_from_patch_data(self, output):
-        """Returns packages (sometimes with version information embedded) from patch data"""
-        self.composite_logger.log_debug("[ZPM] Extracting package entries from security patch data...")
-        packages = []
-        parser_seeing_packages_flag = False
+    class PatchDataOutputParser(PackageManager.OutputLineParser):
+        """ Incremental parser of the packages listed in patch installation (simulation) output """
+        def __init__(self, package_manager):
+            self.composite_logger = package_manager.composite_logger
+            PackageManager.OutputLineParser.__init__(self)
+            self.composite_logger.log_debug("[ZPM] Extracting package entries from security patch data...")
 
-        lines = output.strip().split('\n')
-        for line in lines:
-            if not parser_seeing_packages_flag:
+        def reset(self):
+            PackageManager.OutputLineParser.reset(self)
+            self.packages = []
+            self.__parser_seeing_packages_flag = False
+
+        def consume_line(self, line):
+            if not self.__parser_seeing_packages_flag:
                 if 'package is going to be installed' in line or 'package is going to be upgraded' in line or \
                         'packages are going to be installed:' in line or 'packages are going to be upgraded:' in line:
                     self.composite_logger.log_verbose("[ZPM] > Start marker line: " + line)
-                    parser_seeing_packages_flag = True  # Start -- Next line contains information we need
+                    self.__parser_seeing_packages_flag = True  # Start -- Next line contains information we need
                 else:
                     self.composite_logger.log_verbose("[ZPM] > Inapplicable line: " + line)
-                continue
+                return
 
             if not line or line.isspace():
                 self.composite_logger.log_verbose("[ZPM] > End marker line: " + line)
-                parser_seeing_packages_flag = False
-                continue  # End -- We're past a package information block
+                self.__parser_seeing_packages_flag = False
+                return  # End -- We're past a package information block
 
             line_parts = line.strip().split(' ')
             self.composite_logger.log_verbose("[ZPM] > Package list line: " + line)
             for line_part in line_parts:
-                packages.append(line_part)
+                self.packages.append(line_part)
                 self.composite_logger.log_verbose("    - Package: " + line_part)
 
-        self.composite_logger.log_verbose("[ZPM] Extracted " + str(len(packages)) + " prospective package entries from security patch data.\n")
-        return packages
+        def complete(self):
+            self.composite_logger.log_verbose("[ZPM] Extracted " + str(len(self.packages)) + " prospective package entries from security patch data.\n")
+            return self.packages
     # endregion
     # endregion
 
@@ -42,6 +42,10 @@ class StatusHandler(object):
         # Status components
         self.__high_level_status_message = ""
 
+        # Status file write coalescing - non-terminal updates are held in memory until the minimum write interval elapses or a flush is requested
+        self.__is_status_file_dirty = False
+        self.__last_status_file_write_time = None
+
         # Internal in-memory representation of Patch Installation data
         self.__installation_substatus_json = None
         self.__installation_summary_json = None
@@ -285,6 +289,7 @@ class StatusHandler(object):
         self.composite_logger.log_debug("Setting new installation reboot status. [NewRebootStatus={0}] [CurrentRebootStatus={1}]".format(str(new_reboot_status), self.__installation_reboot_status))
         self.__installation_reboot_status = new_reboot_status
         self.set_installation_substatus_json()
+        self.flush()    # reboot state transitions must be on disk before anything else happens to the machine
 
     def __refresh_installation_reboot_status(self):
         """ Discovers if the system needs a reboot. Never allows going back to NotNeeded (deliberate). ONLY called internally. """
@@ -325,6 +330,7 @@ class StatusHandler(object):
     def set_maintenance_window_exceeded(self, maintenance_windows_exceeded):
         self.__maintenance_window_exceeded = maintenance_windows_exceeded
         self.set_installation_substatus_json()
+        self.flush()
 
     def set_assessment_substatus_json(self, status=Constants.STATUS_TRANSITIONING, code=0):
         """ Prepare the assessment substatus json including the message containing assessment summary """
@@ -340,7 +346,7 @@ class StatusHandler(object):
         self.__set_force_truncation_on_terminal_status(substatus_status=status)
 
         # Update complete status on disk
-        self.__write_status_file()
+        self.__write_status_file(force=self.__is_terminal_status(status))
 
     def __new_assessment_summary_json(self, assessment_packages_json, status, code):
         """ Called by: set_assessment_substatus_json
@@ -392,7 +398,7 @@ class StatusHandler(object):
         self.__set_force_truncation_on_terminal_status(substatus_status=status)
 
         # Update complete status on disk
-        self.__write_status_file()
+        self.__write_status_file(force=self.__is_terminal_status(status))
 
     def __new_installation_summary_json(self, installation_packages_json):
         """ Called by: set_installation_substatus_json
@@ -456,8 +462,8 @@ class StatusHandler(object):
         # Set force truncation true when final status is success or error
         self.__set_force_truncation_on_terminal_status(substatus_status=status)
 
-        # Update complete status on disk
-        self.__write_status_file()
+        # Update complete status on disk - not coalesced, as healthstore picks this up from the status file
+        self.__write_status_file(force=True)
 
         # wait period required in cases where we need to ensure HealthStore reads the status from GA
         if wait_after_update:
@@ -493,7 +499,7 @@ class StatusHandler(object):
         self.__set_force_truncation_on_terminal_status(substatus_status=status)
 
         # Update complete status on disk
-        self.__write_status_file()
+        self.__write_status_file(force=self.__is_terminal_status(status))
 
     def __new_configure_patching_summary_json(self, automatic_os_patch_state, auto_assessment_state, status, code):
         """ Called by: set_configure_patching_substatus_json
@@ -539,6 +545,11 @@ class StatusHandler(object):
         # Create agent-facing status template
         self.env_layer.file_system.write_with_retry(self.status_file_path, '[{0}]'.format(status_file_reset_content), mode='w+')
 
+    @staticmethod
+    def __is_terminal_status(status):
+        """ Substatus status values are persisted in lower case, so both casings are accepted """
+        return str(status).lower() != Constants.STATUS_TRANSITIONING.lower()
+
     def __new_basic_status_json(self):
         return {
             "version": 1.0,
@@ -572,6 +583,9 @@ class StatusHandler(object):
         :return: None
         """
 
+        # Persist any coalesced updates before in-memory records are replaced
+        self.flush()
+
         # Initializing records safely
         self.__installation_substatus_json = None
         self.__installation_summary_json = None
@@ -681,7 +695,25 @@ class StatusHandler(object):
                     raise
         return complete_status_file_data
 
-    def __write_status_file(self):
+    def flush(self):
+        """ Externally available method to persist any status updates that are being held in memory. No-op if there are none. """
+        if self.__is_status_file_dirty:
+            self.__persist_status_file()
+
+    def __write_status_file(self, force=False):
+        """ Marks in-memory status data as pending persistence. It is written out right away only if forced (e.g. terminal states) or if
+            MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS has elapsed since the last write; otherwise it is coalesced into the next write or flush. """
+        self.__is_status_file_dirty = True
+        if force or self.__is_status_file_write_due():
+            self.__persist_status_file()
+
+    def __is_status_file_write_due(self):
+        if self.__last_status_file_write_time is None:
+            return True
+        elapsed_time_in_secs = time.time() - self.__last_status_file_write_time
+        return elapsed_time_in_secs < 0 or elapsed_time_in_secs >= Constants.MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS   # clock moving back should not stall writes
+
+    def __persist_status_file(self):
         """ Composes and writes the status file from **already up-to-date** in-memory data.
             This is usually the final call to compose and persist after an in-memory data update in a specialized method.
 
@@ -743,12 +775,17 @@ class StatusHandler(object):
 
         # Write status file <seq.no>.status
         self.env_layer.file_system.write_with_retry_using_temp_file(self.status_file_path, '[{0}]'.format(status_file_payload_json_dumps), mode='w+')
+
+        self.__is_status_file_dirty = False
+        self.__last_status_file_write_time = time.time()
     # endregion
 
     # region - Error objects
     def set_current_operation(self, operation):
         if self.execution_config.exec_auto_assess_only and operation != Constants.ASSESSMENT:
             raise Exception("Status reporting for a non-assessment operation was attempted when executing in auto-assessment mode. [Operation={0}]".format(str(operation)))
+        if operation != self.__current_operation:
+            self.flush()    # operation boundary
         self.__current_operation = operation
 
     def get_current_operation(self):
@@ -923,6 +960,10 @@ class StatusHandler(object):
             self.__installation_patches_copy = self.__installation_substatus_msg_copy['patches']
             low_pri_index = self.__get_installation_low_pri_index(self.__installation_patches_copy)
 
+        # Patches are serialized once here - every cut evaluated below is a lookup, however many passes it takes to fit
+        assessment_patches_size_prefix_sums = self.__calc_patches_payload_size_prefix_sums(self.__assessment_patches_copy)
+        installation_patches_size_prefix_sums = self.__calc_patches_payload_size_prefix_sums(self.__installation_patches_copy)
+
         status_file_without_patches_size_in_bytes = self.__size_of_constant_status_data(copy.deepcopy(truncated_status_file), assessment_substatus_index, installation_substatus_index)  # Deepcopy, fully copies the object to avoid reference modifications
 
         max_allowed_patches_size_in_bytes = Constants.StatusTruncationConfig.INTERNAL_FILE_SIZE_LIMIT_IN_BYTES - status_file_without_patches_size_in_bytes
@@ -931,7 +972,8 @@ class StatusHandler(object):
         while status_file_size_in_bytes > Constants.StatusTruncationConfig.INTERNAL_FILE_SIZE_LIMIT_IN_BYTES:
             # Start truncation process
             patches_retained_in_assessment, self.__assessment_patches_removed, patches_retained_in_installation, self.__installation_patches_removed = \
-                self.__start_truncation_process(self.__assessment_patches_copy, self.__installation_patches_copy, max_allowed_patches_size_in_bytes, low_pri_index)
+                self.__start_truncation_process(self.__assessment_patches_copy, self.__installation_patches_copy, max_allowed_patches_size_in_bytes, low_pri_index,
+                                                assessment_patches_size_prefix_sums, installation_patches_size_prefix_sums)
 
             if len(self.__assessment_patches_removed) > 0:
                 assessment_tombstone_list = self.__create_assessment_tombstones_by_classification(self.__assessment_patches_removed)
@@ -958,24 +1000,34 @@ class StatusHandler(object):
             if len(assessment_patches) > min_patches_count else (assessment_patches, [])
         return min_assessment_patches_to_retain, remaining_assessment_patches
 
-    def __start_truncation_process(self, assessment_patches, installation_patches, max_allowed_patches_size_in_bytes, low_pri_index=None):
+    def __start_truncation_process(self, assessment_patches, installation_patches, max_allowed_patches_size_in_bytes, low_pri_index=None, assessment_patches_size_prefix_sums=None, installation_patches_size_prefix_sums=None):
         """ Function truncates patches from assessment and installation substatus's while always retaining a required minimum count of assessment patches """
+        if assessment_patches_size_prefix_sums is None:
+            assessment_patches_size_prefix_sums = self.__calc_patches_payload_size_prefix_sums(assessment_patches)
+        if installation_patches_size_prefix_sums is None:
+            installation_patches_size_prefix_sums = self.__calc_patches_payload_size_prefix_sums(installation_patches)
+
         installation_low_pri = []
         installation_high_pri = installation_patches
+        installation_low_pri_size_prefix_sums = [0]
+        installation_high_pri_size_prefix_sums = installation_patches_size_prefix_sums
         # Cut assessment patches into [:5], [5:]
         min_assessment_patches_to_retain, remaining_assessment_patches = self.__split_assessment_patches(assessment_patches)
+        remaining_assessment_size_prefix_sums = self.__slice_patches_payload_size_prefix_sums(assessment_patches_size_prefix_sums, len(min_assessment_patches_to_retain), len(assessment_patches))
 
         if len(min_assessment_patches_to_retain) > 0:
-            max_allowed_patches_size_in_bytes = max_allowed_patches_size_in_bytes - self.__calc_patches_payload_size_on_disk(min_assessment_patches_to_retain)
+            max_allowed_patches_size_in_bytes = max_allowed_patches_size_in_bytes - self.__get_patches_payload_size_from_prefix_sums(assessment_patches_size_prefix_sums, len(min_assessment_patches_to_retain))
 
         # Split installation patches into high priority (Failed, Installed) and low priority (Pending, Excluded, Not_Selected)
         if low_pri_index is not None:
             installation_high_pri = installation_patches[:low_pri_index]
             installation_low_pri = installation_patches[low_pri_index:]
+            installation_high_pri_size_prefix_sums = self.__slice_patches_payload_size_prefix_sums(installation_patches_size_prefix_sums, 0, low_pri_index)
+            installation_low_pri_size_prefix_sums = self.__slice_patches_payload_size_prefix_sums(installation_patches_size_prefix_sums, low_pri_index, len(installation_patches))
 
-        patches_retained_in_install_high_pri, patches_removed_from_install_high_pri, remaining_patches_size_available_in_bytes = self.__truncate_patches(installation_high_pri, max_allowed_patches_size_in_bytes)
-        patches_retained_in_assessment, patches_removed_from_assessment, remaining_patches_size_available_in_bytes = self.__truncate_patches(remaining_assessment_patches, remaining_patches_size_available_in_bytes)
-        patches_retained_in_install_low_pri, patches_removed_from_install_low_pri, remaining_patches_size_available_in_bytes = self.__truncate_patches(installation_low_pri, remaining_patches_size_available_in_bytes)
+        patches_retained_in_install_high_pri, patches_removed_from_install_high_pri, remaining_patches_size_available_in_bytes = self.__truncate_patches(installation_high_pri, max_allowed_patches_size_in_bytes, installation_high_pri_size_prefix_sums)
+        patches_retained_in_assessment, patches_removed_from_assessment, remaining_patches_size_available_in_bytes = self.__truncate_patches(remaining_assessment_patches, remaining_patches_size_available_in_bytes, remaining_assessment_size_prefix_sums)
+        patches_retained_in_install_low_pri, patches_removed_from_install_low_pri, remaining_patches_size_available_in_bytes = self.__truncate_patches(installation_low_pri, remaining_patches_size_available_in_bytes, installation_low_pri_size_prefix_sums)
         self.composite_logger.log_verbose("Remaining patches size available in bytes after truncation: [RemainingPatchListSizeInBytes={0}]".format(remaining_patches_size_available_in_bytes))
 
         truncated_installation_patches = patches_retained_in_install_high_pri + patches_retained_in_install_low_pri
@@ -991,11 +1043,12 @@ class StatusHandler(object):
                 return low_pri_index
         return None
 
-    def __truncate_patches(self, patches, max_allowed_patches_size_in_bytes):
+    def __truncate_patches(self, patches, max_allowed_patches_size_in_bytes, patches_size_prefix_sums=None):
         """ Binary search
         Instead of checking patches[mid_index] >= target, check byte_size(patches[:mid_index]),
         as byte_size[patches[:i]] is monotonically increasing, i.e.
         byte_size[patches[:1]] < byte_size[patches[:2]] < byte_size[patches[:3]] ...
+        byte_size[patches[:i]] is looked up from prefix sums of per-patch sizes, so no patch is serialized more than once
         return truncated_patches, patches_removed_from_patches, and remaining max_patches_byte_size
         """
         left_index = 0
@@ -1004,23 +1057,28 @@ class StatusHandler(object):
         # no truncation on empty list, return [],[]
         if len(patches) == 0:
             return [], [], max_allowed_patches_size_in_bytes
+
+        if patches_size_prefix_sums is None:
+            patches_size_prefix_sums = self.__calc_patches_payload_size_prefix_sums(patches)
+
         # if patches byte size <= max list patches byte size, then returns it (no truncation needed)
-        if self.__calc_patches_payload_size_on_disk(patches) <= max_allowed_patches_size_in_bytes:
-            return patches, [], max_allowed_patches_size_in_bytes - self.__calc_patches_payload_size_on_disk(patches)
+        patches_size_in_bytes = self.__get_patches_payload_size_from_prefix_sums(patches_size_prefix_sums, len(patches))
+        if patches_size_in_bytes <= max_allowed_patches_size_in_bytes:
+            return patches, [], max_allowed_patches_size_in_bytes - patches_size_in_bytes
         # if first element byte size > max patches byte size, then add patches to patches_removed
-        if self.__calc_patches_payload_size_on_disk(patches[0]) > max_allowed_patches_size_in_bytes:
+        if patches_size_prefix_sums[1] > max_allowed_patches_size_in_bytes:   # size of patches[0] on its own (not as a list)
             return [], patches, max_allowed_patches_size_in_bytes
 
         while left_index < right_index:
             mid_index = left_index + int((right_index - left_index) / 2)
-            if self.__calc_patches_payload_size_on_disk(patches[:mid_index]) >= max_allowed_patches_size_in_bytes:
+            if self.__get_patches_payload_size_from_prefix_sums(patches_size_prefix_sums, mid_index) >= max_allowed_patches_size_in_bytes:
                 right_index = mid_index
             else:
                 left_index = mid_index + 1
 
         truncated_patches = patches[:left_index - 1]
         patches_removed = patches[left_index - 1:]
-        truncated_patches_size_in_bytes = self.__calc_patches_payload_size_on_disk(truncated_patches)
+        truncated_patches_size_in_bytes = self.__get_patches_payload_size_from_prefix_sums(patches_size_prefix_sums, len(truncated_patches))
         return truncated_patches, patches_removed, max_allowed_patches_size_in_bytes - truncated_patches_size_in_bytes
 
     def __removed_older_complete_status_files(self, status_folder):
@@ -1045,10 +1103,26 @@ class StatusHandler(object):
         """ Calculate status file size in bytes on disk """
         return len(status_file_dumps.encode("utf-8"))
 
-    def __calc_patches_payload_size_on_disk(self, patches):
-        """ Calculate patches size in bytes accounting for escape chars """
-        first_json_dump = json.dumps(patches)
-        return len(json.dumps(first_json_dump).encode("utf-8"))
+    @staticmethod
+    def __calc_patches_payload_size_prefix_sums(patches):
+        """ Calculate cumulative patch sizes in bytes, accounting for escape chars, such that [i] is the size of patches[:i] less the enclosing list.
+            json.dumps output is ascii with control chars already escaped, so the second json.dumps only adds a backslash per quote and backslash
+            and the size of a serialized list is additive over its patches (each patch also brings a ', ' separator). """
+        prefix_sums = [0]
+        for patch in patches:
+            patch_json_dumps = json.dumps(patch)
+            prefix_sums.append(prefix_sums[-1] + len(patch_json_dumps) + patch_json_dumps.count('"') + patch_json_dumps.count('\\') + 2)
+        return prefix_sums
+
+    @staticmethod
+    def __slice_patches_payload_size_prefix_sums(prefix_sums, start_index, end_index):
+        """ Prefix sums for patches[start_index:end_index], derived without re-serializing """
+        return [prefix_sum - prefix_sums[start_index] for prefix_sum in prefix_sums[start_index:end_index + 1]]
+
+    @staticmethod
+    def __get_patches_payload_size_from_prefix_sums(prefix_sums, patch_count):
+        """ Size in bytes of json.dumps(json.dumps(patches[:patch_count])) - the escaped list brackets and quotes add 4 bytes, less the one separator not needed """
+        return 4 if patch_count == 0 else prefix_sums[patch_count] + 2
 
     def __size_of_constant_status_data(self, status_payload_json, assessment_status_index, installation_status_index):
         """ Get the size in bytes of the status payload without patches data """
@@ -13,6 +13,7 @@
 # limitations under the License.
 #
 # Requires Python 2.7+
+import collections
 import datetime
 import errno
 import json
@@ -20,6 +21,7 @@ import os
 import re
 import shutil
 import tempfile
+import threading
 import time
 
 from core.src.bootstrap.Constants import Constants
@@ -42,10 +44,29 @@ class TelemetryWriter(object):
         self.start_time_for_event_count_throttle_check = datetime.datetime.utcnow()
         self.event_count = 1
 
+        # Events are spooled in memory, and written out to a new event file on size, time or an explicit flush (e.g. end of a phase)
+        self.__event_spool = []
+        self.__event_spool_size_in_chars = 2    # size of the spool serialized as a json list
+        self.__event_spool_last_flush_time = 0
+        self.__last_event_file_timestamp = 0
+        self.__events_dir_size = None   # measured once, then tracked incrementally
+
+        # Events are handed off to a bounded queue, which is drained into the spool by a background writer (or inline on the caller's thread, if that is not enabled)
+        self.__event_queue = collections.deque()
+        self.__event_queue_condition = threading.Condition()
+        self.__dropped_verbose_event_count = 0
+        self.__coalesced_verbose_event_count = 0
+        self.__is_flush_requested = False
+        self.__is_draining = False
+        self.__background_writer = None
+        self.__background_writer_error = None
+
         if self.__get_events_folder_path_exists(events_folder_path):
             self.events_folder_path = events_folder_path
 
         self.__is_telemetry_supported = telemetry_supported and self.events_folder_path is not None
+        if self.__is_telemetry_supported and Constants.TELEMETRY_ENABLED_AT_EXTENSION and Constants.TELEMETRY_BACKGROUND_WRITER_ENABLED:
+            self.__start_background_writer()
 
         self.write_event('Started Linux patch core operation.', Constants.TelemetryEventLevel.Informational)
         self.machine_info = None
@@ -127,7 +148,7 @@ class TelemetryWriter(object):
         """ Returns True if the events folder path passed in is not None and exists on disk """
         return events_folder_path is not None and os.path.exists(events_folder_path)
 
-    def __new_event_json(self, event_level, message, task_name):
+    def __new_event_json(self, event_level, message, task_name, timestamp):
         # Step 1: Sanitize credentials from URIs
         sanitized_message = self.credential_sanitizer.sanitize(message)
         # Step 2: Apply message restrictions (formatting, truncation)
@@ -135,7 +156,7 @@ class TelemetryWriter(object):
 
         return {
             "Version": Constants.EXT_VERSION,
-            "Timestamp": str(datetime.datetime.utcnow()),
+            "Timestamp": timestamp,
             "TaskName": task_name,
             "EventLevel": event_level,
             "Message": restricted_message,
@@ -195,57 +216,249 @@ class TelemetryWriter(object):
             self.telemetry_buffer_store = ""
 
     def write_event(self, message, event_level=Constants.TelemetryEventLevel.Informational, task_name=Constants.TelemetryTaskName.UNKNOWN, is_event_file_throttling_needed=True):
-        """ Creates and writes event to event file after validating none of the telemetry size restrictions are breached
+        """ Queues an event, to be written to an event file after validating none of the telemetry size restrictions are breached.
+        Throttling is applied as events are written out, i.e. on the background writer when enabled, so it does not hold up the caller.
         NOTE: is_event_file_throttling_needed is used to determine if event file throttling is required and as such should always be True.
         The only scenario where this is False is when throttling is taking place and we write to telemetry about it. i.e. only from within __throttle_telemetry_writes_if_required()"""
         try:
             if not self.is_telemetry_supported() or not Constants.TELEMETRY_ENABLED_AT_EXTENSION:
                 return
 
-            # ensure file throttle limit is reached
-            self.__throttle_telemetry_writes_if_required(is_event_file_throttling_needed)
-
-            self.__delete_older_events_if_dir_size_limit_not_met()
+            if self.__background_writer_error is not None:
+                raise self.__background_writer_error
 
             # use established task name if the input is defaulted
             if task_name == Constants.TelemetryTaskName.UNKNOWN:
                 task_name = self.__task_name
 
-            event = self.__new_event_json(event_level, message, task_name)
-            if len(json.dumps(event)) > Constants.TELEMETRY_EVENT_SIZE_LIMIT_IN_CHARS:
-                self.composite_logger.log_telemetry_module_error("Cannot send data to telemetry as it exceeded the acceptable data size. [Data not sent={0}]".format(json.dumps(message)))
-            else:
-                file_path, all_events = self.__get_file_and_content_to_write(self.events_folder_path, event)
-                self.__write_event_using_temp_file(file_path, all_events)
+            self.__enqueue_event(self.__new_queued_event(message, event_level, task_name, is_event_file_throttling_needed))
+            if self.__background_writer is None:
+                self.__write_queued_events()
 
         except Exception as e:
             self.composite_logger.log_telemetry_module_error("Error occurred while writing telemetry events. [Error={0}]".format(repr(e)))
             raise Exception("Internal reporting error. Execution could not complete.")
 
+    def flush(self):
+        """ Writes out any queued or spooled events that are not yet in an event file. Expected to be called at the end of each phase of the operation.
+        With the background writer, this only requests the write out and does not wait for it. """
+        try:
+            if not self.is_telemetry_supported() or not Constants.TELEMETRY_ENABLED_AT_EXTENSION:
+                return
+
+            if self.__background_writer is not None:
+                with self.__event_queue_condition:
+                    self.__is_flush_requested = True
+                    self.__event_queue_condition.notify_all()
+                return
+
+            self.__write_queued_events()
+            self.__flush_event_spool()
+        except Exception as e:
+            self.composite_logger.log_telemetry_module_error("Error occurred while flushing telemetry events. [Error={0}]".format(repr(e)))
+            raise Exception("Internal reporting error. Execution could not complete.")
+
+    def drain(self):
+        """ Writes out everything queued or spooled, and stops the background writer. Pending throttle waits are cut short to guarantee this completes.
+        Expected to be called once, at the very end of the operation. Any later events are written inline. """
+        try:
+            if not self.is_telemetry_supported() or not Constants.TELEMETRY_ENABLED_AT_EXTENSION:
+                return
+
+            background_writer = self.__background_writer
+            if background_writer is not None:
+                with self.__event_queue_condition:
+                    self.__is_draining = True
+                    self.__event_queue_condition.notify_all()
+                background_writer.join(Constants.TELEMETRY_DRAIN_TIMEOUT_IN_SECS)
+                if background_writer.is_alive():
+                    self.composite_logger.log_telemetry_module_error("Telemetry events were not drained in time. [Timeout={0}][QueuedEvents={1}]".format(str(Constants.TELEMETRY_DRAIN_TIMEOUT_IN_SECS), str(len(self.__event_queue))))
+                    return
+                self.__background_writer = None
+
+            self.__write_queued_events()
+            self.__flush_event_spool()
+        except Exception as e:
+            self.composite_logger.log_telemetry_module_error("Error occurred while draining telemetry events. [Error={0}]".format(repr(e)))
+
+    # region Event queue
+    @staticmethod
+    def __new_queued_event(message, event_level, task_name, is_event_file_throttling_needed):
+        # timestamp is taken when the event is raised, not when it gets written out
+        return {'message': message, 'event_level': event_level, 'task_name': task_name, 'timestamp': str(datetime.datetime.utcnow()), 'is_event_file_throttling_needed': is_event_file_throttling_needed}
+
+    def __enqueue_event(self, queued_event):
+        with self.__event_queue_condition:
+            if len(self.__event_queue) >= Constants.TELEMETRY_EVENT_QUEUE_MAX_SIZE and not self.__make_room_in_event_queue(queued_event):
+                return
+            self.__event_queue.append(queued_event)
+            self.__event_queue_condition.notify_all()
+
+    def __make_room_in_event_queue(self, queued_event):
+        """ Applies the overflow policy to a full queue. Returns False if the new event was coalesced or dropped, i.e. it must not be added to the queue.
+        Only verbose events are ever coalesced or dropped - anything else is queued even past the bound. Expects the queue lock to be held. """
+        if queued_event['event_level'] == Constants.TelemetryEventLevel.Verbose and Constants.TELEMETRY_EVENT_QUEUE_OVERFLOW_POLICY == Constants.TelemetryEventQueueOverflowPolicy.COALESCE_VERBOSE:
+            last_queued_event = self.__event_queue[-1]     # only the last event, to not reorder events
+            if last_queued_event['event_level'] == Constants.TelemetryEventLevel.Verbose and last_queued_event['task_name'] == queued_event['task_name'] and last_queued_event['is_event_file_throttling_needed']:
+                coalesced_message = str(last_queued_event['message']) + self.TELEMETRY_BUFFER_DELIMETER + str(queued_event['message'])
+                if len(coalesced_message) + Constants.TELEMETRY_EVENT_COUNTER_MSG_SIZE_LIMIT_IN_CHARS <= Constants.TELEMETRY_MSG_SIZE_LIMIT_IN_CHARS:
+                    last_queued_event['message'] = coalesced_message
+                    self.__coalesced_verbose_event_count += 1
+                    return False
+
+        for index, oldest_queued_event in enumerate(self.__event_queue):
+            if oldest_queued_event['event_level'] == Constants.TelemetryEventLevel.Verbose:
+                del self.__event_queue[index]
+                self.__dropped_verbose_event_count += 1
+                return True
+
+        if queued_event['event_level'] == Constants.TelemetryEventLevel.Verbose:
+            self.__dropped_verbose_event_count += 1
+            return False
+        return True
+
+    def __write_queued_events(self):
+        """ Writes all queued events out to the spool, throttling as required """
+        while True:
+            with self.__event_queue_condition:
+                if len(self.__event_queue) == 0:
+                    break
+                queued_event = self.__event_queue.popleft()
+            self.__write_queued_event(queued_event)
+
+        if self.__dropped_verbose_event_count > 0 or self.__coalesced_verbose_event_count > 0:
+            with self.__event_queue_condition:
+                queue_overflow_msg = "Telemetry event queue overflowed. [DroppedVerboseEvents={0}][CoalescedVerboseEvents={1}]".format(str(self.__dropped_verbose_event_count), str(self.__coalesced_verbose_event_count))
+                self.__dropped_verbose_event_count = self.__coalesced_verbose_event_count = 0
+            self.composite_logger.log_telemetry_module(queue_overflow_msg)
+            self.__write_queued_event(self.__new_queued_event(queue_overflow_msg, Constants.TelemetryEventLevel.Warning, self.__task_name, True))
+
+    def __write_queued_event(self, queued_event):
+        # ensure file throttle limit is reached
+        self.__throttle_telemetry_writes_if_required(queued_event['is_event_file_throttling_needed'])
+
+        event = self.__new_event_json(queued_event['event_level'], queued_event['message'], queued_event['task_name'], queued_event['timestamp'])
+        event_size_in_chars = len(json.dumps(event))
+        if event_size_in_chars > Constants.TELEMETRY_EVENT_SIZE_LIMIT_IN_CHARS:
+            self.composite_logger.log_telemetry_module_error("Cannot send data to telemetry as it exceeded the acceptable data size. [Data not sent={0}]".format(json.dumps(queued_event['message'])))
+        else:
+            self.__spool_event(event, event_size_in_chars)
+            if self.__is_event_spool_flush_due():
+                self.__flush_event_spool()
+    # endregion
+
+    # region Background writer
+    def __start_background_writer(self):
+        self.__background_writer = threading.Thread(target=self.__run_background_writer, name="TelemetryWriter")
+        self.__background_writer.daemon = True    # must never keep the process alive - drain() is what guarantees events are written out
+        self.__background_writer.start()
+
+    def __run_background_writer(self):
+        """ Writes queued events out until drained. Wakes up at least once per spool flush interval, so spooled events are not held back while the operation is quiet. """
+        try:
+            while True:
+                with self.__event_queue_condition:
+                    if len(self.__event_queue) == 0 and not self.__is_flush_requested and not self.__is_draining:
+                        self.__event_queue_condition.wait(max(Constants.TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS, 1))
+                    is_flush_requested, is_draining = self.__is_flush_requested, self.__is_draining
+                    self.__is_flush_requested = False
+
+                self.__write_queued_events()
+                if is_flush_requested or is_draining or self.__is_event_spool_flush_due():
+                    self.__flush_event_spool()
+
+                if is_draining:
+                    with self.__event_queue_condition:
+                        if len(self.__event_queue) == 0:
+                            return
+        except Exception as error:
+            # surfaced to the operation on the next write, as inline writes would have
+            self.composite_logger.log_telemetry_module_error("Background telemetry writer stopped. [Error={0}]".format(repr(error)))
+            self.__background_writer_error = error
+
+    def __is_on_background_writer(self):
+        return self.__background_writer is not None and threading.current_thread() is self.__background_writer
+
+    def __wait_out_event_count_throttle(self, time_to_wait_in_secs):
+        """ Inline writes wait on the caller's thread, as they always have. The background writer writes out what it has first, and stops waiting if it is being drained. """
+        if not self.__is_on_background_writer():
+            time.sleep(time_to_wait_in_secs)
+            return
+
+        self.__flush_event_spool()
+        end_time = time.time() + time_to_wait_in_secs
+        with self.__event_queue_condition:
+            while not self.__is_draining and time.time() < end_time:
+                self.__event_queue_condition.wait(end_time - time.time())
+    # endregion
+
+    def __spool_event(self, event, event_size_in_chars):
+        """ Adds an event to the spool. Spooled events are written out first if the event would take them past the event file size limit. """
+        if len(self.__event_spool) > 0 and self.__event_spool_size_in_chars + event_size_in_chars + 2 > Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS:
+            self.__flush_event_spool()
+
+        self.__event_spool_size_in_chars += event_size_in_chars + (2 if len(self.__event_spool) > 0 else 0)   # ', ' separator
+        self.__event_spool.append(event)
+        self.__telemetry_event_counter += 1
+        self.event_count += 1
+
+    def __is_event_spool_flush_due(self):
+        current_time = time.time()
+        if current_time < self.__event_spool_last_flush_time:
+            self.__event_spool_last_flush_time = current_time    # clock moved back - the interval restarts from now
+        return current_time - self.__event_spool_last_flush_time >= Constants.TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS
+
+    def __flush_event_spool(self):
+        """ Writes all spooled events to a new event file. Existing event files are never read back or rewritten, as the agent may pick them up at any time. """
+        if len(self.__event_spool) == 0:
+            return
+
+        self.__delete_older_events_if_dir_size_limit_not_met()
+        self.__write_event_using_temp_file(self.__get_new_event_file_path(), self.__event_spool)
+        self.__track_events_dir_size(self.__event_spool_size_in_chars)
+
+        self.__event_spool = []
+        self.__event_spool_size_in_chars = 2
+        self.__event_spool_last_flush_time = time.time()
+
+    def __track_events_dir_size(self, size_delta_in_chars):
+        if self.__events_dir_size is not None:
+            self.__events_dir_size = max(0, self.__events_dir_size + size_delta_in_chars)
+
     def __delete_older_events_if_dir_size_limit_not_met(self):
         """ Delete older events until the at least one new event file can be added as per the size restrictions """
         try:
-            if self.__get_events_dir_size() < Constants.TELEMETRY_DIR_SIZE_LIMIT_IN_CHARS - Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS:
+            if self.__events_dir_size is None:
+                self.__events_dir_size = self.__get_events_dir_size()
+
+            if self.__events_dir_size < Constants.TELEMETRY_DIR_SIZE_LIMIT_IN_CHARS - Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS:
                 # Not deleting any existing event files as the event directory does not exceed max limit. At least one new event file can be added. Not printing this statement as it will add repetitive logs
                 return
 
+            # Tracked size only drifts upwards (e.g. when the agent consumes event files), so it is re-measured before deleting anything
+            self.__events_dir_size = self.__get_events_dir_size()
+            if self.__events_dir_size < Constants.TELEMETRY_DIR_SIZE_LIMIT_IN_CHARS - Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS:
+                return
+
             self.composite_logger.log_telemetry_module("Events directory size exceeds maximum limit. Deleting older event files until at least one new event file can be added.")
             event_files = [os.path.join(self.events_folder_path, event_file) for event_file in os.listdir(self.events_folder_path) if (event_file.lower().endswith(".json"))]
             event_files.sort(key=os.path.getmtime, reverse=True)
 
             for event_file in event_files:
                 try:
-                    if self.__get_events_dir_size() < Constants.TELEMETRY_DIR_SIZE_LIMIT_IN_CHARS - Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS:
+                    if self.__events_dir_size < Constants.TELEMETRY_DIR_SIZE_LIMIT_IN_CHARS - Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS:
                         # Not deleting any more event files as the event directory has sufficient space to add at least one new event file. Not printing this statement as it will add repetitive logs
                         break
 
                     if os.path.exists(event_file):
+                        event_file_size = os.path.getsize(event_file)
                         os.remove(event_file)
+                        self.__events_dir_size -= event_file_size
                         self.composite_logger.log_telemetry_module("Deleted event file. [File={0}]".format(repr(event_file)))
                 except Exception as e:
                     self.composite_logger.log_telemetry_module_error("Error deleting event file. [File={0}] [Exception={1}]".format(repr(event_file), repr(e)))
 
-            if self.__get_events_dir_size() >= Constants.TELEMETRY_DIR_SIZE_LIMIT_IN_CHARS:
+            if self.__events_dir_size >= Constants.TELEMETRY_DIR_SIZE_LIMIT_IN_CHARS:
                 self.composite_logger.log_telemetry_module_error("Older event files were not deleted. Current event will not be sent to telemetry as events directory size exceeds maximum limit")
                 raise
 
@@ -253,25 +466,6 @@ class TelemetryWriter(object):
             self.composite_logger.log_telemetry_module_error("Error occurred while deleting older telemetry events. [Error={0}]".format(repr(e)))
             raise
 
-    def __get_file_and_content_to_write(self, folder_path, data):
-        """ Identifies the file where the event is to be written. Can be an existing event file or a new one depending upon the size restrictions. If event is to be written to an existing file, fetches retains it's content """
-        try:
-            file_path = self.__get_event_file_path(folder_path)
-            all_events = []
-            if os.path.exists(file_path):
-                file_size = self.get_file_size(file_path)
-                # if file_size exceeds max limit, sleep for 1 second, so the event can be written to a new file since the event file name is a timestamp
-                if file_size >= Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS:
-                    time.sleep(1)
-                    file_path = self.__get_event_file_path(folder_path)
-                else:
-                    all_events = self.__fetch_events_from_previous_file(file_path)  # fetches existing content within the file
-            all_events.append(data)
-            return file_path, all_events
-        except Exception as e:
-            self.composite_logger.log_telemetry_module_error("Error occurred while fetching event file to write the event to. [Error={0}]")
-            raise
-
     def __throttle_telemetry_writes_if_required(self, is_event_file_throttling_needed=True):
         """ Ensures the # of event files that can be written per time unit restriction is met. Returns False if the any updates are required after the restriction enforcement. For eg: file_name is a timestamp and should be modified if a wait is added here.
         NOTE: is_event_file_throttling_needed is used to determine if event file throttling is required and as such should always be True.
@@ -292,8 +486,8 @@ class TelemetryWriter(object):
                     time_to_wait_in_secs = ((time_to_wait.microseconds + (time_to_wait.seconds + time_to_wait.days * 24 * 3600) * 10 ** 6) / 10 ** 6)  # Computing seconds as per: https://docs.python.org/2/library/datetime.html#datetime.timedelta.total_seconds, since total_seconds() is not supported in python 2.6
                     event_write_throttled_msg = "Max telemetry event file limit reached. Extension will wait until a telemetry event file can be written again. [WaitTimeInSecs={0}]".format(str(time_to_wait_in_secs))
                     self.composite_logger.log_telemetry_module(event_write_throttled_msg)
-                    self.write_event(message=event_write_throttled_msg, event_level=Constants.TelemetryEventLevel.Informational, is_event_file_throttling_needed=False)
-                    time.sleep(time_to_wait_in_secs)
+                    self.__write_queued_event(self.__new_queued_event(event_write_throttled_msg, Constants.TelemetryEventLevel.Informational, self.__task_name, False))
+                    self.__wait_out_event_count_throttle(time_to_wait_in_secs)
                     self.start_time_for_event_count_throttle_check = datetime.datetime.utcnow()
                     self.event_count = 1
 
@@ -311,8 +505,6 @@ class TelemetryWriter(object):
                 json.dump(all_events, tf, default=all_events.__str__())
                 tempname = tf.name
             shutil.move(tempname, file_path)
-            self.__telemetry_event_counter += 1
-            self.event_count += 1
         except Exception as error:
             self.composite_logger.log_telemetry_module_error("Unable to write to telemetry. [Event File={0}] [Error={1}].".format(str(file_path), repr(error)))
             raise
@@ -333,28 +525,14 @@ class TelemetryWriter(object):
                     raise
         return total_dir_size
 
-    @staticmethod
-    def __get_event_file_path(folder_path):
-        """ Returns the filename, generated from current timestamp in seconds, to be used to write an event. Eg: 1614111606855.json"""
-        return os.path.join(folder_path, str(int(round(time.time() * 1000))) + ".json")
-
-    @staticmethod
-    def get_file_size(file_path):
-        """ Returns the size of a file. Extracted out for mocking in unit test """
-        return os.path.getsize(file_path)
-
-    def __fetch_events_from_previous_file(self, file_path):
-        """ Fetch contents from the file, return empty if file doesn't exist """
-        try:
-            with open(file_path, 'r') as file_handle:
-                file_contents = file_handle.read()
-                return json.loads(file_contents)
-        except OSError as error:
-            if error.errno == errno.ENOENT:
-                return []
-            else:
-                self.composite_logger.log_telemetry_module_error("Error occurred while fetching contents from existing event file. [File={0}] [Error={1}].".format(repr(file_path), repr(error)))
-                raise
+    def __get_new_event_file_path(self):
+        """ Returns the filename, generated from current timestamp in milliseconds, to be used for a new event file. Eg: 1614111606855.json
+            On a name clash the timestamp is bumped, so a new file never needs to wait for the clock to move on. """
+        event_file_timestamp = int(round(time.time() * 1000))
+        while event_file_timestamp == self.__last_event_file_timestamp or os.path.exists(os.path.join(self.events_folder_path, str(event_file_timestamp) + ".json")):
+            event_file_timestamp += 1
+        self.__last_event_file_timestamp = event_file_timestamp
+        return os.path.join(self.events_folder_path, str(event_file_timestamp) + ".json")
 
     def set_operation_id(self, operation_id):
         self.__operation_id = operation_id
@@ -14,7 +14,10 @@
 #
 # Requires Python 2.7+
 import json
+import functools
 import os
+import threading
+import types
 import unittest
 import sys
 # Conditional import for StringIO
@@ -30,6 +33,72 @@ from core.tests.library.ArgumentComposer import ArgumentComposer
 from core.tests.library.LegacyEnvLayerExtensions import LegacyEnvLayerExtensions
 from core.tests.library.RuntimeCompositor import RuntimeCompositor
 from core.src.package_managers import AptitudePackageManager, UbuntuProClient
+from core.src.package_managers.DpkgStatusReader import DpkgStatusReader
+
+
+class MockAptCache(object):
+    """ Stand-in for apt.Cache over a fixed set of packages, for the in-process (python-apt) queries """
+    class Origin(object):
+        def __init__(self, label, archive):
+            self.label, self.archive = label, archive
+
+    class Version(object):
+        def __init__(self, version, archives, downloadable=True):
+            self.version, self.downloadable = version, downloadable
+            self.origins = [MockAptCache.Origin("Ubuntu", archive) for archive in archives]
+
+    class Package(object):
+        def __init__(self, cache, name, installed_version, versions, dependencies=()):
+            self.cache, self.name, self.versions, self.dependencies = cache, name, versions, dependencies
+            self.installed_version, self.candidate = installed_version, versions[0]
+            self.is_installed = installed_version is not None
+            self.marked_install = self.marked_upgrade = False
+
+        def mark_install(self):
+            if self.installed_version == self.candidate.version:
+                return
+            self.marked_upgrade, self.marked_install = self.is_installed, not self.is_installed
+            for dependency in self.dependencies:
+                self.cache[dependency].mark_install()
+
+    def __init__(self):
+        self.packages = {}
+        for name, installed_version, versions, dependencies in [
+                ("git", "1:2.7.4-0ubuntu1", [self.Version("1:2.7.4-0ubuntu1.6", ["xenial-security"]), self.Version("1:2.7.4-0ubuntu1", ["xenial"])], ["git-man"]),
+                ("git-man", "1:2.7.4-0ubuntu1", [self.Version("1:2.7.4-0ubuntu1.6", ["xenial-security"]), self.Version("1:2.7.4-0ubuntu1", ["xenial"])], []),
+                ("vim", "2:7.4.1689-3ubuntu1", [self.Version("2:7.4.1689-3ubuntu1.5", ["xenial-updates"]), self.Version("2:7.4.1689-3ubuntu1", ["xenial"], downloadable=False)], []),
+                ("bash", "4.3-14ubuntu1", [self.Version("4.3-14ubuntu1", ["xenial"])], [])]:
+            self.packages[name] = self.Package(self, name, installed_version, versions, dependencies)
+
+    def __contains__(self, name):
+        return name in self.packages
+
+    def __getitem__(self, name):
+        return self.packages[name]
+
+    def upgrade(self, dist_upgrade=False):
+        for package in self.packages.values():
+            if package.is_installed:
+                package.mark_install()
+
+    def get_changes(self):
+        return sorted([package for package in self.packages.values() if package.marked_install or package.marked_upgrade], key=lambda package: package.name)
+
+    def clear(self):
+        for package in self.packages.values():
+            package.marked_install = package.marked_upgrade = False
+
+
+class MockAptPkgConfig(dict):
+    """ Stand-in for apt_pkg.config """
+    def find_dir(self, key):
+        return self[key]
+
+    def find_file(self, key):
+        return self[key]
+
+    def set(self, key, value):
+        self[key] = value
 
 
 class TestAptitudePackageManager(unittest.TestCase):
@@ -145,6 +214,25 @@ class TestAptitudePackageManager(unittest.TestCase):
                 return 1, "Error"
         return 0, ""
 
+    def mock_run_command_output_installed_packages_snapshot(self, cmd, no_output=False, chk_err=True):
+        if cmd.find("dpkg-query -W") > -1:
+            self.installed_packages_snapshot_query_count += 1
+            return 0, "mysql-server 5.7.25-0ubuntu0.16.04.2 ii\nmysql-client 5.7.25-0ubuntu0.16.04.2 rc\nlibc6 2.23-0ubuntu11 ii\nlibc6 2.23-0ubuntu11 ii\nbad line\n"
+        if cmd.find("dpkg -s") > -1:
+            self.per_package_install_check_count += 1
+            return 1, "dpkg-query: package '" + cmd.split(' ')[-1] + "' is not installed and no information is available"
+        return 0, ""
+
+    def mock_run_command_output_dist_upgrade_with_origins(self, cmd, no_output=False, chk_err=True):
+        if cmd.find("apt-get -q update") > -1:
+            self.repo_refresh_count += 1
+        elif cmd.find("apt-get -s dist-upgrade") > -1:
+            self.dist_upgrade_simulation_count += 1
+            return 0, "Inst libssl1.0.0 [1.0.2g-1ubuntu4.15] (1.0.2g-1ubuntu4.16 Ubuntu:16.04/xenial-updates, Ubuntu:16.04/xenial-security [amd64])\n" \
+                      "Inst coreutils [8.25-2ubuntu2] (8.25-2ubuntu3~16.04 Ubuntu:16.04/xenial-updates [amd64])\n" \
+                      "Inst openssl [1.1.1f-1ubuntu2.16] (1.1.1f-1ubuntu2.fips.3 UbuntuFIPSUpdates:20.04/focal-fips-updates [amd64])\n"
+        return 0, ""
+
     def mock_is_mokutil_installed_return_false(self):
         return False
 
@@ -332,6 +420,105 @@ class TestAptitudePackageManager(unittest.TestCase):
         self.assertEqual(package_versions[1], '4.3-14ubuntu1.2')
         self.assertEqual(package_versions[2], '4.3-14ubuntu1')
 
+    def test_single_pass_assessment_classifies_security_by_origin(self):
+        package_manager = self.container.get('package_manager')
+        backup_run_command_output = package_manager.env_layer.run_command_output
+        package_manager.env_layer.run_command_output = self.mock_run_command_output_dist_upgrade_with_origins
+        self.repo_refresh_count = 0
+        self.dist_upgrade_simulation_count = 0
+
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_SINGLE_PASS_ASSESSMENT, True)
+        packages, versions = package_manager.get_all_updates()
+        self.assertEqual(packages, ['libssl1.0.0', 'coreutils', 'openssl'])
+        sec_packages, sec_versions = package_manager.get_security_updates()
+        self.assertEqual(sec_packages, ['libssl1.0.0', 'openssl'])
+        self.assertEqual(sec_versions, ['1.0.2g-1ubuntu4.16', '1.1.1f-1ubuntu2.fips.3'])
+        other_packages, other_versions = package_manager.get_other_updates()
+        self.assertEqual(other_packages, ['coreutils'])
+        self.assertEqual(self.repo_refresh_count, 1)
+        self.assertEqual(self.dist_upgrade_simulation_count, 1)
+
+        # outside of single-pass assessment, security updates come from a security-only sources simulation
+        package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_SINGLE_PASS_ASSESSMENT, False)
+        package_manager.get_security_updates()
+        self.assertEqual(self.repo_refresh_count, 2)
+        self.assertEqual(self.dist_upgrade_simulation_count, 2)
+
+        package_manager.env_layer.run_command_output = backup_run_command_output
+
+    def test_package_manager_commands_needing_the_dpkg_lock_are_serialized(self):
+        package_manager = self.container.get('package_manager')
+        active_commands = {True: 0, False: 0}   # by whether the command is lock-free
+        max_active_commands = {True: 0, False: 0}
+        count_lock = threading.Lock()
+        lock_free_commands_overlapped = threading.Event()
+
+        def mock_run_command_output(cmd, no_output=False, chk_err=False):
+            is_lock_free = "apt-get -s" in cmd
+            with count_lock:
+                active_commands[is_lock_free] += 1
+                max_active_commands[is_lock_free] = max(max_active_commands[is_lock_free], active_commands[is_lock_free])
+                if active_commands[True] > 1:
+                    lock_free_commands_overlapped.set()
+            lock_free_commands_overlapped.wait(0.2)     # gives other commands the chance to overlap
+            with count_lock:
+                active_commands[is_lock_free] -= 1
+            return 0, str()
+
+        self.runtime.env_layer.run_command_output = mock_run_command_output
+        commands = ["sudo apt-get -q update", "LANG=en_US.UTF8 sudo apt-get -s dist-upgrade", "sudo apt-get -y --only-upgrade true install git", "LANG=en_US.UTF8 sudo apt-get -s dist-upgrade"]
+        package_manager.query_executor.run([functools.partial(package_manager.run_package_manager_command, command) for command in commands])
+
+        self.assertEqual(max_active_commands[False], 1)
+        self.assertEqual(max_active_commands[True], 2)
+
+    def test_read_only_queries_are_answered_in_process_by_python_apt_when_available(self):
+        Constants.CommandResultCacheConfig.ENABLED = False      # every command that is run is counted
+        package_manager = self.container.get('package_manager')
+        backup_modules = dict((name, sys.modules.get(name)) for name in ["apt", "apt_pkg"])
+        sys.modules["apt"], sys.modules["apt_pkg"] = types.ModuleType("apt"), types.ModuleType("apt_pkg")
+        sys.modules["apt"].Cache = MockAptCache
+        sys.modules["apt_pkg"].config = MockAptPkgConfig({"Dir::Etc::SourceParts": "/etc/apt/sources.list.d/", "Dir::Etc::SourceList": "/etc/apt/sources.list"})
+        Constants.AptPkgSettings.FEATURE_ENABLED = True
+        commands_run = []
+
+        def mock_run_command_output(cmd, no_output=False, chk_err=False):
+            if "apt-get -q update" not in cmd:     # refreshes the custom sources
+                commands_run.append(cmd)
+            return 0, "git | 1:2.7.4-0ubuntu1.6 | http://security.ubuntu.com/ubuntu xenial-security/main amd64 Packages"
+
+        try:
+            self.runtime.env_layer.run_command_output = mock_run_command_output
+
+            self.assertEqual(package_manager.get_all_updates(), (["git", "git-man", "vim"], ["1:2.7.4-0ubuntu1.6", "1:2.7.4-0ubuntu1.6", "2:7.4.1689-3ubuntu1.5"]))
+            self.assertEqual(package_manager.get_dependent_list(["git"]), ["git-man"])
+            self.assertEqual(package_manager.get_dependent_list(["bash"]), [])
+            self.assertEqual(package_manager.get_all_available_versions_of_package("vim"), ["2:7.4.1689-3ubuntu1.5"])
+            self.assertEqual(package_manager.get_all_available_versions_of_package("not-a-package"), [])
+            package_manager.set_package_manager_setting(Constants.PKG_MGR_SETTING_SINGLE_PASS_ASSESSMENT, True)
+            self.assertEqual(package_manager.get_security_updates(), (["git", "git-man"], ["1:2.7.4-0ubuntu1.6", "1:2.7.4-0ubuntu1.6"]))
+            self.assertEqual(commands_run, [])
+            self.assertTrue(sys.modules["apt_pkg"].config["Dir::Etc::SourceList"].endswith("-any-all.list"))
+
+            # A/B verification - the command line is queried too, and its result used
+            Constants.InProcessQuerySettings.VERIFY_AGAINST_COMMAND_LINE = True
+            self.assertEqual(package_manager.get_all_available_versions_of_package("git"), ["1:2.7.4-0ubuntu1.6"])
+            self.assertEqual(commands_run, ["apt-cache madison git"])
+
+            # falls back to the command line if the in-process query fails
+            Constants.InProcessQuerySettings.VERIFY_AGAINST_COMMAND_LINE = False
+            package_manager.apt_pkg_client.fingerprint_provider = lambda: "changed"     # reopens the cache
+            sys.modules["apt"].Cache = None
+            self.assertEqual(package_manager.get_all_available_versions_of_package("git"), ["1:2.7.4-0ubuntu1.6"])
+            self.assertEqual(len(commands_run), 2)
+        finally:
+            Constants.InProcessQuerySettings.VERIFY_AGAINST_COMMAND_LINE = False
+            for name, module in backup_modules.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
+
     def test_install_package_success(self):
         self.runtime.set_legacy_test_type('SuccessInstallPath')
 
@@ -351,7 +538,64 @@ class TestAptitudePackageManager(unittest.TestCase):
         self.assertEqual(package_manager.is_package_version_installed('mysql-server', '5.7.25-0ubuntu0.16.04.2'), True)
         self.assertEqual(package_manager.is_package_version_installed('mysql-client', '5.7.25-0ubuntu0.16.04.2'), False)
 
+    def test_is_installed_check_with_installed_packages_snapshot(self):
+        package_manager = self.container.get('package_manager')
+        backup_run_command_output = package_manager.env_layer.run_command_output
+        package_manager.env_layer.run_command_output = self.mock_run_command_output_installed_packages_snapshot
+        self.installed_packages_snapshot_query_count = 0
+        self.per_package_install_check_count = 0
+
+        # installed packages are answered from one bulk query
+        self.assertTrue(package_manager.is_package_version_installed_per_snapshot('mysql-server', '5.7.25-0ubuntu0.16.04.2'))
+        self.assertTrue(package_manager.is_package_version_installed_per_snapshot('libc6', '2.23-0ubuntu11'))
+        self.assertEqual(self.installed_packages_snapshot_query_count, 1)
+        self.assertEqual(self.per_package_install_check_count, 0)
+
+        # removed (config-files only) and unknown packages are verified individually
+        self.assertFalse(package_manager.is_package_version_installed_per_snapshot('mysql-client', '5.7.25-0ubuntu0.16.04.2'))
+        self.assertFalse(package_manager.is_package_version_installed_per_snapshot('bad', 'line'))
+        self.assertEqual(self.installed_packages_snapshot_query_count, 1)
+        self.assertEqual(self.per_package_install_check_count, 2)
+
+        # an install command invalidates the snapshot
+        package_manager.install_update_and_dependencies('mysql-server', '5.7.25-0ubuntu0.16.04.2')
+        self.assertTrue(package_manager.is_package_version_installed_per_snapshot('mysql-server', '5.7.25-0ubuntu0.16.04.2'))
+        self.assertEqual(self.installed_packages_snapshot_query_count, 2)
+
+        package_manager.env_layer.run_command_output = backup_run_command_output
+
+    def test_is_installed_check_with_dpkg_status_database(self):
+        package_manager = self.container.get('package_manager')
+        status_file_path = os.path.join(self.runtime.execution_config.temp_folder, "status")
+        updates_dir_path = os.path.join(self.runtime.execution_config.temp_folder, "updates")
+        os.mkdir(updates_dir_path)
+        self.runtime.write_to_file(status_file_path, "Package: mysql-server\nStatus: install ok installed\nArchitecture: all\nVersion: 5.7.25-0ubuntu0.16.04.2\nDescription: MySQL database server\n multi-line description\n\n"
+                                                     "Package: mysql-client\nStatus: deinstall ok config-files\nArchitecture: amd64\nVersion: 5.7.25-0ubuntu0.16.04.2\n\n"
+                                                     "Package: libc6\nStatus: install ok installed\nArchitecture: amd64\nVersion: 2.23-0ubuntu10\n\n"
+                                                     "Package: libc6\nStatus: hold ok installed\nArchitecture: i386\nVersion: 2.23-0ubuntu10")
+        package_manager.dpkg_status_reader = DpkgStatusReader(self.runtime.composite_logger, status_file_path, updates_dir_path)
+
+        self.assertTrue(package_manager.is_package_version_installed('mysql-server', '5.7.25-0ubuntu0.16.04.2'))
+        self.assertFalse(package_manager.is_package_version_installed('mysql-client', '5.7.25-0ubuntu0.16.04.2'))
+        self.assertTrue(package_manager.is_package_version_installed('libc6:i386', '2.23-0ubuntu10'))
+        self.assertFalse(package_manager.is_package_version_installed('libc6', '2.23-0ubuntu11'))
+        self.assertEqual(package_manager.get_installed_packages_snapshot()['libc6'], ['2.23-0ubuntu10', '2.23-0ubuntu10'])
+        self.assertFalse('mysql-client' in package_manager.get_installed_packages_snapshot())
+
+        # journal entries are applied on top of the status file, and trigger a re-index
+        self.runtime.write_to_file(os.path.join(updates_dir_path, "0000"), "Package: libc6\nStatus: install ok installed\nArchitecture: amd64\nVersion: 2.23-0ubuntu11\n")
+        self.assertTrue(package_manager.is_package_version_installed('libc6', '2.23-0ubuntu11'))
+        self.assertTrue(package_manager.is_package_version_installed('libc6:amd64', '2.23-0ubuntu11'))
+        self.assertFalse(package_manager.is_package_version_installed('libc6:amd64', '2.23-0ubuntu10'))
+
+        # an unreadable database falls back to dpkg
+        self.runtime.set_legacy_test_type('SuccessInstallPath')
+        package_manager.dpkg_status_reader = DpkgStatusReader(self.runtime.composite_logger, status_file_path + "-missing", updates_dir_path)
+        self.assertTrue(package_manager.is_package_version_installed('mysql-server', '5.7.25-0ubuntu0.16.04.2'))
+        self.assertIsNone(package_manager.dpkg_status_reader.get_installed_packages())
+
     def test_install_package_failure(self):
+        Constants.MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS = 0     # the status file is inspected right after the failure
         self.runtime.set_legacy_test_type('FailInstallPath')
 
         package_manager = self.container.get('package_manager')
@@ -0,0 +1,111 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+import os
+import unittest
+from core.src.bootstrap.CommandPerfLedger import CommandPerfLedger
+from core.src.bootstrap.Constants import Constants
+from core.src.bootstrap.EnvLayer import EnvLayer
+from core.tests.library.ArgumentComposer import ArgumentComposer
+from core.tests.library.RuntimeCompositor import RuntimeCompositor
+
+
+class TestCommandPerfLedger(unittest.TestCase):
+    def test_command_template(self):
+        self.assertEqual(CommandPerfLedger.get_command_template("sudo dpkg -s git"), "dpkg -s <ARG>")
+        self.assertEqual(CommandPerfLedger.get_command_template("sudo dpkg -s linux-image-azure"), "dpkg -s <ARG>")
+        self.assertEqual(CommandPerfLedger.get_command_template("sudo apt-get -y --only-upgrade true install git=1:2.7.4 git-man=1:2.7.4 vim=2:8.0"),
+                         "apt-get -y --only-upgrade <ARG> install <ARG>...")
+        self.assertEqual(CommandPerfLedger.get_command_template("sudo LANG=en_US.UTF8 apt-cache madison bash"), "LANG=<ARG> apt-cache madison <ARG>")
+        self.assertEqual(CommandPerfLedger.get_command_template("sudo zypper --non-interactive --type package search -s 'kernel-default'"), "zypper --non-interactive --type package search -s <ARG>")
+        self.assertEqual(CommandPerfLedger.get_command_template("sudo apt-get -s dist-upgrade -oDir::Etc::SourceList=/tmp/azgps.list | grep ^Inst"), "apt-get -s dist-upgrade -oDir::Etc::SourceList=<ARG> | grep <ARG>")
+        self.assertEqual(CommandPerfLedger.get_command_template("cat /etc/os-release > /tmp/out 2>&1"), "cat <ARG> > <ARG> 2>&1")
+        self.assertEqual(CommandPerfLedger.get_command_template("echo 'unbalanced"), "echo <ARG>")
+
+    def test_report_is_ranked_by_cumulative_time(self):
+        ledger = CommandPerfLedger()
+        for package in ["git", "vim", "curl"]:
+            ledger.record("sudo dpkg -s " + package, 1.0, 100, 0)
+        ledger.record("sudo apt-get -s dist-upgrade", 2.5, 5000, 0)
+        ledger.record("sudo systemctl is-active auoms", 0.1, 8, 3)
+
+        report = ledger.get_report()
+        self.assertEqual(report['commandCount'], 5)
+        self.assertEqual(report['totalTimeInSecs'], 5.6)
+        self.assertEqual([entry['template'] for entry in report['commands']], ["dpkg -s <ARG>", "apt-get -s dist-upgrade", "systemctl is-active <ARG>"])
+
+        entry = report['commands'][0]
+        self.assertEqual((entry['count'], entry['totalTimeInSecs'], entry['avgTimeInSecs'], entry['totalOutputSizeInBytes'], entry['failureCount']), (3, 3.0, 1.0, 300, 0))
+        self.assertEqual(entry['callers'], {"TestCommandPerfLedger.test_report_is_ranked_by_cumulative_time": 3})
+        self.assertEqual(report['commands'][2]['exitCodes'], {"3": 1})
+        self.assertEqual(report['commands'][2]['failureCount'], 1)
+
+        summary = CommandPerfLedger.get_summary(report)
+        self.assertTrue(summary.startswith("Command perf summary: [Commands=5][TotalTimeInSecs=5.6][Templates=3] [dpkg -s <ARG>|Count=3|TotalSecs=3.0|"))
+
+    def test_templates_and_summary_are_bounded(self):
+        ledger = CommandPerfLedger()
+        for index in range(0, Constants.CommandPerfLedgerConfig.MAX_TEMPLATES + 10):
+            ledger.record("command-" + str(index) + " --flag", 1.0, 1, 0)
+
+        report = ledger.get_report()
+        self.assertEqual(len(report['commands']), Constants.CommandPerfLedgerConfig.MAX_TEMPLATES + 1)
+        self.assertEqual(report['commands'][0]['template'], CommandPerfLedger.OTHER_TEMPLATE)
+        self.assertEqual(report['commands'][0]['count'], 10)
+        self.assertTrue(len(CommandPerfLedger.get_summary(report)) <= Constants.CommandPerfLedgerConfig.TELEMETRY_SUMMARY_SIZE_LIMIT_IN_CHARS)
+
+    def test_commands_are_recorded_under_the_caller_of_added_pass_through_functions(self):
+        ledger = CommandPerfLedger()
+
+        def stand_in_run_command_output(cmd):
+            ledger.record(cmd, 1.0, 0, 0)
+
+        stand_in_run_command_output("sudo dpkg -s git")
+        ledger.add_pass_through_functions(["stand_in_run_command_output"])
+        stand_in_run_command_output("sudo dpkg -s vim")
+        self.assertEqual(ledger.get_report()['commands'][0]['callers'], {"stand_in_run_command_output": 1,
+                                                                         "TestCommandPerfLedger.test_commands_are_recorded_under_the_caller_of_added_pass_through_functions": 1})
+
+    @unittest.skipIf(os.name != 'posix', "Needs a posix shell")
+    def test_env_layer_records_commands(self):
+        env_layer = EnvLayer()
+        env_layer.run_command_output("printf 'abc\\n'", False, False)
+        env_layer.run_command_output("exit 2", False, False)
+        env_layer.run_command_output_streaming("printf 'abc\\ndef\\n'", lambda line: None, False)
+
+        report = env_layer.command_perf_ledger.get_report()
+        entries = dict((entry['template'], entry) for entry in report['commands'])
+        self.assertEqual(report['commandCount'], 3)
+        self.assertEqual(entries["printf <ARG>"]['count'], 2)
+        self.assertEqual(entries["printf <ARG>"]['totalOutputSizeInBytes'], 12)
+        self.assertEqual(entries["exit <ARG>"]['exitCodes'], {"2": 1})
+        self.assertEqual(entries["exit <ARG>"]['callers'], {"TestCommandPerfLedger.test_env_layer_records_commands": 1})
+
+    def test_package_manager_commands_are_recorded_under_the_real_caller(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        package_manager = runtime.package_manager
+        package_manager.env_layer = EnvLayer()      # commands run for real, through the generic package manager command runners
+        package_manager.cmd_repo_refresh_template = "printf 'Reading package lists... Done\\n'"
+        package_manager.refresh_repo()
+
+        entries = package_manager.env_layer.command_perf_ledger.get_report()['commands']
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['callers'], {"AptitudePackageManager.refresh_repo": 1})
+        runtime.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
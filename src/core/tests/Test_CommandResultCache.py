@@ -0,0 +1,117 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+import os
+import shutil
+import tempfile
+import unittest
+from core.src.bootstrap.Constants import Constants
+from core.src.package_managers.CommandResultCache import CommandResultCache
+
+
+class TestCommandResultCache(unittest.TestCase):
+    def setUp(self):
+        self.backup_config = (Constants.CommandResultCacheConfig.ENABLED, Constants.CommandResultCacheConfig.MAX_ENTRIES,
+                              Constants.CommandResultCacheConfig.MAX_SIZE_IN_CHARS, Constants.CommandResultCacheConfig.MAX_ENTRY_SIZE_IN_CHARS)
+        Constants.CommandResultCacheConfig.ENABLED = True
+        self.temp_dir = tempfile.mkdtemp()
+        self.lists_dir = os.path.join(self.temp_dir, "lists")
+        os.mkdir(self.lists_dir)
+        self.status_file_path = os.path.join(self.temp_dir, "status")
+        self.__write_file(self.status_file_path, "a")
+
+    def tearDown(self):
+        (Constants.CommandResultCacheConfig.ENABLED, Constants.CommandResultCacheConfig.MAX_ENTRIES,
+         Constants.CommandResultCacheConfig.MAX_SIZE_IN_CHARS, Constants.CommandResultCacheConfig.MAX_ENTRY_SIZE_IN_CHARS) = self.backup_config
+        shutil.rmtree(self.temp_dir)
+
+    def test_results_are_reused_until_the_fingerprint_changes(self):
+        cache = CommandResultCache([self.status_file_path, self.lists_dir, os.path.join(self.temp_dir, "not-present")])
+        self.assertEqual(cache.get("apt-cache madison git"), None)
+        cache.put("apt-cache madison git", 0, "git | 1:2.7.4")
+        self.assertEqual(cache.get("apt-cache madison git"), (0, "git | 1:2.7.4"))
+
+        # a file is added to a fingerprinted directory
+        self.__write_file(os.path.join(self.lists_dir, "archive.ubuntu.com_Packages"), "Package: git")
+        self.assertEqual(cache.get("apt-cache madison git"), None)
+
+        # a fingerprinted file changes
+        cache.put("apt-cache madison git", 0, "git | 1:2.7.4")
+        self.__write_file(self.status_file_path, "ab")
+        self.assertEqual(cache.get("apt-cache madison git"), None)
+
+        # a path that was not present appears
+        cache.put("apt-cache madison git", 0, "git | 1:2.7.4")
+        self.__write_file(os.path.join(self.temp_dir, "not-present"), "")
+        self.assertEqual(cache.get("apt-cache madison git"), None)
+
+        # invalidated by a command that may change the package database
+        cache.put("apt-cache madison git", 0, "git | 1:2.7.4")
+        cache.invalidate()
+        self.assertEqual(cache.get("apt-cache madison git"), None)
+        self.assertEqual((cache.hit_count, cache.miss_count), (1, 5))
+
+        Constants.CommandResultCacheConfig.ENABLED = False
+        cache.put("apt-cache madison git", 0, "git | 1:2.7.4")
+        self.assertEqual(cache.get("apt-cache madison git"), None)
+
+    def test_cache_is_bounded(self):
+        Constants.CommandResultCacheConfig.MAX_ENTRIES = 3
+        Constants.CommandResultCacheConfig.MAX_SIZE_IN_CHARS = 10
+        Constants.CommandResultCacheConfig.MAX_ENTRY_SIZE_IN_CHARS = 5
+        cache = CommandResultCache([self.status_file_path])
+
+        for command in ["a", "b", "c"]:
+            cache.put(command, 0, command)
+        cache.get("a")      # most recently used now
+        cache.put("d", 0, "d")
+        self.assertEqual([command for command in ["a", "b", "c", "d"] if cache.get(command) is not None], ["a", "c", "d"])
+
+        # least recently used entries are evicted to fit the size limit, and entries over the entry size limit are not cached
+        cache.put("e", 0, "eeeee")
+        cache.put("f", 0, "ffffff")
+        self.assertEqual([command for command in ["a", "c", "d", "e", "f"] if cache.get(command) is not None], ["c", "d", "e"])
+
+        output_capture = CommandResultCache.OutputCapture()
+        output_capture.append("abc")
+        self.assertEqual(output_capture.get_output(), "abc")
+        output_capture.append("def")
+        self.assertEqual(output_capture.get_output(), None)
+
+    def test_database_fingerprint_is_comparable_across_runs(self):
+        cache = CommandResultCache([self.status_file_path, self.lists_dir])
+        database_fingerprint = cache.get_database_fingerprint()
+        self.assertEqual(len(database_fingerprint), 64)
+
+        # invalidation is specific to the process, and doesn't change the package database
+        cache.invalidate()
+        self.assertEqual(cache.get_database_fingerprint(), database_fingerprint)
+        self.assertEqual(CommandResultCache([self.status_file_path, self.lists_dir]).get_database_fingerprint(), database_fingerprint)
+
+        self.__write_file(self.status_file_path, "ab")
+        self.assertNotEqual(cache.get_database_fingerprint(), database_fingerprint)
+
+        # nothing to determine it from
+        self.assertEqual(CommandResultCache([]).get_database_fingerprint(), None)
+
+    @staticmethod
+    def __write_file(path, data):
+        with open(path, 'w') as file_handle:
+            file_handle.write(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
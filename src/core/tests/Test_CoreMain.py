@@ -25,6 +25,7 @@ import uuid
 from core.src.CoreMain import CoreMain
 from core.src.bootstrap.Constants import Constants
 from core.src.external_dependencies import distro
+from core.src.service_interfaces.TelemetryWriter import TelemetryWriter
 from core.tests.library.ArgumentComposer import ArgumentComposer
 from core.tests.library.LegacyEnvLayerExtensions import LegacyEnvLayerExtensions
 from core.tests.library.RuntimeCompositor import RuntimeCompositor
@@ -1375,6 +1376,28 @@ class TestCoreMain(unittest.TestCase):
 
         LegacyEnvLayerExtensions.LegacyPlatform.linux_distribution = backup_envlayer_platform_linux_distribution
 
+    def test_telemetry_is_drained_even_if_clean_up_fails(self):
+        argument_composer = ArgumentComposer()
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.ZYPPER)
+        runtime.set_legacy_test_type('SuccessInstallPath')
+        backup_write_command_perf_report, backup_drain = CoreMain.write_command_perf_report, TelemetryWriter.drain
+        self.drain_count = 0
+
+        def mock_write_command_perf_report(bootstrapper, telemetry_writer, composite_logger):
+            raise Exception("Unable to write command perf report")
+
+        def mock_drain(telemetry_writer):
+            self.drain_count += 1
+            backup_drain(telemetry_writer)
+        CoreMain.write_command_perf_report = staticmethod(mock_write_command_perf_report)
+        TelemetryWriter.drain = mock_drain
+        try:
+            self.assertRaises(Exception, CoreMain, argument_composer.get_composed_arguments())
+        finally:
+            CoreMain.write_command_perf_report, TelemetryWriter.drain = staticmethod(backup_write_command_perf_report), backup_drain
+        self.assertEqual(self.drain_count, 1)
+        runtime.stop()
+
     def __check_telemetry_events(self, runtime):
         all_events = os.listdir(runtime.telemetry_writer.events_folder_path)
         self.assertTrue(len(all_events) > 0)
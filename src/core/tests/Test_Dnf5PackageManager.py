@@ -730,6 +730,30 @@ class TestDnfPackageManager(unittest.TestCase):
         package_manager.set_security_esm_package_status("op", [])
         package_manager.separate_out_esm_packages([], [])
 
+    def test_dependency_simulation_exiting_1_is_served_from_the_cache(self):
+        Constants.CommandResultCacheConfig.ENABLED = True
+        package_manager = self.container.get('package_manager')
+        fingerprint_file_path = os.path.join(self.runtime.execution_config.temp_folder, "rpmdb")
+        self.runtime.write_to_file(fingerprint_file_path, "a")
+        package_manager.command_result_cache.fingerprint_paths = [fingerprint_file_path]
+        commands_run = []
+
+        def mock_run_command_output(cmd, no_output=False, chk_err=False):
+            commands_run.append(cmd)
+            return 1, "Operation aborted."     # anything to install
+        self.runtime.env_layer.run_command_output = mock_run_command_output
+
+        simulation_cmd = package_manager.single_package_upgrade_simulation_cmd + "git"
+        self.assertEqual(package_manager.run_package_manager_command(simulation_cmd), (1, "Operation aborted."))
+        self.assertEqual(package_manager.run_package_manager_command(simulation_cmd), (1, "Operation aborted."))
+        self.assertEqual(commands_run, [simulation_cmd])
+
+        # other commands are not cached on that exit code
+        package_manager.run_package_manager_command(package_manager.cmd_get_all_updates)
+        package_manager.run_package_manager_command(package_manager.cmd_get_all_updates)
+        self.assertEqual(commands_run, [simulation_cmd] + [package_manager.cmd_get_all_updates] * 2)
+
+
 if __name__ == '__main__':
     unittest.main()
 
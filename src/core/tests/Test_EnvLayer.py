@@ -15,7 +15,10 @@
 # Requires Python 2.7+
 import os
 import platform
+import shutil
 import sys
+import tempfile
+import time
 import unittest
 # Conditional import for StringIO
 try:
@@ -23,6 +26,7 @@ try:
 except ImportError:
     from io import StringIO  # Python 3
 
+from core.src.bootstrap.CoprocessShell import CoprocessShell
 from core.src.bootstrap.EnvLayer import EnvLayer
 from core.src.bootstrap.Constants import Constants
 from core.src.external_dependencies import distro
@@ -314,6 +318,166 @@ class TestExecutionConfig(unittest.TestCase):
         self.envlayer.platform.cpu_arch()
         self.envlayer.platform.vm_name()
 
+    @unittest.skipIf(os.name != 'posix', "POSIX shell commands")
+    def test_run_command_output_streaming(self):
+        lines = []
+        code, out = self.envlayer.run_command_output_streaming("printf 'first\\n\\nthird\\nlast'", lines.append, False)
+        self.assertEqual(code, 0)
+        self.assertEqual(lines, ["first", "", "third", "last"])
+        self.assertEqual(out, "first\n\nthird\nlast")
+
+        # only the tail of the output is kept, and the return code is passed through
+        backup_max_tail_size = Constants.MAX_STREAMED_COMMAND_OUTPUT_TAIL_IN_CHARS
+        Constants.MAX_STREAMED_COMMAND_OUTPUT_TAIL_IN_CHARS = 10
+        lines = []
+        code, out = self.envlayer.run_command_output_streaming("seq 1 100; exit 3", lines.append, False)
+        Constants.MAX_STREAMED_COMMAND_OUTPUT_TAIL_IN_CHARS = backup_max_tail_size
+        self.assertEqual(code, 3)
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(out, "98\n99\n100")
+
+    @unittest.skipIf(os.name != 'posix', "POSIX shell commands")
+    def test_run_command_output_spilled(self):
+        spill_folder = tempfile.mkdtemp()
+
+        # small outputs are read back into memory
+        code, output = self.envlayer.run_command_output_spilled("printf 'first\\n\\nlast'", spill_folder, False)
+        self.assertEqual(code, 0)
+        self.assertFalse(output.is_spilled())
+        self.assertEqual(list(output.iterate_lines()), ["first", "", "last"])
+        self.assertEqual(os.listdir(spill_folder), [])
+
+        # larger outputs stay on disk, and are read via mmap
+        backup_spill_threshold, backup_excerpt_head, backup_excerpt_tail = Constants.CommandOutputSpillConfig.SPILL_THRESHOLD_IN_BYTES, Constants.CommandOutputSpillConfig.EXCERPT_HEAD_IN_CHARS, Constants.CommandOutputSpillConfig.EXCERPT_TAIL_IN_CHARS
+        Constants.CommandOutputSpillConfig.SPILL_THRESHOLD_IN_BYTES, Constants.CommandOutputSpillConfig.EXCERPT_HEAD_IN_CHARS, Constants.CommandOutputSpillConfig.EXCERPT_TAIL_IN_CHARS = 100, 5, 7
+        try:
+            code, output = self.envlayer.run_command_output_spilled("seq 1 1000; echo '{\"summary\": {\"ua\": {\"attached\": true}}}'; exit 3", spill_folder, False)
+            with output:
+                self.assertEqual(code, 3)
+                self.assertTrue(output.is_spilled())
+                self.assertEqual(len(os.listdir(spill_folder)), 1)
+                lines = list(output.iterate_lines())
+                self.assertEqual(len(lines), 1001)
+                self.assertEqual(lines[999], "1000")
+                self.assertEqual(output.read_from_last_occurrence('"summary"'), '"summary": {"ua": {"attached": true}}}\n')
+                self.assertEqual(output.read_from_last_occurrence('"absent"'), None)
+                self.assertEqual(output.get_excerpt(), "1\n2\n3\n...[" + str(output.size - 12) + " bytes omitted]...\nrue}}}\n")
+            self.assertEqual(os.listdir(spill_folder), [])
+            self.assertEqual(EnvLayer.get_output_excerpt("0123456789abcdefghij"), "01234\n...[8 chars omitted]...\ndefghij")
+            self.assertEqual(EnvLayer.get_output_excerpt("0123456789ab"), "0123456789ab")
+        finally:
+            Constants.CommandOutputSpillConfig.SPILL_THRESHOLD_IN_BYTES, Constants.CommandOutputSpillConfig.EXCERPT_HEAD_IN_CHARS, Constants.CommandOutputSpillConfig.EXCERPT_TAIL_IN_CHARS = backup_spill_threshold, backup_excerpt_head, backup_excerpt_tail
+            shutil.rmtree(spill_folder)
+
+    @unittest.skipIf(os.name != 'posix', "Process groups are POSIX only")
+    def test_run_command_output_with_time_limit(self):
+        backup_grace_period = Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS
+        Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS = 0.3
+        self.envlayer.set_command_time_limit_provider(lambda: 0.3)
+
+        code, out = self.envlayer.run_command_output("echo started; sleep 0.1; echo done", False, False)
+        self.assertEqual((code, out), (0, "started\ndone\n"))
+        self.assertEqual(len(self.envlayer.timed_out_commands), 0)
+
+        # SIGTERM, then SIGKILL for the whole process group
+        start_time = time.time()
+        code, out = self.envlayer.run_command_output("echo started; sleep 5", False, False)
+        self.assertEqual(code, Constants.CommandDeadlineConfig.TIMED_OUT_EXIT_CODE)
+        self.assertTrue(out.startswith("started\n"))
+        code, out = self.envlayer.run_command_output("trap '' TERM; echo started; sleep 5", False, False)
+        self.assertEqual(code, Constants.CommandDeadlineConfig.TIMED_OUT_EXIT_CODE)
+        self.assertTrue(time.time() - start_time < 3)
+        self.assertEqual([timed_out_command['command'] for timed_out_command in self.envlayer.timed_out_commands], ["echo started; sleep 5", "trap '' TERM; echo started; sleep 5"])
+
+        self.envlayer.set_command_time_limit_provider(None)
+        Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS = backup_grace_period
+
+    @unittest.skipIf(os.name != 'posix', "Process groups are POSIX only")
+    def test_run_command_output_streaming_and_spilled_with_time_limit(self):
+        backup_grace_period = Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS
+        Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS = 0.3
+        self.envlayer.set_command_time_limit_provider(lambda: 0.3)
+        spill_folder = tempfile.mkdtemp()
+        try:
+            lines = []
+            code, out = self.envlayer.run_command_output_streaming("echo started; sleep 0.1; echo done", lines.append, False)
+            self.assertEqual((code, lines), (0, ["started", "done"]))
+            self.assertEqual(len(self.envlayer.timed_out_commands), 0)
+
+            # SIGTERM, then SIGKILL for the whole process group - e.g. a package manager waiting on a lock
+            start_time = time.time()
+            lines = []
+            code, out = self.envlayer.run_command_output_streaming("trap '' TERM; echo started; sleep 5", lines.append, False)
+            self.assertEqual(code, Constants.CommandDeadlineConfig.TIMED_OUT_EXIT_CODE)
+            self.assertEqual(lines, ["started"])
+            self.assertTrue(out.startswith("started\n[Command timed out]"))
+
+            code, output = self.envlayer.run_command_output_spilled("echo started; sleep 5", spill_folder, False)
+            with output:
+                self.assertEqual(code, Constants.CommandDeadlineConfig.TIMED_OUT_EXIT_CODE)
+                self.assertTrue(output.read().startswith("started\n"))
+            self.assertTrue(time.time() - start_time < 3)
+            self.assertEqual([timed_out_command['command'] for timed_out_command in self.envlayer.timed_out_commands], ["trap '' TERM; echo started; sleep 5", "echo started; sleep 5"])
+        finally:
+            self.envlayer.set_command_time_limit_provider(None)
+            Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS = backup_grace_period
+            shutil.rmtree(spill_folder)
+
+    @unittest.skipIf(os.name != 'posix' or os.geteuid() != 0, "Coprocess shells are only started when privileged")
+    def test_run_command_output_on_coprocess_shell(self):
+        # queries run on one long-lived shell ($$ is the shell's pid, also in the subshell each command runs in)
+        code, first_shell_pid = self.envlayer.run_command_output("command -v sh >/dev/null; echo $$", False, False)
+        self.assertEqual(code, 0)
+        code, shell_pid = self.envlayer.run_command_output("sudo dpkg -s lpe-package-not-present >/dev/null 2>&1; echo $$; exit 3", False, False)
+        self.assertEqual(code, 3)
+        self.assertEqual(shell_pid, first_shell_pid)
+
+        # same results as a one-off process, incl. output without a trailing newline
+        for cmd in ["command -v sh; printf 'no newline'", "command -v lpe-tool-not-present"]:
+            result = self.envlayer.run_command_output(cmd, False, False)
+            Constants.CoprocessShellConfig.ENABLED = False
+            self.assertEqual(result, self.envlayer.run_command_output(cmd, False, False))
+            Constants.CoprocessShellConfig.ENABLED = True
+
+        # a hung shell is replaced, and the query is still answered
+        backup_timeout = Constants.CoprocessShellConfig.COMMAND_TIMEOUT_IN_SECS
+        Constants.CoprocessShellConfig.COMMAND_TIMEOUT_IN_SECS = 0.2
+        code, out = self.envlayer.run_command_output("command -v sh >/dev/null; sleep 1; echo done", False, False)
+        Constants.CoprocessShellConfig.COMMAND_TIMEOUT_IN_SECS = backup_timeout
+        self.assertEqual((code, out), (0, "done\n"))
+        code, shell_pid = self.envlayer.run_command_output("command -v sh >/dev/null; echo $$", False, False)
+        self.assertNotEqual(shell_pid, first_shell_pid)
+
+        # other commands are not run on the shell
+        code, out = self.envlayer.run_command_output("echo $$", False, False)
+        self.assertNotEqual(out, shell_pid)
+        self.envlayer.close_coprocess_shells()
+
+    @unittest.skipIf(os.name != 'posix' or os.geteuid() != 0, "Coprocess shells are only started when privileged")
+    def test_coprocess_shell_close_is_bounded(self):
+        backup_killpg, backup_close_timeout = os.killpg, Constants.CoprocessShellConfig.CLOSE_TIMEOUT_IN_SECS
+        Constants.CoprocessShellConfig.CLOSE_TIMEOUT_IN_SECS = 0.3
+
+        def mock_killpg(pid, signal_number):
+            raise OSError(1, "Operation not permitted")
+        os.killpg = mock_killpg
+        try:
+            # the process group can't be signalled - the shell itself is ended instead
+            shell = CoprocessShell()
+            process = shell._CoprocessShell__process
+            shell.close()
+            self.assertNotEqual(process.poll(), None)
+
+            # nor the shell - close() doesn't wait for it indefinitely
+            shell = CoprocessShell()
+            process = shell._CoprocessShell__process
+            process.kill = lambda: mock_killpg(process.pid, 9)
+            start_time = time.time()
+            shell.close()
+            self.assertTrue(time.time() - start_time < 3)
+        finally:
+            os.killpg, Constants.CoprocessShellConfig.CLOSE_TIMEOUT_IN_SECS = backup_killpg, backup_close_timeout
+
     def test_get_package_manager_rhel10_not_supported(self):
         """Test for RHEL 10 log unsupported message"""
         self.backup_platform_system = platform.system
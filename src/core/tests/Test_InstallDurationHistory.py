@@ -0,0 +1,86 @@
+# Copyright 2026 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+
+import os
+import unittest
+from core.src.bootstrap.Constants import Constants
+from core.src.core_logic.InstallDurationHistory import InstallDurationHistory
+from core.tests.library.ArgumentComposer import ArgumentComposer
+from core.tests.library.RuntimeCompositor import RuntimeCompositor
+
+
+class TestInstallDurationHistory(unittest.TestCase):
+    def setUp(self):
+        self.runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        self.history_file_path = os.path.join(self.runtime.execution_config.config_folder, Constants.INSTALL_DURATION_HISTORY_FILE)
+
+    def tearDown(self):
+        self.runtime.stop()
+
+    def test_estimates_use_defaults_until_enough_history(self):
+        history = InstallDurationHistory(self.runtime.env_layer, self.runtime.composite_logger, self.history_file_path)
+        self.assertEqual(history.get_estimates_in_seconds(Constants.APT, 90, 300), (90, 300))
+
+        for index in range(0, Constants.InstallDurationHistoryConfig.MIN_SAMPLES_FOR_ESTIMATE - 1):
+            history.record(Constants.APT, 10, 30)
+        self.assertEqual(history.get_estimates_in_seconds(Constants.APT, 90, 300), (90, 300))
+
+        history.record(Constants.APT, 10, 30)
+        avg_time_in_secs, max_time_in_secs = history.get_estimates_in_seconds(Constants.APT, 90, 300)
+        self.assertAlmostEqual(avg_time_in_secs, 3)
+        self.assertEqual(max_time_in_secs, Constants.InstallDurationHistoryConfig.MIN_MAX_TIME_IN_SECS)     # floor applies
+        self.assertEqual(history.get_estimates_in_seconds(Constants.YUM, 90, 300), (90, 300))     # per package manager
+
+    def test_estimates_are_robust_to_outliers_and_per_package(self):
+        history = InstallDurationHistory(self.runtime.env_layer, self.runtime.composite_logger, self.history_file_path)
+        for index in range(0, 99):
+            history.record(Constants.APT, 1, 4)
+        history.record(Constants.APT, 1, 3600)     # one outlier
+        avg_time_in_secs, max_time_in_secs = history.get_estimates_in_seconds(Constants.APT, 90, 300)
+        self.assertTrue(avg_time_in_secs < 90)
+        self.assertEqual(max_time_in_secs, Constants.InstallDurationHistoryConfig.MIN_MAX_TIME_IN_SECS)
+
+        # a package known to take long on its own raises the max for installs including it
+        history.record(Constants.APT, 3, 600, "linux-image-azure")
+        self.assertEqual(history.get_estimates_in_seconds(Constants.APT, 90, 300, ["git", "linux-image-azure"])[1], 600)
+        self.assertEqual(history.get_estimates_in_seconds(Constants.APT, 90, 300, ["git"])[1], Constants.InstallDurationHistoryConfig.MIN_MAX_TIME_IN_SECS)
+
+    def test_history_is_persisted(self):
+        history = InstallDurationHistory(self.runtime.env_layer, self.runtime.composite_logger, self.history_file_path)
+        for index in range(0, Constants.InstallDurationHistoryConfig.MIN_SAMPLES_FOR_ESTIMATE):
+            history.record(Constants.APT, 2, 10, "git")
+        history.save()
+
+        reloaded_history = InstallDurationHistory(self.runtime.env_layer, self.runtime.composite_logger, self.history_file_path)
+        self.assertEqual(reloaded_history.get_estimates_in_seconds(Constants.APT, 90, 300), history.get_estimates_in_seconds(Constants.APT, 90, 300))
+
+        # unreadable history is discarded
+        self.runtime.env_layer.file_system.write_with_retry(self.history_file_path, "{not json", mode='w+')
+        reloaded_history = InstallDurationHistory(self.runtime.env_layer, self.runtime.composite_logger, self.history_file_path)
+        self.assertEqual(reloaded_history.get_estimates_in_seconds(Constants.APT, 90, 300), (90, 300))
+
+    def test_learned_estimates_drive_batch_size_and_cutoff(self):
+        default_max_batch_size = self.runtime.patch_installer.get_max_batch_size(self.runtime.maintenance_window, self.runtime.package_manager)
+        for index in range(0, Constants.InstallDurationHistoryConfig.MIN_SAMPLES_FOR_ESTIMATE):
+            self.runtime.package_manager.record_package_install_duration(["git", "git-man"], 6)
+        self.assertTrue(self.runtime.patch_installer.get_max_batch_size(self.runtime.maintenance_window, self.runtime.package_manager) > default_max_batch_size)
+
+        # 3 minutes is too short for one package at the default max time, but not as learned
+        self.assertTrue(self.runtime.maintenance_window.is_package_install_time_available(self.runtime.package_manager, 3, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
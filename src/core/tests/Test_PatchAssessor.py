@@ -189,6 +189,43 @@ class TestPatchAssessor(unittest.TestCase):
         self.assertIn(Constants.ERROR_ADDED_TO_STATUS, repr(context.exception))
         self.assertEqual(context.exception.args[1], "[{0}]".format(Constants.ERROR_ADDED_TO_STATUS))
 
+    def test_auto_assessment_prefetches_packages_planned_for_installation(self):
+        self.download_commands = []
+        self.download_exit_code = 0
+
+        def mock_run_package_manager_command(command, line_parser=None):
+            if "--download-only" in command:
+                self.download_commands.append(command)
+                return self.download_exit_code, ""
+            return original_run_package_manager_command(command, line_parser)
+        original_run_package_manager_command = self.runtime.package_manager.run_package_manager_command
+        self.runtime.package_manager.run_package_manager_command = mock_run_package_manager_command
+        self.runtime.execution_config.exec_auto_assess_only = True
+        self.runtime.patch_assessor.should_auto_assessment_run = lambda: True
+
+        # nothing is downloaded until an installation operation saved its filter
+        self.assertTrue(self.runtime.patch_assessor.start_assessment())
+        self.assertEqual(self.download_commands, [])
+
+        self.runtime.execution_config.excluded_package_name_mask_list = ["samba-libs"]
+        self.runtime.patch_assessor.package_prefetcher.save_installation_filter()
+        self.assertTrue(self.runtime.patch_assessor.start_assessment())
+        self.assertEqual(len(self.download_commands), 1)
+        self.assertTrue("Dl-Limit=" + str(Constants.PackagePrefetchConfig.MAX_BANDWIDTH_IN_KBPS) + " install " in self.download_commands[0])
+        self.assertTrue(" python-samba=" in self.download_commands[0] and " samba-libs=" not in self.download_commands[0])
+
+        # staged packages are recorded for the installation
+        with open(os.path.join(self.runtime.execution_config.config_folder, Constants.PACKAGE_PREFETCH_STATE_FILE), 'r') as file_handle:
+            staged_packages = json.load(file_handle)['stagedPackages']
+        self.assertTrue(len(staged_packages) > 0)
+        packages, package_versions = list(staged_packages.keys()), list(staged_packages.values())
+        self.assertEqual(self.runtime.patch_installer.package_prefetcher.get_staged_packages(packages + ["other"], package_versions + ["1.0"]), packages)
+
+        # nothing is recorded as staged if the download fails
+        self.download_exit_code = 100
+        self.assertTrue(self.runtime.patch_assessor.start_assessment())
+        self.assertEqual(self.runtime.patch_assessor.package_prefetcher.get_staged_packages(packages, package_versions), [])
+
     def raise_ex(self):
         raise Exception()
 
@@ -18,9 +18,14 @@ import datetime
 import json
 import math
 import os
+import re
+import shutil
 import sys
+import tempfile
+import time
 import unittest
 from core.src.bootstrap.Constants import Constants
+from core.src.bootstrap.EnvLayer import EnvLayer
 from core.tests.Test_UbuntuProClient import MockUpdatesResult, MockVersionResult
 from core.tests.library.ArgumentComposer import ArgumentComposer
 from core.tests.library.RuntimeCompositor import RuntimeCompositor
@@ -108,6 +113,7 @@ class TestPatchInstaller(unittest.TestCase):
         }
         self.__write_config_settings_to_file(config_settings, config_file_path=config_file_path)
         runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, package_manager_name)
+        Constants.MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS = 0     # the status file is inspected right after in-memory updates
         return runtime
 
     @staticmethod
@@ -809,6 +815,435 @@ class TestPatchInstaller(unittest.TestCase):
         self.assertEqual(calculated_max_batch_size, expected_max_batch_size)
         runtime.stop()
 
+    def test_status_reconciliation_from_installed_state_delta(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        runtime.status_handler.set_current_operation(Constants.INSTALLATION)
+        patch_installer = runtime.patch_installer
+        installed_packages = {'git': ['1:2.7.4-0ubuntu1'], 'libc6': ['2.23-0ubuntu10'], 'curl': ['7.47.0-1ubuntu2']}
+        runtime.package_manager.get_installed_packages_snapshot = lambda: installed_packages
+        self.get_all_updates_call_count = 0
+
+        def mock_get_all_updates(cached=False):
+            self.get_all_updates_call_count += 1
+            return ['curl'], ['7.47.0-1ubuntu2.2']
+        runtime.package_manager.get_all_updates = mock_get_all_updates
+
+        patch_installer.last_still_needed_packages = ['git', 'libc6', 'curl']
+        patch_installer.last_still_needed_package_versions = ['1:2.7.4-0ubuntu1.6', '2.23-0ubuntu11', '7.47.0-1ubuntu2.2']
+        patch_installer.reconciliation_checkpoint = patch_installer.get_reconciliation_checkpoint(runtime.package_manager)
+
+        # required versions now installed are picked up without a full evaluation
+        installed_packages['git'] = ['1:2.7.4-0ubuntu1.6']
+        installed_packages['libc6'] = ['2.23-0ubuntu11']
+        self.assertEqual(patch_installer.perform_status_reconciliation_conditionally(runtime.package_manager), 2)
+        self.assertEqual(self.get_all_updates_call_count, 0)
+        self.assertEqual(patch_installer.last_still_needed_packages, ['curl'])
+        self.assertEqual(patch_installer.perform_status_reconciliation_conditionally(runtime.package_manager), 0)
+        self.assertEqual(self.get_all_updates_call_count, 0)
+
+        # an unexpected version change falls back to a full evaluation
+        installed_packages['curl'] = ['7.47.0-1ubuntu2.1']
+        self.assertEqual(patch_installer.perform_status_reconciliation_conditionally(runtime.package_manager), 0)
+        self.assertEqual(self.get_all_updates_call_count, 1)
+        self.assertEqual(patch_installer.reconciliation_checkpoint, {'curl': ['7.47.0-1ubuntu2.1']})
+
+        # no installed package database falls back to a full evaluation
+        runtime.package_manager.get_installed_packages_snapshot = lambda: {}
+        self.assertEqual(patch_installer.perform_status_reconciliation_conditionally(runtime.package_manager), 0)
+        self.assertEqual(self.get_all_updates_call_count, 2)
+        runtime.stop()
+
+    def test_failed_batch_is_bisected_along_dependency_components(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        runtime.status_handler.set_current_operation(Constants.INSTALLATION)
+        patch_installer = runtime.patch_installer
+        package_manager = runtime.package_manager
+        packages = ["pkg" + str(index) for index in range(0, 16)]
+        package_versions = ["1.0." + str(index) for index in range(0, 16)]
+        bad_packages = ["pkg5", "pkg11"]
+        dependencies = {"pkg5": ["libshared"], "pkg6": ["libshared"], "pkg7": ["libshared"]}     # pkg5, pkg6 and pkg7 are a connected component
+        self.install_calls = []
+
+        def mock_install_update_and_dependencies(package_and_dependencies, package_and_dependency_versions, simulate=False):
+            self.install_calls.append(list(package_and_dependencies))
+            return (100 if any(package in bad_packages for package in package_and_dependencies) else 0), "", "install"     # apt fails the whole transaction
+        package_manager.install_update_and_dependencies = mock_install_update_and_dependencies
+        package_manager.get_installation_status = lambda code, out, exec_cmd, package, version, simulate=False: Constants.FAILED if code != 0 else Constants.INSTALLED
+        package_manager.get_dependent_list = lambda packages_to_resolve: [dependency for package in packages_to_resolve for dependency in dependencies.get(package, [])]
+        package_manager.add_arch_dependencies = lambda *args: None
+        package_manager.is_reboot_pending = lambda: False
+
+        patch_installer.last_still_needed_packages = list(packages)
+        patch_installer.last_still_needed_package_versions = list(package_versions)
+        installed_update_count, failed_packages, failed_package_versions, not_attempted_packages, not_attempted_package_versions = patch_installer.install_batch_and_bisect_failures(
+            packages, package_versions, packages, package_versions, list(packages), list(package_versions), runtime.maintenance_window, package_manager)
+
+        self.assertEqual(failed_packages, bad_packages)
+        self.assertEqual(failed_package_versions, ["1.0.5", "1.0.11"])
+        self.assertEqual(not_attempted_packages, [])
+        self.assertEqual(installed_update_count, 14)
+        self.assertEqual(patch_installer.last_still_needed_packages, bad_packages)
+        self.assertTrue(["pkg5"] in self.install_calls and ["pkg11"] in self.install_calls)
+        self.assertTrue(len(self.install_calls) < len(packages))
+        self.assertTrue(all(not ("pkg5" in install_call) or ("pkg6" in install_call and "pkg7" in install_call) for install_call in self.install_calls if len(install_call) > 3))    # component is not split up until needed
+
+        # failures are only marked once isolated
+        self.assertEqual(patch_installer.failed_parent_package_install_count, 2)
+        self.assertEqual(patch_installer.successful_parent_package_install_count, 14)
+        runtime.stop()
+
+    def test_excluded_updates_are_evaluated_with_few_dependency_resolutions(self):
+        argument_composer = ArgumentComposer()
+        argument_composer.patches_to_exclude = ["libexcluded", "pkg7"]
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.APT)
+        patch_installer = runtime.patch_installer
+        package_manager = runtime.package_manager
+        packages = ["pkg" + str(index) for index in range(0, 500)]
+        package_versions = ["1.0." + str(index) for index in range(0, 500)]
+        dependencies = {"pkg42": ["libexcluded"], "pkg43": ["libshared"], "pkg300": ["pkg7"]}    # pkg300 depends on a package that is excluded by itself
+        self.resolved_package_sets = []
+
+        def mock_get_dependent_list(packages_to_resolve):
+            self.resolved_package_sets.append(list(packages_to_resolve))
+            return sorted(set(dependency for package in packages_to_resolve for dependency in dependencies.get(package, []) if dependency not in packages_to_resolve))
+        package_manager.get_dependent_list = mock_get_dependent_list
+
+        excluded_packages, excluded_package_versions = patch_installer.get_excluded_updates(package_manager, packages, package_versions)
+        self.assertEqual(excluded_packages, ["pkg7", "pkg42", "pkg300"])
+        self.assertEqual(excluded_package_versions, ["1.0.7", "1.0.42", "1.0.300"])
+        self.assertEqual(len(self.resolved_package_sets[0]), 499)      # all candidates are resolved together first
+        self.assertTrue(len(self.resolved_package_sets) < 40)
+
+        # later queries are answered from the graph, until the package database changes
+        resolution_count = len(self.resolved_package_sets)
+        self.assertEqual(package_manager.dependency_graph.get_dependent_list(["pkg42"]), ["libexcluded"])
+        self.assertEqual(len(self.resolved_package_sets), resolution_count)
+        package_manager.command_result_cache.invalidate()
+        self.assertEqual(package_manager.dependency_graph.get_dependent_list(["pkg42"]), ["libexcluded"])
+        self.assertEqual(len(self.resolved_package_sets), resolution_count + 1)
+
+        # without anything excluded through dependencies, one resolution answers for all packages
+        dependencies = {}
+        self.resolved_package_sets = []
+        self.assertEqual(patch_installer.get_excluded_updates(package_manager, packages, package_versions)[0], ["pkg7"])
+        self.assertEqual(len(self.resolved_package_sets), 1)
+        runtime.stop()
+
+    def test_batch_install_stops_once_a_command_runs_past_the_deadline(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        runtime.status_handler.set_current_operation(Constants.INSTALLATION)
+        patch_installer = runtime.patch_installer
+        package_manager = runtime.package_manager
+        packages = ["pkg" + str(index) for index in range(0, 8)]
+        package_versions = ["1.0." + str(index) for index in range(0, 8)]
+        self.install_calls = []
+
+        def mock_install_update_and_dependencies(package_and_dependencies, package_and_dependency_versions, simulate=False):
+            self.install_calls.append(list(package_and_dependencies))
+            runtime.env_layer.timed_out_commands.append({'command': 'install', 'timeLimitInSecs': 60, 'timestamp': 0})     # as recorded by the env layer when it ends a command
+            return Constants.CommandDeadlineConfig.TIMED_OUT_EXIT_CODE, "", "install"
+        package_manager.install_update_and_dependencies = mock_install_update_and_dependencies
+        package_manager.get_installation_status = lambda code, out, exec_cmd, package, version, simulate=False: Constants.FAILED if code != 0 else Constants.INSTALLED
+        package_manager.get_dependent_list = lambda packages_to_resolve: []
+        package_manager.add_arch_dependencies = lambda *args: None
+        package_manager.is_reboot_pending = lambda: False
+
+        patch_installer.timed_out_command_count_at_start = len(runtime.env_layer.timed_out_commands)
+        patch_installer.last_still_needed_packages = list(packages)
+        patch_installer.last_still_needed_package_versions = list(package_versions)
+        installed_update_count, failed_packages, failed_package_versions, not_attempted_packages, not_attempted_package_versions = patch_installer.install_batch_and_bisect_failures(
+            packages, package_versions, packages, package_versions, list(packages), list(package_versions), runtime.maintenance_window, package_manager)
+
+        # the failed batch is not bisected, and its packages are left for after the reboot
+        self.assertEqual(len(self.install_calls), 1)
+        self.assertEqual(sorted(not_attempted_packages), packages)
+        self.assertEqual(failed_packages, [])
+        self.assertEqual(installed_update_count, 0)
+        self.assertTrue(patch_installer.is_command_deadline_exceeded())
+
+        # the time limit for commands leaves time for a reboot
+        reboot_buffer_in_minutes = 0 if Constants.REBOOT_SETTINGS[runtime.execution_config.reboot_setting] == Constants.REBOOT_NEVER else Constants.REBOOT_BUFFER_IN_MINUTES
+        self.assertAlmostEqual(runtime.maintenance_window.get_command_time_limit_in_secs(), (runtime.maintenance_window.get_remaining_time_in_minutes() - reboot_buffer_in_minutes) * 60, delta=5)
+        runtime.stop()
+
+    @unittest.skipIf(os.name != 'posix', "Process groups are POSIX only")
+    def test_install_command_running_past_the_command_time_limit_is_not_ended(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        backup_grace_period = Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS
+        Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS = 0.3
+        package_manager = runtime.package_manager
+        package_manager.env_layer = EnvLayer()      # commands run for real
+        package_manager.env_layer.set_command_time_limit_provider(lambda: 0.3)
+        package_manager.single_package_upgrade_cmd = "sleep 1; echo Setting up "
+        try:
+            # ending an install midway would leave the package database broken, so it runs to completion
+            code, out, exec_cmd = package_manager.install_update_and_dependencies(["pkg1"], ["1.0"])
+            self.assertEqual(code, 0)
+            self.assertTrue("Setting up pkg1" in out)
+            self.assertEqual(package_manager.env_layer.timed_out_commands, [])
+
+            # other commands are still ended
+            out, code = package_manager.invoke_package_manager_advanced("sleep 1; echo done", raise_on_exception=False)
+            self.assertEqual(code, Constants.CommandDeadlineConfig.TIMED_OUT_EXIT_CODE)
+            self.assertEqual([timed_out_command['command'] for timed_out_command in package_manager.env_layer.timed_out_commands], ["sleep 1; echo done"])
+        finally:
+            package_manager.env_layer.set_command_time_limit_provider(None)
+            Constants.CommandDeadlineConfig.TERMINATION_GRACE_PERIOD_IN_SECS = backup_grace_period
+            runtime.stop()
+
+    def test_final_status_reconciliation_is_not_time_limited(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        patch_installer = runtime.patch_installer
+        package_manager = runtime.package_manager
+        patch_installer.last_still_needed_packages, patch_installer.last_still_needed_package_versions = ["pkg1", "pkg2"], ["1.0", "2.0"]
+        patch_installer.get_reconciled_packages_from_checkpoint = lambda package_manager: (None, None)     # full reconciliation
+        self.time_limits_in_secs = []
+
+        def mock_get_all_updates(cached=True):
+            self.time_limits_in_secs.append(runtime.env_layer._EnvLayer__get_command_time_limit_in_secs())
+            return ["pkg2"], ["2.0"]
+        package_manager.get_all_updates = mock_get_all_updates
+
+        # past the maintenance window cutoff, commands only get the minimum time limit - the periodic reconciliation between installs has it too
+        runtime.env_layer.set_command_time_limit_provider(lambda: Constants.CommandDeadlineConfig.MIN_TIME_LIMIT_IN_SECS)
+        self.assertEqual(patch_installer.perform_status_reconciliation_conditionally(package_manager, True), 1)
+        self.assertEqual(patch_installer.perform_final_status_reconciliation(package_manager), 0)
+        self.assertEqual(self.time_limits_in_secs, [Constants.CommandDeadlineConfig.MIN_TIME_LIMIT_IN_SECS, None])
+        self.assertEqual(runtime.env_layer._EnvLayer__get_command_time_limit_in_secs(), Constants.CommandDeadlineConfig.MIN_TIME_LIMIT_IN_SECS)
+        runtime.env_layer.set_command_time_limit_provider(None)
+        runtime.stop()
+
+    def test_next_batch_is_downloaded_while_the_current_batch_installs(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        backup_min_free_disk_space_in_mb = Constants.BatchDownloadPipelineConfig.MIN_FREE_DISK_SPACE_IN_MB
+        Constants.BatchDownloadPipelineConfig.MIN_FREE_DISK_SPACE_IN_MB = 0
+        runtime.status_handler.set_current_operation(Constants.INSTALLATION)
+        patch_installer = runtime.patch_installer
+        package_manager = runtime.package_manager
+        package_manager.package_cache_path = tempfile.mkdtemp()
+        packages = ["pkg" + str(index) for index in range(0, 6)]
+        package_versions = ["1.0." + str(index) for index in range(0, 6)]
+        self.install_calls, self.download_commands, self.cached_files_at_install = [], [], []
+
+        def mock_install_update_and_dependencies(package_and_dependencies, package_and_dependency_versions, simulate=False):
+            self.install_calls.append(list(package_and_dependencies))
+            self.cached_files_at_install.append(sorted(os.listdir(package_manager.package_cache_path)))
+            runtime.backup_time_sleep(0.2)
+            return 0, "", "install"
+
+        def mock_run_command_output_cancellable(cmd, cancellation_event, chk_err=True):
+            self.download_commands.append(cmd)
+            download_dir = re.search(r'Dir::Cache::archives=(\S+)', cmd).group(1)
+            for package in re.findall(r'(pkg\d+)=', cmd):
+                with open(os.path.join(download_dir, package + ".deb"), 'w') as file_handle:
+                    file_handle.write(package)
+            if cancellation_event.wait(0.1):
+                return Constants.CommandDeadlineConfig.CANCELLED_EXIT_CODE, "[Command cancelled]"
+            return 0, ""
+        package_manager.install_update_and_dependencies = mock_install_update_and_dependencies
+        runtime.env_layer.run_command_output_cancellable = mock_run_command_output_cancellable
+        package_manager.get_installation_status = lambda code, out, exec_cmd, package, version, simulate=False: Constants.FAILED if code != 0 else Constants.INSTALLED
+        package_manager.get_dependent_list = lambda packages_to_resolve: []
+        package_manager.add_arch_dependencies = lambda *args: None
+        package_manager.is_reboot_pending = lambda: False
+        patch_installer.perform_status_reconciliation_conditionally = lambda *args, **kwargs: 0
+
+        # each batch installs from the package manager's cache, downloaded while the previous batch installed
+        patch_installer.last_still_needed_packages = list(packages)
+        patch_installer.last_still_needed_package_versions = list(package_versions)
+        installed_update_count, patch_installation_successful, maintenance_window_batch_cutoff_reached, remaining_packages, remaining_package_versions = patch_installer.install_packages_in_batches(
+            packages, package_versions, packages, package_versions, runtime.maintenance_window, package_manager, 2)
+        self.assertEqual(self.install_calls, [["pkg0", "pkg1"], ["pkg2", "pkg3"], ["pkg4", "pkg5"]])
+        self.assertEqual(len(self.download_commands), 2)
+        self.assertTrue("Debug::NoLocking=true" in self.download_commands[0] and "pkg2=1.0.2 pkg3=1.0.3" in self.download_commands[0])
+        self.assertEqual(self.cached_files_at_install, [[], ["pkg2.deb", "pkg3.deb"], ["pkg2.deb", "pkg3.deb", "pkg4.deb", "pkg5.deb"]])
+        self.assertFalse(os.path.exists(patch_installer.batch_download_pipeline.download_dir))
+        self.assertTrue(patch_installation_successful and not maintenance_window_batch_cutoff_reached)
+        self.assertTrue(patch_installer.batch_download_pipeline.get_overlap_in_secs(0, time.time()) > 0)
+
+        # the download is cancelled and discarded if the next batch is past the maintenance window cutoff
+        shutil.rmtree(package_manager.package_cache_path)
+        os.mkdir(package_manager.package_cache_path)
+        self.install_calls, self.download_commands, self.cached_files_at_install = [], [], []
+        install_time_checks = []
+        runtime.maintenance_window.is_package_install_time_available = lambda *args: install_time_checks.append(args) is None and len(install_time_checks) < 2
+        patch_installer.last_still_needed_packages = list(packages)
+        patch_installer.last_still_needed_package_versions = list(package_versions)
+        installed_update_count, patch_installation_successful, maintenance_window_batch_cutoff_reached, remaining_packages, remaining_package_versions = patch_installer.install_packages_in_batches(
+            packages, package_versions, packages, package_versions, runtime.maintenance_window, package_manager, 2)
+        self.assertEqual(self.install_calls, [["pkg0", "pkg1"]])
+        self.assertEqual(len(self.download_commands), 1)
+        self.assertTrue(maintenance_window_batch_cutoff_reached)
+        self.assertEqual(remaining_packages, ["pkg2", "pkg3", "pkg4", "pkg5"])
+        self.assertEqual(os.listdir(package_manager.package_cache_path), [])
+        self.assertFalse(os.path.exists(patch_installer.batch_download_pipeline.download_dir))
+
+        shutil.rmtree(package_manager.package_cache_path)
+        Constants.BatchDownloadPipelineConfig.MIN_FREE_DISK_SPACE_IN_MB = backup_min_free_disk_space_in_mb
+        runtime.stop()
+
+    def test_install_queue_puts_inclusions_then_security_then_cheapest_packages_first(self):
+        argument_composer = ArgumentComposer()
+        argument_composer.classifications_to_include = ["Security", "Other"]
+        argument_composer.patches_to_include = ["pkg-included"]
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.APT)
+        patch_installer = runtime.patch_installer
+        package_manager = runtime.package_manager
+        package_manager.record_package_install_duration(["sec-slow"], 3600, "sec-slow")
+        package_manager.record_package_install_duration(["sec-fast"], 1, "sec-fast")
+        package_manager.record_package_install_duration(["other-b"], 1, "other-b")
+
+        packages = ["other-a", "sec-slow", "other-b", "pkg-included", "sec-unknown", "sec-fast"]
+        package_versions = ["1.0." + str(index) for index in range(0, len(packages))]
+        queued_packages, queued_package_versions = patch_installer.get_prioritized_install_queue(package_manager, packages, package_versions, ["sec-slow", "sec-unknown", "sec-fast"])
+        self.assertEqual(queued_packages, ["pkg-included", "sec-fast", "sec-unknown", "sec-slow", "other-b", "other-a"])
+        self.assertEqual(queued_package_versions, ["1.0.3", "1.0.5", "1.0.4", "1.0.1", "1.0.2", "1.0.0"])
+
+        # packages that are equal on all criteria keep their order
+        self.assertEqual(patch_installer.get_prioritized_install_queue(package_manager, ["b", "a", "c"], ["1", "2", "3"], []), (["b", "a", "c"], ["1", "2", "3"]))
+        runtime.stop()
+
+    def test_install_plan_predicts_completion_and_cutoffs(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        patch_installer = runtime.patch_installer
+        package_manager = runtime.package_manager
+        packages = ["pkg" + str(index) for index in range(0, 30)] + ["linux-image-generic"]
+        package_versions = ["1.0." + str(index) for index in range(0, len(packages))]
+        all_packages, all_package_versions = packages + ["libshared"], package_versions + ["2.0"]
+        package_manager.get_package_install_time_estimates_in_seconds = lambda packages_to_estimate=None: (60, 120)
+        package_manager.get_dependent_list = lambda packages_to_resolve: ["libshared"] if "pkg0" in packages_to_resolve else []
+        package_manager.is_reboot_pending = lambda: False
+
+        # everything fits in a long enough window
+        runtime.maintenance_window.get_remaining_time_in_minutes = lambda *args, **kwargs: 240
+        plan = patch_installer.get_install_plan(runtime.maintenance_window, package_manager, all_packages, all_package_versions, packages, package_versions, ["pkg-excluded"])
+        self.assertEqual(plan.get_planned_packages(), packages)
+        self.assertEqual(plan.cut_off_packages, [])
+        self.assertEqual(plan.installs[0]['transactionSize'], len(packages) + 1)    # with the dependency
+        self.assertEqual(plan.get_expected_duration_in_secs(), 60 * (len(packages) + 1))
+        self.assertEqual(plan.get_predicted_completion_time() - plan.start_time, datetime.timedelta(seconds=60 * (len(packages) + 1)))
+        self.assertEqual(plan.reboot_likelihood, "Likely")
+        self.assertEqual(plan.to_dict()['excludedPackages'], ["pkg-excluded"])
+
+        # a short window leaves the last packages out, after falling back to installs of their own
+        runtime.maintenance_window.get_remaining_time_in_minutes = lambda *args, **kwargs: 20
+        plan = patch_installer.get_install_plan(runtime.maintenance_window, package_manager, all_packages, all_package_versions, packages, package_versions)
+        self.assertTrue(len(plan.cut_off_packages) > 0 and "linux-image-generic" in plan.cut_off_packages)
+        self.assertEqual(plan.get_planned_packages() + plan.cut_off_packages, packages)
+        self.assertTrue(plan.installs[-1]['isSequential'])
+        self.assertTrue(plan.get_expected_duration_in_secs() <= 20 * 60)
+        self.assertEqual(plan.reboot_likelihood, "Unlikely")
+
+        # the completion estimate follows progress
+        patch_installer.install_plan = plan
+        patch_installer.last_still_needed_packages = list(packages)
+        estimate_with_all_packages_needed = patch_installer.get_completion_estimate()
+        patch_installer.last_still_needed_packages = packages[len(packages) // 2:]
+        self.assertTrue(patch_installer.get_completion_estimate() < estimate_with_all_packages_needed)
+        runtime.stop()
+
+    def test_installation_resumes_from_the_journal_after_a_crash(self):
+        runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.APT)
+        runtime.status_handler.set_current_operation(Constants.INSTALLATION)
+        patch_installer = runtime.patch_installer
+        package_manager = runtime.package_manager
+        packages = ["pkg" + str(index) for index in range(0, 6)]
+        package_versions = ["1.0." + str(index) for index in range(0, 6)]
+        self.still_needed_packages, self.install_calls, self.refresh_count, self.crash_on_package = list(packages), [], 0, "pkg2"
+        self.database_fingerprint = "fingerprint0"
+
+        def mock_refresh_repo():
+            self.refresh_count += 1
+
+        def mock_install_update_and_dependencies(package_and_dependencies, package_and_dependency_versions, simulate=False):
+            if self.crash_on_package in package_and_dependencies:
+                raise Exception("Process ended")
+            self.install_calls.append(list(package_and_dependencies))
+            self.still_needed_packages = [package for package in self.still_needed_packages if package not in package_and_dependencies]
+            self.database_fingerprint = "fingerprint" + str(len(self.install_calls))
+            return 0, "", "install"
+        package_manager.refresh_repo = mock_refresh_repo
+        package_manager.get_available_updates = lambda package_filter: (list(self.still_needed_packages), [version for package, version in zip(packages, package_versions) if package in self.still_needed_packages])
+        package_manager.get_all_updates = lambda cached=False: package_manager.get_available_updates(None)
+        package_manager.get_security_updates = lambda: (["pkg5"], ["1.0.5"])
+        package_manager.set_security_esm_package_status = lambda operation, packages_to_set: None
+        package_manager.install_update_and_dependencies = mock_install_update_and_dependencies
+        package_manager.get_installation_status = lambda code, out, exec_cmd, package, version, simulate=False: Constants.INSTALLED
+        package_manager.get_dependent_list = lambda packages_to_resolve: []
+        package_manager.add_arch_dependencies = lambda *args: None
+        package_manager.is_reboot_pending = lambda: False
+        package_manager.command_result_cache.get_database_fingerprint = lambda: self.database_fingerprint
+        patch_installer.get_max_batch_size = lambda *args: 2
+        patch_installer.perform_status_reconciliation_conditionally = lambda *args, **kwargs: 0
+
+        # the run is journaled as planned, and checkpointed after each batch - the crash is in the second one
+        self.assertRaises(Exception, patch_installer.install_updates, runtime.maintenance_window, package_manager)
+        journal_file_path = patch_installer.installation_journal.journal_file_path
+        with open(journal_file_path, 'r') as file_handle:
+            records = [json.loads(line) for line in file_handle.readlines()]
+        self.assertEqual([record['type'] for record in records], ["plan", "checkpoint"])
+        self.assertEqual(records[0]['run']['packages'][0], "pkg5")      # security first
+        self.assertEqual(records[1]['installedPackages'], ["pkg0", "pkg5"])
+        self.assertEqual(records[1]['fingerprint'], "fingerprint1")
+
+        # the next run picks up after the last checkpoint, without refreshing the repositories or planning again
+        self.crash_on_package = None
+        patch_installer.get_install_plan = lambda *args, **kwargs: self.fail("Resumed run was planned again")
+        installed_update_count, patch_installation_successful, maintenance_window_exceeded = patch_installer.install_updates(runtime.maintenance_window, package_manager)
+        self.assertEqual(self.refresh_count, 1)
+        self.assertEqual(sorted(package for install_call in self.install_calls[1:] for package in install_call), ["pkg1", "pkg2", "pkg3", "pkg4"])
+        self.assertEqual((installed_update_count, patch_installation_successful, maintenance_window_exceeded), (4, True, False))
+        self.assertEqual(sorted(patch_installer.last_still_needed_packages), [])
+        with open(runtime.execution_config.status_file_path, 'r') as file_handle:
+            substatus_file_data = json.loads(json.load(file_handle)[0]["status"]["substatus"][0]["formattedMessage"]["message"])["patches"]
+        self.assertEqual(sorted(patch["name"] for patch in substatus_file_data if patch["patchInstallationState"] == Constants.INSTALLED), packages)
+        with open(journal_file_path, 'r') as file_handle:
+            self.assertEqual(json.loads(file_handle.readlines()[-1])['type'], "completed")
+
+        # a completed run is not resumed, and neither is a run the package database changed under since its last checkpoint
+        self.assertEqual(patch_installer.installation_journal.get_resumable_run(patch_installer.package_manager_name, self.database_fingerprint), None)
+        self.still_needed_packages, self.crash_on_package = list(packages), "pkg2"
+        del patch_installer.get_install_plan
+        self.assertRaises(Exception, patch_installer.install_updates, runtime.maintenance_window, package_manager)
+        self.assertEqual(self.refresh_count, 2)
+        self.assertNotEqual(patch_installer.installation_journal.get_resumable_run(patch_installer.package_manager_name, self.database_fingerprint), None)
+        self.assertEqual(patch_installer.installation_journal.get_resumable_run(patch_installer.package_manager_name, "fingerprint-changed"), None)
+        self.assertEqual(patch_installer.installation_journal.get_resumable_run("yum", self.database_fingerprint), None)
+        runtime.stop()
+
+    def test_installation_with_the_result_cache_journal_and_download_pipeline_as_shipped(self):
+        argument_composer = ArgumentComposer()
+        argument_composer.maximum_duration = "PT235M"
+        runtime = RuntimeCompositor(argument_composer.get_composed_arguments(), True, Constants.APT)
+        runtime.set_legacy_test_type('SuccessInstallPath')
+        backup_min_free_disk_space_in_mb = Constants.BatchDownloadPipelineConfig.MIN_FREE_DISK_SPACE_IN_MB
+        Constants.BatchDownloadPipelineConfig.MIN_FREE_DISK_SPACE_IN_MB = 0
+        patch_installer = runtime.patch_installer
+        package_manager = runtime.package_manager
+        package_manager.package_cache_path = tempfile.mkdtemp()
+        patch_installer.get_max_batch_size = lambda *args: 1    # for the next batch to be downloaded alongside each install
+        self.downloaded_packages = []
+
+        def mock_finish(original_finish=patch_installer.batch_download_pipeline.finish):
+            downloaded_packages = original_finish()
+            self.downloaded_packages += downloaded_packages
+            return downloaded_packages
+        patch_installer.batch_download_pipeline.finish = mock_finish
+
+        self.assertTrue(patch_installer.start_installation())
+        self.assertEqual(self.downloaded_packages, ["samba-common-bin", "samba-libs"])
+        self.assertFalse(os.path.exists(patch_installer.batch_download_pipeline.download_dir))
+        self.assertTrue(package_manager.command_result_cache.miss_count > 0)
+        with open(patch_installer.installation_journal.journal_file_path, 'r') as file_handle:
+            self.assertEqual([json.loads(line)['type'] for line in file_handle.readlines()], ["plan", "checkpoint", "checkpoint", "checkpoint", "completed"])
+        with open(runtime.execution_config.status_file_path, 'r') as file_handle:
+            substatus_file_data = json.loads(json.load(file_handle)[0]["status"]["substatus"][0]["formattedMessage"]["message"])["patches"]
+        self.assertEqual(sorted(patch["name"] for patch in substatus_file_data if patch["patchInstallationState"] == Constants.INSTALLED), ["python-samba", "samba-common-bin", "samba-libs"])
+
+        shutil.rmtree(package_manager.package_cache_path)
+        Constants.BatchDownloadPipelineConfig.MIN_FREE_DISK_SPACE_IN_MB = backup_min_free_disk_space_in_mb
+        runtime.stop()
+
     # region test update certs
     def test_try_update_certificates__with_various_use_cases(self):
         """Test update certificate flow using consolidated use cases without losing scenario coverage."""
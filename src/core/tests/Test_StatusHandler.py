@@ -28,6 +28,7 @@ class TestStatusHandler(unittest.TestCase):
     def setUp(self):
         self.runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True)
         self.container = self.runtime.container
+        Constants.MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS = 0     # the status file is inspected right after in-memory updates
 
     def tearDown(self):
         self.runtime.stop()
@@ -457,6 +458,55 @@ class TestStatusHandler(unittest.TestCase):
         self.runtime.execution_config.complete_status_file_path = self.old_complete_status_path
         self.runtime.execution_config.status_file_path = self.old_status_path
 
+    def test_status_file_writes_coalesced_until_flush_or_terminal_status(self):
+        self.runtime.status_handler.set_current_operation(Constants.INSTALLATION)
+        written_file_paths = []
+        backup_write_with_retry_using_temp_file = self.runtime.env_layer.file_system.write_with_retry_using_temp_file
+
+        def mock_write_with_retry_using_temp_file(file_path, data, mode='w'):
+            written_file_paths.append(file_path)
+            backup_write_with_retry_using_temp_file(file_path, data, mode)
+
+        backup_min_write_interval = Constants.MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS
+        Constants.MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS = 300
+        self.runtime.env_layer.file_system.write_with_retry_using_temp_file = mock_write_with_retry_using_temp_file
+        try:
+            self.runtime.status_handler.set_installation_substatus_json()   # write interval starts from here
+            del written_file_paths[:]
+
+            # per-package updates are held in memory
+            for package_name in ["python-samba", "samba-common-bin", "samba-libs"]:
+                self.runtime.status_handler.set_package_install_status(package_name, "2:4.4.5+dfsg-2ubuntu5.4", Constants.PENDING)
+                self.runtime.status_handler.set_package_install_status(package_name, "2:4.4.5+dfsg-2ubuntu5.4", Constants.INSTALLED)
+            self.runtime.status_handler.add_error_to_status("Coalesced error", Constants.PatchOperationErrorCodes.DEFAULT_ERROR)
+            self.assertEqual(len(written_file_paths), 0)
+            with self.runtime.env_layer.file_system.open(self.runtime.execution_config.status_file_path, 'r') as file_handle:
+                substatus_file_data = json.load(file_handle)[0]["status"]["substatus"][0]
+            self.assertEqual(len(json.loads(substatus_file_data["formattedMessage"]["message"])["patches"]), 0)
+
+            # an explicit flush writes everything out once, and is a no-op when there is nothing pending
+            with self.runtime.patch_installer:
+                pass
+            self.runtime.patch_installer.flush()
+            self.assertEqual(len(written_file_paths), 2)   # complete status file + status file
+            with self.runtime.env_layer.file_system.open(self.runtime.execution_config.status_file_path, 'r') as file_handle:
+                substatus_file_data = json.load(file_handle)[0]["status"]["substatus"][0]
+            message = json.loads(substatus_file_data["formattedMessage"]["message"])
+            self.assertEqual(message["installedPatchCount"], 3)
+            self.assertEqual(len(message["errors"]["details"]), 1)
+
+            # terminal states are never held back
+            self.runtime.status_handler.set_package_install_status("python-samba", "2:4.4.5+dfsg-2ubuntu5.4", Constants.FAILED)
+            self.runtime.status_handler.set_installation_substatus_json(status=Constants.STATUS_ERROR)
+            self.assertEqual(len(written_file_paths), 4)
+            with self.runtime.env_layer.file_system.open(self.runtime.execution_config.status_file_path, 'r') as file_handle:
+                substatus_file_data = json.load(file_handle)[0]["status"]["substatus"][0]
+            self.assertEqual(substatus_file_data["status"], Constants.STATUS_ERROR.lower())
+            self.assertEqual(json.loads(substatus_file_data["formattedMessage"]["message"])["failedPatchCount"], 1)
+        finally:
+            Constants.MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS = backup_min_write_interval
+            self.runtime.env_layer.file_system.write_with_retry_using_temp_file = backup_write_with_retry_using_temp_file
+
     def test_assessment_packages_map(self):
         patch_count_for_test = 5
         expected_patch_id = 'python-samba0_2:4.4.5+dfsg-2ubuntu5.4_Ubuntu_16.04'
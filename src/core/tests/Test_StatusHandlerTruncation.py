@@ -36,6 +36,7 @@ class TestStatusHandlerTruncation(unittest.TestCase):
     def setUp(self):
         self.runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True)
         self.container = self.runtime.container
+        Constants.MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS = 0     # the status file is inspected right after in-memory updates
         self.__test_scenario = None
         self.__patch_count_assessment = 0
         self.__patch_count_installation = 0
@@ -738,6 +739,26 @@ class TestStatusHandlerTruncation(unittest.TestCase):
         self.runtime.status_handler.composite_logger.log_debug('performance_time_formatted_with_truncation ' + performance_time_formatted_with_truncation)
         self.assertTrue((performance_time_with_truncation - performance_time_no_truncation) < TestStatusHandlerTruncation.TimePerformanceUTConfig.EXPECTED_TRUNCATION_TIME_LIMIT_IN_SEC)
 
+    def test_patches_payload_size_from_prefix_sums_matches_serialized_size(self):
+        """ The size of patches[:i] derived from the prefix sums is that of the patches serialized twice over, as they are in the status file,
+        including for names and versions with quotes, backslashes, control and non-ascii chars - and for slices of the prefix sums """
+        status_handler = self.runtime.status_handler
+        names = ['python-samba', 'pkg"with"quotes', 'pkg\\with\\backslashes', u'pkg-éè-中文', 'pkg\twith\ncontrol', u'pkg-"\\ü"']
+        versions = ['2:4.4.5+dfsg-2ubuntu5.4', '1.0"beta"', '2.0\\1', u'3.0-ß', '4.0\x01', u'☃\\"']
+        patches = []
+        for index, (name, version) in enumerate(zip(names, versions)):
+            patches.append({"patchId": u"{0}_{1}_Ubuntu_16.04".format(name, version), "name": name, "version": version,
+                            "classifications": ["Security" if index % 2 == 0 else "Other"], "patchState": Constants.PENDING})
+
+        prefix_sums = status_handler._StatusHandler__calc_patches_payload_size_prefix_sums(patches)
+        for patch_count in range(0, len(patches) + 1):
+            self.assertEqual(len(json.dumps(json.dumps(patches[:patch_count]))), status_handler._StatusHandler__get_patches_payload_size_from_prefix_sums(prefix_sums, patch_count))
+
+        start_index = 2
+        sliced_prefix_sums = status_handler._StatusHandler__slice_patches_payload_size_prefix_sums(prefix_sums, start_index, len(patches))
+        for patch_count in range(0, len(patches) - start_index + 1):
+            self.assertEqual(len(json.dumps(json.dumps(patches[start_index:start_index + patch_count]))), status_handler._StatusHandler__get_patches_payload_size_from_prefix_sums(sliced_prefix_sums, patch_count))
+
     # Setup functions for testing
     def __assert_patch_summary_from_status(self, substatus_file_data, operation, patch_summary, status, patch_count, errors_count=0,
             errors_code=Constants.PatchOperationTopLevelErrorCode.SUCCESS, installation_substatus_index=0, complete_substatus_file_data=None, is_under_internal_size_limit=False, is_truncated=False):
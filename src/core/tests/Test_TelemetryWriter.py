@@ -20,6 +20,7 @@ import re
 import time
 import unittest
 from core.src.bootstrap.Constants import Constants
+from core.src.service_interfaces.TelemetryWriter import TelemetryWriter
 from core.tests.library.ArgumentComposer import ArgumentComposer
 from core.tests.library.RuntimeCompositor import RuntimeCompositor
 
@@ -27,6 +28,8 @@ from core.tests.library.RuntimeCompositor import RuntimeCompositor
 class TestTelemetryWriter(unittest.TestCase):
     def setUp(self):
         self.runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True)
+        Constants.TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS = 0     # events are inspected in their files right after they are written
+        self.runtime.telemetry_writer.drain()   # ... so they are written inline, on the caller's thread, from here on
 
     def tearDown(self):
         self.runtime.stop()
@@ -76,8 +79,12 @@ class TestTelemetryWriter(unittest.TestCase):
     def test_write_multiple_events_in_same_file(self):
         time_backup = time.time
         time.time = self.mock_time
+        spool_flush_interval_backup = Constants.TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS
+        Constants.TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS = 300
         self.runtime.telemetry_writer.write_event("testing telemetry write to file", Constants.TelemetryEventLevel.Error, "Test Task")
         self.runtime.telemetry_writer.write_event("testing telemetry write to file", Constants.TelemetryEventLevel.Error, "Test Task2")
+        self.runtime.telemetry_writer.flush()
+        Constants.TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS = spool_flush_interval_backup
         latest_event_file = [pos_json for pos_json in os.listdir(self.runtime.telemetry_writer.events_folder_path) if re.search('^' + str(self.mock_time()) + '0+.json$', pos_json)][-1]
         with open(os.path.join(self.runtime.telemetry_writer.events_folder_path, latest_event_file), 'r+') as f:
             events = json.load(f)
@@ -87,6 +94,125 @@ class TestTelemetryWriter(unittest.TestCase):
             f.close()
         time.time = time_backup
 
+    def test_write_events_spooled_until_flush_or_file_size_limit(self):
+        events_folder_path = self.runtime.telemetry_writer.events_folder_path
+        self.runtime.telemetry_writer.flush()
+        event_files_before = set(f for f in os.listdir(events_folder_path) if re.search('^[0-9]+.json$', f))
+
+        spool_flush_interval_backup = Constants.TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS
+        event_file_size_limit_backup = Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS
+        Constants.TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS = 300
+        Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS = 2048
+        event_count_max_throttle_backup = Constants.TELEMETRY_MAX_EVENT_COUNT_THROTTLE
+        Constants.TELEMETRY_MAX_EVENT_COUNT_THROTTLE = 360
+        self.runtime.telemetry_writer.event_count = 1
+        sleep_backup = time.sleep
+        sleep_calls = []
+        time.sleep = lambda seconds: sleep_calls.append(seconds)
+        try:
+            # nothing is written until the spool fills up an event file
+            self.runtime.telemetry_writer.write_event("spooled event 1", Constants.TelemetryEventLevel.Informational, "Test Task")
+            self.runtime.telemetry_writer.write_event("spooled event 2", Constants.TelemetryEventLevel.Informational, "Test Task")
+            new_event_files = [f for f in os.listdir(events_folder_path) if re.search('^[0-9]+.json$', f) and f not in event_files_before]
+            self.assertEqual(len(new_event_files), 0)
+
+            for i in range(3, 21):
+                self.runtime.telemetry_writer.write_event("spooled event " + str(i), Constants.TelemetryEventLevel.Informational, "Test Task")
+            self.runtime.telemetry_writer.flush()
+
+            new_event_files = [f for f in os.listdir(events_folder_path) if re.search('^[0-9]+.json$', f) and f not in event_files_before]
+            self.assertTrue(len(new_event_files) > 1)
+            messages = []
+            for event_file in sorted(new_event_files, key=lambda file_name: int(file_name.split('.')[0])):
+                with open(os.path.join(events_folder_path, event_file), 'r') as f:
+                    file_contents = f.read()
+                self.assertTrue(len(file_contents) <= Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS)
+                messages.extend(event["Message"] for event in json.loads(file_contents))
+            self.assertEqual([message.split(" [TC=")[0] for message in messages if message.startswith("spooled event")], ["spooled event " + str(i) for i in range(1, 21)])
+            self.assertEqual(len(sleep_calls), 0)    # rolling over to a new event file does not wait on the clock
+        finally:
+            time.sleep = sleep_backup
+            Constants.TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS = spool_flush_interval_backup
+            Constants.TELEMETRY_EVENT_FILE_SIZE_LIMIT_IN_CHARS = event_file_size_limit_backup
+            Constants.TELEMETRY_MAX_EVENT_COUNT_THROTTLE = event_count_max_throttle_backup
+
+    def test_background_writer_throttles_without_blocking_caller(self):
+        events_folder_path = self.runtime.telemetry_writer.events_folder_path
+        background_writer_enabled_backup = Constants.TELEMETRY_BACKGROUND_WRITER_ENABLED
+        event_count_max_throttle_backup = Constants.TELEMETRY_MAX_EVENT_COUNT_THROTTLE
+        Constants.TELEMETRY_BACKGROUND_WRITER_ENABLED = True
+        Constants.TELEMETRY_MAX_EVENT_COUNT_THROTTLE = 5
+        try:
+            telemetry_writer = TelemetryWriter(self.runtime.env_layer, self.runtime.composite_logger, self.runtime.credential_sanitizer, events_folder_path, True)
+            start_time = datetime.datetime.utcnow()
+            for i in range(1, 11):
+                telemetry_writer.write_event("background event " + str(i), Constants.TelemetryEventLevel.Informational, "Test Task")
+            self.assertTrue((datetime.datetime.utcnow() - start_time).seconds < 5)     # the writer waits out the throttle, not the caller
+
+            self.__wait_for_event_message(events_folder_path, "Max telemetry event file limit reached")
+            telemetry_writer.drain()    # cuts the throttle wait short
+
+            messages = self.__get_event_messages(events_folder_path)
+            self.assertEqual([message for message in messages if message.startswith("background event")], ["background event " + str(i) for i in range(1, 11)])
+            telemetry_writer.write_event("event after drain", Constants.TelemetryEventLevel.Informational, "Test Task")    # written inline
+            self.assertTrue("event after drain" in self.__get_event_messages(events_folder_path))
+        finally:
+            Constants.TELEMETRY_BACKGROUND_WRITER_ENABLED = background_writer_enabled_backup
+            Constants.TELEMETRY_MAX_EVENT_COUNT_THROTTLE = event_count_max_throttle_backup
+
+    def test_background_writer_queue_overflow_never_drops_errors(self):
+        events_folder_path = self.runtime.telemetry_writer.events_folder_path
+        background_writer_enabled_backup = Constants.TELEMETRY_BACKGROUND_WRITER_ENABLED
+        event_count_max_throttle_backup = Constants.TELEMETRY_MAX_EVENT_COUNT_THROTTLE
+        event_queue_max_size_backup = Constants.TELEMETRY_EVENT_QUEUE_MAX_SIZE
+        overflow_policy_backup = Constants.TELEMETRY_EVENT_QUEUE_OVERFLOW_POLICY
+        Constants.TELEMETRY_BACKGROUND_WRITER_ENABLED = True
+        Constants.TELEMETRY_MAX_EVENT_COUNT_THROTTLE = 3     # writer is held up on the throttle right after startup events, so everything below stays queued
+        Constants.TELEMETRY_EVENT_QUEUE_MAX_SIZE = 3
+        try:
+            for overflow_policy, expected_verbose_messages, expected_overflow_msg in [
+                    (Constants.TelemetryEventQueueOverflowPolicy.DROP_OLDEST_VERBOSE, ["verbose 6"], "[DroppedVerboseEvents=5][CoalescedVerboseEvents=0]"),
+                    (Constants.TelemetryEventQueueOverflowPolicy.COALESCE_VERBOSE, ["verbose 5 | verbose 6"], "[DroppedVerboseEvents=3][CoalescedVerboseEvents=2]")]:
+                Constants.TELEMETRY_EVENT_QUEUE_OVERFLOW_POLICY = overflow_policy
+                for event_file in os.listdir(events_folder_path):
+                    os.remove(os.path.join(events_folder_path, event_file))
+
+                telemetry_writer = TelemetryWriter(self.runtime.env_layer, self.runtime.composite_logger, self.runtime.credential_sanitizer, events_folder_path, True)
+                self.__wait_for_event_message(events_folder_path, "Max telemetry event file limit reached")
+                for i in range(1, 7):
+                    telemetry_writer.write_event("verbose " + str(i), Constants.TelemetryEventLevel.Verbose, "Test Task")
+                    if i == 4:
+                        telemetry_writer.write_event("error 1", Constants.TelemetryEventLevel.Error, "Test Task")
+                telemetry_writer.write_event("error 2", Constants.TelemetryEventLevel.Error, "Test Task")
+                telemetry_writer.drain()
+
+                messages = self.__get_event_messages(events_folder_path)
+                self.assertEqual([message for message in messages if message.startswith("verbose")], expected_verbose_messages)
+                self.assertEqual([message for message in messages if message.startswith("error")], ["error 1", "error 2"])
+                self.assertTrue(any(message.startswith("Telemetry event queue overflowed.") and expected_overflow_msg in message for message in messages))
+        finally:
+            Constants.TELEMETRY_BACKGROUND_WRITER_ENABLED = background_writer_enabled_backup
+            Constants.TELEMETRY_MAX_EVENT_COUNT_THROTTLE = event_count_max_throttle_backup
+            Constants.TELEMETRY_EVENT_QUEUE_MAX_SIZE = event_queue_max_size_backup
+            Constants.TELEMETRY_EVENT_QUEUE_OVERFLOW_POLICY = overflow_policy_backup
+
+    @staticmethod
+    def __get_event_messages(events_folder_path):
+        """ Messages from all event files, in the order written, without the telemetry event counter """
+        messages = []
+        event_files = [f for f in os.listdir(events_folder_path) if re.search('^[0-9]+.json$', f)]
+        for event_file in sorted(event_files, key=lambda file_name: int(file_name.split('.')[0])):
+            with open(os.path.join(events_folder_path, event_file), 'r') as f:
+                messages.extend(event["Message"].split(" [TC=")[0] for event in json.load(f))
+        return messages
+
+    def __wait_for_event_message(self, events_folder_path, message_prefix):
+        for attempt in range(0, 100):
+            if any(message.startswith(message_prefix) for message in self.__get_event_messages(events_folder_path)):
+                return
+            self.runtime.backup_time_sleep(0.1)
+        self.fail("Event not written in time. [MessagePrefix={0}]".format(message_prefix))
+
     def test_write_event_msg_size_limit(self):
         # Assuming 1 char is 1 byte
         message = "a"*3074
@@ -234,6 +234,17 @@ class TestUbuntuProClient(unittest.TestCase):
 
         package_manager.env_layer.run_command_output = backup_run_command_output
 
+    def test_log_ubuntu_pro_client_attached_decodes_only_the_summary(self):
+        package_manager = self.container.get('package_manager')
+        security_status = "{\"_schema_version\": \"0.1\", \"packages\": [" + ", ".join(["{\"package\": \"pkg" + str(index) + "\", \"status\": \"upgrade_available\"}" for index in range(0, 1000)]) + \
+                          "], \"summary\": {\"ua\": {\"attached\": true}, \"num_installed_packages\": 1000}, \"livepatch\": {}}"
+        package_manager.env_layer.run_command_output = lambda cmd, no_output=False, chk_err=False: (0, security_status)
+        self.assertTrue(package_manager.ubuntu_pro_client.log_ubuntu_pro_client_attached())
+
+        # falls back to decoding all of it
+        package_manager.env_layer.run_command_output = lambda cmd, no_output=False, chk_err=False: (0, "{\"summary\": {\"ua\": {\"attached\": true}}, \"notes\": \"summary\"}")
+        self.assertTrue(package_manager.ubuntu_pro_client.log_ubuntu_pro_client_attached())
+
     def test_extract_packages_and_versions_returns_zero_for_empty_updates(self):
         package_manager = self.container.get('package_manager')
         empty_updates = []
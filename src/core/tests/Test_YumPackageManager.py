@@ -14,7 +14,10 @@
 #
 # Requires Python 2.7+
 import json
+import functools
 import os
+import threading
+import types
 import unittest
 import sys
 # Conditional import for StringIO
@@ -29,6 +32,77 @@ from core.tests.library.LegacyEnvLayerExtensions import LegacyEnvLayerExtensions
 from core.tests.library.RuntimeCompositor import RuntimeCompositor
 
 
+class MockRpmTransactionSet(object):
+    """ Stand-in for rpm.TransactionSet over a fixed installed set, for the in-process (rpm bindings) queries """
+    HEADERS = [{"name": b"kernel", "arch": b"x86_64", "epoch": None, "version": b"3.10.0", "release": b"862.el7"},
+               {"name": b"kernel", "arch": b"x86_64", "epoch": None, "version": b"3.10.0", "release": b"862.2.3.el7"},
+               {"name": b"selinux-policy", "arch": b"noarch", "epoch": 0, "version": b"3.13.1", "release": b"102.el7_3.16"}]
+
+    def dbMatch(self):
+        return self.HEADERS
+
+    def closeDB(self):
+        pass
+
+
+class MockDnfBase(object):
+    """ Stand-in for dnf.Base over fixed installed and available sets, for the in-process (dnf bindings) queries """
+    class Package(object):
+        def __init__(self, name, arch, evr, is_installed):
+            self.name, self.arch, self.evr, self.is_installed = name, arch, evr, is_installed
+
+        def __lt__(self, other):
+            return self.evr < other.evr
+
+    class Query(object):
+        def __init__(self, packages):
+            self.packages = packages
+
+        def __iter__(self):
+            return iter(self.packages)
+
+        def filter(self, **criteria):
+            return MockDnfBase.Query([package for package in self.packages if all(getattr(package, key) == value for key, value in criteria.items())])
+
+        def installed(self):
+            return MockDnfBase.Query([package for package in self.packages if package.is_installed])
+
+        def available(self):
+            return MockDnfBase.Query([package for package in self.packages if not package.is_installed])
+
+        def upgrades(self):
+            installed = dict(((package.name, package.arch), package.evr) for package in self.packages if package.is_installed)
+            return MockDnfBase.Query([package for package in self.available() if (package.name, package.arch) in installed and package.evr > installed[(package.name, package.arch)]])
+
+        def latest(self):
+            latest = {}
+            for package in self.packages:
+                if (package.name, package.arch) not in latest or latest[(package.name, package.arch)] < package:
+                    latest[(package.name, package.arch)] = package
+            return MockDnfBase.Query(list(latest.values()))
+
+    def __init__(self):
+        self.conf = types.ModuleType("conf")
+        self.conf.read = lambda: None
+        self.conf.installroot = "/"
+        self.conf.substitutions = types.ModuleType("substitutions")
+        self.conf.substitutions.update_from_etc = lambda installroot: None
+        packages = [self.Package("kernel", "x86_64", "3.10.0-862.2.3.el7", True), self.Package("kernel", "x86_64", "3.10.0-862.3.2.el7", False),
+                    self.Package("kernel", "x86_64", "3.10.0-862.9.1.el7", False), self.Package("kernel", "x86_64", "3.10.0-862.1.1.el7", False),
+                    self.Package("selinux-policy", "noarch", "3.13.1-102.el7_3.16", True)]
+        self.sack = types.ModuleType("sack")
+        self.sack.query = lambda: MockDnfBase.Query(packages)
+
+    def read_all_repos(self):
+        pass
+
+    def fill_sack(self, load_system_repo=True, load_available_repos=True):
+        pass
+
+    def close(self):
+        pass
+
+
 class TestYumPackageManager(unittest.TestCase):
     def setUp(self):
         self.runtime = RuntimeCompositor(ArgumentComposer().get_composed_arguments(), True, Constants.YUM)
@@ -185,6 +259,214 @@ class TestYumPackageManager(unittest.TestCase):
         self.assertEqual(len(available_updates), 6)
         self.assertEqual(len(package_versions), 6)
 
+    def test_check_update_output_parser_with_wrapped_lines(self):
+        """Unit test for the incremental yum output parser, fed one line at a time"""
+        package_manager = self.container.get('package_manager')
+        output_lines = ["", "Loaded plugins: langpacks, product-id", "",
+                        "selinux-policy.noarch                3.13.1-102.el7_3.16              rhui-rhel-7-server-rhui-rpms",
+                        "libgudev1.x86_64",
+                        "                                     219-30.el7_3.9                   rhui-rhel-7-server-rhui-rpms",
+                        "kernel-tools-libs.x86_64             3.10.0-514.21.1.el7",
+                        "                                                                      rhui-rhel-7-server-rhui-rpms",
+                        "python-perf.x86_64                   3.10.0-514.21.1.el7",
+                        "", ""]
+
+        line_parser = package_manager.CheckUpdateOutputParser(package_manager)
+        for line in output_lines:
+            line_parser.feed(line)
+        packages, versions = line_parser.complete()
+
+        self.assertEqual(packages, ["selinux-policy.noarch", "libgudev1.x86_64", "kernel-tools-libs.x86_64"])
+        self.assertEqual(versions, ["3.13.1-102.el7_3.16", "219-30.el7_3.9", "3.10.0-514.21.1.el7"])
+        self.assertEqual((packages, versions), package_manager.extract_packages_and_versions_including_duplicates("\n".join(output_lines)))
+
+    def test_get_all_and_security_updates_run_concurrently(self):
+        Constants.CommandResultCacheConfig.ENABLED = False      # the queries are run again, not answered from the cache
+        self.runtime.set_legacy_test_type('HappyPath')
+        backup_envlayer_platform_linux_distribution = LegacyEnvLayerExtensions.LegacyPlatform.linux_distribution
+        LegacyEnvLayerExtensions.LegacyPlatform.linux_distribution = self.mock_linux8_distribution_to_return_redhat     # dnf-based yum
+        package_manager = self.container.get('package_manager')
+        expected_updates = (package_manager.get_all_updates(), package_manager.get_security_updates())
+
+        # each check-update waits for the other to start, which only happens in time if they run concurrently
+        started_commands = []
+        both_started = threading.Event()
+        backup_run_command_output = self.runtime.env_layer.run_command_output
+
+        def mock_run_command_output(cmd, no_output=False, chk_err=False):
+            if "check-update" in cmd:
+                started_commands.append(cmd)
+                if len(started_commands) == 2:
+                    both_started.set()
+                both_started.wait(5)
+            return backup_run_command_output(cmd, no_output, chk_err)
+
+        self.runtime.env_layer.run_command_output = mock_run_command_output
+        self.assertEqual(package_manager.get_all_and_security_updates(), expected_updates)
+        self.assertTrue(both_started.is_set())
+        LegacyEnvLayerExtensions.LegacyPlatform.linux_distribution = backup_envlayer_platform_linux_distribution
+
+    def test_get_all_and_security_updates_run_one_after_the_other_on_yum_3(self):
+        self.runtime.set_legacy_test_type('HappyPath')
+        backup_envlayer_platform_linux_distribution = LegacyEnvLayerExtensions.LegacyPlatform.linux_distribution
+        LegacyEnvLayerExtensions.LegacyPlatform.linux_distribution = self.mock_linux7_distribution_to_return_redhat
+        package_manager = self.container.get('package_manager')
+        expected_updates = (package_manager.get_all_updates(), package_manager.get_security_updates())
+        package_manager.is_yum_security_prerequisite_ensured = False
+
+        # the security plugin is installed before either query, and the queries don't overlap
+        started_commands = []
+        running_commands = []
+        backup_run_command_output = self.runtime.env_layer.run_command_output
+
+        def mock_run_command_output(cmd, no_output=False, chk_err=False):
+            started_commands.append(cmd)
+            running_commands.append(cmd)
+            self.assertEqual(len(running_commands), 1)
+            threading.Event().wait(0.1)     # time.sleep is mocked
+            running_commands.remove(cmd)
+            return backup_run_command_output(cmd, no_output, chk_err)
+
+        self.runtime.env_layer.run_command_output = mock_run_command_output
+        self.assertEqual(package_manager.get_all_and_security_updates(), expected_updates)
+        self.assertEqual(started_commands, [package_manager.yum_check_security_prerequisite, package_manager.yum_check, package_manager.yum_check_security])
+        LegacyEnvLayerExtensions.LegacyPlatform.linux_distribution = backup_envlayer_platform_linux_distribution
+
+    def test_command_results_are_cached_until_the_package_database_changes(self):
+        self.runtime.set_legacy_test_type('HappyPath')
+        Constants.CommandResultCacheConfig.ENABLED = True
+        package_manager = self.container.get('package_manager')
+        fingerprint_file_path = os.path.join(self.runtime.execution_config.temp_folder, "rpmdb")
+        self.runtime.write_to_file(fingerprint_file_path, "a")
+        package_manager.command_result_cache.fingerprint_paths = [fingerprint_file_path]
+
+        check_commands = []
+        backup_run_command_output = self.runtime.env_layer.run_command_output
+
+        def mock_run_command_output(cmd, no_output=False, chk_err=False):
+            if cmd == package_manager.yum_check:
+                check_commands.append(cmd)
+            return backup_run_command_output(cmd, no_output, chk_err)
+        self.runtime.env_layer.run_command_output = mock_run_command_output
+
+        expected_updates = package_manager.get_all_updates()
+        self.assertEqual(package_manager.get_all_updates(), expected_updates)
+        self.assertEqual(len(check_commands), 1)
+
+        # the package database changed
+        self.runtime.write_to_file(fingerprint_file_path, "ab")
+        self.assertEqual(package_manager.get_all_updates(), expected_updates)
+        self.assertEqual(len(check_commands), 2)
+
+        # a command that may change the package database ran
+        package_manager.run_package_manager_command(package_manager.single_package_upgrade_cmd + "selinux-policy.noarch")
+        self.assertEqual(package_manager.get_all_updates(), expected_updates)
+        self.assertEqual(len(check_commands), 3)
+        self.assertEqual((package_manager.command_result_cache.hit_count, package_manager.command_result_cache.miss_count), (1, 3))
+
+    def test_dependency_simulation_exiting_1_is_served_from_the_cache(self):
+        Constants.CommandResultCacheConfig.ENABLED = True
+        package_manager = self.container.get('package_manager')
+        fingerprint_file_path = os.path.join(self.runtime.execution_config.temp_folder, "rpmdb")
+        self.runtime.write_to_file(fingerprint_file_path, "a")
+        package_manager.command_result_cache.fingerprint_paths = [fingerprint_file_path]
+        commands_run = []
+
+        def mock_run_command_output(cmd, no_output=False, chk_err=False):
+            commands_run.append(cmd)
+            return 1, "Operation aborted."     # anything to install
+        self.runtime.env_layer.run_command_output = mock_run_command_output
+
+        simulation_cmd = package_manager.single_package_upgrade_simulation_cmd + "git"
+        self.assertEqual(package_manager.run_package_manager_command(simulation_cmd), (1, "Operation aborted."))
+        self.assertEqual(package_manager.run_package_manager_command(simulation_cmd), (1, "Operation aborted."))
+        self.assertEqual(commands_run, [simulation_cmd])
+
+        # other commands are not cached on that exit code
+        package_manager.run_package_manager_command(package_manager.yum_check)
+        package_manager.run_package_manager_command(package_manager.yum_check)
+        self.assertEqual(commands_run, [simulation_cmd] + [package_manager.yum_check] * 2)
+
+    def test_read_only_queries_are_answered_in_process_by_rpm_and_dnf_bindings_when_available(self):
+        package_manager = self.container.get('package_manager')
+        backup_modules = dict((name, sys.modules.get(name)) for name in ["rpm", "dnf"])
+        sys.modules["rpm"], sys.modules["dnf"] = types.ModuleType("rpm"), types.ModuleType("dnf")
+        sys.modules["rpm"].TransactionSet = MockRpmTransactionSet
+        sys.modules["rpm"].RPMTAG_NAME, sys.modules["rpm"].RPMTAG_ARCH, sys.modules["rpm"].RPMTAG_EPOCH, sys.modules["rpm"].RPMTAG_VERSION, sys.modules["rpm"].RPMTAG_RELEASE = "name", "arch", "epoch", "version", "release"
+        sys.modules["dnf"].Base = MockDnfBase
+        Constants.RpmBindingsSettings.FEATURE_ENABLED = True
+        commands_run = []
+
+        def mock_run_command_output(cmd, no_output=False, chk_err=False):
+            commands_run.append(cmd)
+            return 0, "kernel.x86_64    3.10.0-862.9.1.el7    updates"
+
+        try:
+            self.runtime.env_layer.run_command_output = mock_run_command_output
+            self.runtime.env_layer.run_command_output_spilled = None
+
+            self.assertEqual(package_manager.get_installed_packages_snapshot(), {"kernel.x86_64": ["3.10.0-862.el7", "3.10.0-862.2.3.el7"], "selinux-policy.noarch": ["0:3.13.1-102.el7_3.16"]})
+            self.assertEqual(package_manager.get_all_updates(), (["kernel.x86_64"], ["3.10.0-862.9.1.el7"]))
+            self.assertEqual(package_manager.get_all_available_versions_of_package("kernel.x86_64"), ["3.10.0-862.1.1.el7", "3.10.0-862.3.2.el7", "3.10.0-862.9.1.el7"])
+            self.assertEqual(package_manager.get_all_available_versions_of_package("not-a-package"), [])
+            self.assertEqual(commands_run, [])
+
+            # A/B verification - the command line is queried too, and its result used
+            Constants.InProcessQuerySettings.VERIFY_AGAINST_COMMAND_LINE = True
+            self.assertEqual(package_manager.get_all_available_versions_of_package("kernel"), ["3.10.0-862.9.1.el7"])
+            self.assertEqual(len(commands_run), 1)
+
+            # falls back to the command line if the in-process query fails
+            Constants.InProcessQuerySettings.VERIFY_AGAINST_COMMAND_LINE = False
+            package_manager.rpm_db_client.fingerprint_provider = lambda: "changed"     # reloads the metadata
+            sys.modules["dnf"].Base = None
+            self.assertEqual(package_manager.get_all_updates(), (["kernel.x86_64"], ["3.10.0-862.9.1.el7"]))
+            self.assertEqual(len(commands_run), 2)
+        finally:
+            Constants.InProcessQuerySettings.VERIFY_AGAINST_COMMAND_LINE = False
+            for name, module in backup_modules.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
+
+    def test_query_executor(self):
+        package_manager = self.container.get('package_manager')
+        self.assertEqual(package_manager.query_executor.run([]), [])
+        self.assertEqual(package_manager.query_executor.run([lambda: 1]), [1])
+
+        # results are in order, and no more than max_parallelism run at a time
+        active_count = [0, 0]   # current, max
+        count_lock = threading.Lock()
+
+        def query(result):
+            with count_lock:
+                active_count[0] += 1
+                active_count[1] = max(active_count[1], active_count[0])
+            threading.Event().wait(0.05)
+            with count_lock:
+                active_count[0] -= 1
+            return result
+
+        results = package_manager.query_executor.run([functools.partial(query, index) for index in range(0, 10)])
+        self.assertEqual(results, list(range(0, 10)))
+        self.assertTrue(1 < active_count[1] <= Constants.ParallelQueryConfig.MAX_PARALLELISM)
+
+        # the first error (in order) is raised, once all queries completed
+        completed_queries = []
+
+        def failing_query(index):
+            completed_queries.append(index)
+            raise Exception("Query {0} failed".format(str(index)))
+
+        queries = [functools.partial(query, 0), functools.partial(failing_query, 1), functools.partial(failing_query, 2), functools.partial(query, 3)]
+        try:
+            package_manager.query_executor.run(queries)
+            self.fail("The failed query was not raised")
+        except Exception as error:
+            self.assertEqual(str(error), "Query 1 failed")
+        self.assertEqual(sorted(completed_queries), [1, 2])
+
     def test_do_processes_require_restart(self):
         """Unit test for yum package manager"""
 
@@ -211,6 +493,7 @@ class TestYumPackageManager(unittest.TestCase):
 
     def test_package_manager(self):
         """Unit test for yum package manager"""
+        Constants.CommandResultCacheConfig.ENABLED = False      # the mocked command outputs change with the test type, not with the package database
         self.runtime.set_legacy_test_type('HappyPath')
 
         package_manager = self.container.get('package_manager')
@@ -316,6 +599,22 @@ class TestYumPackageManager(unittest.TestCase):
         # test for successfully installing a package
         self.assertEqual(package_manager.install_update_and_dependencies_and_get_status('selinux-policy.noarch', '3.13.1-102.el7_3.16', simulate=True), Constants.INSTALLED)
 
+    def test_extract_installed_packages_snapshot(self):
+        """Unit test for parsing the bulk rpm query used for installed checks"""
+        package_manager = self.container.get('package_manager')
+        self.assertTrue(package_manager.cmd_get_installed_packages_snapshot.startswith('rpm -qa --queryformat'))
+
+        output = "selinux-policy.noarch 3.13.1-102.el7_3.16\nkernel.x86_64 3.10.0-514.el7\nkernel.x86_64 3.10.0-693.el7\nlibgcc.i686 1:4.8.5-11.el7\n\nmalformed\n"
+        snapshot = package_manager.extract_installed_packages_snapshot(output.split('\n'))
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(snapshot['kernel.x86_64'], ['3.10.0-514.el7', '3.10.0-693.el7'])
+        self.assertEqual(snapshot['libgcc.i686'], ['1:4.8.5-11.el7'])
+
+        package_manager.installed_packages_snapshot = snapshot
+        self.assertTrue(package_manager.is_package_version_installed_per_snapshot('selinux-policy.noarch', '3.13.1-102.el7_3.16'))
+        package_manager.invalidate_installed_packages_snapshot()
+        self.assertIsNone(package_manager.installed_packages_snapshot)
+
     def test_install_package_failure(self):
         """Unit test for install package failure"""
         self.runtime.set_legacy_test_type('FailInstallPath')
@@ -635,6 +635,7 @@ class TestZypperPackageManager(unittest.TestCase):
             return str_to_find in str(file_contents)
 
     def test_package_manager_with_retries(self):
+        Constants.MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS = 0     # the status file is inspected right after each command
         package_manager = self.container.get('package_manager')
         # Setting operation to assessment to add all errors under assessment substatus
         self.runtime.status_handler.set_current_operation(Constants.ASSESSMENT)
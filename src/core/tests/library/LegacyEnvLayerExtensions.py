@@ -1391,6 +1391,13 @@ class LegacyEnvLayerExtensions():
                                  "(1.187.3~18.04.1+2.06-2ubuntu14.1 Ubuntu:18.04/bionic-updates [amd64]) []" \
                                  "Inst grub-efi-amd64-bin [2.06-2ubuntu14] " \
                                  "(2.06-2ubuntu14.1 Ubuntu:18.04/bionic-updates [amd64])"
+                    elif cmd.find("apt-get -y --only-upgrade true -s install ") > -1 and cmd.find(" grub-efi-amd64-signed ") > -1:
+                        # dependency resolution of any other set of packages including grub-efi-amd64-signed
+                        code = 0
+                        output = "Inst grub-efi-amd64-signed [1.187.2~18.04.1+2.06-2ubuntu14] " \
+                                 "(1.187.3~18.04.1+2.06-2ubuntu14.1 Ubuntu:18.04/bionic-updates [amd64]) []" \
+                                 "Inst grub-efi-amd64-bin [2.06-2ubuntu14] " \
+                                 "(2.06-2ubuntu14.1 Ubuntu:18.04/bionic-updates [amd64])"
                     elif cmd.find("apt-get -y --only-upgrade true -s install grub-efi-amd64-signed") > -1:
                         code = 0
                         output = "Inst grub-efi-amd64-signed [1.187.2~18.04.1+2.06-2ubuntu14] " \
@@ -1453,13 +1460,10 @@ class LegacyEnvLayerExtensions():
                                  "(1.187.3~18.04.1+2.06-2ubuntu14.1 Ubuntu:18.04/bionic-updates [amd64]) []" \
                                  "Inst grub-efi-amd64-bin [2.06-2ubuntu14] " \
                                  "(2.06-2ubuntu14.1 Ubuntu:18.04/bionic-updates [amd64])"
-                    elif cmd.find("apt-get -y --only-upgrade true -s install git-man git grub-efi-amd64-signed") > -1:
+                    elif cmd.find("apt-get -y --only-upgrade true -s install ") > -1 and cmd.find(" grub-efi-amd64-signed ") > -1:
+                        # dependency resolution of any other set of packages including grub-efi-amd64-signed
                         code = 0
-                        output = "Inst git-man [1:2.17.1-1ubuntu0.15] (1:2.17.1-1ubuntu0.16 Ubuntu:18.04/bionic-updates, " \
-                                 "Ubuntu:18.04/bionic-security [all])" \
-                                 "Inst git [1:2.17.1-1ubuntu0.15] (1:2.17.1-1ubuntu0.16 Ubuntu:18.04/bionic-updates, " \
-                                 "Ubuntu:18.04/bionic-security [amd64])" \
-                                 "Inst grub-efi-amd64-signed [1.187.2~18.04.1+2.06-2ubuntu14] " \
+                        output = "Inst grub-efi-amd64-signed [1.187.2~18.04.1+2.06-2ubuntu14] " \
                                  "(1.187.3~18.04.1+2.06-2ubuntu14.1 Ubuntu:18.04/bionic-updates [amd64]) []" \
                                  "Inst grub-efi-amd64-bin [2.06-2ubuntu14] " \
                                  "(2.06-2ubuntu14.1 Ubuntu:18.04/bionic-updates [amd64])"
@@ -18,6 +18,7 @@ import datetime
 import json
 import os
 import socket
+import sys
 import tempfile
 import time
 import uuid
@@ -27,6 +28,7 @@ from core.tests.library.ArgumentComposer import ArgumentComposer
 from core.tests.library.LegacyEnvLayerExtensions import LegacyEnvLayerExtensions
 from core.src.bootstrap.Bootstrapper import Bootstrapper
 from core.src.bootstrap.Constants import Constants
+from core.src.bootstrap.EnvLayer import EnvLayer
 
 # Todo: find a different way to import these
 try:
@@ -41,6 +43,12 @@ except ImportError:
 
 
 class RuntimeCompositor(object):
+    # Settings that tests opt out of, e.g. as they depend on exact mocked command outputs, with their values as shipped
+    SHIPPED_SETTINGS = [(owner, name, getattr(owner, name)) for owner, name in [
+        (Constants, "MIN_STATUS_FILE_WRITE_INTERVAL_IN_SECS"), (Constants, "TELEMETRY_EVENT_SPOOL_FLUSH_INTERVAL_IN_SECS"), (Constants, "TELEMETRY_BACKGROUND_WRITER_ENABLED"),
+        (Constants.CommandResultCacheConfig, "ENABLED"), (Constants.AptPkgSettings, "FEATURE_ENABLED"), (Constants.RpmBindingsSettings, "FEATURE_ENABLED"),
+        (Constants.BatchDownloadPipelineConfig, "ENABLED"), (Constants.InstallationJournalConfig, "ENABLED")]]
+
     def __init__(self, argv=Constants.DEFAULT_UNSPECIFIED_VALUE, legacy_mode=False, package_manager_name=Constants.APT, vm_cloud_type=Constants.VMCloudType.AZURE, test_type="HappyPath"):
         # Init data
         self.original_rm_start_reboot = None
@@ -49,6 +57,9 @@ class RuntimeCompositor(object):
         self.argv = argv if argv != Constants.DEFAULT_UNSPECIFIED_VALUE else ArgumentComposer().get_composed_arguments()
         self.vm_cloud_type = vm_cloud_type
         Constants.SystemPaths.SYSTEMD_ROOT = os.getcwd() # mocking to pass a basic systemd check in Windows
+        Constants.SystemPaths.DPKG_STATUS = os.path.join(os.getcwd(), "dpkg-status-not-present")   # keeps installed checks on the mocked dpkg commands
+        Constants.SystemPaths.DPKG_UPDATES = os.path.join(os.getcwd(), "dpkg-updates-not-present")
+        Constants.SystemPaths.APT_ESM_HOOK_CONF = os.path.join(os.getcwd(), "apt-esm-hook-not-present")
         self.is_github_runner = os.getenv('RUNNER_TEMP', None) is not None
         self.scratch_path = os.path.join(os.path.curdir, "scratch")
 
@@ -57,6 +68,10 @@ class RuntimeCompositor(object):
         Constants.MAX_IMDS_CONNECTION_RETRY_COUNT = 1
         Constants.WAIT_TIME_AFTER_HEALTHSTORE_STATUS_UPDATE_IN_SECS = 0
 
+        # every runtime starts from the configuration that ships - tests opt out of what gets in their way after constructing it
+        for owner, name, value in self.SHIPPED_SETTINGS:
+            setattr(owner, name, value)
+
         if self.is_github_runner:
             def mkdtemp_runner():
                 temp_path = os.path.join(os.getenv('RUNNER_TEMP'), str(uuid.uuid4()))
@@ -78,6 +93,10 @@ class RuntimeCompositor(object):
 
         # Reconfigure env layer for legacy mode tests
         self.env_layer = self.bootstrapper.env_layer
+        self.env_layer.run_command_output_streaming = self.mock_run_command_output_streaming
+        self.env_layer.run_command_output_spilled = self.mock_run_command_output_spilled
+        self.env_layer.run_command_output_cancellable = self.mock_run_command_output_cancellable
+        self.env_layer.command_perf_ledger.add_pass_through_functions(["mock_run_command_output_streaming", "mock_run_command_output_spilled", "mock_run_command_output_cancellable"])
         if legacy_mode:
             self.legacy_env_layer_extensions = LegacyEnvLayerExtensions(package_manager_name, test_type)
             self.reconfigure_env_layer_to_legacy_mode()
@@ -153,6 +172,8 @@ class RuntimeCompositor(object):
         self.env_layer.get_package_manager = self.legacy_env_layer_extensions.get_package_manager
         self.env_layer.platform = self.legacy_env_layer_extensions.LegacyPlatform()
         self.env_layer.run_command_output = self.legacy_env_layer_extensions.run_command_output
+        for module_name in ["apt", "apt_pkg", "rpm", "dnf", "libdnf5"]:
+            sys.modules[module_name] = None     # the host's package manager bindings would answer queries from its own package database, instead of the mocked command line
         if os.name == 'nt':
             self.env_layer.etc_environment_file_path = os.getcwd()
 
@@ -176,6 +197,22 @@ class RuntimeCompositor(object):
     def mock_sleep(self, seconds):
         pass
 
+    def mock_run_command_output_streaming(self, cmd, line_consumer, chk_err=True):
+        """ Streams the output of run_command_output, as (re)configured by the test at the time of the call, so command mocks apply to streamed commands too """
+        code, out = self.env_layer.run_command_output(cmd, False, chk_err)
+        for line in str(out).split('\n'):
+            line_consumer(line)
+        return code, out
+
+    def mock_run_command_output_cancellable(self, cmd, cancellation_event, chk_err=True):
+        """ Output of run_command_output, as (re)configured by the test at the time of the call """
+        return self.env_layer.run_command_output(cmd, False, chk_err)
+
+    def mock_run_command_output_spilled(self, cmd, spill_folder, chk_err=True):
+        """ Output of run_command_output, as (re)configured by the test at the time of the call, held in memory """
+        code, out = self.env_layer.run_command_output(cmd, False, chk_err)
+        return code, EnvLayer.CommandOutput(text=out)
+
     def check_sudo_status(self, raise_if_not_sudo=True):
         return True
 